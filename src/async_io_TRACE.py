@@ -0,0 +1,235 @@
+"""
+Overlap the disk I/O of the build with the processing. Without this, the build works strictly one step at a time:
+read a daily file, parse it, clean it, read the next file, and the CPU idles while a year is written to disk. Here,
+the reads and the writes run in background threads that are connected to the processing by bounded queues. The
+steps are as follows:
+    Step 1:     Prefetch the next files (e.g. the raw daily files including the decompression, or the next yearly
+                dataset) on an I/O thread while the current file is parsed and cleaned (prefetch()). At most
+                'prefetch_files' files are loaded ahead of the processing.
+    Step 2:     Write the outputs (yearly datasets, partitions and buckets) in a background writer thread
+                (write_async()). At most 'max_pending_writes' DataFrames wait to be written, such that the
+                memory stays bounded. wait_for_writes() waits until all outputs are on disk and re-raises the first
+                error of the writer.
+
+Note: The reading of the raw files, the decompression and the writing to disk release the GIL, such that they run in
+parallel to the processing. Every output is written to a temporary file first and then renamed, i.e. an output file
+is either complete or does not exist. A DataFrame must not be changed after it is passed to write_async().
+The settings are taken from dataset_specs['overlap_io'] (see specs.py and settings_TRACE.py).
+"""
+
+import atexit
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+import zipfile
+
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+# State of the background writer: queue of the pending writes, writer thread and errors of the writes
+WRITER = {
+    'queue': None,
+    'thread': None,
+    'errors': [],
+}
+# Decompression of the raw files by file extension (the same compressions that pandas infers from the file name)
+DECOMPRESS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+#########
+# Step 1: Prefetch the input files
+########
+def load_raw_file(path):
+    """
+    Read one raw file into memory and decompress it (.gz, .bz2, .xz or .zip with one file). The result can be
+    passed to pd.read_csv() instead of the path.
+
+    Parameters:
+    -----------
+    path (str): Path of the raw file
+
+    Returns:
+    --------
+    raw_file (BytesIO): Content of the (decompressed) file
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.zip':
+        with zipfile.ZipFile(path) as zip_file:
+            names = zip_file.namelist()
+            if len(names) != 1:
+                raise ValueError('The zip file {} has to contain exactly one file, found: {}'.format(
+                    path, ', '.join(names)))
+            data = zip_file.read(names[0])
+    elif ext in DECOMPRESS:
+        with DECOMPRESS[ext](path, 'rb') as f:
+            data = f.read()
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+    return io.BytesIO(data)
+
+
+def prefetch(load, items, n_ahead=None, settings=None):
+    """
+    Load the items one after the other on an I/O thread and return them in their order while the caller processes
+    the previous items. An error of load() is raised in the caller when the item is reached.
+
+    Parameters:
+    -----------
+    load (function): Loads one item (e.g. load_raw_file())
+    items (list): Items to load (e.g. paths)
+    n_ahead (int): Number of items that may be loaded ahead of the caller (None -> 'prefetch_files' of the settings)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    Generator of the loaded items
+    """
+    items = list(items)
+    if settings is None:
+        settings = get_settings()
+    if n_ahead is None:
+        n_ahead = settings['overlap_io']['prefetch_files']
+    if settings['overlap_io']['enabled'] == False:
+        for item in items:
+            yield load(item)
+        return
+
+    queue_loaded = queue.Queue()
+    # Free slots for loaded items. The slot is taken before an item is loaded, i.e. at most n_ahead items are
+    # loaded (or being loaded) ahead of the caller
+    slots = threading.Semaphore(n_ahead)
+    stop = threading.Event()
+
+    def produce():
+        for item in items:
+            # Wait for a free slot, but give up if the caller closed the generator
+            while slots.acquire(timeout=0.1) == False:
+                if stop.is_set():
+                    return
+            if stop.is_set():
+                return
+            try:
+                queue_loaded.put((True, load(item)))
+            except BaseException as e:
+                queue_loaded.put((False, e))
+                return
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        for _ in range(len(items)):
+            success, result = queue_loaded.get()
+            slots.release()
+            if success == False:
+                raise result
+            yield result
+    finally:
+        # Stop the I/O thread if the caller stops early (e.g. after an error in the processing)
+        stop.set()
+        thread.join()
+
+
+#########
+# Step 2: Write the outputs in the background
+########
+def write_pickle(df, out_path):
+    """
+    Write a DataFrame in pickle format. The DataFrame is written to a temporary file in the same folder first and
+    then renamed, such that out_path is never incomplete.
+    """
+    path_tmp = os.path.join(os.path.dirname(out_path), 'tmp_' + os.path.basename(out_path))
+    df.to_pickle(path_tmp)
+    os.replace(path_tmp, out_path)
+
+
+def run_writer(queue_writes):
+    """
+    Background writer: write the DataFrames of the queue one after the other until it gets None. After an error, the
+    remaining writes are skipped and the error is raised by the next wait_for_writes().
+    """
+    while True:
+        item = queue_writes.get()
+        if item is None:
+            queue_writes.task_done()
+            return
+        write, df, out_path = item
+        try:
+            if len(WRITER['errors']) == 0:
+                write(df, out_path)
+        except BaseException as e:
+            WRITER['errors'].append((out_path, e))
+        finally:
+            del [df, item]
+            queue_writes.task_done()
+
+
+def start_writer(max_pending_writes):
+    """
+    Start the background writer with a queue of at most max_pending_writes DataFrames. A running writer with another
+    bound (e.g. of an earlier build) writes its pending DataFrames and stops first.
+    """
+    if WRITER['thread'] is not None:
+        if WRITER['queue'].maxsize == max_pending_writes:
+            return
+        WRITER['queue'].put(None)
+        WRITER['thread'].join()
+    WRITER['queue'] = queue.Queue(maxsize=max_pending_writes)
+    WRITER['thread'] = threading.Thread(target=run_writer, args=(WRITER['queue'],), name='writer', daemon=True)
+    WRITER['thread'].start()
+
+
+def write_async(write, df, out_path, settings=None):
+    """
+    Write a DataFrame in the background writer. Waits if 'max_pending_writes' DataFrames are already waiting to be
+    written.
+
+    Parameters:
+    -----------
+    write (function): Writes the DataFrame to out_path (e.g. write_pickle() or store_frame() of storage_TRACE.py)
+    df (DataFrame): Data to write. It must not be changed afterwards
+    out_path (str): Output path
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+    """
+    if settings is None:
+        settings = get_settings()
+    if settings['overlap_io']['enabled'] == False:
+        write(df, out_path)
+        return
+    start_writer(settings['overlap_io']['max_pending_writes'])
+    # Fail early if a previous write failed
+    if len(WRITER['errors']) > 0:
+        wait_for_writes()
+    WRITER['queue'].put((write, df, out_path))
+
+
+def write_pickle_async(df, out_path, settings=None):
+    """
+    Write a DataFrame in pickle format in the background writer (see write_async()).
+    """
+    write_async(write_pickle, df, out_path, settings)
+
+
+def wait_for_writes():
+    """
+    Wait until all pending writes are on disk. Raises the first error of the background writer.
+    """
+    if WRITER['queue'] is not None:
+        WRITER['queue'].join()
+    if len(WRITER['errors']) > 0:
+        out_path, error = WRITER['errors'][0]
+        WRITER['errors'] = []
+        raise IOError('The background writer failed to write {}: {}'.format(out_path, error)) from error
+
+
+# Do not lose pending writes if the program ends without waiting for them
+atexit.register(wait_for_writes)
@@ -0,0 +1,542 @@
+"""
+Benchmark the stages of the build on generated fixtures such that the effect of a code change on the run time and
+the memory usage can be measured. The benchmarks run offline (no raw TRACE or MERGENT data is needed) and the results
+are stored per git commit such that they can be compared across commits. The steps are as follows:
+    Step 1:     Generate the fixtures. Synthetic daily raw files in the pre- and post-2012 layouts (including
+                inter-dealer trades, cancellations, corrections and reversals) are generated for a given number of
+                trades (see generate_synthetic_TRACE.py). They are read and cleaned with the processing modules
+                and stored in a temporary project folder together with synthetic issue, rating and bond info data.
+    Step 2:     Run the benchmarks. Every benchmark is run repeatedly on a fresh copy of its inputs. The wall time
+                is measured without tracing and the peak memory in a separate run with tracemalloc.
+                a) Micro benchmarks:    One function of the build (e.g. post_2012_clean())
+                b) Macro benchmarks:    A chain of stages (the daily cleaning of the read-in step and all steps
+                                        from the concatenation up to the event time variables)
+    Step 3:     Store the results in bld/data/TRACE/TRACE_info/benchmarks (benchmark_<commit>.json and
+                benchmark_history.csv) and compare the results of two commits.
+
+Example (in the src folder):
+    python -m pycleantrace benchmark --scales 10k 100k
+    python -m pycleantrace benchmark --compare <commit>
+"""
+
+import contextlib
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+from read_TRACE import adj_dt_format_pre_2012, adj_dt_format_post_2012
+from clean_TRACE import post_2012_clean, prior_2012_clean, del_interd_transact
+from concatenate_merge_TRACE_MERGENT import rd_cl_ratings, read_yearly_data, merge_transact_rating, conct_merge_data
+from read_TRACE import select_bonds
+from process_TRACE import clean_merged_data
+from prepare_variables import define_event_time_week
+from telemetry_TRACE import read_proc_file, get_peak_rss, reset_peak_rss
+from general_functions import build_folders
+from storage_TRACE import store_frame
+from generate_synthetic_TRACE import get_synthetic_trades, get_raw_file_text
+
+# Data scales (number of trades of each layout before the cancellations, corrections and reversals are added)
+SCALES = {'10k': 10000, '100k': 100000, '1M': 1000000}
+# Scales that are run by default
+DEFAULT_SCALES = ['10k', '100k']
+
+# Version of the fixture generator. Results of different fixture versions are not comparable
+FIXTURE_VERSION = 2
+
+
+#########
+# Step 1: Generate the fixtures
+########
+def get_fixture_dates(n_rows):
+    """
+    Get the trading days of the fixtures. The pre-2012 trades are spread over the trading days from March 2011 to
+    the reporting change and the post-2012 trades over the trading days from the reporting change to March 2013
+    (about 20,000 trades per day, at least 20 days).
+
+    Parameters:
+    -----------
+    n_rows (int): Number of trades per layout
+
+    Returns:
+    --------
+    dates_pre (list): Trading days prior to the reporting change (YYYYMMDD)
+    dates_post (list): Trading days after the reporting change (YYYYMMDD)
+    """
+    n_days = max(20, n_rows // 20000)
+    dates = {}
+    for layout, start, end in [('PRE', '2011-03-01', '2012-02-03'), ('POST', '2012-02-06', '2013-03-28')]:
+        bdays = pd.bdate_range(start, end)
+        # Spread the days evenly over the period such that every quarter contains trading days
+        idx = np.unique(np.linspace(0, len(bdays) - 1, min(n_days, len(bdays))).astype(int))
+        dates[layout] = list(bdays[idx].strftime('%Y%m%d'))
+
+    return dates['PRE'], dates['POST']
+
+
+def get_daily_texts(df):
+    """
+    Write the raw transactions to one pipe-delimited text per trading day (including the two trailer rows of the
+    raw files).
+
+    Parameters:
+    -----------
+    df (DataFrame): Raw transactions (see get_synthetic_trades() in generate_synthetic_TRACE.py)
+
+    Returns:
+    --------
+    list_texts (list): Content of the daily raw files
+    """
+    list_texts = []
+    for _, df_day in df.groupby('TRD_RPT_DT', sort=True):
+        list_texts.append(get_raw_file_text(df_day))
+
+    return list_texts
+
+
+def parse_daily_texts(list_texts, pre_post_id):
+    """
+    Read in the daily raw texts as in read_TRACE.py and concatenate them.
+    """
+    adj_dt_format = adj_dt_format_pre_2012 if pre_post_id == 'PRE' else adj_dt_format_post_2012
+
+    return pd.concat([adj_dt_format(io.StringIO(text)) for text in list_texts], ignore_index=True)
+
+
+def get_mergent_fixtures(cusips):
+    """
+    Generate the synthetic issue, rating and bond info data of the fixture bonds. Every tenth bond is a medium term
+    note and thus not selected (see select_bonds()). The ratings change twice during the sample.
+
+    Parameters:
+    -----------
+    cusips (np.array): CUSIP IDs of the fixture bonds
+
+    Returns:
+    --------
+    df_issue (DataFrame): Issue data (as issue_data.pkl)
+    df_ratings (DataFrame): Rating data (as ratings.pkl)
+    df_bond_info (DataFrame): Bond background information (as bond_info.pkl)
+    """
+    n_cusips = len(cusips)
+    df_issue = pd.DataFrame({
+        'CUSIP_ID': cusips,
+        'issuer_cusip': [c[:6] for c in cusips],
+        'issue_cusip': [c[6:] for c in cusips],
+        'bond_type': np.where(np.arange(n_cusips) % 10 == 9, 'CMTN', 'CDEB'),
+        'putable': 'N',
+        'maturity': pd.Timestamp('2030-01-01'),
+        'offering_amt': 500000.0,
+        'offering_price': 100.0,
+        'principal_amt': 1000.0,
+        'amount_outstanding': 500000.0,
+        'effective_date': pd.Timestamp('2005-01-01'),
+        'offering_date': pd.Timestamp('2005-01-01'),
+        'active_issue': 'Y',
+    })
+    list_ratings = []
+    for rating_date, rating, rating_type in [('2010-06-01', 'A', 'SPR'), ('2011-09-01', 'A-', 'SPR'),
+                                             ('2012-08-15', 'BBB', 'SPR'), ('2012-08-15', 'Baa1', 'MR')]:
+        list_ratings.append(pd.DataFrame({'complete_cusip': cusips, 'rating_date': pd.Timestamp(rating_date),
+                                          'rating': rating, 'rating_type': rating_type}))
+    df_ratings = pd.concat(list_ratings, ignore_index=True)
+    df_bond_info = pd.DataFrame({'CUSIP_ID': cusips, 'RULE_144A_FL': np.where(np.arange(n_cusips) % 7 == 0, 'Y', 'N')})
+
+    return df_issue, df_ratings, df_bond_info
+
+
+def get_fixtures(n_rows, project_path, seed=0):
+    """
+    Generate all fixtures of one data scale. The daily raw texts are read and cleaned as in read_TRACE.py and the
+    yearly cleaned data is stored in a temporary project folder together with the MERGENT data and the bond info
+    data such that the steps after the read-in can be run on it.
+
+    Parameters:
+    -----------
+    n_rows (int): Number of trades per layout
+    project_path (str): Temporary project root path
+    seed (int): Seed of the random number generator
+
+    Returns:
+    --------
+    fixtures (dict): Inputs of the benchmarks
+    """
+    cusips = np.array(['{:06d}AA{}'.format(i, i % 10) for i in range(max(20, n_rows // 100))])
+    dates_pre, dates_post = get_fixture_dates(n_rows)
+    fixtures = {
+        'n_rows': n_rows,
+        'project_path': project_path,
+        'dataset_specs': get_benchmark_specs(),
+        'texts_pre': get_daily_texts(get_synthetic_trades('PRE', dates_pre, n_rows, cusips, seed)),
+        'texts_post': get_daily_texts(get_synthetic_trades('POST', dates_post, n_rows, cusips, seed + 1)),
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Read-in step
+        fixtures['df_pre'] = parse_daily_texts(fixtures['texts_pre'], 'PRE')
+        fixtures['df_post'] = parse_daily_texts(fixtures['texts_post'], 'POST')
+        df_post_clean, fixtures['unmatched'] = post_2012_clean(fixtures['df_post'].copy())
+        df_pre_clean = prior_2012_clean(fixtures['df_pre'].copy(), fixtures['unmatched'])
+
+        # Store the yearly data, the MERGENT data and the reporting dates in the temporary project folder
+        for folder in ['/src/original_data/Mergent_FISD', '/bld/data/TRACE/TRACE_raw_clean',
+                       '/bld/data/TRACE/TRACE_info']:
+            build_folders(project_path + folder)
+        path_clean = project_path + '/bld/data/TRACE/TRACE_raw_clean/'
+        year_pre = pd.to_datetime(df_pre_clean['TRD_EXCTN_DT']).dt.year
+        year_post = pd.to_datetime(df_post_clean['TRD_EXCTN_DT']).dt.year
+        store_frame(df_pre_clean.loc[year_pre == 2011], path_clean + 'TRACE_clean_2011.pkl')
+        store_frame(df_pre_clean.loc[year_pre == 2012], path_clean + 'TRACE_clean_2012_prior.pkl')
+        store_frame(df_post_clean.loc[year_post == 2012], path_clean + 'TRACE_clean_2012_post.pkl')
+        store_frame(df_post_clean.loc[year_post == 2013], path_clean + 'TRACE_clean_2013.pkl')
+        df_issue, df_ratings, df_bond_info = get_mergent_fixtures(cusips)
+        df_issue.to_pickle(project_path + '/src/original_data/Mergent_FISD/issue_data.pkl')
+        df_ratings.to_pickle(project_path + '/src/original_data/Mergent_FISD/ratings.pkl')
+        store_frame(df_bond_info, path_clean + 'bond_info.pkl')
+        rpt_dates = [datetime.datetime.strptime(d, '%Y%m%d').strftime('%Y-%m-%d') for d in dates_pre + dates_post]
+        store_frame(pd.DataFrame({'rpt_date': rpt_dates}),
+                    project_path + '/bld/data/TRACE/TRACE_info/TRACE_rpt_dates.pkl')
+
+        # Inputs of the steps after the read-in
+        cusip_keep = select_bonds(project_path)
+        fixtures['df_transact'] = read_yearly_data(project_path, 'TRACE_clean_2013.pkl', 'POST',
+                                                   fixtures['dataset_specs'], cusip_keep)
+        fixtures['df_ratings'] = rd_cl_ratings(project_path, fixtures['dataset_specs']['ratings']['varlist'])
+        df_merged = conct_merge_data(project_path, fixtures['dataset_specs'])
+        df_merged['I_drop'] = np.arange(0, len(df_merged))
+        fixtures['df_merged_red'] = df_merged[['CUSIP_ID', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'ENTRD_VOL_QT',
+                                               'RPTD_PR', 'RPTG_PARTY_ID', 'CNTRA_PARTY_ID', 'RPT_SIDE_CD',
+                                               'I_drop']].copy()
+        fixtures['df_clean'] = clean_merged_data(df_merged.drop(columns=['I_drop']), project_path,
+                                                 fixtures['dataset_specs'])
+
+    return fixtures
+
+
+def get_benchmark_specs():
+    """
+    Get the dataset specifications of the fixtures (default specifications for the years 2011 to 2013).
+    """
+    from pycleantrace.specs import get_default_specs
+    dataset_specs = get_default_specs()
+    dataset_specs['sample_time_span'] = [2011, 2013]
+
+    return dataset_specs
+
+
+#########
+# Step 2: Run the benchmarks
+########
+# Each benchmark gets a fresh copy of its inputs from the fixtures (the functions change their inputs in place) and
+# runs one function or a chain of stages
+def run_post_2012_clean(fixtures):
+    return post_2012_clean(fixtures['df_post'].copy())
+
+
+def run_prior_2012_clean(fixtures):
+    return prior_2012_clean(fixtures['df_pre'].copy(), fixtures['unmatched'].copy())
+
+
+def run_del_interd_transact(fixtures):
+    return del_interd_transact(fixtures['df_merged_red'].copy())
+
+
+def run_merge_transact_rating(fixtures):
+    return merge_transact_rating(fixtures['project_path'], fixtures['df_transact'].copy(),
+                                 fixtures['dataset_specs'], fixtures['df_ratings'].copy())
+
+
+def run_define_event_time_week(fixtures):
+    return define_event_time_week(fixtures['df_clean'].copy())
+
+
+def run_read_clean_daily(fixtures):
+    # Read-in step: read the daily raw texts and apply the corrections of Dick-Nielsen & Poulsen (2019)
+    df_post, unmatched = post_2012_clean(parse_daily_texts(fixtures['texts_post'], 'POST'))
+    df_pre = prior_2012_clean(parse_daily_texts(fixtures['texts_pre'], 'PRE'), unmatched)
+
+    return df_pre, df_post
+
+
+def run_merge_clean_event_time(fixtures):
+    # All steps from the concatenation of the yearly data up to the event time variables
+    df_merged = conct_merge_data(fixtures['project_path'], fixtures['dataset_specs'])
+    df_clean = clean_merged_data(df_merged, fixtures['project_path'], fixtures['dataset_specs'])
+
+    return define_event_time_week(df_clean)
+
+
+BENCHMARKS = {
+    'post_2012_clean': {'kind': 'micro', 'run': run_post_2012_clean, 'rows': 'df_post'},
+    'prior_2012_clean': {'kind': 'micro', 'run': run_prior_2012_clean, 'rows': 'df_pre'},
+    'del_interd_transact': {'kind': 'micro', 'run': run_del_interd_transact, 'rows': 'df_merged_red'},
+    'merge_transact_rating': {'kind': 'micro', 'run': run_merge_transact_rating, 'rows': 'df_transact'},
+    'define_event_time_week': {'kind': 'micro', 'run': run_define_event_time_week, 'rows': 'df_clean'},
+    'read_clean_daily': {'kind': 'macro', 'run': run_read_clean_daily, 'rows': ['df_pre', 'df_post']},
+    'merge_clean_event_time': {'kind': 'macro', 'run': run_merge_clean_event_time, 'rows': 'df_merged_red'},
+}
+
+
+def get_rows_in(fixtures, rows):
+    """
+    Get the number of input rows of a benchmark (rows: name of one or a list of fixture DataFrames).
+    """
+    if isinstance(rows, list):
+        return sum([len(fixtures[r]) for r in rows])
+
+    return len(fixtures[rows])
+
+
+def measure(run, fixtures, repeat):
+    """
+    Measure the wall time and the peak memory of a benchmark. The wall time is measured in repeat runs without
+    tracing. The peak memory is measured in a separate run with tracemalloc (peak of the memory allocated by the
+    benchmark) and as the increase of the peak resident memory (RSS, Linux only) over the resident memory at the
+    start of the timed runs.
+
+    Parameters:
+    -----------
+    run (function): Benchmark function (see BENCHMARKS)
+    fixtures (dict): Inputs of the benchmarks
+    repeat (int): Number of timed runs
+
+    Returns:
+    --------
+    result (dict): Minimum and median wall time, peak allocated memory and peak RSS increase
+    """
+    list_times = []
+    peak_rss_increase = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            gc.collect()
+            rss_0 = read_proc_file('/proc/self/status', ['VmRSS'])['VmRSS']
+            reset_peak_rss()
+            t0 = time.perf_counter()
+            output = run(fixtures)
+            list_times.append(time.perf_counter() - t0)
+            peak_rss = get_peak_rss()
+            if (rss_0 is not None) & (peak_rss is not None):
+                peak_rss_increase = max(peak_rss_increase or 0, peak_rss - rss_0 * 1024)
+            del output
+        gc.collect()
+        tracemalloc.start()
+        output = run(fixtures)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del output
+        gc.collect()
+
+    return {
+        'time_min_s': min(list_times),
+        'time_median_s': float(np.median(list_times)),
+        'peak_alloc_bytes': peak_alloc,
+        'peak_rss_increase_bytes': peak_rss_increase,
+    }
+
+
+def format_megabytes(n_bytes):
+    """
+    Format a number of bytes in MB (e.g. '12.5 MB').
+    """
+    if n_bytes is None:
+        return 'n/a'
+
+    return '{:.1f} MB'.format(n_bytes / 1024**2)
+
+
+def run_benchmarks(project_path, scales=None, benchmarks=None, repeat=3, seed=0):
+    """
+    Run the benchmarks at the given data scales and store the results (see store_benchmark_results()).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path (the results are stored in its bld folder)
+    scales (list): Data scales (see SCALES, None -> DEFAULT_SCALES)
+    benchmarks (list): Benchmarks to run (see BENCHMARKS, None -> all)
+    repeat (int): Number of timed runs per benchmark
+    seed (int): Seed of the fixture generation
+
+    Returns:
+    --------
+    df_results (DataFrame): One row per benchmark and scale
+    """
+    scales = scales or DEFAULT_SCALES
+    benchmarks = benchmarks or list(BENCHMARKS.keys())
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            raise ValueError('Unknown benchmark {} (available: {})'.format(name, ', '.join(BENCHMARKS.keys())))
+    for scale in scales:
+        if scale not in SCALES:
+            raise ValueError('Unknown scale {} (available: {})'.format(scale, ', '.join(SCALES.keys())))
+
+    run_info = get_run_info(project_path)
+    list_results = []
+    for scale in scales:
+        path_fixtures = tempfile.mkdtemp(prefix='TRACE_benchmark_')
+        try:
+            t0 = time.time()
+            fixtures = get_fixtures(SCALES[scale], path_fixtures, seed)
+            print('BENCHMARK: Fixtures of scale {} generated in {:.1f}s'.format(scale, time.time() - t0))
+            for name in benchmarks:
+                result = measure(BENCHMARKS[name]['run'], fixtures, repeat)
+                result = dict({'benchmark': name, 'kind': BENCHMARKS[name]['kind'], 'scale': scale,
+                               'rows_in': get_rows_in(fixtures, BENCHMARKS[name]['rows']), 'repeat': repeat},
+                              **result)
+                result['rows_per_s'] = result['rows_in'] / result['time_min_s'] if result['time_min_s'] > 0 else None
+                list_results.append(dict(run_info, **result))
+                print('BENCHMARK {} ({}): {:.3f}s (median {:.3f}s), peak alloc {}, peak RSS increase {}'.format(
+                    name, scale, result['time_min_s'], result['time_median_s'],
+                    format_megabytes(result['peak_alloc_bytes']),
+                    format_megabytes(result['peak_rss_increase_bytes'])))
+            del fixtures
+            gc.collect()
+        finally:
+            shutil.rmtree(path_fixtures, ignore_errors=True)
+
+    df_results = pd.DataFrame(list_results)
+    store_benchmark_results(project_path, df_results)
+
+    return df_results
+
+
+#########
+# Step 3: Store and compare the results
+########
+def get_git_commit():
+    """
+    Get the abbreviated git commit of the benchmarked code (the repository of this file, the project path of the
+    benchmark data can be anywhere). '-dirty' is appended if tracked files have uncommitted changes and 'unknown' is
+    returned outside of a git repository.
+    """
+    code_path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=code_path, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=code_path,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    if changes != '':
+        commit = commit + '-dirty'
+
+    return commit
+
+
+def get_run_info(project_path):
+    """
+    Get the commit, the time and the environment of a benchmark run.
+    """
+    return {
+        'commit': get_git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split(' ')[0],
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'fixture_version': FIXTURE_VERSION,
+    }
+
+
+def get_benchmark_path(project_path):
+    """
+    Get the output folder of the benchmark results and create it if necessary.
+    """
+    path_benchmarks = project_path + '/bld/data/TRACE/TRACE_info/benchmarks/'
+    build_folders(path_benchmarks)
+
+    return path_benchmarks
+
+
+def store_benchmark_results(project_path, df_results):
+    """
+    Store the benchmark results of a commit in benchmark_<commit>.json (results of earlier runs of the same commit
+    are replaced per benchmark and scale) and append them to benchmark_history.csv.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    df_results (DataFrame): Benchmark results (see run_benchmarks())
+    """
+    if len(df_results) == 0:
+        return
+    path_benchmarks = get_benchmark_path(project_path)
+    commit = df_results['commit'].iloc[0]
+    df_stored = load_benchmark_results(project_path, commit)
+    if df_stored is not None:
+        df_stored = df_stored.set_index(['benchmark', 'scale'])
+        df_stored = df_stored.loc[df_stored.index.isin(df_results.set_index(['benchmark', 'scale']).index) == False]
+        df_results = pd.concat([df_stored.reset_index(), df_results], ignore_index=True)
+    with open(path_benchmarks + 'benchmark_{}.json'.format(commit), 'w') as f:
+        json.dump(df_results.to_dict(orient='records'), f, indent=2)
+
+    path_history = path_benchmarks + 'benchmark_history.csv'
+    df_results.loc[df_results['timestamp'] == df_results['timestamp'].max()].to_csv(
+        path_history, mode='a', index=False, header=(os.path.isfile(path_history) == False))
+    print('BENCHMARK: The results are stored in {}'.format(path_benchmarks + 'benchmark_{}.json'.format(commit)))
+
+
+def load_benchmark_results(project_path, commit):
+    """
+    Load the benchmark results of a commit (None if there are no results).
+    """
+    file_path = get_benchmark_path(project_path) + 'benchmark_{}.json'.format(commit)
+    if os.path.isfile(file_path) == False:
+        return None
+    with open(file_path, 'r') as f:
+        return pd.DataFrame(json.load(f))
+
+
+def compare_benchmark_results(project_path, commit_base, commit_new=None, threshold=0.1):
+    """
+    Compare the benchmark results of two commits. A benchmark is flagged as a regression (improvement) if its
+    minimum wall time or its peak allocated memory increased (decreased) by more than the threshold.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    commit_base (str): Commit of the baseline results
+    commit_new (str): Commit of the new results (None -> current commit)
+    threshold (float): Relative change that is flagged (0.1 -> 10%)
+
+    Returns:
+    --------
+    df_compare (DataFrame): One row per benchmark and scale that was run for both commits
+    """
+    commit_new = commit_new or get_git_commit()
+    df_base = load_benchmark_results(project_path, commit_base)
+    df_new = load_benchmark_results(project_path, commit_new)
+    for commit, df in [(commit_base, df_base), (commit_new, df_new)]:
+        if df is None:
+            raise ValueError('There are no benchmark results for the commit {}'.format(commit))
+
+    # Results on fixtures of different generator versions are not comparable
+    versions = [df['fixture_version'].iloc[0] if 'fixture_version' in df.columns else 1 for df in [df_base, df_new]]
+    if versions[0] != versions[1]:
+        print('BENCHMARK: WARNING the fixtures of the commits differ (fixture versions {} and {})'.format(*versions))
+
+    metrics = ['time_min_s', 'peak_alloc_bytes']
+    df_compare = df_base.set_index(['benchmark', 'scale'])[metrics].join(
+        df_new.set_index(['benchmark', 'scale'])[metrics], how='inner', lsuffix='_base', rsuffix='_new')
+    df_compare['time_ratio'] = df_compare['time_min_s_new'] / df_compare['time_min_s_base']
+    df_compare['memory_ratio'] = df_compare['peak_alloc_bytes_new'] / df_compare['peak_alloc_bytes_base']
+    df_compare['flag'] = ''
+    df_compare.loc[(df_compare.time_ratio < 1 - threshold) | (df_compare.memory_ratio < 1 - threshold),
+                   'flag'] = 'improvement'
+    df_compare.loc[(df_compare.time_ratio > 1 + threshold) | (df_compare.memory_ratio > 1 + threshold),
+                   'flag'] = 'REGRESSION'
+    print('BENCHMARK: {} (base) vs. {} (new)'.format(commit_base, commit_new))
+    print(df_compare[['time_min_s_base', 'time_min_s_new', 'time_ratio', 'memory_ratio', 'flag']].to_string(
+        float_format='{:.3f}'.format))
+
+    return df_compare
@@ -0,0 +1,297 @@
+"""
+Build the sample of the Dick-Nielsen & Poulsen (2019) corrections as it would have looked on a given report date
+(as-of snapshots). post_2012_clean() and prior_2012_clean() apply the full history of cancellations, corrections and
+reversals, i.e. a trade that is cancelled years later is never in the cleaned yearly data. Here, every trade report
+gets a knowledge interval on the report date axis: it is known from its report date (TRD_RPT_DT) until the report
+date of the first cancellation, correction or reversal that deletes it (DEL_RPT_DT). The steps are as follows:
+    Step 1:     Build the bitemporal index while the raw data is read in (store_bitemporal_index()): the trade reports
+                that the corrections delete (all trade reports minus the cleaned yearly data, matched by the
+                provenance ID RAW_ID, see provenance_TRACE.py) with the report date of the deleting report. The
+                deleting reports are matched with the rules of clean_TRACE.py. The index is stored next to the
+                cleaned yearly data in bld/data/TRACE/TRACE_bitemporal and only holds the deleted trade reports, the
+                trades that are never deleted are the cleaned yearly data itself.
+    Step 2:     Materialize the snapshots of many as-of dates in one pass (load_asof_snapshots()): every trade
+                report is in the snapshots of the as-of dates in [TRD_RPT_DT, DEL_RPT_DT), i.e. the dates of a
+                report are found with a binary search over the sorted as-of dates instead of cleaning the data again
+                for every date.
+
+Note: The snapshot as of a date after the last report date is the cleaned yearly data. The snapshots contain the
+transaction variables of the merge (dataset_specs['transactions']['varlist']) before the merge with the MERGENT FISD
+data and before the cleaning steps of Bessembinder et al. (2018) and Anand et al. (2021). The index is built if
+dataset_specs['bitemporal']['enabled'] is True (see specs.py and settings_TRACE.py).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+# Import the columnar storage of the outputs
+from storage_TRACE import store_frame, load_frame, frame_exists, remove_frame
+# Import the provenance IDs of the trades
+from provenance_TRACE import RAW_ID
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+# Report date of the cancellation, correction or reversal that deletes a trade report
+DEL_RPT_DT = 'DEL_RPT_DT'
+# Report date of the snapshot
+ASOF_DT = 'ASOF_DT'
+
+
+def get_bitemporal_path(project_path, file_name):
+    """
+    Get the path of the deleted trade reports of a yearly dataset (e.g. TRACE_clean_2013.pkl).
+    """
+    return project_path + '/bld/data/TRACE/TRACE_bitemporal/' + file_name
+
+
+#########
+# Step 1: Build the bitemporal index
+########
+def get_deletion_dates(df_rows, left_on, df_deleting, right_on):
+    """
+    Get the first report date of the deleting reports that match every row on the given variables (missing values
+    match like in the merges of clean_TRACE.py).
+
+    Parameters:
+    -----------
+    df_rows (DataFrame): Trade reports
+    left_on (list): Variables of the trade reports
+    df_deleting (DataFrame): Deleting reports (cancellations, corrections or reversals)
+    right_on (list): Variables of the deleting reports
+
+    Returns:
+    --------
+    del_dates (array): Report date of the first matching deleting report (NaT if none matches)
+    """
+    df_match = df_deleting[right_on].copy()
+    df_match.columns = left_on
+    df_match[DEL_RPT_DT] = pd.to_datetime(df_deleting['TRD_RPT_DT']).values
+    df_match = df_match.groupby(left_on, dropna=False, as_index=False)[DEL_RPT_DT].min()
+
+    return df_rows[left_on].merge(df_match, on=left_on, how='left')[DEL_RPT_DT].values
+
+
+def get_deletions_post_2012(df_raw):
+    """
+    Get the trade reports after the reporting change and the first report date of the cancellations, corrections
+    (1.2) and reversals (1.3) that delete them (see post_2012_clean()).
+
+    Parameters:
+    -----------
+    df_raw (DataFrame): Raw data after the reporting change
+
+    Returns:
+    --------
+    df_trades (DataFrame): Trade reports with the report date of the first deleting report (NaT if none)
+    """
+    df_raw = df_raw.loc[df_raw.CUSIP_ID.isna() == False]
+    # Step 1.1: Executing party instead of the give-up party
+    for var, var_gvp in [('RPTG_PARTY_ID', 'RPTG_PARTY_GVP_ID'), ('CNTRA_PARTY_ID', 'CNTRA_PARTY_GVP_ID')]:
+        df_raw.loc[df_raw[var_gvp].isna() == False, var] = df_raw.loc[df_raw[var_gvp].isna() == False, var_gvp]
+    df_trades = df_raw.loc[df_raw.TRD_ST_CD.isin(['X', 'C', 'Y']) == False]
+
+    merge_vars = ['CUSIP_ID', 'ENTRD_VOL_QT', 'RPTD_PR', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'RPT_SIDE_CD',
+                  'CNTRA_PARTY_ID', 'CNTRA_PARTY_GVP_ID']
+    del_cancel = get_deletion_dates(df_trades, merge_vars + ['SYSTM_CNTRL_NB'],
+                                    df_raw.loc[df_raw.TRD_ST_CD.isin(['X', 'C'])], merge_vars + ['SYSTM_CNTRL_NB'])
+    del_reversal = get_deletion_dates(df_trades, merge_vars + ['SYSTM_CNTRL_NB'],
+                                      df_raw.loc[df_raw.TRD_ST_CD == 'Y'], merge_vars + ['PREV_TRD_CNTRL_NB'])
+    df_trades[DEL_RPT_DT] = np.fmin(del_cancel, del_reversal)
+
+    return df_trades
+
+
+def get_deletions_prior_2012(df_raw, unmatched):
+    """
+    Get the trade reports prior to the reporting change and the report date of the same-day cancellations and
+    corrections (2.2) and of the reversals (2.3/2.4) that delete them (see prior_2012_clean()). Like in the cleaning,
+    every reversal deletes the closest trade that is reported before it.
+
+    Parameters:
+    -----------
+    df_raw (DataFrame): Raw data prior to the reporting change
+    unmatched (DataFrame): Reversals referring to trades before Feb 6th, 2012 [Output from post_2012_clean()]
+
+    Returns:
+    --------
+    df_trades (DataFrame): Trade reports with the report date of the first deleting report (NaT if none)
+    """
+    df_raw = df_raw.loc[df_raw.CUSIP_ID.isna() == False]
+    # Step 2.1: Executing party instead of the give-up party
+    for var, var_gvp in [('RPTG_MKT_MP_ID', 'RPTG_SIDE_GVP_MP_ID'), ('CNTRA_MP_ID', 'CNTRA_GVP_ID')]:
+        df_raw.loc[df_raw[var_gvp].isna() == False, var] = df_raw.loc[df_raw[var_gvp].isna() == False, var_gvp]
+    df_trades = df_raw.loc[df_raw.TRC_ST.isin(['T', 'W', 'N']) & (df_raw.ASOF_CD != 'R')]
+
+    # Step 2.2: Same-day cancellations and corrections (deleted on the report date of the trade)
+    del_same_day = get_deletion_dates(df_trades, ['REC_CT_NB', 'TRD_RPT_DT'],
+                                      df_raw.loc[df_raw.TRC_ST.isin(['C', 'W'])], ['PREV_REC_CT_NB', 'TRD_RPT_DT'])
+
+    # Step 2.3/2.4: Reversals (including the reversals reported after the reporting change). Every reversal deletes
+    # the closest trade that matches and is reported before it
+    rev_vars = ['CUSIP_ID', 'EXCTN_TM', 'RPTD_PR', 'ENTRD_VOL_QT', 'RPT_SIDE_CD', 'CNTRA_MP_ID']
+    D_kept = pd.isna(del_same_day)
+    unmatched = unmatched.rename(columns={'TRD_EXCTN_TM': 'EXCTN_TM', 'CNTRA_PARTY_ID': 'CNTRA_MP_ID'})
+    df_reversal = df_raw.loc[df_raw.TRC_ST.isin(['T', 'W', 'N']) & (df_raw.ASOF_CD == 'R')]
+    df_reversal = df_reversal.loc[pd.isna(get_deletion_dates(
+        df_reversal, ['REC_CT_NB', 'TRD_RPT_DT'], df_raw.loc[df_raw.TRC_ST.isin(['C', 'W'])],
+        ['PREV_REC_CT_NB', 'TRD_RPT_DT']))]
+    df_reversal = pd.concat([df_reversal[rev_vars + ['TRD_RPT_TM', 'TRD_RPT_DT']],
+                             unmatched[rev_vars + ['TRD_RPT_TM', 'TRD_RPT_DT']]], ignore_index=True)
+    df_reversal['REV_ID'] = np.arange(len(df_reversal))
+    df_reversal = df_reversal.rename(columns={'TRD_RPT_DT': DEL_RPT_DT})
+    df_match = df_trades.loc[D_kept, rev_vars + ['TRD_RPT_TM', RAW_ID]].merge(
+        df_reversal, on=rev_vars, suffixes=('', '_reversal'))
+    df_match = df_match.loc[df_match['TRD_RPT_TM'] < df_match['TRD_RPT_TM_reversal']]
+    df_match['datetime_dist'] = df_match['TRD_RPT_TM_reversal'] - df_match['TRD_RPT_TM']
+    df_match = df_match.sort_values(['REV_ID', 'datetime_dist']).drop_duplicates(subset=['REV_ID'])
+    df_match[DEL_RPT_DT] = pd.to_datetime(df_match[DEL_RPT_DT])
+    del_reversal = pd.to_datetime(df_trades[RAW_ID].map(df_match.groupby(RAW_ID)[DEL_RPT_DT].min())).values
+    df_trades[DEL_RPT_DT] = np.fmin(del_same_day, del_reversal)
+
+    return df_trades
+
+
+def store_bitemporal_index(project_path, df_raw, df_clean, file_name, cusip_subset=None, unmatched=None,
+                           settings=None):
+    """
+    Store the trade reports of a yearly dataset that the corrections delete with the report date of the deleting
+    report. The deleted trade reports are the trade reports that are not in the cleaned yearly data. A trade report
+    without a matching deleting report (e.g. a report that the cleaning removes for another reason) is deleted on
+    its own report date, i.e. it is in no snapshot.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    df_raw (DataFrame): Raw data of the yearly dataset (input of post_2012_clean() or prior_2012_clean())
+    df_clean (DataFrame): Cleaned yearly data
+    file_name (str): File name of the yearly dataset (e.g. TRACE_clean_2013.pkl)
+    cusip_subset (list): Optional. Only these CUSIP IDs were read in, the index of the other bonds is kept
+    unmatched (DataFrame): Reversals referring to trades before Feb 6th, 2012 (prior to the reporting change)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+    """
+    if settings is None:
+        settings = get_settings()
+    out_path = get_bitemporal_path(project_path, file_name)
+    if settings['bitemporal']['enabled'] == False:
+        # An index of an earlier build would not match the new yearly data
+        if frame_exists(out_path):
+            remove_frame(out_path)
+        return
+    if (RAW_ID not in df_raw.columns) | (RAW_ID not in df_clean.columns):
+        print('The bitemporal index of {} is not stored: the trades have no provenance IDs'.format(file_name))
+        return
+
+    print('Storing the bitemporal index of {}'.format(file_name))
+    if 'TRC_ST' in df_raw.columns:
+        df_trades = get_deletions_prior_2012(df_raw, unmatched)
+    else:
+        df_trades = get_deletions_post_2012(df_raw)
+    # The trades that are never deleted are the cleaned yearly data
+    df_deleted = df_trades.loc[df_trades[RAW_ID].isin(df_clean[RAW_ID]) == False]
+    del_dates = df_deleted[DEL_RPT_DT].fillna(pd.to_datetime(df_deleted['TRD_RPT_DT']))
+    # Same columns as the cleaned yearly data (dates as datetime.date like TRD_RPT_DT)
+    df_deleted = df_deleted[[c for c in df_clean.columns if c in df_deleted.columns]].copy()
+    df_deleted[DEL_RPT_DT] = del_dates.dt.date.values
+    df_deleted = df_deleted.reset_index(drop=True)
+
+    if (cusip_subset is not None) & frame_exists(out_path):
+        df_stored = load_frame(out_path)
+        df_deleted = pd.concat([df_stored.loc[df_stored['CUSIP_ID'].isin(cusip_subset) == False], df_deleted],
+                               ignore_index=True)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    store_frame(df_deleted, out_path, settings)
+
+
+#########
+# Step 2: Materialize the snapshots
+########
+def to_day_array(values):
+    """
+    Convert dates (datetime.date, strings or timestamps) to a datetime64[D] array (missing dates -> NaT).
+    """
+    return pd.to_datetime(pd.Series(values, dtype=object)).values.astype('datetime64[D]')
+
+
+def expand_asof(df, asof_dates):
+    """
+    Repeat every trade report for the as-of dates in [TRD_RPT_DT, DEL_RPT_DT) with a binary search over the sorted
+    as-of dates.
+
+    Parameters:
+    -----------
+    df (DataFrame): Trade reports with TRD_RPT_DT and DEL_RPT_DT (NaT -> never deleted)
+    asof_dates (array): Sorted unique as-of dates (datetime64[D])
+
+    Returns:
+    --------
+    df_asof (DataFrame): Trade reports with the as-of date (ASOF_DT, first column)
+    """
+    rpt_dates = to_day_array(df['TRD_RPT_DT'].values)
+    del_dates = to_day_array(df[DEL_RPT_DT].values)
+    # A trade report is in the snapshots from its report date until the day before its deletion
+    first = np.searchsorted(asof_dates, rpt_dates, side='left')
+    last = np.where(np.isnat(del_dates), len(asof_dates), np.searchsorted(asof_dates, del_dates, side='left'))
+    counts = np.clip(last - first, 0, None)
+    counts[np.isnat(rpt_dates)] = 0
+
+    rows = np.repeat(np.arange(len(df)), counts)
+    positions = first[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    df_asof = df.drop(columns=[DEL_RPT_DT]).take(rows)
+    df_asof.insert(0, ASOF_DT, pd.to_datetime(asof_dates).date[positions])
+
+    return df_asof
+
+
+def load_asof_snapshots(project_path, asof_dates, dict_spec, cusips=None):
+    """
+    Materialize the sample after the Dick-Nielsen & Poulsen (2019) corrections as it would have looked at the end
+    of several report dates, with the late reports, corrections and reversals that were reported until then. All
+    as-of dates are materialized in one pass over the cleaned yearly data and the bitemporal index.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    asof_dates (list): As-of dates (a single date is also accepted)
+    dict_spec (dict): Final dataset specifications
+    cusips (list): Optional. Only the trades of these CUSIP IDs
+
+    Returns:
+    --------
+    df_asof (DataFrame): Trade reports of every snapshot (ASOF_DT, the transaction variables and RAW_ID), sorted by
+                         the as-of date
+    """
+    # The yearly datasets are read like in the merge (imported here because the merge imports the read-in, which
+    # builds the index)
+    from concatenate_merge_TRACE_MERGENT import get_yearly_files, read_yearly_data
+    from read_TRACE import select_bonds
+
+    if np.ndim(asof_dates) == 0:
+        asof_dates = [asof_dates]
+    asof_dates = np.unique(to_day_array(asof_dates))
+    if (len(asof_dates) == 0) or np.isnat(asof_dates).any():
+        raise ValueError('The as-of dates have to be valid dates: {}'.format(asof_dates))
+    cusip_keep = select_bonds(project_path)
+    if cusips is not None:
+        cusip_keep = cusip_keep.loc[cusip_keep.isin(list(cusips))]
+    # Only the trade reports until the last as-of date are read
+    filters = [('TRD_RPT_DT', '<=', pd.Timestamp(asof_dates[-1]).date())]
+    extra_vars = [v for v in ['TRD_RPT_DT'] if v not in dict_spec['transactions']['varlist']]
+
+    list_asof = []
+    for year, file_name, pre_post_id in get_yearly_files(dict_spec['sample_time_span']):
+        if frame_exists(get_bitemporal_path(project_path, file_name)) == False:
+            raise FileNotFoundError('The bitemporal index of {} does not exist. Build the dataset with '
+                                    "dataset_specs['bitemporal']['enabled'] = True".format(file_name))
+        df_clean = read_yearly_data(project_path, file_name, pre_post_id, dict_spec, cusip_keep, filters=filters,
+                                    extra_vars=extra_vars)
+        df_clean[DEL_RPT_DT] = pd.NaT
+        df_deleted = read_yearly_data(project_path, file_name, pre_post_id, dict_spec, cusip_keep, filters=filters,
+                                      folder='TRACE_bitemporal', extra_vars=extra_vars + [DEL_RPT_DT])
+        list_asof.append(expand_asof(pd.concat([df_clean, df_deleted], ignore_index=True), asof_dates))
+
+    df_asof = pd.concat(list_asof, ignore_index=True)
+    df_asof = df_asof.iloc[np.argsort(to_day_array(df_asof[ASOF_DT].values), kind='stable')]
+
+    return df_asof.drop(columns=extra_vars).reset_index(drop=True)
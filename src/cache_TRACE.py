@@ -0,0 +1,312 @@
+"""
+Cache the results of the queries of the final TRACE dataset (see query_TRACE.py). The same queries (e.g. the volume
+by rating or the trades per event week) are run many times a day, and every run reads the final dataset again. Here,
+the result of a query is kept in memory and on disk and is reused until a new final dataset is published. The steps
+are as follows:
+    Step 1:     Normalize the query (e.g. the order of the CUSIPs or of the filters does not change the key, the
+                group-by columns and aggregations are part of it) and get the fingerprint of the stored final
+                dataset. A new build or update writes a new dataset and thus
+                changes the fingerprint, i.e. the cached results of older builds are never returned.
+    Step 2:     Keep the results in memory with a least-recently-used eviction bounded by 'max_memory_mb'
+                (get_memory_result(), store_memory_result()).
+    Step 3:     Keep the results on disk (bld/data/TRACE/TRACE_query_cache) with a least-recently-used eviction
+                bounded by 'max_disk_mb' (get_disk_result(), store_disk_result()). The results of older builds are
+                deleted when the cache is used with a new fingerprint.
+
+Note: The cache is off by default. It pays off for aggregations and small projections that are queried repeatedly
+(e.g. by the server, see server_TRACE.py), whereas a cached projection of many columns only duplicates the final
+dataset in memory and on disk. A result that is larger than the bound is not cached. The DataFrames returned from the
+cache are copies, i.e. they can be changed without changing the cache. Streamed queries (batch_size) are not cached.
+The settings are taken from dataset_specs['query_cache'] (see specs.py and settings_TRACE.py).
+"""
+
+import collections
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+
+# Import the columnar storage of the outputs
+from storage_TRACE import META_FILE, get_storage_path, get_disk_size, store_frame, load_frame
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Version of the cache entries (changes if the key or the format of the entries change)
+CACHE_VERSION = 2
+# Results in the memory of the process: key -> (result, size in bytes), the least recently used first
+MEMORY_CACHE = {'entries': collections.OrderedDict(), 'bytes': 0}
+
+
+def get_cache_path(project_path):
+    """
+    Get the folder of the cached results on disk.
+    """
+    return project_path + '/bld/data/TRACE/TRACE_query_cache/'
+
+
+#########
+# Step 1: Normalize the query and get the fingerprint of the final dataset
+########
+def to_key_value(value):
+    """
+    Convert a value of a filter to a JSON value that keeps its type (e.g. the date 2014-01-01 and the string
+    '2014-01-01' are different filters).
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [to_key_value(v) for v in value]
+    if (value is None) or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return '{}:{}'.format(type(value).__name__, value.isoformat())
+
+    return '{}:{}'.format(type(value).__name__, value)
+
+
+def normalize_query(columns, query_filters, output, aggregation=None):
+    """
+    Normalize a query: the filters are conjunctive, i.e. their order does not matter, and the values of in and not in
+    are sets. The order of the columns, of the group-by columns and of the aggregations is kept because it is the
+    order of the result.
+
+    Parameters:
+    -----------
+    columns (list): Columns of the query (None -> all columns)
+    query_filters (list): Filters of the query (see get_query_filters() in query_TRACE.py)
+    output (str): 'pandas' or 'arrow'
+    aggregation (dict): Group-by columns and aggregations of the query (see get_aggregation() in query_TRACE.py,
+                        None -> no aggregation)
+
+    Returns:
+    --------
+    query (dict): Normalized query
+    """
+    list_filters = []
+    for col, op, value in query_filters:
+        value = to_key_value(value)
+        if op in ['in', 'not in']:
+            value = sorted(set([json.dumps(v) for v in value]))
+        list_filters.append(json.dumps([col, op, value]))
+
+    return {'columns': None if columns is None else list(columns), 'filters': sorted(set(list_filters)),
+            'output': output, 'aggregation': aggregation}
+
+
+def get_build_fingerprint(final_paths):
+    """
+    Get the fingerprint of the stored final dataset. Every build or update writes a new dataset folder (or pickle),
+    i.e. the file of the metadata gets a new inode and modification time.
+
+    Parameters:
+    -----------
+    final_paths (list): Paths of the final dataset or of its shards (see get_final_paths() in query_TRACE.py)
+
+    Returns:
+    --------
+    fingerprint (str): Fingerprint of the final dataset
+    """
+    list_stats = []
+    for path in final_paths:
+        storage_path = get_storage_path(path)
+        if os.path.isdir(storage_path):
+            stat = os.stat(storage_path + '/' + META_FILE)
+        else:
+            stat = os.stat(storage_path)
+        list_stats.append([os.path.basename(storage_path), stat.st_ino, stat.st_mtime_ns, stat.st_size])
+
+    return hashlib.sha1(json.dumps([CACHE_VERSION, list_stats]).encode()).hexdigest()[:16]
+
+
+def get_query_key(query, fingerprint):
+    """
+    Get the key of a query: the fingerprint of the final dataset followed by the hash of the normalized query, such
+    that the entries of older builds can be found by their prefix.
+    """
+    return fingerprint + '_' + hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()[:24]
+
+
+def get_result_bytes(result):
+    """
+    Get the size of a result in memory (DataFrame or Arrow table) in bytes.
+    """
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True, index=True).sum())
+
+    return int(result.nbytes)
+
+
+def copy_result(result):
+    """
+    Copy a DataFrame that is returned from the cache (Arrow tables cannot be changed and are not copied).
+    """
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+
+    return result
+
+
+#########
+# Step 2: Keep the results in memory
+########
+def get_memory_result(key, fingerprint):
+    """
+    Get a result from the memory (None if it is not cached). The results of other builds are deleted.
+    """
+    entries = MEMORY_CACHE['entries']
+    for k in [k for k in entries if k.startswith(fingerprint + '_') == False]:
+        MEMORY_CACHE['bytes'] -= entries.pop(k)[1]
+    if key not in entries:
+        return None
+    entries.move_to_end(key)
+
+    return copy_result(entries[key][0])
+
+
+def store_memory_result(key, result, max_memory_mb):
+    """
+    Keep a result in memory and evict the least recently used results beyond max_memory_mb.
+    """
+    max_bytes = max_memory_mb * 1024 ** 2
+    n_bytes = get_result_bytes(result)
+    if n_bytes > max_bytes:
+        return
+    entries = MEMORY_CACHE['entries']
+    if key in entries:
+        MEMORY_CACHE['bytes'] -= entries.pop(key)[1]
+    while (len(entries) > 0) and (MEMORY_CACHE['bytes'] + n_bytes > max_bytes):
+        MEMORY_CACHE['bytes'] -= entries.popitem(last=False)[1][1]
+    entries[key] = (copy_result(result), n_bytes)
+    MEMORY_CACHE['bytes'] += n_bytes
+
+
+#########
+# Step 3: Keep the results on disk
+########
+def get_disk_entries(cache_path):
+    """
+    Get the results on disk: DataFrames are stored as outputs (<key>.parquet or <key>.pkl, see storage_TRACE.py) and
+    Arrow tables as Arrow IPC files (<key>.arrow).
+
+    Returns:
+    --------
+    entries (dict): Key -> path of the entry
+    """
+    entries = {}
+    if os.path.isdir(cache_path) == False:
+        return entries
+    for f in os.listdir(cache_path):
+        key, ext = os.path.splitext(f)
+        if (ext in ['.parquet', '.pkl', '.arrow']) and (f.startswith('tmp_') == False):
+            entries[key] = cache_path + f
+
+    return entries
+
+
+def remove_disk_entry(entry_path):
+    """
+    Delete a result on disk.
+    """
+    if os.path.isdir(entry_path):
+        shutil.rmtree(entry_path)
+    elif os.path.isfile(entry_path):
+        os.remove(entry_path)
+
+
+def get_disk_result(cache_path, key, fingerprint, output):
+    """
+    Get a result from the disk (None if it is not cached). The results of other builds are deleted.
+    """
+    entries = get_disk_entries(cache_path)
+    for k in [k for k in entries if k.startswith(fingerprint + '_') == False]:
+        remove_disk_entry(entries.pop(k))
+    if key not in entries:
+        return None
+    # The modification time is the time of the last use (least-recently-used eviction)
+    os.utime(entries[key])
+    if output == 'arrow':
+        with pa.memory_map(entries[key], 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    return load_frame(cache_path + key + '.pkl')
+
+
+def store_disk_result(cache_path, key, result, max_disk_mb):
+    """
+    Store a result on disk and evict the least recently used results beyond max_disk_mb.
+    """
+    max_bytes = max_disk_mb * 1024 ** 2
+    os.makedirs(cache_path, exist_ok=True)
+    if isinstance(result, pd.DataFrame):
+        store_frame(result, cache_path + key + '.pkl')
+        entry_path = get_storage_path(cache_path + key + '.pkl')
+    else:
+        # Write into a temporary file first, such that an entry is either complete or does not exist
+        entry_path = cache_path + key + '.arrow'
+        with pa.OSFile(cache_path + 'tmp_' + key + '.arrow', 'wb') as sink:
+            with pa.ipc.new_file(sink, result.schema) as writer:
+                writer.write_table(result)
+        os.replace(cache_path + 'tmp_' + key + '.arrow', entry_path)
+
+    # Delete the least recently used entries (including the new one if it is larger than the bound)
+    entries = get_disk_entries(cache_path)
+    list_entries = sorted([(os.path.getmtime(p), p) for p in entries.values()])
+    dict_bytes = {p: get_disk_size(p) for _, p in list_entries}
+    total_bytes = sum(dict_bytes.values())
+    if dict_bytes[entry_path] > max_bytes:
+        remove_disk_entry(entry_path)
+        total_bytes -= dict_bytes[entry_path]
+    for _, p in list_entries:
+        if total_bytes <= max_bytes:
+            break
+        if (p != entry_path) & os.path.exists(p):
+            remove_disk_entry(p)
+            total_bytes -= dict_bytes[p]
+
+
+def run_cached(project_path, final_paths, columns, query_filters, output, run_query, aggregation=None,
+               settings=None):
+    """
+    Return the cached result of a query or run the query and cache its result (memory first, then disk).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    final_paths (list): Paths of the final dataset or of its shards
+    columns (list): Columns of the query (None -> all columns)
+    query_filters (list): Filters of the query
+    output (str): 'pandas' or 'arrow'
+    run_query (function): Function without arguments that runs the query
+    aggregation (dict): Group-by columns and aggregations of the query (None -> no aggregation)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings, i.e. no cache)
+
+    Returns:
+    --------
+    result (DataFrame or Table): Result of the query
+    """
+    if settings is None:
+        settings = get_settings()
+    query_cache = settings['query_cache']
+    if (query_cache['enabled'] == False) | ((output == 'arrow') & (pa is None)):
+        return run_query()
+    fingerprint = get_build_fingerprint(final_paths)
+    key = get_query_key(normalize_query(columns, query_filters, output, aggregation), fingerprint)
+    cache_path = get_cache_path(project_path)
+
+    result = get_memory_result(key, fingerprint)
+    if result is not None:
+        return result
+    result = get_disk_result(cache_path, key, fingerprint, output)
+    if result is None:
+        result = run_query()
+        if query_cache['max_disk_mb'] > 0:
+            store_disk_result(cache_path, key, result, query_cache['max_disk_mb'])
+    if query_cache['max_memory_mb'] > 0:
+        store_memory_result(key, result, query_cache['max_memory_mb'])
+
+    return result
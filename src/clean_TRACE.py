@@ -18,8 +18,16 @@ pd.options.mode.chained_assignment = None
 from datetime import datetime
 # Import the dates of US holidays
 from data_specs.US_holidays.US_holiday_list import get_US_holiday_dates
-
-def post_2012_clean(df_post):
+# Import the join with the check of the result size
+from join_guard_TRACE import guarded_merge
+# Import the reading of the stored outputs (see storage_TRACE.py)
+from storage_TRACE import load_rpt_dates
+# Import the provenance IDs of the trades
+from provenance_TRACE import get_provenance_vars
+# Import the sort order of the frames
+from sort_order_TRACE import set_sort_order, rename_sort_order, sort_frame
+
+def post_2012_clean(df_post, settings=None):
     """
     Rreplicate the code by Dick-Nielsen and Poulsen (2019) for the post-2012 data. In the code,
     I document the pages in the paper where the respective passage original SAS code is displayed.
@@ -27,6 +35,7 @@ def post_2012_clean(df_post):
     Parameters:
     -----------
     df_post (DataFrame): Post-2012 raw dataset
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -72,8 +81,8 @@ def post_2012_clean(df_post):
     # Indicator which rows are to be dropped
     temp_deleteI_NEW['drop'] = 1
     # Generate the merged temp file. This is the equivalent to the SQL command on page 14 (upper part)
-    temp_raw2 = temp_raw.merge(temp_deleteI_NEW, left_on = merge_vars_tmp2,
-                               right_on = merge_vars_tmp2, how = 'left')
+    temp_raw2 = guarded_merge(temp_raw, temp_deleteI_NEW, 'post_2012_clean: temp_raw2', left_on = merge_vars_tmp2,
+                              right_on = merge_vars_tmp2, how = 'left', settings=settings)
     # Drop rows based on the drop indicator
     temp_raw2 = temp_raw2.loc[temp_raw2["drop"] != 1]
     # Drop unnecessary variable
@@ -88,8 +97,10 @@ def post_2012_clean(df_post):
     temp_deleteII_NEW['drop'] = 1
     
     # Generate the merged temp file. This is the equivalent of the SQL command on page 14 (lower part)
-    temp_raw3_NEW = temp_raw2.merge(temp_deleteII_NEW[merge_vars_raw_delII + ['drop']], left_on = merge_vars_raw2,
-                                        right_on = merge_vars_raw_delII, how = 'left', suffixes=('', '_temp_delII'))
+    temp_raw3_NEW = guarded_merge(temp_raw2, temp_deleteII_NEW[merge_vars_raw_delII + ['drop']],
+                                  'post_2012_clean: temp_raw3_NEW', left_on = merge_vars_raw2,
+                                  right_on = merge_vars_raw_delII, how = 'left', suffixes=('', '_temp_delII'),
+                                  settings=settings)
     # Drop rows based on indicator
     temp_raw3_NEW = temp_raw3_NEW.loc[temp_raw3_NEW["drop"] != 1]
     temp_raw3_NEW = temp_raw3_NEW.drop(columns = ['drop', 'PREV_TRD_CNTRL_NB_temp_delII'])
@@ -101,7 +112,7 @@ def post_2012_clean(df_post):
     return temp_raw3_NEW, unmatched
 
 
-def prior_2012_clean(df_pre, unmatched):
+def prior_2012_clean(df_pre, unmatched, settings=None):
     """
     Replicate the code by Dick Nielsen and Poulsen (2019) for the pre-2012 data. In the code
     I document the pages in the paper where the respective passage original SAS code is displayed.
@@ -110,6 +121,7 @@ def prior_2012_clean(df_pre, unmatched):
     -----------
     df_pre: Pre-2012 raw dataset
     unmatched: Reversals referring to trades before Feb 6th, 2012 [Output from post_2012_clean()]
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -142,18 +154,21 @@ def prior_2012_clean(df_pre, unmatched):
     # Add an indicator for which rows to drop
     temp_delete['drop'] = 1
     # Generate the merged temp file. This is the equivalent to the SQL command on page 15-16
-    temp_raw_red = temp_raw_tmp.merge(temp_delete, left_on = ['REC_CT_NB', 'TRD_RPT_DT'],
-                                      right_on = ['PREV_REC_CT_NB', 'TRD_RPT_DT'], how = 'left')
+    temp_raw_red = guarded_merge(temp_raw_tmp, temp_delete, 'prior_2012_clean: temp_raw_red',
+                                 left_on = ['REC_CT_NB', 'TRD_RPT_DT'], right_on = ['PREV_REC_CT_NB', 'TRD_RPT_DT'],
+                                 how = 'left', settings=settings)
     # Drop rows based on indicator
     temp_raw_red = temp_raw_red.loc[temp_raw_red["drop"] != 1]
-    # Sort variables
-    temp_raw_red = temp_raw_red.sort_values(['REC_CT_NB', 'TRD_RPT_DT'])[['REC_CT_NB', 'TRD_RPT_DT']]
-    temp_raw2 = temp_raw.merge(temp_raw_red, on = ['REC_CT_NB', 'TRD_RPT_DT'], how='inner')
+    # Keep the keys. The inner join below keeps the order of temp_raw, i.e. the right side does not have to be sorted
+    temp_raw_red = temp_raw_red[['REC_CT_NB', 'TRD_RPT_DT']]
+    temp_raw2 = guarded_merge(temp_raw, temp_raw_red, 'prior_2012_clean: temp_raw2', on = ['REC_CT_NB', 'TRD_RPT_DT'],
+                              how='inner', settings=settings)
 
 
     # Step 2.3: (Dick Nielsen and Thomas Poulsen (2019), p.16)
-    # Take out reversals into a dataset;
+    # Take out reversals into a dataset; The data is numbered in its order, i.e. it is sorted by N
     temp_raw2['N'] = np.arange(1,len(temp_raw2)+1)
+    temp_raw2 = set_sort_order(temp_raw2, ['N'])
     reversal  = temp_raw2.loc[temp_raw2.ASOF_CD=='R']
     temp_raw3 = temp_raw2.loc[temp_raw2.ASOF_CD!='R']
     # Include reversals referring to transactions before February 6th, 2012 that
@@ -180,19 +195,20 @@ def prior_2012_clean(df_pre, unmatched):
     # Identify all transactions that matches the reversals. This code is analogous to the SQL command on page. 17
     reversal_tmp = reversal[['CUSIP_ID', 'EXCTN_TM', 'RPTD_PR', 'ENTRD_VOL_QT', 'RPT_SIDE_CD','CNTRA_MP_ID', 'REV_ID',
                              'TRD_RPT_TM']]
-    reversal2 = temp_raw3.merge(reversal_tmp, on=['CUSIP_ID', 'EXCTN_TM', 'RPTD_PR', 'ENTRD_VOL_QT', 'RPT_SIDE_CD',
-                                                  'CNTRA_MP_ID'], how = 'inner', suffixes=('', '_reversal'))
+    reversal2 = guarded_merge(temp_raw3, reversal_tmp, 'prior_2012_clean: reversal2',
+                              on=['CUSIP_ID', 'EXCTN_TM', 'RPTD_PR', 'ENTRD_VOL_QT', 'RPT_SIDE_CD', 'CNTRA_MP_ID'],
+                              how = 'inner', suffixes=('', '_reversal'), settings=settings)
     # Reversals must be reported after the matching transaction
     reversal2 = reversal2.loc[reversal2['TRD_RPT_TM']<reversal2['TRD_RPT_TM_reversal']]
     reversal2['datetime_dist'] = reversal2['TRD_RPT_TM_reversal'] - reversal2['TRD_RPT_TM']
-    reversal2 = reversal2.sort_values('N')
     # Keep the earliest transaction (in a chronological sense) that matches each
-    # reversal;
-    reversal2 = reversal2.sort_values(['REV_ID', 'datetime_dist'])
-    reversal2 = reversal2.drop_duplicates(subset=['REV_ID'])
-    # Sort the data
-    reversal2 = reversal2.sort_values(['N'])
-    temp_raw3 = temp_raw3.sort_values(['N'])
+    # reversal; If several transactions are equally close, keep the first one (in the order of N). The minima are
+    # taken per reversal (hashed groups), i.e. the matches are not sorted by REV_ID
+    reversal2 = reversal2.loc[reversal2['datetime_dist'] ==
+                              reversal2.groupby('REV_ID', sort=False)['datetime_dist'].transform('min')]
+    reversal2 = reversal2.loc[reversal2['N'] == reversal2.groupby('REV_ID', sort=False)['N'].transform('min')]
+    # Sort the data (temp_raw3 is still sorted by N, the matching transactions are only used as a set)
+    temp_raw3 = sort_frame(temp_raw3, ['N'])
     # Delete the matching reversals
     temp_raw3['drop_ind_rev_2'] = (temp_raw3['N'].isin(reversal2['N']))*1
     temp_raw4 = temp_raw3.loc[temp_raw3.drop_ind_rev_2 == 0]
@@ -226,6 +242,8 @@ def harmon_pre_post_data(df, pre_post_id):
                               "CNTRA_MP_ID":"CNTRA_PARTY_ID", "CNTRA_GVP_ID":"CNTRA_PARTY_GVP_ID",
                                "EXCTN_TM":"TRD_EXCTN_TM", "WIS_CD":"WIS_DSTRD_CD", "CMSN_TRD_FL":"CMSN_TRD"},
                      inplace=True)
+        # The execution time is part of the canonical order of the yearly data (see sort_order_TRACE.py)
+        df = rename_sort_order(df, {"EXCTN_TM": "TRD_EXCTN_TM"})
     # If the DataFrame is from the post period:
     elif pre_post_id == 'POST':
         # Rename variables in temp_raw3_new
@@ -278,7 +296,7 @@ def filter_agency_trd(df):
     return temp_raw6
 
 
-def del_interd_transact(df_in_concat):
+def del_interd_transact(df_in_concat, settings=None):
     """
     Delete the inter-dealer transactions (one of the sides). This is not necessary and entirely depends on the
     researcher's discretion. See Dick-Nielsen (2014, 2019) for a discussion.
@@ -286,6 +304,7 @@ def del_interd_transact(df_in_concat):
     Parameters:
     -----------
     df_in_concat (DataFrame): Concatenated and merged yearly TRACE data
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -299,8 +318,8 @@ def del_interd_transact(df_in_concat):
     #temp_raw6 = filter_agency_trd(df_in_concat)
     temp_raw6 = df_in_concat.copy()
 
-    # Sort the data and assign an unique ID to each observation
-    temp_raw6 = temp_raw6.sort_values(['CUSIP_ID', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM'])
+    # Assign an unique ID to each observation. The matches are identified by the values of the transactions and the
+    # kept transactions are returned as a set, i.e. the data does not have to be sorted
     temp_raw6['id'] = np.arange(0,len(temp_raw6))
 
     # Identify all inter-dealer trades
@@ -316,13 +335,12 @@ def del_interd_transact(df_in_concat):
                            'RPTG_PARTY_ID']
 
     # Identify matching inter-dealer transactions
-    matches = inter_dealer.merge(dealer_buys[merge_deal_buy_vars+ ['id']], left_on = merge_int_deal_vars,
-                                 right_on=merge_deal_buy_vars, how='inner', suffixes=('', '_match'))
-    matches = matches.loc[matches.RPT_SIDE_CD=='S'].sort_values(['id'])
+    matches = guarded_merge(inter_dealer, dealer_buys[merge_deal_buy_vars+ ['id']], 'del_interd_transact: matches',
+                            left_on = merge_int_deal_vars, right_on=merge_deal_buy_vars, how='inner',
+                            suffixes=('', '_match'), settings=settings)
+    matches = matches.loc[matches.RPT_SIDE_CD=='S']
 
     # Delete one side of each inter-dealer transaction (double counting)
-    # Sort the temp_raw6 by the ID variable
-    temp_raw6 = temp_raw6.sort_values(['id'])
     temp_raw6['select_d'] = (temp_raw6['id'].isin(matches['id']))*1
     temp_raw7 = temp_raw6.loc[temp_raw6.select_d == 0]
 
@@ -339,7 +357,73 @@ def del_interd_transact(df_in_concat):
 #######
 #Step 4
 #######
-def clean_trade_level(df_in):
+def flag_trade_size_offer_size(df_clean):
+    """
+    Apply the filters b) and c) of clean_trade_level() (without printing) and compute the indicator whether the
+    trade size exceeds the bond's offer size (see d) in clean_trade_level()).
+
+    Parameters:
+    -----------
+    df_clean (DataFrame): Input DataFrame
+
+    Returns:
+    --------
+    df_clean (DataFrame): Secondary market transactions that are not reported after the amount outstanding is zero,
+                          including the indicator D_trd_size_offer_size
+    """
+    df_clean = df_clean[df_clean.TRDG_MKT_CD == "S1"]
+    df_clean['TRD_RPT_DT'] = pd.to_datetime(df_clean['TRD_RPT_DT'])
+    df_clean['effective_date'] = pd.to_datetime(df_clean['effective_date'])
+    df_clean = df_clean[((df_clean['TRD_RPT_DT'] > df_clean['effective_date']) & (df_clean.amount_outstanding == 0)) == False]
+    df_clean['trd_quantity'] = df_clean.ENTRD_VOL_QT / df_clean.principal_amt
+    df_clean['D_trd_size_offer_size'] = (df_clean.trd_quantity > df_clean.offering_amt) * 1
+
+    return df_clean
+
+
+def get_cusip_trade_stats(df_in):
+    """
+    Compute the bond-level statistics that clean_trade_level() needs over the entire sample for one partition of the
+    sample (e.g. one year). The statistics of all partitions are combined using combine_cusip_trade_stats(). This
+    allows to apply clean_trade_level() partition by partition without holding the entire sample in memory.
+
+    Parameters:
+    -----------
+    df_in (DataFrame): One partition of the input DataFrame of clean_trade_level()
+
+    Returns:
+    --------
+    df_stats (DataFrame): Statistics per CUSIP (index): the number of trades (N_trnsct) and the maximum of the
+                          indicator whether the trade size exceeds the offer size (D_trd_size_offer_size_max)
+    """
+    df_stats = df_in.groupby('CUSIP_ID')['CUSIP_ID'].count().to_frame('N_trnsct')
+    df_flag = flag_trade_size_offer_size(df_in.copy())
+    # Bonds without any trade after the filters b) and c) are set to 0 (they have no trade to be excluded)
+    df_stats['D_trd_size_offer_size_max'] = (
+        df_flag.groupby('CUSIP_ID')['D_trd_size_offer_size'].max().reindex(df_stats.index, fill_value=0)
+    )
+
+    return df_stats
+
+
+def combine_cusip_trade_stats(list_stats):
+    """
+    Combine the bond-level statistics of several partitions (see get_cusip_trade_stats()).
+
+    Parameters:
+    -----------
+    list_stats (list): List with the statistics of each partition
+
+    Returns:
+    --------
+    df_stats (DataFrame): Statistics per CUSIP over all partitions
+    """
+    df_stats = pd.concat(list_stats).groupby(level=0).agg({'N_trnsct': 'sum', 'D_trd_size_offer_size_max': 'max'})
+
+    return df_stats
+
+
+def clean_trade_level(df_in, cusip_stats=None):
     """
     Perform additional cleaning steps following Bessembinder et al. (2018) p. 1623 and Anand et al (2021)
     p. 12. They exclude bonds based on the following criteria:
@@ -353,6 +437,8 @@ def clean_trade_level(df_in):
     Parameters:
     -----------
     df_in (DataFrame): Input DataFrame that is to be cleared
+    cusip_stats (DataFrame): Optional. Bond-level statistics over the entire sample (see get_cusip_trade_stats()).
+                             If specified, df_in can be a partition of the sample (e.g. one year).
 
     Returns:
     --------
@@ -367,7 +453,10 @@ def clean_trade_level(df_in):
     N_trnsct = len(df_clean)
 
     # a) Keep a bond only in the sample if it has more than 5 trades over the entire sample period:
-    df_clean = df_clean[df_in.groupby('CUSIP_ID')['CUSIP_ID'].transform(lambda x: len(x)) > 5]
+    if cusip_stats is None:
+        df_clean = df_clean[df_in.groupby('CUSIP_ID')['CUSIP_ID'].transform(lambda x: len(x)) > 5]
+    else:
+        df_clean = df_clean[df_clean['CUSIP_ID'].map(cusip_stats['N_trnsct']) > 5]
     print('STEP 3.2.1: Keeping only bonds with more than 5 trades over the sample deletes {} transactions'.format(N_trnsct - len(df_clean)))
     N_trnsct = len(df_clean)
 
@@ -394,7 +483,10 @@ def clean_trade_level(df_in):
     # Select only those bonds for which the trade size is smaller than the issue size
     #df_clean['D_trd_size_offer_size'] = (df_clean.trd_quantity > df_clean.offering_amt) * 1
     df_clean['D_trd_size_offer_size'] = (df_clean.trd_quantity > df_clean.offering_amt) * 1
-    df_clean['D_trd_size_offer_size_max'] = df_clean.groupby('CUSIP_ID')['D_trd_size_offer_size'].transform('max')
+    if cusip_stats is None:
+        df_clean['D_trd_size_offer_size_max'] = df_clean.groupby('CUSIP_ID')['D_trd_size_offer_size'].transform('max')
+    else:
+        df_clean['D_trd_size_offer_size_max'] = df_clean['CUSIP_ID'].map(cusip_stats['D_trd_size_offer_size_max'])
     # Only keep bonds where the trading amount is indeed lower than the offering amount, i.e. exclude those bonds
     # where the maximum is 1 (which implies that the trade size is indeed larger than the offer size).
     #df_clean = df_clean.loc[df_clean.D_trd_size_offer_size_max == 0]
@@ -437,8 +529,8 @@ def clean_df_general(df_in, dict_spec):
     # Get the initial (pre-cleaning) number of transactions
     N_trnsct = len(df_clean_df)
 
-    # a) Only keep the specified variables in the final dataset
-    df_clean_df = df_clean_df[dict_spec['dataset_clean']['varlist']]
+    # a) Only keep the specified variables in the final dataset (and the provenance ID of the trades, raw_id)
+    df_clean_df = df_clean_df[dict_spec['dataset_clean']['varlist'] + get_provenance_vars(df_clean_df)]
 
     # b) Change all variable names from capital letters to small letters
     df_clean_df.columns = map(str.lower, df_clean_df.columns)
@@ -521,7 +613,7 @@ def clean_trd_days(df_in, project_path):
     # 2) Keep only those transactions that are executed on a date where there exists a  TRACE reporting file
     # (as dates without a reported file sometimes have an exceptionally small number of trades).
     # The TRACE_rpt_dates.pkl is constructed in the read_TRACE.py script.
-    TRACE_rpt_days = pd.read_pickle(project_path + '/' + 'bld/data/TRACE/TRACE_info/TRACE_rpt_dates.pkl')
+    TRACE_rpt_days = load_rpt_dates(project_path + '/' + 'bld/data/TRACE/TRACE_info/TRACE_rpt_dates.pkl')
     TRACE_rpt_days = [datetime.strptime(date, '%Y-%m-%d').date() for date in TRACE_rpt_days]
     df_clean_dates = df_clean_dates.loc[df_clean_dates.trd_exctn_dt.isin(TRACE_rpt_days)]
 
@@ -8,7 +8,7 @@ Step 1: Prepare and merge the ratings data to the transaction data. Note that so
         function is not necessary but useful to check if all non directly mergeable ratings are properly merged.
 
 Step 2: Concatenate the yearly dataset to one large dataset. For computational reasons, merge the issue and the bond
-        info data already during the concatenate-step. Finally, save the concatenated dataset as pickle format.
+        info data already during the concatenate-step. Finally, save the concatenated dataset.
 """
 
 import pandas as pd
@@ -16,6 +16,22 @@ pd.options.mode.chained_assignment = None
 
 # Import the concatenating function from Dick-Nielsen & Poulsen (2019)
 from clean_TRACE import harmon_pre_post_data
+# Import the as-of merge of the time-varying bond information
+from read_bond_background_TRACE import merge_bond_info_intervals
+# Import the bond selection according to Bessembinder et al. (2018)
+from read_TRACE import select_bonds
+# Import the join with the check of the result size
+from join_guard_TRACE import guarded_merge
+# Import the prefetching of the next yearly dataset (see async_io_TRACE.py)
+from async_io_TRACE import prefetch
+# Import the settings of the build (see settings_TRACE.py)
+from settings_TRACE import get_settings
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import load_frame, get_frame_columns
+# Import the provenance IDs of the trades
+from provenance_TRACE import RAW_ID, get_provenance_vars
+# Import the sort order of the frames
+from sort_order_TRACE import sort_frame, keep_sort_order, replace_sort_var, asof_join_sorted
 
 #########
 # Step 1: Prepare and merge ratings data
@@ -145,7 +161,8 @@ def merge_transact_rating(path, df_transact, dict_spec, df_rating):
     Merge the transaction data (TRACE) and the ratings data (MERGENT FISD). Importantly, some ratings are issued on a
     date when the bond is not traded. In case a rating date can not directly be merged to a transaction date, I assign
     the rating to the closest transaction in the future. This assures that the rating information is only assigned to
-    trades where it was already known to the market. This merging can be achieved using merge_asof()
+    trades where it was already known to the market. This merging is achieved with an as-of join of the datasets
+    sorted by CUSIP and date (see asof_join_sorted() in sort_order_TRACE.py)
 
     Parameters:
     -----------
@@ -156,47 +173,247 @@ def merge_transact_rating(path, df_transact, dict_spec, df_rating):
     Returns:
     --------
     merge_transact_rating (DataFrame):  Output DataFrame consisting of both the transaction and the rating data
+                                        (sorted by CUSIP_ID and date)
 
     """
 
     # Read-in the ratings data
     #df_rating = rd_cl_ratings(path, dict_spec['ratings']['varlist'])
 
-    # Add a common date identifier and sort values (transaction data)
-    # Note: merge_asof requires no missing values in the merge variable
+    # Add a common date identifier (transaction data)
+    # Note: The as-of join requires no missing values in the merge variable
     df_transact = df_transact.dropna(subset=['TRD_EXCTN_DT'])
     df_transact['date'] = pd.to_datetime(df_transact['TRD_EXCTN_DT'])
-    # merge_asof requires variables to be sorted first along the merge variable
-    df_transact = df_transact.sort_values(['date', 'CUSIP_ID'])
-
-    # Add a common date identifier and sort values (rating data)
-    # Note: merge_asof requires no missing values in the merge variable
-    df_rating['date'] = pd.to_datetime(df_rating['rating_date'])
+    # The yearly data is stored in the canonical order (CUSIP, execution date and time), i.e. it is sorted by the date
+    df_transact = replace_sort_var(df_transact, 'TRD_EXCTN_DT', 'date')
+
+    # Add a common date identifier (rating data) unless it is already added. The ratings are sorted by CUSIP and date
+    # only once for all years (see iter_merged_data())
+    # Note: The as-of join requires no missing values in the merge variable
+    if 'date' not in df_rating.columns:
+        df_rating['date'] = pd.to_datetime(df_rating['rating_date'])
     # Restrict the rating data to one year prior to the earliest transaction. This avoids that the
     # matching algorithm assigns only ratings that are not older than a year. If there was no
     # such rating, the rating observation is missing.
     df_rating = df_rating.loc[df_rating.rating_year >= dict_spec['sample_time_span'][0]-1]
-    # merge_asof requires variables to be sorted first along the merge variable
-    df_rating = df_rating.sort_values(['date', 'CUSIP_ID'])
     # Apply the merging. All ratings that can be directly matched to a trading date on the CUSIP level are
     # directly merged. All ratings that cannot be directly merged are merged to the next closest transaction (looking
-    # forward in time).
-    merge_transact_rating = (pd.merge_asof(df_transact, df_rating, on='date', left_by='CUSIP_ID', right_by='CUSIP_ID',
-                                           direction='backward').sort_values(
-        ['CUSIP_ID', 'date'])
-    )
+    # forward in time). The as-of join sorts both datasets by CUSIP and date (unless they are already sorted, e.g. the
+    # transactions in the canonical order) and merge-joins the sorted keys, i.e. the result is in the canonical
+    # order of the transactions
+    merge_transact_rating = asof_join_sorted(df_transact, df_rating, by='CUSIP_ID', on='date')
 
     return merge_transact_rating
 
 
 
+def merge_bond_info(df_transact, df_bond_info, dict_spec, settings=None):
+    """
+    Merge the bond background information to the transaction data. If the time-varying bond master is used
+    (dict_spec['bond_info']['time_varying']), the attributes in force on the execution date of each trade are merged.
+    Otherwise, the first record of each bond is merged.
+
+    Parameters:
+    -----------
+    df_transact (DataFrame): Transaction dataset
+    df_bond_info (DataFrame): Bond background information (either bond_info.pkl or bond_info_intervals.pkl)
+    dict_spec (dictionary): Dictionary containing the dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    df_merge (DataFrame): Transaction dataset containing the bond background information
+
+    """
+    if dict_spec['bond_info'].get('time_varying', False):
+        df_merge = merge_bond_info_intervals(df_transact, df_bond_info, dict_spec['bond_info']['varlist'])
+    else:
+        df_merge = guarded_merge(df_transact, df_bond_info[dict_spec['bond_info']['varlist']], 'merge_bond_info',
+                                 on='CUSIP_ID', how='left', settings=settings)
+
+    return df_merge
+
+
 #########
 # Step 2:
 ## 2.1) Concatenate the yearly data
 ## 2.2) Merge the issue and bond info data to the transaction data
 ########
 
-def conct_merge_data(path, dict_spec):
+def get_yearly_files(sample_time_span):
+    """
+    Get the yearly cleaned TRACE transaction datasets of the sample period (starting with the last year). In the year
+    2012, the data after the reporting change (06.02.2012) comes first and the data prior to the reporting change
+    second.
+
+    Parameters:
+    -----------
+    sample_time_span (list): First and last year of the sample
+
+    Returns:
+    --------
+    yearly_files (list): Year, file name and pre-post-ID (see harmon_pre_post_data()) of every yearly dataset
+
+    """
+    # Subtract 1 year from the beginning year to account for Python 0 counting (i.e. actually include that year)
+    yearly_files = []
+    for year in range(sample_time_span[1], sample_time_span[0]-1, -1):
+        # 2013 - last year
+        if year > 2012:
+            yearly_files.append((year, 'TRACE_clean_{}.pkl'.format(year), 'POST'))
+        # 2012: First the data post 06.02.2012, then the data pre 06.02.2012
+        elif year == 2012:
+            yearly_files.append((year, 'TRACE_clean_2012_post.pkl', 'POST'))
+            yearly_files.append((year, 'TRACE_clean_2012_prior.pkl', 'PRE'))
+        # 2002-2011
+        else:
+            yearly_files.append((year, 'TRACE_clean_{}.pkl'.format(year), 'PRE'))
+
+    return yearly_files
+
+
+def read_yearly_data(path, file_name, pre_post_id, dict_spec, cusip_keep, filters=None,
+                     folder='TRACE_raw_clean', extra_vars=None):
+    """
+    Read in one yearly cleaned TRACE transaction dataset, harmonise the variable names and keep only the selected
+    bonds and variables.
+
+    Parameters:
+    -----------
+    path (string): Project path
+    file_name (string): File name of the yearly dataset (e.g. TRACE_clean_2013.pkl)
+    pre_post_id (string): Either 'PRE' or 'POST' (see harmon_pre_post_data())
+    dict_spec (dict): Final dataset specifications
+    cusip_keep (array): CUSIP IDs that are to be kept in the dataset
+    filters (list): Optional. Additional filters of the rows (see load_frame() in storage_TRACE.py)
+    folder (string): Folder of the yearly dataset in bld/data/TRACE (e.g. TRACE_bitemporal, see bitemporal_TRACE.py)
+    extra_vars (list): Optional. Additional variables that are kept
+
+    Returns:
+    --------
+    df_year (DataFrame): Yearly transaction data
+
+    """
+    file_path = path + '/bld/data/TRACE/' + folder + '/' + file_name
+    extra_vars = [] if extra_vars is None else list(extra_vars)
+    # Only read the columns that are kept after the harmonization (if the stored columns are known without a read)
+    columns = get_frame_columns(file_path)
+    if columns is not None:
+        columns_harmon = harmon_pre_post_data(pd.DataFrame(columns=columns), pre_post_id=pre_post_id).columns
+        columns = [c for c, c_harmon in zip(columns, columns_harmon)
+                   if (c_harmon in dict_spec['transactions']['varlist'] + extra_vars) | (c_harmon == RAW_ID)]
+    # Re-apply the bond selection while reading. This makes sure that bonds that are no longer selected (e.g. after
+    # an update of the issue data) are excluded and allows to restrict the data to a subset of bonds
+    df_year = harmon_pre_post_data(
+        load_frame(file_path, columns=columns,
+                   filters=[('CUSIP_ID', 'in', list(cusip_keep))] + (filters if filters is not None else [])),
+        pre_post_id=pre_post_id
+    )
+    # Keep the provenance ID of the trades (yearly files of older builds do not have it)
+    df_year = df_year[dict_spec['transactions']['varlist'] + extra_vars + get_provenance_vars(df_year)]
+
+    return df_year
+
+
+def merge_yearly_data(path, file_name, pre_post_id, dict_spec, cusip_keep, df_ratings, df_issue, df_bond_info,
+                      df_transact=None, settings=None):
+    """
+    Read in one yearly cleaned TRACE transaction dataset and merge the rating, issue and bond info data.
+
+    Parameters:
+    -----------
+    path (string): Project path
+    file_name (string): File name of the yearly dataset (e.g. TRACE_clean_2013.pkl)
+    pre_post_id (string): Either 'PRE' or 'POST' (see harmon_pre_post_data())
+    dict_spec (dict): Final dataset specifications
+    cusip_keep (array): CUSIP IDs that are to be kept in the dataset
+    df_ratings (DataFrame): Cleaned rating data (see rd_cl_ratings())
+    df_issue (DataFrame): MERGENT FISD issue data
+    df_bond_info (DataFrame): Bond background information
+    df_transact (DataFrame): Optional. Yearly transaction data that is already read in (see read_yearly_data())
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    df_year (DataFrame): Yearly transaction data including the merged information (sorted by CUSIP_ID and date)
+
+    """
+    # Read-in the transaction data of the new year
+    if df_transact is None:
+        df_transact = read_yearly_data(path, file_name, pre_post_id, dict_spec, cusip_keep)
+    df_year = (
+        # Merge the new year data with the ratings data
+        merge_transact_rating(path,
+            # Transaction data of the new year
+            df_transact,
+            # Merge the new data with the ratinf data
+            dict_spec, df_ratings
+        )
+    )
+    # Merge the issue information
+    df_year_rating = df_year
+    df_year = guarded_merge(df_year, df_issue[dict_spec['issue_data']['varlist']], 'merge_yearly_data: issue data',
+                            on='CUSIP_ID', how='left', settings=settings)
+    # Merge with the bond info data
+    df_year = merge_bond_info(df_year, df_bond_info, dict_spec, settings)
+    # The left joins keep the order of the transactions, i.e. the yearly data is sorted by CUSIP and date
+    df_year = keep_sort_order(df_year, df_year_rating)
+
+    return df_year
+
+
+def iter_merged_data(path, dict_spec, cusip_subset=None, settings=None):
+    """
+    Loop over the yearly cleaned TRACE transaction data (starting with the last year) and return the merged yearly
+    datasets one after the other. In the year 2012, the data after the reporting change (06.02.2012) is returned
+    first and the data prior to the reporting change second.
+
+    Parameters:
+    -----------
+    path (string): Project path
+    dict_spec (dict): Final dataset specifications
+    cusip_subset (list): Optional. Only merge the transactions of these CUSIPs
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dict_spec)
+
+    Returns:
+    --------
+    Generator of the merged yearly DataFrames
+
+    """
+    if settings is None:
+        settings = get_settings(dict_spec)
+    # Read in the ratings dataset. Add the date identifier and sort the ratings by CUSIP and date once for the as-of
+    # join of all years (see merge_transact_rating())
+    df_ratings = rd_cl_ratings(path, dict_spec['ratings']['varlist'])
+    df_ratings['date'] = pd.to_datetime(df_ratings['rating_date'])
+    df_ratings = sort_frame(df_ratings, ['CUSIP_ID', 'date'])
+
+    # Read in the issue data
+    df_issue = pd.read_pickle(path + '/src/original_data/Mergent_FISD/issue_data.pkl')
+
+    # Read in the bond info data (either the first record per bond or the time-varying bond master)
+    if dict_spec['bond_info'].get('time_varying', False):
+        df_bond_info = load_frame(path + '/bld/data/TRACE/TRACE_raw_clean/bond_info_intervals.pkl')
+    else:
+        df_bond_info = load_frame(path + '/bld/data/TRACE/TRACE_raw_clean/bond_info.pkl')
+
+    # Get the CUSIPs that are to be kept in the dataset
+    cusip_keep = select_bonds(path)
+    if cusip_subset is not None:
+        cusip_keep = cusip_keep.loc[cusip_keep.isin(cusip_subset)]
+
+    yearly_files = get_yearly_files(dict_spec['sample_time_span'])
+    # Read in the next yearly dataset on an I/O thread while the current one is merged (one dataset ahead)
+    transact_data = prefetch(lambda f: read_yearly_data(path, f[1], f[2], dict_spec, cusip_keep), yearly_files,
+                             n_ahead=1, settings=settings)
+    for k, (year, file_name, pre_post_id) in enumerate(yearly_files):
+        if (k == 0) or (yearly_files[k - 1][0] != year):
+            print('Dataset concatenated until:{}'.format(year))
+        yield merge_yearly_data(path, file_name, pre_post_id, dict_spec, cusip_keep, df_ratings, df_issue,
+                                df_bond_info, next(transact_data), settings)
+
+
+def conct_merge_data(path, dict_spec, cusip_subset=None, settings=None):
     """
     Concatenate the yearly cleaned TRACE transaction data over the entire sample period available. Due to the large
     sample size issue and rating data have to be merged directly after reading in the transaction data as o.w.
@@ -206,6 +423,9 @@ def conct_merge_data(path, dict_spec):
     -----------
     path (string): Project path
     dict_spec (dict): Final dataset specifications
+    cusip_subset (list): Optional. Only concatenate and merge the transactions of these CUSIPs (used for the
+                         partial recomputation after an update of the MERGENT data)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dict_spec)
 
     Returns:
     --------
@@ -215,111 +435,7 @@ def conct_merge_data(path, dict_spec):
     print("")
     print('STEP 2: The concatenation and cleaning step has started. Finished years will be displayed')
 
-    # Read in the ratings dataset
-    df_ratings = rd_cl_ratings(path, dict_spec['ratings']['varlist'])
-    
-    # Read in the issue data
-    df_issue = pd.read_pickle(path + '/src/original_data/Mergent_FISD/issue_data.pkl')
-
-    # Read in the bond info data
-    df_bond_info = pd.read_pickle(path + '/bld/data/TRACE/TRACE_raw_clean/bond_info.pkl')
-
-    # Subtract 1 year from the beginning year to account for Python 0 counting (i.e. actually include that year)
-    for year in range(dict_spec['sample_time_span'][1], dict_spec['sample_time_span'][0]-1, -1):
-        print('Dataset concatenated until:{}'.format(year))
-        # last year of the sample
-        if (year == dict_spec['sample_time_span'][1])&(year>2012):
-            df_concat = (harmon_pre_post_data(
-                pd.read_pickle(path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}.pkl'.format(year)), pre_post_id='POST')
-            [dict_spec['transactions']['varlist']]
-            )
-            # Merge the rating information
-            df_concat = merge_transact_rating(path, df_concat, dict_spec, df_ratings)
-            # Merge the issue information
-            df_concat = df_concat.merge(df_issue[dict_spec['issue_data']['varlist']], on='CUSIP_ID', how='left')
-            # Merge with the bond info data
-            df_concat = df_concat.merge(df_bond_info[dict_spec['bond_info']['varlist']], on='CUSIP_ID', how='left')
-        # 2013 - last year
-        elif (year < dict_spec['sample_time_span'][1]) & (year > 2012):
-            df_tmp = (
-                # Merge the new year data with the ratings data
-                merge_transact_rating(path,
-                # Read-in the transaction data of the new year
-                harmon_pre_post_data(
-                    pd.read_pickle(path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}.pkl'.format(year)),
-                    pre_post_id='POST'
-                )[dict_spec['transactions']['varlist']],
-                # Merge the new data with the ratinf data
-                dict_spec, df_ratings
-                )
-            )
-            # Merge the issue information
-            df_tmp = df_tmp.merge(df_issue[dict_spec['issue_data']['varlist']], on='CUSIP_ID', how='left')
-            # Merge with the bond info data
-            df_tmp = df_tmp.merge(df_bond_info[dict_spec['bond_info']['varlist']], on='CUSIP_ID', how='left')
-            # Concatenate the previous year data and the newly read data
-            df_concat = pd.concat([df_concat, df_tmp])
-        # 2012
-        elif year == 2012:
-            # Concatenate the pre- and post dataset in 2012
-            ## Post 06.02.2012
-            df_tmp_post = (
-                # Merge the new year data with the ratings data
-                merge_transact_rating(path,
-                    # Read-in the transaction data of the new year
-                    harmon_pre_post_data(
-                        pd.read_pickle(path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_2012_post.pkl'),
-                        pre_post_id='POST'
-                    )[dict_spec['transactions']['varlist']],
-                    # Merge the new data with the ratinf data
-                    dict_spec, df_ratings
-                )
-            )
-            # Merge the issue information
-            df_tmp_post = df_tmp_post.merge(df_issue[dict_spec['issue_data']['varlist']], on='CUSIP_ID', how='left')
-            # Merge with the bond info data
-            df_tmp_post = df_tmp_post.merge(df_bond_info[dict_spec['bond_info']['varlist']], on='CUSIP_ID', how='left')
-            # Concatenate the previous year data and the newly read data
-            df_concat = pd.concat([df_concat, df_tmp_post])
-            ## Pre 06.02.2012
-            df_tmp_prior = (
-                # Merge the new year data with the ratings data
-                merge_transact_rating(path,
-                    # Read-in the transaction data of the new year
-                    harmon_pre_post_data(
-                        pd.read_pickle(path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_2012_prior.pkl'),
-                        pre_post_id='PRE'
-                    )[dict_spec['transactions']['varlist']],
-                    # Merge the new data with the ratinf data
-                    dict_spec, df_ratings
-                )
-            )
-            # Merge the issue information
-            df_tmp_prior = df_tmp_prior.merge(df_issue[dict_spec['issue_data']['varlist']], on='CUSIP_ID', how='left')
-            # Merge with the bond info data
-            df_tmp_prior = df_tmp_prior.merge(df_bond_info[dict_spec['bond_info']['varlist']], on='CUSIP_ID', how='left')
-            # Concatenate the previous year data and the newly read data
-            df_concat = pd.concat([df_concat, df_tmp_prior])
-        # 2002-2011
-        else:
-            df_tmp = (
-                # Merge the new year data with the ratings data
-                merge_transact_rating(path,
-                    # Read-in the transaction data of the new year
-                    harmon_pre_post_data(
-                        pd.read_pickle(path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}.pkl'.format(year)),
-                        pre_post_id='PRE'
-                    )[dict_spec['transactions']['varlist']],
-                    # Merge the new data with the ratinf data
-                    dict_spec, df_ratings
-                )
-            )
-            # Merge the issue information
-            df_tmp = df_tmp.merge(df_issue[dict_spec['issue_data']['varlist']], on='CUSIP_ID', how='left')
-            # Merge with the bond info data
-            df_tmp = df_tmp.merge(df_bond_info[dict_spec['bond_info']['varlist']], on='CUSIP_ID', how='left')
-            # Concatenate the previous year data and the newly read data
-            df_concat = pd.concat([df_concat, df_tmp])
+    # Concatenate the merged yearly data
+    df_concat = pd.concat(list(iter_merged_data(path, dict_spec, cusip_subset, settings)))
 
     return df_concat
-
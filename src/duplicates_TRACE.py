@@ -0,0 +1,370 @@
+"""
+Detect the trade reports that appear in more than one raw file (e.g. in overlapping vendor deliveries or in the files
+at the year boundary) while the raw data is read in. An exact drop_duplicates() over all variables of the full sample
+does not fit in memory, here every trade report is checked once against a compact summary of all trade reports that
+were read in before. The steps are as follows:
+    Step 1:     Hash the canonical key of every trade report to 64 bits (hash_trade_keys()): the report number, the
+                status and the economic variables of the report (KEY_VARS, different for the data prior to and after
+                the reporting change on 06.02.2012).
+    Step 2:     Check the hashes against a Bloom filter of the hashes of all earlier files (BloomFilter) and add them
+                afterwards. The filter has a fixed size ('expected_trades' and 'false_positive_rate'), i.e. the
+                memory does not grow with the sample. Only the few candidates that the filter reports are checked
+                further.
+    Step 3:     Confirm the candidates exactly (check_duplicates()): the earlier trade report with the same hash is
+                looked up in the sorted hashes of the earlier files (kept on disk) and the canonical keys of both raw
+                records are compared (see get_raw_records() in provenance_TRACE.py). The confirmed duplicates are
+                stored in bld/data/TRACE/TRACE_duplicates (RAW_ID of the duplicate, FIRST_RAW_ID of the first copy)
+                and dropped before the cleaning if 'action' is 'drop'.
+
+Note: The first copy of a trade report is the one that is read in first, i.e. the copy in the later year (the years are
+read in backwards). The files are checked against all files that were read in by the same process: the sequential
+read-in checks the whole sample in one pass, the parallel read-in (see read_TRACE_all_PARALLEL_2()) checks every year
+on its own. The check is set with dataset_specs['duplicates'] (see specs.py and settings_TRACE.py).
+"""
+
+import contextlib
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+# Import the loading of the raw files (see async_io_TRACE.py)
+from async_io_TRACE import load_raw_file, DECOMPRESS
+# Import the columnar storage of the outputs
+from storage_TRACE import store_frame, load_frame, frame_exists, remove_frame
+# Import the provenance IDs of the trades
+from provenance_TRACE import RAW_ID, get_raw_records
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+# Canonical key of a trade report prior to and after the reporting change on 06.02.2012
+KEY_VARS = {
+    'prior_2012': ['CUSIP_ID', 'REC_CT_NB', 'TRC_ST', 'ASOF_CD', 'TRD_EXCTN_DT', 'EXCTN_TM', 'TRD_RPT_DT',
+                   'TRD_RPT_TM', 'ENTRD_VOL_QT', 'RPTD_PR', 'RPT_SIDE_CD', 'RPTG_MKT_MP_ID', 'CNTRA_MP_ID'],
+    'post_2012': ['CUSIP_ID', 'SYSTM_CNTRL_DT', 'SYSTM_CNTRL_NB', 'TRD_ST_CD', 'ASOF_CD', 'TRD_EXCTN_DT',
+                  'TRD_EXCTN_TM', 'TRD_RPT_DT', 'TRD_RPT_TM', 'ENTRD_VOL_QT', 'RPTD_PR', 'RPT_SIDE_CD',
+                  'RPTG_PARTY_ID', 'CNTRA_PARTY_ID'],
+}
+# Provenance ID of the first copy of a duplicate trade report
+FIRST_RAW_ID = 'FIRST_RAW_ID'
+# Number of hashes whose bit positions are computed at once
+CHUNK_SIZE = 1000000
+# State of the check of the current process: Bloom filter and folder of the sorted hashes of the checked files
+DUPLICATE_CHECK = {'bloom': None, 'hash_path': None, 'files': []}
+
+
+def get_duplicates_path(project_path, file_name):
+    """
+    Get the path of the duplicates of a yearly dataset (e.g. TRACE_clean_2013.pkl).
+    """
+    return project_path + '/bld/data/TRACE/TRACE_duplicates/' + file_name
+
+
+#########
+# Step 1: Hash the canonical keys
+########
+def get_key_vars(df):
+    """
+    Get the canonical key of the trade reports of the data prior to or after the reporting change.
+    """
+    if 'TRC_ST' in df.columns:
+        return KEY_VARS['prior_2012']
+
+    return KEY_VARS['post_2012']
+
+
+def hash_trade_keys(df, key_vars):
+    """
+    Hash the canonical key of every trade report to 64 bits (the hashes are only compared within one process).
+
+    Parameters:
+    -----------
+    df (DataFrame): Trade reports
+    key_vars (list): Variables of the canonical key
+
+    Returns:
+    --------
+    hashes (array): Hash of every trade report (uint64)
+    """
+    return pd.util.hash_pandas_object(df[key_vars], index=False).values
+
+
+#########
+# Step 2: Check the hashes against the Bloom filter
+########
+class BloomFilter:
+    """
+    Bloom filter of 64-bit hashes. The bit positions are derived from the two halves of the hash (double hashing),
+    i.e. the hashes are not hashed again. The hashes are processed in chunks of CHUNK_SIZE, such that the positions of
+    a large file do not have to be in memory at once.
+    """
+    def __init__(self, n_items, false_positive_rate):
+        # Number of bits and of bit positions per hash of the optimal filter
+        self.n_bits = max(64, int(math.ceil(-n_items * math.log(false_positive_rate) / math.log(2) ** 2)))
+        self.n_positions = max(1, int(round(self.n_bits / n_items * math.log(2))))
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+
+    def get_positions(self, hashes):
+        """
+        Get the byte and the bit mask of the bit positions of every hash (one row per hash).
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.n_positions, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            positions = (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.n_bits)
+
+        return (positions >> np.uint64(3)).astype(np.intp), np.left_shift(
+            np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+
+    def contains(self, hashes):
+        """
+        Check whether the hashes may have been added (False -> certainly not added).
+        """
+        D_contained = np.zeros(len(hashes), dtype=bool)
+        for start in range(0, len(hashes), CHUNK_SIZE):
+            bytes_pos, masks = self.get_positions(hashes[start:start + CHUNK_SIZE])
+            D_contained[start:start + CHUNK_SIZE] = ((self.bits[bytes_pos] & masks) != 0).all(axis=1)
+
+        return D_contained
+
+    def add(self, hashes):
+        """
+        Add hashes to the filter.
+        """
+        for start in range(0, len(hashes), CHUNK_SIZE):
+            bytes_pos, masks = self.get_positions(hashes[start:start + CHUNK_SIZE])
+            np.bitwise_or.at(self.bits, bytes_pos.ravel(), masks.ravel())
+
+
+@contextlib.contextmanager
+def duplicate_check(project_path, settings=None):
+    """
+    Scope of the duplicate check of one read-in: all files that are checked in the scope are checked against each
+    other. The sorted hashes of the checked files are kept in a temporary folder next to the duplicates that is
+    removed at the end (settings: see settings_TRACE.py, None -> default settings).
+    """
+    if settings is None:
+        settings = get_settings()
+    duplicates = settings['duplicates']
+    if duplicates['action'] == 'off':
+        yield
+        return
+    out_path = get_duplicates_path(project_path, '')
+    os.makedirs(out_path, exist_ok=True)
+    DUPLICATE_CHECK['bloom'] = BloomFilter(duplicates['expected_trades'], duplicates['false_positive_rate'])
+    DUPLICATE_CHECK['hash_path'] = tempfile.mkdtemp(prefix='tmp_hashes_', dir=out_path)
+    DUPLICATE_CHECK['files'] = []
+    try:
+        yield
+    finally:
+        shutil.rmtree(DUPLICATE_CHECK['hash_path'], ignore_errors=True)
+        DUPLICATE_CHECK['bloom'] = None
+        DUPLICATE_CHECK['hash_path'] = None
+        DUPLICATE_CHECK['files'] = []
+
+
+#########
+# Step 3: Confirm the candidates exactly
+########
+def read_raw_header(path):
+    """
+    Read the variable names in the header of a raw file.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if (ext in DECOMPRESS) or (ext == '.zip'):
+        line = load_raw_file(path).readline()
+    else:
+        with open(path, 'rb') as f:
+            line = f.readline()
+
+    return line.decode().rstrip('\r\n').split('|')
+
+
+def get_raw_keys(project_path, raw_ids, key_vars):
+    """
+    Get the canonical key of trade reports from their raw records (the variables as written in the raw file).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    raw_ids (array): Provenance IDs
+    key_vars (list): Variables of the canonical key
+
+    Returns:
+    --------
+    keys (list): Canonical key of every trade report (None if the record or a variable does not exist)
+    """
+    df_records = get_raw_records(project_path, raw_ids)
+    dict_headers = {}
+    keys = []
+    for file_path, record in zip(df_records['file'].values, df_records['record'].values):
+        if record is None:
+            keys.append(None)
+            continue
+        if file_path not in dict_headers:
+            dict_headers[file_path] = read_raw_header(file_path)
+        fields = dict(zip(dict_headers[file_path], record.split('|')))
+        if all([v in fields for v in key_vars]):
+            keys.append(tuple([fields[v] for v in key_vars]))
+        else:
+            keys.append(None)
+
+    return keys
+
+
+def find_first_copies(hashes, raw_ids, D_candidate):
+    """
+    Find the first trade report with the same hash for the candidates: in the files that were checked before (in the
+    order of the check) or earlier in the same file.
+
+    Parameters:
+    -----------
+    hashes (array): Hashes of the trade reports of the file
+    raw_ids (array): Provenance IDs of the trade reports of the file
+    D_candidate (array): Candidates (the Bloom filter or an earlier trade report of the file has the hash)
+
+    Returns:
+    --------
+    first_ids (array): Provenance ID of the first trade report with the same hash (-1 if there is none)
+    """
+    first_ids = np.full(len(hashes), -1, dtype=np.int64)
+    for file_path in DUPLICATE_CHECK['files']:
+        D_open = D_candidate & (first_ids == -1)
+        if D_open.any() == False:
+            break
+        # Only the looked-up pages of the sorted hashes are read
+        stored_hashes = np.load(file_path + '_hashes.npy', mmap_mode='r')
+        stored_ids = np.load(file_path + '_ids.npy', mmap_mode='r')
+        if len(stored_hashes) == 0:
+            continue
+        pos = np.searchsorted(stored_hashes, hashes[D_open])
+        pos_valid = np.minimum(pos, len(stored_hashes) - 1)
+        D_found = (pos < len(stored_hashes)) & (stored_hashes[pos_valid] == hashes[D_open])
+        first_ids[np.flatnonzero(D_open)[D_found]] = stored_ids[pos_valid[D_found]]
+
+    # Trade reports whose hash appears earlier in the same file (only the hashes of the open candidates are grouped)
+    D_open = D_candidate & (first_ids == -1)
+    if D_open.any():
+        D_group = np.isin(hashes, hashes[D_open])
+        s_first = pd.Series(raw_ids[D_group]).groupby(hashes[D_group]).transform('first').values
+        D_repeat = D_open[D_group] & (s_first != raw_ids[D_group])
+        first_ids[np.flatnonzero(D_group)[D_repeat]] = s_first[D_repeat]
+
+    return first_ids
+
+
+def store_file_hashes(hashes, raw_ids):
+    """
+    Store the hashes of a checked file sorted (with the provenance ID of the first trade report of every hash), such
+    that the later files are checked against it without keeping it in memory.
+    """
+    df_hashes = pd.DataFrame({'hash': hashes, RAW_ID: raw_ids}).drop_duplicates(subset=['hash'])
+    df_hashes = df_hashes.sort_values('hash')
+    file_path = DUPLICATE_CHECK['hash_path'] + '/file_{}'.format(len(DUPLICATE_CHECK['files']))
+    np.save(file_path + '_hashes.npy', df_hashes['hash'].values)
+    np.save(file_path + '_ids.npy', df_hashes[RAW_ID].values)
+    DUPLICATE_CHECK['files'].append(file_path)
+
+
+def check_duplicates(project_path, df, file_name, cusip_subset=None, settings=None):
+    """
+    Check the trade reports of a yearly dataset against the trade reports of all files that were read in before
+    (and against each other) and store the confirmed duplicates. Outside of duplicate_check(), the trade reports are
+    only checked against each other.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    df (DataFrame): Raw data of the yearly dataset after the bond selection (input of the cleaning)
+    file_name (str): File name of the yearly dataset (e.g. TRACE_clean_2013.pkl)
+    cusip_subset (list): Optional. Only these CUSIP IDs were read in, the duplicates of the other bonds are kept
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    df (DataFrame): Raw data without the duplicates if 'action' is 'drop' (else unchanged)
+    """
+    if settings is None:
+        settings = get_settings()
+    action = settings['duplicates']['action']
+    out_path = get_duplicates_path(project_path, file_name)
+    if action == 'off':
+        # The duplicates of an earlier build would not match the new yearly data
+        if frame_exists(out_path):
+            remove_frame(out_path)
+        return df
+    if RAW_ID not in df.columns:
+        print('The duplicates of {} are not checked: the trades have no provenance IDs'.format(file_name))
+        return df
+    if DUPLICATE_CHECK['bloom'] is None:
+        with duplicate_check(project_path, settings):
+            return check_duplicates(project_path, df, file_name, cusip_subset, settings)
+
+    # Step 1: Hash the canonical keys
+    key_vars = get_key_vars(df)
+    hashes = hash_trade_keys(df, key_vars)
+    raw_ids = df[RAW_ID].values.astype(np.int64)
+
+    # Step 2: Candidates of the Bloom filter (earlier files) and repeated hashes (same file)
+    D_candidate = DUPLICATE_CHECK['bloom'].contains(hashes) | pd.Series(hashes).duplicated().values
+    DUPLICATE_CHECK['bloom'].add(hashes)
+
+    # Step 3: Exact confirmation with the first copy of the hash and the canonical keys of the raw records
+    first_ids = find_first_copies(hashes, raw_ids, D_candidate)
+    store_file_hashes(hashes, raw_ids)
+    D_match = first_ids != -1
+    df_duplicates = pd.DataFrame({'CUSIP_ID': df['CUSIP_ID'].values[D_match], RAW_ID: raw_ids[D_match],
+                                  FIRST_RAW_ID: first_ids[D_match]})
+    if len(df_duplicates) > 0:
+        keys = get_raw_keys(project_path, df_duplicates[RAW_ID].values, key_vars)
+        first_keys = get_raw_keys(project_path, df_duplicates[FIRST_RAW_ID].values, key_vars)
+        df_duplicates = df_duplicates.loc[[(k is not None) and (k == f) for k, f in zip(keys, first_keys)]]
+    df_duplicates = df_duplicates.reset_index(drop=True)
+    print('Duplicate check of {}: {} candidates of the Bloom filter, {} duplicate trade reports{}'.format(
+        file_name, int(D_candidate.sum()), len(df_duplicates), ' dropped' if action == 'drop' else ''))
+
+    if (cusip_subset is not None) & frame_exists(out_path):
+        df_stored = load_frame(out_path)
+        df_duplicates = pd.concat([df_stored.loc[df_stored['CUSIP_ID'].isin(cusip_subset) == False], df_duplicates],
+                                  ignore_index=True)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    store_frame(df_duplicates, out_path, settings)
+
+    if action == 'drop':
+        df = df.loc[df[RAW_ID].isin(df_duplicates[RAW_ID]) == False]
+
+    return df
+
+
+def load_duplicates(project_path, sample_time_span):
+    """
+    Load the duplicate trade reports of all yearly datasets of the sample period.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    sample_time_span (list): First and last year of the sample
+
+    Returns:
+    --------
+    df_duplicates (DataFrame): File name of the yearly dataset, CUSIP_ID, RAW_ID of the duplicate and FIRST_RAW_ID of
+                               the first copy
+    """
+    # Imported here because the merge imports the read-in, which checks the duplicates
+    from concatenate_merge_TRACE_MERGENT import get_yearly_files
+
+    list_duplicates = []
+    for year, file_name, pre_post_id in get_yearly_files(sample_time_span):
+        if frame_exists(get_duplicates_path(project_path, file_name)) == False:
+            raise FileNotFoundError("The duplicates of {} do not exist. Build the dataset with "
+                                    "dataset_specs['duplicates']['action'] = 'flag' or 'drop'".format(file_name))
+        df_file = load_frame(get_duplicates_path(project_path, file_name))
+        df_file.insert(0, 'file', file_name)
+        list_duplicates.append(df_file)
+
+    return pd.concat(list_duplicates, ignore_index=True)
@@ -0,0 +1,683 @@
+"""
+Check that a new implementation (e.g. a faster engine) of a cleaning step keeps exactly the same trades as the
+current implementation. The current pandas implementations are the reference (they are validated against the SAS
+code by Dick-Nielsen & Poulsen (2019), see clean_TRACE.py). The steps are as follows:
+    Step 1:     Prepare the input. Every input row gets a row ID (I_eq) such that every output row can be traced
+                back to its input row. The input is either given directly or loaded for one full year of the
+                project (the raw daily files for the Dick-Nielsen & Poulsen (2019) corrections and the merged
+                yearly data for the steps after the concatenation).
+    Step 2:     Run the reference and the candidate on the same input and hash every output row (independent of
+                the row and column ordering). The order-insensitive digests of both outputs are compared first.
+                The row-by-row comparison is only run if the digests differ. Optionally, the input is split into
+                CUSIP partitions (all matching rules of these steps are within a bond) to limit the memory usage.
+    Step 3:     Report the differing trades (dropped by the candidate, added by the candidate or with differing
+                values) and attribute each of them to the cleaning rule of the reference that removes or keeps
+                the trade. The report is stored in bld/data/TRACE/TRACE_info/equivalence.
+
+Example (in the src folder, the candidate is given as module:function):
+    python -m pycleantrace equivalence --check post_2012_clean --candidate fast_clean:post_2012_clean --year 2015
+    python -m pycleantrace equivalence --check clean_merged_data
+                                       --candidate process_TRACE:clean_merged_data_parallel
+                                       --candidate-kwargs '{"N_workers": 4}' --year 2014
+"""
+
+import copy
+import datetime
+import importlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+import clean_TRACE
+import process_TRACE
+from read_TRACE import adj_dt_format_pre_2012, adj_dt_format_post_2012, select_bonds
+from concatenate_merge_TRACE_MERGENT import iter_merged_data
+from general_functions import build_folders
+from storage_TRACE import load_rpt_dates
+from data_specs.US_holidays.US_holiday_list import get_US_holiday_dates
+
+# Name of the row ID (lower case after clean_df_general())
+ID_VARS = ['I_eq', 'i_eq']
+# Variables that are shown for the differing trades (if they exist)
+REPORT_VARS = ['CUSIP_ID', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'EXCTN_TM', 'TRD_RPT_DT', 'TRD_RPT_TM', 'RPTD_PR',
+               'ENTRD_VOL_QT', 'RPT_SIDE_CD', 'TRD_ST_CD', 'TRC_ST']
+# Variables of the merged data that are passed to del_interd_transact() (see drop_interd_transact())
+INTERD_VARS = ['CUSIP_ID', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'ENTRD_VOL_QT', 'RPTD_PR', 'RPTG_PARTY_ID',
+               'CNTRA_PARTY_ID', 'RPT_SIDE_CD']
+
+
+#########
+# Step 1: Prepare the input
+########
+def add_row_ids(df):
+    """
+    Add the row ID I_eq (0, 1, ...) to the input DataFrame.
+    """
+    df = df.reset_index(drop=True)
+    df = df.drop(columns=[var for var in ID_VARS if var in df.columns])
+    df['I_eq'] = np.arange(0, len(df))
+
+    return df
+
+
+def get_specs_with_id(dataset_specs):
+    """
+    Get a copy of the dataset specifications that keeps the row ID in clean_df_general() (as I_order in
+    clean_merged_data_parallel()).
+    """
+    dataset_specs_id = copy.deepcopy(dataset_specs)
+    dataset_specs_id['dataset_clean']['varlist'] = dataset_specs['dataset_clean']['varlist'] + ['I_eq']
+
+    return dataset_specs_id
+
+
+def read_raw_year(project_path, year, pre_post_id):
+    """
+    Read in the daily raw files of one year and keep the selected bonds as in read_TRACE.py (without the cleaning).
+    In 2012, the first 23 trading days are prior to the reporting change.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    year (int): Year
+    pre_post_id (str): Either 'PRE' (prior to 06.02.2012) or 'POST'
+
+    Returns:
+    --------
+    df (DataFrame): Concatenated raw daily data of the year
+    """
+    path_raw = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    annual_fld = [f for f in sorted(os.listdir(path_raw)) if f.endswith(str(year))]
+    if len(annual_fld) == 0:
+        raise ValueError('There is no raw TRACE folder of the year {} in {}'.format(year, path_raw))
+    daily_files = (
+        [f for f in sorted(os.listdir(path_raw + annual_fld[0]))
+         if not (f.startswith('0033-corp-bond') | f.startswith('.'))]
+    )
+    if year == 2012:
+        daily_files = daily_files[:23] if pre_post_id == 'PRE' else daily_files[23:]
+    adj_dt_format = adj_dt_format_pre_2012 if pre_post_id == 'PRE' else adj_dt_format_post_2012
+
+    cusip_list_keep = select_bonds(project_path)
+    list_df = []
+    for day in range(0, len(daily_files)):
+        if day % 50 == 0:
+            print('EQUIVALENCE: Reading year {}, trading day {}/{}'.format(year, day, len(daily_files)))
+        df_day = adj_dt_format(path_raw + annual_fld[0] + '/' + daily_files[day])
+        list_df.append(df_day.loc[df_day['CUSIP_ID'].isin(cusip_list_keep)])
+
+    return pd.concat(list_df, ignore_index=True)
+
+
+def load_year_inputs(project_path, check, year, dataset_specs):
+    """
+    Load the input of a check for one full year of the project. The steps after the concatenation get the merged
+    yearly data (see iter_merged_data()) after the reference steps that come before them in clean_merged_data().
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    check (str): Name of the check (see CHECKS)
+    year (int): Year
+    dataset_specs (dict): Final dataset specifications
+
+    Returns:
+    --------
+    inputs (dict): Input DataFrame with row IDs (df) and the further arguments of the check
+    """
+    inputs = {'project_path': project_path, 'dataset_specs': dataset_specs}
+    if check == 'post_2012_clean':
+        inputs['df'] = add_row_ids(read_raw_year(project_path, year, 'POST'))
+    elif check == 'prior_2012_clean':
+        inputs['df'] = add_row_ids(read_raw_year(project_path, year, 'PRE'))
+        # NOTE: The reversals that are reported after the reporting change (unmatched) are not loaded, i.e. only the
+        # reversals within the pre-2012 files are matched
+        inputs['unmatched'] = pd.DataFrame(columns=['TRD_EXCTN_DT', 'CUSIP_ID', 'TRD_EXCTN_TM', 'RPTD_PR',
+                                                    'ENTRD_VOL_QT', 'RPT_SIDE_CD', 'CNTRA_PARTY_ID', 'TRD_RPT_DT',
+                                                    'TRD_RPT_TM'])
+    else:
+        dataset_specs_year = copy.deepcopy(dataset_specs)
+        dataset_specs_year['sample_time_span'] = [year, year]
+        inputs['df'] = add_row_ids(pd.concat(list(iter_merged_data(project_path, dataset_specs_year))))
+        # Apply the reference steps prior to the checked step
+        for stage in MERGED_STAGES[:MERGED_STAGES.index(check)] if check in MERGED_STAGES else []:
+            inputs['df'] = CHECKS[stage]['run'](CHECKS[stage]['reference'], inputs)
+
+    return inputs
+
+
+#########
+# Step 2: Run the reference and the candidate
+########
+# Every check calls the reference or the candidate function with the arguments of the reference and returns the
+# output rows as a DataFrame (including the row ID)
+def run_post_2012_clean(func, inputs):
+    return func(inputs['df'].copy())[0]
+
+
+def run_prior_2012_clean(func, inputs):
+    return func(inputs['df'].copy(), inputs['unmatched'].copy())
+
+
+def run_del_interd_transact(func, inputs):
+    df = inputs['df']
+    df_red = df[INTERD_VARS].copy()
+    df_red['I_drop'] = df['I_eq'].values
+    list_keep = func(df_red)
+
+    return df.loc[df['I_eq'].isin(list_keep)]
+
+
+def run_clean_trade_level(func, inputs):
+    return func(inputs['df'].copy())
+
+
+def run_clean_df_general(func, inputs):
+    return func(inputs['df'].copy(), get_specs_with_id(inputs['dataset_specs']))
+
+
+def run_add_clean_trading_dates(func, inputs):
+    return func(inputs['df'].copy(), inputs['project_path'])
+
+
+def run_clean_merged_data(func, inputs):
+    return func(inputs['df'].copy(), inputs['project_path'], get_specs_with_id(inputs['dataset_specs']))
+
+
+def get_row_hashes(df, columns):
+    """
+    Hash every row of a DataFrame. The columns are hashed in sorted order and integer, boolean and float32 columns
+    are hashed as float64 such that the hashes do not depend on the column ordering and the numeric dtype.
+
+    Parameters:
+    -----------
+    df (DataFrame): Output of a check
+    columns (list): Columns to hash
+
+    Returns:
+    --------
+    hashes (np.array): uint64 hash of every row
+    """
+    df_hash = df[sorted(columns)]
+    for col in df_hash.columns:
+        if (pd.api.types.is_bool_dtype(df_hash[col]) | pd.api.types.is_integer_dtype(df_hash[col]) |
+                (df_hash[col].dtype == 'float32')):
+            df_hash[col] = df_hash[col].astype('float64')
+
+    return pd.util.hash_pandas_object(df_hash, index=False).values
+
+
+def get_digest(hashes):
+    """
+    Get an order-insensitive digest of the row hashes: the number of rows and two sums of the hashes (modulo 2^64).
+    """
+    with np.errstate(over='ignore'):
+        sum_1 = int(hashes.sum(dtype=np.uint64))
+        sum_2 = int((hashes * hashes).sum(dtype=np.uint64))
+
+    return '{}:{:016x}{:016x}'.format(len(hashes), sum_1, sum_2)
+
+
+def get_unmatched_rows(hashes_ref, hashes_new):
+    """
+    Match the rows of two outputs by their hashes (as multisets, i.e. duplicated rows are matched one by one).
+
+    Returns:
+    --------
+    D_only_ref (np.array): Indicator of the reference rows without a match in the candidate output
+    D_only_new (np.array): Indicator of the candidate rows without a match in the reference output
+    """
+    keys = []
+    for hashes in [hashes_ref, hashes_new]:
+        # Number the occurrences of each hash and combine it with the hash
+        occurrence = pd.Series(hashes).groupby(hashes).cumcount().values.astype(np.uint64)
+        with np.errstate(over='ignore'):
+            keys.append(pd.Index(hashes + occurrence * np.uint64(0x9E3779B97F4A7C15)))
+
+    return keys[0].isin(keys[1]) == False, keys[1].isin(keys[0]) == False
+
+
+def get_id(df):
+    """
+    Get the row IDs of an output (NaN if the output does not keep the row ID).
+    """
+    for var in ID_VARS:
+        if var in df.columns:
+            return df[var].values.astype('float64')
+
+    return np.full(len(df), np.nan)
+
+
+def get_var(df, var):
+    """
+    Get a variable of a DataFrame in upper or lower case (the variable names are lower case after
+    clean_df_general()).
+    """
+    return df[var] if var in df.columns else df[var.lower()]
+
+
+def get_differing_vars(df_ref, df_new, columns):
+    """
+    Get the variables that differ between the reference and the candidate version of the same trades (same row
+    IDs, aligned by their index).
+    """
+    list_vars = []
+    for i in df_ref.index:
+        list_vars.append(
+            [col for col in sorted(columns)
+             if not ((df_ref.at[i, col] == df_new.at[i, col]) | (pd.isna(df_ref.at[i, col]) &
+                                                                  pd.isna(df_new.at[i, col])))]
+        )
+
+    return list_vars
+
+
+def compare_outputs(df_ref, df_new, ignore_vars):
+    """
+    Compare the outputs of the reference and the candidate row by row (order-insensitive).
+
+    Parameters:
+    -----------
+    df_ref (DataFrame): Output of the reference
+    df_new (DataFrame): Output of the candidate
+    ignore_vars (list): Variables that are not compared
+
+    Returns:
+    --------
+    result (dict): Digests, column differences and the differing trades (DataFrame with the row ID, the kind of
+                   difference and the differing variables)
+    """
+    columns_ref = [col for col in df_ref.columns if col not in ID_VARS + ignore_vars]
+    columns_new = [col for col in df_new.columns if col not in ID_VARS + ignore_vars]
+    columns = [col for col in columns_ref if col in columns_new]
+    hashes_ref = get_row_hashes(df_ref, columns)
+    hashes_new = get_row_hashes(df_new, columns)
+    result = {
+        'digest_reference': get_digest(hashes_ref),
+        'digest_candidate': get_digest(hashes_new),
+        'columns_only_reference': [col for col in columns_ref if col not in columns_new],
+        'columns_only_candidate': [col for col in columns_new if col not in columns_ref],
+        'dtypes_differ': [col for col in columns if df_ref[col].dtype != df_new[col].dtype],
+        'df_diff': pd.DataFrame(columns=['I_eq', 'kind', 'vars']),
+    }
+    if result['digest_reference'] == result['digest_candidate']:
+        return result
+
+    # Row-by-row comparison
+    D_only_ref, D_only_new = get_unmatched_rows(hashes_ref, hashes_new)
+    df_only_ref = df_ref.loc[D_only_ref].set_index(pd.Index(get_id(df_ref)[D_only_ref]))
+    df_only_new = df_new.loc[D_only_new].set_index(pd.Index(get_id(df_new)[D_only_new]))
+    # Trades that are kept by both with differing values (same row ID)
+    ids_both = df_only_ref.index[df_only_ref.index.isin(df_only_new.index) &
+                                 (df_only_ref.index.isna() == False)].unique()
+    df_both_ref = df_only_ref.loc[df_only_ref.index.duplicated() == False].loc[ids_both]
+    df_both_new = df_only_new.loc[df_only_new.index.duplicated() == False].loc[ids_both]
+    list_diff = [pd.DataFrame({'I_eq': ids_both, 'kind': 'values differ',
+                               'vars': get_differing_vars(df_both_ref, df_both_new, columns)})]
+    for df_only, kind in [(df_only_ref, 'dropped by the candidate'), (df_only_new, 'added by the candidate')]:
+        ids_only = df_only.index[df_only.index.isin(ids_both) == False]
+        list_diff.append(pd.DataFrame({'I_eq': ids_only, 'kind': kind, 'vars': [[] for _ in ids_only]}))
+    result['df_diff'] = pd.concat(list_diff, ignore_index=True)
+
+    return result
+
+
+#########
+# Step 3: Attribute the differing trades to the cleaning rules
+########
+# Every attribution function gets the input of the check and the input rows of the differing trades and returns the
+# rule of the reference that removes each trade ('kept' if no rule applies). The conditions are the ones of the
+# reference functions in clean_TRACE.py. All rules except the same-day corrections prior to 2012 are within a bond,
+# thus the input is reduced to the bonds of the differing trades first.
+def get_key_match(df_left, left_on, df_right, right_on):
+    """
+    Indicator whether a row of df_left matches any row of df_right on the given variables.
+    """
+    df_match = df_right[right_on].drop_duplicates()
+    df_match.columns = left_on
+    df_match['D_match'] = True
+
+    return df_left[left_on].merge(df_match, on=left_on, how='left')['D_match'].fillna(False).values.astype(bool)
+
+
+def get_bond_input(df_in, df_rows):
+    """
+    Reduce the input to the bonds of the given rows.
+    """
+    return df_in.loc[df_in['CUSIP_ID'].isin(df_rows['CUSIP_ID']) | df_in['CUSIP_ID'].isna()].copy()
+
+
+def attribute_post_2012_clean(inputs, df_rows):
+    df_in = get_bond_input(inputs['df'], df_rows)
+    # Step 1.1: Executing party instead of the give-up party
+    for var, var_gvp in [('RPTG_PARTY_ID', 'RPTG_PARTY_GVP_ID'), ('CNTRA_PARTY_ID', 'CNTRA_PARTY_GVP_ID')]:
+        df_in.loc[df_in[var_gvp].isna() == False, var] = df_in.loc[df_in[var_gvp].isna() == False, var_gvp]
+    df_rows = df_in.loc[df_in['I_eq'].isin(df_rows['I_eq'])]
+    merge_vars = ['CUSIP_ID', 'ENTRD_VOL_QT', 'RPTD_PR', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'RPT_SIDE_CD',
+                  'CNTRA_PARTY_ID', 'CNTRA_PARTY_GVP_ID']
+    D_cancel = get_key_match(df_rows, merge_vars + ['SYSTM_CNTRL_NB'],
+                             df_in.loc[df_in.TRD_ST_CD.isin(['X', 'C'])], merge_vars + ['SYSTM_CNTRL_NB'])
+    D_reversal = get_key_match(df_rows, merge_vars + ['SYSTM_CNTRL_NB'],
+                               df_in.loc[df_in.TRD_ST_CD == 'Y'], merge_vars + ['PREV_TRD_CNTRL_NB'])
+    rules = np.select(
+        [df_rows.CUSIP_ID.isna(), df_rows.TRD_ST_CD.isin(['X', 'C']), df_rows.TRD_ST_CD == 'Y', D_cancel, D_reversal],
+        ['post_2012_clean 1.1: missing CUSIP', 'post_2012_clean 1.1: cancellation or correction report',
+         'post_2012_clean 1.1: reversal report', 'post_2012_clean 1.2: matched by a cancellation or correction',
+         'post_2012_clean 1.3: matched by a reversal'],
+        'kept')
+
+    return pd.Series(rules, index=df_rows['I_eq'].values)
+
+
+def attribute_prior_2012_clean(inputs, df_rows):
+    df_in = inputs['df'].copy()
+    # Step 2.1: Executing party instead of the give-up party
+    for var, var_gvp in [('RPTG_MKT_MP_ID', 'RPTG_SIDE_GVP_MP_ID'), ('CNTRA_MP_ID', 'CNTRA_GVP_ID')]:
+        df_in.loc[df_in[var_gvp].isna() == False, var] = df_in.loc[df_in[var_gvp].isna() == False, var_gvp]
+    df_rows = df_in.loc[df_in['I_eq'].isin(df_rows['I_eq'])]
+    # Step 2.2: Same-day cancellations and corrections (matched on the message sequence number over all bonds)
+    D_same_day = get_key_match(df_rows, ['REC_CT_NB', 'TRD_RPT_DT'], df_in.loc[df_in.TRC_ST.isin(['C', 'W'])],
+                               ['PREV_REC_CT_NB', 'TRD_RPT_DT'])
+    # Step 2.3/2.4: Reversals (including the reversals reported after the reporting change) that are reported after
+    # the trade. The reference removes the closest of these trades for every reversal
+    df_in = get_bond_input(df_in, df_rows)
+    rev_vars = ['CUSIP_ID', 'EXCTN_TM', 'RPTD_PR', 'ENTRD_VOL_QT', 'RPT_SIDE_CD', 'CNTRA_MP_ID']
+    unmatched = inputs['unmatched'].rename(columns={'TRD_EXCTN_TM': 'EXCTN_TM', 'CNTRA_PARTY_ID': 'CNTRA_MP_ID'})
+    df_reversal = pd.concat([df_in.loc[df_in.TRC_ST.isin(['T', 'W', 'N']) & (df_in.ASOF_CD == 'R'),
+                                       rev_vars + ['TRD_RPT_TM']], unmatched[rev_vars + ['TRD_RPT_TM']]])
+    df_match = df_rows[rev_vars + ['TRD_RPT_TM', 'I_eq']].merge(df_reversal, on=rev_vars, suffixes=('', '_reversal'))
+    ids_reversal = df_match.loc[df_match['TRD_RPT_TM'] < df_match['TRD_RPT_TM_reversal'], 'I_eq']
+    rules = np.select(
+        [df_rows.CUSIP_ID.isna(), df_rows.TRC_ST.isin(['T', 'W', 'N']) == False, D_same_day,
+         df_rows.ASOF_CD == 'R', df_rows['I_eq'].isin(ids_reversal)],
+        ['prior_2012_clean 2.1: missing CUSIP', 'prior_2012_clean 2.2: cancellation report',
+         'prior_2012_clean 2.2: matched by a same-day cancellation or correction',
+         'prior_2012_clean 2.3: reversal report', 'prior_2012_clean 2.4: matched by a reversal'],
+        'kept')
+
+    return pd.Series(rules, index=df_rows['I_eq'].values)
+
+
+def attribute_del_interd_transact(inputs, df_rows):
+    df_in = get_bond_input(inputs['df'], df_rows)
+    df_rows = df_in.loc[df_in['I_eq'].isin(df_rows['I_eq'])]
+    D_match = get_key_match(
+        df_rows, ['CUSIP_ID', 'TRD_EXCTN_DT', 'ENTRD_VOL_QT', 'RPTD_PR', 'RPTG_PARTY_ID', 'CNTRA_PARTY_ID'],
+        df_in.loc[(df_in.CNTRA_PARTY_ID != 'C') & (df_in.RPT_SIDE_CD == 'B')],
+        ['CUSIP_ID', 'TRD_EXCTN_DT', 'ENTRD_VOL_QT', 'RPTD_PR', 'CNTRA_PARTY_ID', 'RPTG_PARTY_ID'])
+    rules = np.where((df_rows.CNTRA_PARTY_ID != 'C') & (df_rows.RPT_SIDE_CD == 'S') & D_match,
+                     'del_interd_transact: inter-dealer sell report matched by the buy report', 'kept')
+
+    return pd.Series(rules, index=df_rows['I_eq'].values)
+
+
+def attribute_clean_trade_level(inputs, df_rows):
+    df_in = get_bond_input(inputs['df'], df_rows)
+    df_rows = df_in.loc[df_in['I_eq'].isin(df_rows['I_eq'])]
+    N_trnsct = df_rows['CUSIP_ID'].map(df_in.groupby('CUSIP_ID')['CUSIP_ID'].count())
+    D_outstanding = ((pd.to_datetime(df_rows['TRD_RPT_DT']) > pd.to_datetime(df_rows['effective_date'])) &
+                     (df_rows.amount_outstanding == 0))
+    rules = np.select(
+        [(N_trnsct > 5) == False, df_rows.TRDG_MKT_CD != 'S1', D_outstanding,
+         df_rows.ENTRD_VOL_QT / df_rows.principal_amt > df_rows.offering_amt],
+        ['clean_trade_level a): bond with 5 or fewer trades', 'clean_trade_level b): primary market trade',
+         'clean_trade_level c): reported after the amount outstanding is zero',
+         'clean_trade_level d): trade size exceeds the offer size'],
+        'kept')
+
+    return pd.Series(rules, index=df_rows['I_eq'].values)
+
+
+def attribute_clean_df_general(inputs, df_rows):
+    df_rows = df_rows.copy()
+    df_rows.columns = map(str.lower, df_rows.columns)
+    rules = np.select(
+        [(df_rows.trd_exctn_tm >= df_rows.offering_date) == False,
+         (df_rows.trd_exctn_tm <= df_rows.maturity) == False,
+         df_rows.rating.isna(),
+         (df_rows.trd_exctn_tm >= datetime.datetime(2002, 7, 1)) == False,
+         ((df_rows.rptd_pr > 0) & (df_rows.rptd_pr < 220)) == False,
+         (df_rows.entrd_vol_qt > 0) == False],
+        ['clean_df_general c): executed before the offering date', 'clean_df_general d): executed after maturity',
+         'clean_df_general e): missing rating', 'clean_df_general f): executed before the start of TRACE',
+         'clean_df_general h): missing or implausible price', 'clean_df_general i): missing or non-positive volume'],
+        'kept')
+
+    return pd.Series(rules, index=df_rows['i_eq'].values)
+
+
+def attribute_add_clean_trading_dates(inputs, df_rows):
+    df_rows = df_rows.copy()
+    df_rows.columns = map(str.lower, df_rows.columns)
+    TRACE_rpt_days = load_rpt_dates(inputs['project_path'] + '/bld/data/TRACE/TRACE_info/TRACE_rpt_dates.pkl')
+    TRACE_rpt_days = [datetime.datetime.strptime(date, '%Y-%m-%d').date() for date in TRACE_rpt_days]
+    rules = np.select(
+        [df_rows.trd_exctn_tm.dt.dayofweek.isin([0, 1, 2, 3, 4]) == False,
+         df_rows.trd_exctn_dt.isin(TRACE_rpt_days) == False,
+         df_rows.trd_exctn_dt.isin(get_US_holiday_dates()),
+         (df_rows.trd_exctn_tm.dt.month == 12) & df_rows.trd_exctn_tm.dt.day.isin([24, 25])],
+        ['clean_trd_days 1): executed on a weekend', 'clean_trd_days 2): no TRACE reporting file on the day',
+         'clean_trd_days 3): executed on a holiday', 'clean_trd_days: executed on Christmas'],
+        'kept')
+
+    return pd.Series(rules, index=df_rows['i_eq'].values)
+
+
+def attribute_clean_merged_data(inputs, df_rows):
+    """
+    Attribute the differing trades of the entire cleaning chain after the concatenation: the reference steps are
+    run one after the other on the bonds of the differing trades and every trade is attributed to the rule of the
+    first step that removes it.
+    """
+    inputs_stage = dict(inputs, df=get_bond_input(inputs['df'], df_rows))
+    rules = pd.Series('kept', index=df_rows['I_eq'].values)
+    for stage in MERGED_STAGES:
+        df_stage = inputs_stage['df']
+        df_stage_rows = df_stage.loc[np.isin(get_id(df_stage), rules.index[rules == 'kept'])]
+        if len(df_stage_rows) > 0:
+            rules_stage = CHECKS[stage]['attribute'](inputs_stage, df_stage_rows)
+            rules_stage = rules_stage.loc[rules_stage != 'kept']
+            rules.loc[rules_stage.index] = rules_stage.values
+        inputs_stage['df'] = CHECKS[stage]['run'](CHECKS[stage]['reference'], inputs_stage)
+
+    return rules
+
+
+# Checks: reference function, call of the reference/candidate, rule attribution, variables that are not compared
+# (the helper variable N of prior_2012_clean() numbers the rows in the input order and is not used afterwards) and
+# whether the input can be split into CUSIP partitions (the same-day corrections prior to 2012 are matched on the
+# message sequence number only)
+CHECKS = {
+    'post_2012_clean': {'reference': clean_TRACE.post_2012_clean, 'run': run_post_2012_clean,
+                        'attribute': attribute_post_2012_clean, 'ignore_vars': [], 'partitionable': True},
+    'prior_2012_clean': {'reference': clean_TRACE.prior_2012_clean, 'run': run_prior_2012_clean,
+                         'attribute': attribute_prior_2012_clean, 'ignore_vars': ['N'],
+                         'partitionable': False},
+    'del_interd_transact': {'reference': clean_TRACE.del_interd_transact, 'run': run_del_interd_transact,
+                            'attribute': attribute_del_interd_transact, 'ignore_vars': [], 'partitionable': True},
+    'clean_trade_level': {'reference': clean_TRACE.clean_trade_level, 'run': run_clean_trade_level,
+                          'attribute': attribute_clean_trade_level, 'ignore_vars': [], 'partitionable': True},
+    'clean_df_general': {'reference': clean_TRACE.clean_df_general, 'run': run_clean_df_general,
+                         'attribute': attribute_clean_df_general, 'ignore_vars': [], 'partitionable': True},
+    'add_clean_trading_dates': {'reference': clean_TRACE.add_clean_trading_dates,
+                                'run': run_add_clean_trading_dates, 'attribute': attribute_add_clean_trading_dates,
+                                'ignore_vars': [], 'partitionable': True},
+    'clean_merged_data': {'reference': process_TRACE.clean_merged_data, 'run': run_clean_merged_data,
+                          'attribute': attribute_clean_merged_data, 'ignore_vars': [], 'partitionable': True},
+}
+# Steps of clean_merged_data() in their order (the variable creation keeps all trades)
+MERGED_STAGES = ['del_interd_transact', 'clean_trade_level', 'clean_df_general', 'add_clean_trading_dates']
+
+
+def get_candidate(candidate, candidate_kwargs=None):
+    """
+    Get the candidate function from a function or a string module:function (e.g. 'fast_clean:post_2012_clean').
+    Further keyword arguments of the candidate are bound to the function.
+    """
+    if isinstance(candidate, str):
+        module_name, func_name = candidate.split(':')
+        candidate = getattr(importlib.import_module(module_name), func_name)
+    if candidate_kwargs:
+        func = candidate
+
+        def candidate(*args):
+            return func(*args, **candidate_kwargs)
+
+    return candidate
+
+
+def format_value(value):
+    """
+    Format a value of a differing trade for the JSON report.
+    """
+    return None if (np.isscalar(value) and pd.isna(value)) else str(value)
+
+
+def check_equivalence(check, candidate, inputs, n_partitions=1, max_report=20):
+    """
+    Run the reference and the candidate of a check on the same input and compare the outputs row by row.
+
+    Parameters:
+    -----------
+    check (str): Name of the check (see CHECKS)
+    candidate (function): New implementation with the same arguments and output as the reference (None -> the
+                          reference itself, e.g. to test the determinism)
+    inputs (dict): Input DataFrame (df, with the row ID I_eq, see add_row_ids()) and the further arguments of the
+                   check (unmatched, project_path, dataset_specs)
+    n_partitions (int): Number of CUSIP partitions that are checked one after the other
+    max_report (int): Number of differing trades that are reported in detail
+
+    Returns:
+    --------
+    report (dict): Equivalence, digests, timings, number of differing trades per kind and rule and the first
+                   differing trades
+    """
+    if check not in CHECKS:
+        raise ValueError('Unknown check {} (available: {})'.format(check, ', '.join(CHECKS)))
+    reference = CHECKS[check]['reference']
+    candidate = reference if candidate is None else candidate
+    if all(var not in inputs['df'].columns for var in ID_VARS):
+        inputs = dict(inputs, df=add_row_ids(inputs['df']))
+    if (n_partitions > 1) & (CHECKS[check]['partitionable'] == False):
+        print('EQUIVALENCE: {} cannot be split into CUSIP partitions, the full input is checked'.format(check))
+        n_partitions = 1
+    buckets = (process_TRACE.get_cusip_bucket(get_var(inputs['df'], 'CUSIP_ID'), n_partitions) if n_partitions > 1
+               else np.zeros(len(inputs['df']), dtype=np.int64))
+
+    report = {'check': check, 'rows_in': len(inputs['df']), 'rows_reference': 0, 'rows_candidate': 0,
+              'time_reference_s': 0.0, 'time_candidate_s': 0.0}
+    list_digests, list_diff, list_results = [], [], []
+    for partition in range(0, n_partitions):
+        inputs_part = dict(inputs, df=inputs['df'].loc[buckets == partition])
+        t0 = time.perf_counter()
+        df_ref = CHECKS[check]['run'](reference, inputs_part)
+        report['time_reference_s'] += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        df_new = CHECKS[check]['run'](candidate, inputs_part)
+        report['time_candidate_s'] += time.perf_counter() - t0
+        report['rows_reference'] += len(df_ref)
+        report['rows_candidate'] += len(df_new)
+
+        result = compare_outputs(df_ref, df_new, CHECKS[check]['ignore_vars'])
+        list_digests.append((result['digest_reference'], result['digest_candidate']))
+        list_results.append(result)
+        if len(result['df_diff']) > 0:
+            # Attribute the differing trades to the rules of the reference
+            df_diff = result['df_diff']
+            df_rows = inputs_part['df'].loc[np.isin(get_id(inputs_part['df']), df_diff['I_eq'])]
+            rules = CHECKS[check]['attribute'](inputs_part, df_rows) if len(df_rows) > 0 else pd.Series(dtype=str)
+            df_diff['rule'] = df_diff['I_eq'].map(rules).fillna('unknown (no row ID in the output)')
+            list_diff.append(df_diff)
+        print('EQUIVALENCE: {} partition {}/{}: {} reference rows, {} candidate rows, {} differing trades'.format(
+            check, partition + 1, n_partitions, len(df_ref), len(df_new), len(result['df_diff'])))
+        del [df_ref, df_new]
+
+    # Summary over all partitions
+    df_diff = (pd.concat(list_diff, ignore_index=True).sort_values('I_eq') if len(list_diff) > 0
+               else pd.DataFrame(columns=['I_eq', 'kind', 'vars', 'rule']))
+    report['columns_only_reference'] = list_results[0]['columns_only_reference']
+    report['columns_only_candidate'] = list_results[0]['columns_only_candidate']
+    report['dtypes_differ'] = sorted(set(col for result in list_results for col in result['dtypes_differ']))
+    report['digests_equal'] = all(digest_ref == digest_new for digest_ref, digest_new in list_digests)
+    report['equivalent'] = (report['digests_equal'] & (len(report['columns_only_reference']) == 0) &
+                            (len(report['columns_only_candidate']) == 0))
+    report['speedup'] = report['time_reference_s'] / report['time_candidate_s'] if report['time_candidate_s'] > 0 \
+        else None
+    report['n_differing'] = df_diff.groupby('kind').size().to_dict()
+    report['rules'] = {'{} | {}'.format(kind, rule): int(n)
+                       for (kind, rule), n in df_diff.groupby(['kind', 'rule']).size().items()}
+    df_first = df_diff.head(max_report)
+    df_first_in = inputs['df'].set_index(pd.Index(get_id(inputs['df']))).loc[df_first['I_eq'].dropna()]
+    report_vars = [var for var in REPORT_VARS if (var in df_first_in.columns) | (var.lower() in df_first_in.columns)]
+    report['first_differences'] = []
+    for _, row in df_first.iterrows():
+        diff = {'I_eq': format_value(row['I_eq']), 'kind': row['kind'], 'rule': row['rule'], 'vars': row['vars']}
+        if pd.isna(row['I_eq']) == False:
+            diff.update({var: format_value(get_var(df_first_in, var).loc[row['I_eq']]) for var in report_vars})
+        report['first_differences'].append(diff)
+
+    print_equivalence_report(report)
+
+    return report
+
+
+def print_equivalence_report(report):
+    """
+    Print the summary of an equivalence report.
+    """
+    print('EQUIVALENCE {}: {} ({} rows in, {} reference rows, {} candidate rows)'.format(
+        report['check'], 'EQUIVALENT' if report['equivalent'] else 'NOT EQUIVALENT', report['rows_in'],
+        report['rows_reference'], report['rows_candidate']))
+    print('EQUIVALENCE: reference {:.2f}s, candidate {:.2f}s'.format(report['time_reference_s'],
+                                                                      report['time_candidate_s']))
+    for key in ['columns_only_reference', 'columns_only_candidate', 'dtypes_differ']:
+        if len(report[key]) > 0:
+            print('EQUIVALENCE: {}: {}'.format(key, ', '.join(report[key])))
+    for rule, n in report['rules'].items():
+        print('EQUIVALENCE: {:>8} x {}'.format(n, rule))
+    for diff in report['first_differences']:
+        print('EQUIVALENCE: {}'.format(diff))
+
+
+def store_equivalence_report(project_path, report, label):
+    """
+    Store an equivalence report in bld/data/TRACE/TRACE_info/equivalence/equivalence_<check>_<label>.json.
+    """
+    path_equivalence = project_path + '/bld/data/TRACE/TRACE_info/equivalence/'
+    build_folders(path_equivalence)
+    file_path = path_equivalence + 'equivalence_{}_{}.json'.format(report['check'], label)
+    with open(file_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print('EQUIVALENCE: The report is stored in {}'.format(file_path))
+
+
+def check_equivalence_year(project_path, check, candidate, year, dataset_specs, n_partitions=1, max_report=20):
+    """
+    Check the equivalence of a candidate on one full year of the project and store the report.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    check (str): Name of the check (see CHECKS)
+    candidate (function): New implementation (None -> the reference itself)
+    year (int): Year (the raw daily files are needed for post_2012_clean() and prior_2012_clean(), the yearly
+                cleaned files of the read-in step for all other checks)
+    dataset_specs (dict): Final dataset specifications
+    n_partitions (int): Number of CUSIP partitions that are checked one after the other
+    max_report (int): Number of differing trades that are reported in detail
+
+    Returns:
+    --------
+    report (dict): Equivalence report (see check_equivalence())
+    """
+    if check not in CHECKS:
+        raise ValueError('Unknown check {} (available: {})'.format(check, ', '.join(CHECKS)))
+    inputs = load_year_inputs(project_path, check, year, dataset_specs)
+    report = check_equivalence(check, candidate, inputs, n_partitions, max_report)
+    report['year'] = year
+    store_equivalence_report(project_path, report, year)
+
+    return report
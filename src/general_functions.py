@@ -1,5 +1,4 @@
-import os.path
-from sys import platform
+import os
 
 def build_folders(path_in):
     """Check if an exisiting file path exists. If not create the necessry folder such that the 
@@ -14,15 +13,9 @@ def build_folders(path_in):
     Generates the relevant file path
     """
 
-    if not os.path.exists(path_in):
-        if ((platform=="win32") | (platform=="win64")):
-            os.mkdir(path_in)
-            #os.system("chmod 777 " + path_in)
-        elif platform=="darwin":
-            os.system("sudo mkdir " + path_in)
-            os.system("sudo chmod 775 " + path_in)
-        else:
-            raise ValueError('The database folder is not constructed')
+    # Create the folder (and missing parent folders) with the permissions of the current user. Owner and group
+    # can write to the folder
+    os.makedirs(path_in, mode=0o775, exist_ok=True)
 
 
 def construct_nec_folders(project_path):
@@ -48,6 +41,8 @@ def construct_nec_folders(project_path):
     path_output_clean_data_3 = project_path + '/bld/data/TRACE/TRACE_raw_clean'
     path_output_clean_data_4 = project_path + '/bld/data/TRACE/TRACE_info'
     path_output_clean_data_5 = project_path + '/bld/data/TRACE/TRACE_final_clean'
+    path_output_clean_data_6 = project_path + '/bld/data/TRACE/TRACE_partitions'
+    path_output_clean_data_7 = project_path + '/bld/data/TRACE/TRACE_checkpoints'
 
 
     # Construct the relevant folders if they are not already exisiting
@@ -60,6 +55,8 @@ def construct_nec_folders(project_path):
     build_folders(path_output_clean_data_3)
     build_folders(path_output_clean_data_4)
     build_folders(path_output_clean_data_5)
+    build_folders(path_output_clean_data_6)
+    build_folders(path_output_clean_data_7)
 
     dir = os.listdir(path_input_raw_data_2)
   
@@ -0,0 +1,607 @@
+"""
+Generate synthetic Academic TRACE and MERGENT FISD data such that the build can be tested and load-tested locally
+without the licensed data. The generated files have the layout of the original files:
+    a) Daily transaction files (0033-corp-academic-trace-data-YYYY-MM-DD.txt) in the pre-2012 layout (before the
+       reporting change on 06.02.2012) and in the post-2012 layout, including the two trailer rows
+    b) Daily bond files (0033-corp-bond-YYYY-MM-DD.txt) and, after the reporting change, the supplemental bond files
+       (0033-corp-bond-supplemental-YYYY-MM-DD.txt)
+    c) MERGENT FISD issue data (issue_data.pkl) and rating data (ratings.pkl) of the same bonds
+The steps are as follows:
+    Step 1:     Define the trading calendar and the bond universe (issue data, ratings and bond attributes that
+                change over time, e.g. the 144A flag after an exchange offer)
+    Step 2:     Generate the transactions of one day: customer and inter-dealer trades (both sides reported),
+                as-of trades and cancellation, correction and reversal chains with controllable rates (see RATES)
+    Step 3:     Write the daily files in parallel (one task per day, every day has its own seed such that the
+                output does not depend on the number of workers) and the MERGENT data
+
+Example (in the src folder, writes into an empty project folder):
+    python -m pycleantrace generate --project-path /tmp/TRACE_synthetic --start-date 2011-01-01
+                                    --end-date 2013-12-31 --trades-per-day 5000 --workers -1
+
+NOTE: The reading-in step (see read_2012() in read_TRACE.py) expects all trading days of January 2012 in the 2012
+folder if the sample contains 2012, and the last year of the sample has to be after 2012.
+"""
+
+import datetime
+import os
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+from pandas.tseries.holiday import AbstractHolidayCalendar, USFederalHolidayCalendar, GoodFriday
+from joblib import Parallel, delayed
+
+from general_functions import build_folders
+
+# Default rates of the generated transactions:
+#   interdealer:    Share of the dealer-dealer trades that are reported by both sides
+#   customer:       Share of the trades with a customer as contra party
+#   asof:           Share of the trades reported on a later day than the execution date (as-of trades)
+#   cancel:         Share of the trade reports that are cancelled
+#   correct:        Share of the trade reports that are corrected
+#   correct_chain:  Probability that a correction is corrected again (correction chains)
+#   reversal:       Share of the trade reports that are reversed
+#   gvp:            Share of the trades reported by a give-up party
+#   primary:        Share of primary market trades
+#   size_error:     Share of trades with a (erroneous) trade size above the bond's offering amount
+RATES = {
+    'interdealer': 0.8,
+    'customer': 0.6,
+    'asof': 0.01,
+    'cancel': 0.02,
+    'correct': 0.01,
+    'correct_chain': 0.2,
+    'reversal': 0.005,
+    'gvp': 0.01,
+    'primary': 0.03,
+    'size_error': 0.0002,
+}
+
+# Columns of the daily raw files prior and post the reporting change on 06.02.2012
+COLUMNS_PRE_2012 = [
+    'REC_CT_NB', 'TRC_ST', 'BOND_SYM_ID', 'CUSIP_ID', 'SCRTY_TYPE_CD', 'WIS_CD', 'CMSN_TRD_FL', 'ENTRD_VOL_QT',
+    'RPTD_PR', 'YLD_SIGN_CD', 'YLD_PT', 'ASOF_CD', 'TRD_EXCTN_DT', 'EXCTN_TM', 'TRD_RPT_DT', 'TRD_RPT_TM',
+    'TRD_STLMT_DT', 'SALE_CNDTN_CD', 'SALE_CNDTN2_CD', 'RPT_SIDE_CD', 'BUY_CMSN_RT', 'BUY_CPCTY_CD',
+    'SELL_CMSN_RT', 'SELL_CPCTY_CD', 'RPTG_MKT_MP_ID', 'RPTG_SIDE_GVP_MP_ID', 'CNTRA_MP_ID', 'CNTRA_GVP_ID',
+    'AGU_TRD_ID', 'SPCL_PR_FL', 'TRDG_MKT_CD', 'DISSEM_FL', 'PREV_REC_CT_NB'
+]
+COLUMNS_POST_2012 = [
+    'REC_CT_NB', 'TRD_ST_CD', 'ISSUE_SYM_ID', 'CUSIP_ID', 'RPTG_PARTY_ID', 'RPTG_PARTY_GVP_ID', 'PRDCT_SBTP_CD',
+    'WIS_DSTRD_CD', 'NO_RMNRN_CD', 'ENTRD_VOL_QT', 'RPTD_PR', 'YLD_DRCTN_CD', 'CALCD_YLD_PT', 'ASOF_CD',
+    'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'TRD_RPT_DT', 'TRD_RPT_TM', 'TRD_STLMT_DT', 'TRD_MDFR_LATE_CD', 'RPT_SIDE_CD',
+    'BUYER_CMSN_AMT', 'BUYER_CPCTY_CD', 'SLLR_CMSN_AMT', 'SLLR_CPCTY_CD', 'CNTRA_PARTY_ID', 'CNTRA_PARTY_GVP_ID',
+    'LCKD_IN_FL', 'TRDG_MKT_CD', 'PBLSH_FL', 'SYSTM_CNTRL_DT', 'SYSTM_CNTRL_NB', 'PREV_TRD_CNTRL_DT',
+    'PREV_TRD_CNTRL_NB', 'FIRST_TRD_CNTRL_DT', 'FIRST_TRD_CNTRL_NB'
+]
+# Columns of the daily bond files
+COLUMNS_BOND = [
+    'FINRA_SCRTY_ID', 'CUSIP_ID', 'SYM_CD', 'CMPNY_NM', 'SUB_PRDCT_TYPE_CD', 'SCRTY_TYPE_CD', 'SCRTY_SBTP_CD',
+    'CPN_RT', 'CPN_TYPE_CD', 'TRD_RPT_EFCTV_DT', 'MTRTY_DT', 'TRACE_GRADE_CD', 'RULE_144A_FL', 'DSMTN_FL',
+    'ACCRD_INTRS_AM', 'CNVRB_FL'
+]
+
+# Date of the TRACE reporting change
+DATE_REPORTING_CHANGE = datetime.date(2012, 2, 6)
+# Days on which the bond market was closed in addition to the regular holidays (e.g. Hurricane Sandy)
+SPECIAL_CLOSURES = ['2004-06-11', '2007-01-02', '2012-10-30', '2018-12-05']
+
+
+#########
+# Step 1: Trading calendar and bond universe
+########
+class BondMarketCalendar(AbstractHolidayCalendar):
+    """
+    Holidays of the U.S. bond market (U.S. federal holidays and Good Friday).
+    """
+    rules = USFederalHolidayCalendar.rules + [GoodFriday]
+
+
+def get_trading_days(start_date, end_date):
+    """
+    Get the trading days of the U.S. bond market between two dates (weekdays without the holidays and the special
+    closures).
+
+    Parameters:
+    -----------
+    start_date (str): First day (YYYY-MM-DD)
+    end_date (str): Last day (YYYY-MM-DD)
+
+    Returns:
+    --------
+    trading_days (DatetimeIndex): Trading days
+    """
+    holidays = BondMarketCalendar().holidays(start_date, end_date).union(pd.to_datetime(SPECIAL_CLOSURES))
+    trading_days = pd.bdate_range(start_date, end_date)
+
+    return trading_days[trading_days.isin(holidays) == False]
+
+
+def get_cusip_check_digit(cusip8):
+    """
+    Compute the check digit of an 8-character CUSIP (modulus 10 double-add-double).
+    """
+    total = 0
+    for i, c in enumerate(cusip8):
+        v = int(c) if c.isdigit() else ord(c) - ord('A') + 10
+        if i % 2 == 1:
+            v = v * 2
+        total = total + v // 10 + v % 10
+
+    return str((10 - total % 10) % 10)
+
+
+def get_bond_universe(n_bonds, start_date, end_date, seed=0):
+    """
+    Generate the bond universe. Bonds are issued before and during the sample and some mature during the sample.
+    Most bonds are corporate debentures (CDEB). Some are medium term notes, bank notes or putable bonds such that
+    the bond selection (see select_bonds() in read_TRACE.py) excludes them. Some 144A bonds are registered after an
+    exchange offer (time-varying 144A flag) and some step-up bonds change their coupon.
+
+    Parameters:
+    -----------
+    n_bonds (int): Number of bonds
+    start_date (str): First day of the sample (YYYY-MM-DD)
+    end_date (str): Last day of the sample (YYYY-MM-DD)
+    seed (int): Seed of the random number generator
+
+    Returns:
+    --------
+    df_bonds (DataFrame): One row per bond
+    """
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    n_issuers = max(1, n_bonds // 5)
+
+    # CUSIP: 6-character issuer code, 2-character issue code and check digit
+    issuer = rng.integers(0, n_issuers, n_bonds)
+    issue = rng.integers(0, 100, n_bonds)
+    issuer_cusip = np.array(['{:06d}'.format(i) for i in issuer])
+    issue_cusip = np.array(['{}{}'.format('ABCDEFGHJK'[n // 10], n % 10) for n in issue])
+    cusip8 = np.char.add(issuer_cusip, issue_cusip)
+    df_bonds = pd.DataFrame({'issuer_cusip': issuer_cusip, 'cusip8': cusip8}).drop_duplicates(subset=['cusip8'])
+    df_bonds['issue_cusip'] = [c[6:] + get_cusip_check_digit(c) for c in df_bonds['cusip8']]
+    df_bonds['CUSIP_ID'] = df_bonds['issuer_cusip'] + df_bonds['issue_cusip']
+    df_bonds = df_bonds.drop(columns=['cusip8']).reset_index(drop=True)
+    n = len(df_bonds)
+
+    # Issue information. A third of the bonds are issued during the sample
+    sample_days = (end - start).days
+    offering_offset = np.where(rng.random(n) < 1 / 3, rng.integers(0, max(1, sample_days), n),
+                               -rng.integers(30, 15 * 365, n))
+    df_bonds['offering_date'] = start + pd.to_timedelta(offering_offset, unit='D')
+    df_bonds['maturity'] = df_bonds['offering_date'] + pd.to_timedelta(
+        rng.choice([3, 5, 7, 10, 20, 30], n) * 365, unit='D')
+    df_bonds['bond_type'] = rng.choice(['CDEB', 'CMTN', 'USBN', 'CCOV'], n, p=[0.8, 0.1, 0.07, 0.03])
+    df_bonds['putable'] = np.where(rng.random(n) < 0.03, 'Y', 'N')
+    df_bonds['offering_amt'] = rng.choice([250000.0, 500000.0, 1000000.0, 2000000.0], n)
+    df_bonds['offering_price'] = np.round(98 + 2 * rng.random(n), 3)
+    df_bonds['principal_amt'] = 1000.0
+    df_bonds['coupon'] = np.round(rng.choice(np.arange(1.0, 9.0, 0.125), n), 3)
+    df_bonds['price'] = np.round(100 + 8 * rng.standard_normal(n), 3)
+    # Some bonds are called before maturity (amount outstanding is zero after the effective date)
+    D_called = rng.random(n) < 0.05
+    df_bonds['effective_date'] = df_bonds['offering_date']
+    df_bonds.loc[D_called, 'effective_date'] = (
+        df_bonds.loc[D_called, 'offering_date'] +
+        (df_bonds.loc[D_called, 'maturity'] - df_bonds.loc[D_called, 'offering_date']) * rng.random(D_called.sum())
+    ).dt.normalize()
+    df_bonds['amount_outstanding'] = np.where(D_called, 0.0, df_bonds['offering_amt'])
+    df_bonds['active_issue'] = np.where(D_called, 'N', 'Y')
+    df_bonds['grade'] = np.where(rng.random(n) < 0.7, 'I', 'H')
+    # Time-varying attributes: registration of 144A bonds and coupon steps
+    df_bonds['rule_144a'] = rng.random(n) < 0.15
+    df_bonds['date_registered'] = pd.NaT
+    D_registered = df_bonds['rule_144a'] & (rng.random(n) < 0.5)
+    df_bonds.loc[D_registered, 'date_registered'] = (
+        df_bonds.loc[D_registered, 'offering_date'] + pd.to_timedelta(rng.integers(90, 365, D_registered.sum()),
+                                                                      unit='D')
+    )
+    df_bonds['date_coupon_step'] = pd.NaT
+    D_step = rng.random(n) < 0.02
+    df_bonds.loc[D_step, 'date_coupon_step'] = (
+        df_bonds.loc[D_step, 'offering_date'] + pd.to_timedelta(rng.integers(365, 5 * 365, D_step.sum()), unit='D')
+    )
+    # Trading activity: few bonds are traded often, many bonds rarely
+    df_bonds['activity'] = rng.pareto(1.5, n) + 0.1
+    df_bonds['FINRA_SCRTY_ID'] = np.arange(1, n + 1) * 1.0
+
+    return df_bonds
+
+
+def get_issue_data(df_bonds):
+    """
+    Get the MERGENT FISD issue data of the bond universe (as issue_data.pkl).
+    """
+    df_issue = df_bonds[['CUSIP_ID', 'issuer_cusip', 'issue_cusip', 'bond_type', 'putable', 'maturity',
+                         'offering_amt', 'offering_price', 'principal_amt', 'amount_outstanding', 'effective_date',
+                         'offering_date', 'active_issue']].copy()
+    df_issue['complete_cusip'] = df_issue['CUSIP_ID']
+
+    return df_issue
+
+
+def get_ratings(df_bonds, end_date, seed=0):
+    """
+    Get the MERGENT FISD rating data of the bond universe (as ratings.pkl). Every bond is rated at issuance by S&P,
+    Moody's and (partly) Fitch. Afterwards, the ratings are reviewed every one to three years until the end of the
+    sample and the bond is up- or downgraded in about half of the reviews. Some bonds have additional Duff & Phelps
+    ratings (excluded by the cleaning) and some are not rated at all.
+
+    Parameters:
+    -----------
+    df_bonds (DataFrame): Bond universe (see get_bond_universe())
+    end_date (str): Last day of the sample (YYYY-MM-DD)
+    seed (int): Seed of the random number generator
+
+    Returns:
+    --------
+    df_ratings (DataFrame): One row per rating action
+    """
+    rng = np.random.default_rng(seed)
+    scale_sp = ['AAA', 'AA+', 'AA', 'AA-', 'A+', 'A', 'A-', 'BBB+', 'BBB', 'BBB-', 'BB+', 'BB', 'BB-', 'B+', 'B',
+                'B-', 'CCC+', 'CCC', 'CCC-', 'CC', 'C', 'D']
+    scale_moody = ['Aaa', 'Aa1', 'Aa2', 'Aa3', 'A1', 'A2', 'A3', 'Baa1', 'Baa2', 'Baa3', 'Ba1', 'Ba2', 'Ba3', 'B1',
+                   'B2', 'B3', 'Caa1', 'Caa2', 'Caa3', 'Ca', 'C', 'C']
+    df_rated = df_bonds.loc[rng.random(len(df_bonds)) < 0.97]
+    n = len(df_rated)
+    list_ratings = []
+    # Rating at issuance and reviews until the end of the sample (or the maturity)
+    notch = np.where(df_rated['grade'] == 'I', rng.integers(0, 10, n), rng.integers(10, 18, n))
+    rating_date = df_rated['offering_date'].values
+    end = np.minimum(df_rated['maturity'].values, np.datetime64(pd.Timestamp(end_date)))
+    D_active = np.full(n, True)
+    while D_active.any():
+        for rating_type, scale, share in [('SPR', scale_sp, 1.0), ('MR', scale_moody, 0.9), ('FR', scale_sp, 0.5),
+                                          ('DPR', scale_sp, 0.05)]:
+            D_rated = D_active & (rng.random(n) < share)
+            # Agencies can differ by one notch
+            notch_agency = np.clip(notch + rng.integers(-1, 2, n) * (rng.random(n) < 0.3), 0, len(scale) - 1)
+            list_ratings.append(pd.DataFrame({
+                'complete_cusip': df_rated['CUSIP_ID'].values[D_rated],
+                'rating_date': pd.to_datetime(rating_date[D_rated]).normalize(),
+                'rating': np.array(scale)[notch_agency[D_rated]],
+                'rating_type': rating_type,
+            }))
+        # Next review
+        D_change = rng.random(n) < 0.5
+        notch = np.clip(notch + D_change * rng.choice([-1, 1, 1, 2], n), 0, len(scale_sp) - 1)
+        rating_date = rating_date + pd.to_timedelta(rng.integers(365, 3 * 365, n), unit='D').values
+        D_active = rating_date <= end
+    df_ratings = pd.concat(list_ratings, ignore_index=True)
+
+    return df_ratings
+
+
+def format_date(values):
+    """
+    Format dates (numpy datetime64 array) as date strings YYYYMMDD.
+    """
+    return np.char.replace(np.datetime_as_string(values.astype('datetime64[D]'), unit='D'), '-', '')
+
+
+def get_bond_file(df_bonds, day):
+    """
+    Get the daily bond file of one day (attributes in force on this day of all bonds that are outstanding).
+
+    Parameters:
+    -----------
+    df_bonds (DataFrame): Bond universe (see get_bond_universe())
+    day (Timestamp): Trading day
+
+    Returns:
+    --------
+    df_bond_file (DataFrame): Daily bond information in the layout of the raw bond files
+    """
+    df = df_bonds.loc[(df_bonds['offering_date'] <= day) & (df_bonds['maturity'] > day)]
+    D_144a = df['rule_144a'] & ((df['date_registered'] > day) | df['date_registered'].isna())
+    D_step = df['date_coupon_step'] <= day
+
+    return pd.DataFrame({
+        'FINRA_SCRTY_ID': df['FINRA_SCRTY_ID'],
+        'CUSIP_ID': df['CUSIP_ID'],
+        'SYM_CD': 'S' + df['issuer_cusip'],
+        'CMPNY_NM': 'ISSUER ' + df['issuer_cusip'],
+        'SUB_PRDCT_TYPE_CD': 'CORP',
+        'SCRTY_TYPE_CD': 'C',
+        'SCRTY_SBTP_CD': '',
+        'CPN_RT': df['coupon'] + 0.5 * D_step,
+        'CPN_TYPE_CD': np.where(df['date_coupon_step'].isna(), 'F', 'S'),
+        'TRD_RPT_EFCTV_DT': format_date(df['offering_date'].values),
+        'MTRTY_DT': format_date(df['maturity'].values),
+        'TRACE_GRADE_CD': df['grade'],
+        'RULE_144A_FL': np.where(D_144a, 'Y', 'N'),
+        'DSMTN_FL': np.where(D_144a, 'N', 'Y'),
+        'ACCRD_INTRS_AM': '',
+        'CNVRB_FL': 'N',
+    }, columns=COLUMNS_BOND)
+
+
+#########
+# Step 2: Transactions of one day
+########
+def format_time(seconds):
+    """
+    Format seconds after midnight as a time string HHMMSS.
+    """
+    seconds = np.minimum(seconds, 24 * 3600 - 1)
+
+    return pd.Series(
+        (seconds // 3600) * 10000 + ((seconds % 3600) // 60) * 100 + seconds % 60
+    ).astype(str).str.zfill(6).values
+
+
+def get_synthetic_trades(pre_post_id, dates, n_rows, cusips, seed, rates=None, prices=None):
+    """
+    Generate synthetic raw transactions in the layout of the daily raw files. Besides the regular trade reports,
+    both sides of inter-dealer trades, as-of trades, cancellations, correction chains and reversals are added such
+    that all matching steps of the cleaning (see clean_TRACE.py) are exercised:
+        PRE:    Cancellations (C) and corrections (W) refer to the message sequence number of the original report
+                (PREV_REC_CT_NB). A correction can be corrected again. Reversals are flagged in ASOF_CD (R).
+        POST:   Cancellations (X) and corrections (C) carry the control number of the original report and a
+                correction is followed by the corrected report (R, PREV_TRD_CNTRL_NB = original control number).
+                A corrected report can be corrected again. Reversals (Y) refer to the control number of the original
+                report (PREV_TRD_CNTRL_NB).
+
+    Parameters:
+    -----------
+    pre_post_id (str): Either 'PRE' (layout prior to 06.02.2012) or 'POST'
+    dates (list): Reporting days (YYYYMMDD). Every trade is reported on a random day of the list
+    n_rows (int): Number of regular trade reports
+    cusips (np.array): CUSIP IDs of the traded bonds (ordered by trading activity, the first bonds are traded most)
+    seed (int): Seed of the random number generator
+    rates (dict): Rates of the generated transactions (see RATES, None -> RATES)
+    prices (np.array): Price level of each bond (None -> 100)
+
+    Returns:
+    --------
+    df (DataFrame): Raw transactions (all variables as strings or floats as in the raw files)
+    """
+    rates = dict(RATES, **(rates or {}))
+    rng = np.random.default_rng(seed)
+    dealers = np.array(['D{:05d}'.format(i) for i in range(500)])
+    prices = np.full(len(cusips), 100.0) if prices is None else np.asarray(prices)
+
+    # Regular trade reports
+    idx_bond = np.minimum((len(cusips) * rng.random(n_rows) ** 2).astype(int), len(cusips) - 1)
+    exctn_sec = rng.integers(8 * 3600, 17 * 3600 + 15 * 60, n_rows)
+    rpt_dt = np.array(dates, dtype='U8')[rng.integers(0, len(dates), n_rows)]
+    # As-of trades are executed up to five trading days before the reporting day
+    asof_lag = (rng.random(n_rows) < rates['asof']) * rng.integers(1, 6, n_rows)
+    exctn_dt = np.busday_offset(pd.to_datetime(rpt_dt).values.astype('datetime64[D]'), -asof_lag, roll='backward')
+    D_customer = rng.random(n_rows) < rates['customer']
+    # Retail-sized and institutional-sized trades
+    volume = np.where(rng.random(n_rows) < 0.6, rng.integers(1, 100, n_rows) * 1000.0,
+                      rng.integers(1, 50, n_rows) * 100000.0)
+    volume = np.where(rng.random(n_rows) < rates['size_error'], volume * 1e6, volume)
+    df = pd.DataFrame({
+        'CUSIP_ID': cusips[idx_bond],
+        'TRD_EXCTN_DT': format_date(exctn_dt),
+        'TRD_RPT_DT': rpt_dt,
+        'exctn_sec': exctn_sec,
+        'rpt_sec': exctn_sec + rng.integers(0, 900, n_rows),
+        'RPT_SIDE_CD': np.where(rng.random(n_rows) < 0.5, 'B', 'S'),
+        'RPTG_ID': dealers[rng.integers(0, len(dealers), n_rows)],
+        'CNTRA_ID': np.where(D_customer, 'C', dealers[rng.integers(0, len(dealers), n_rows)]),
+        'ENTRD_VOL_QT': volume,
+        'RPTD_PR': np.round(prices[idx_bond] + rng.standard_normal(n_rows), 3),
+        'TRDG_MKT_CD': np.where(rng.random(n_rows) < rates['primary'], 'P1', 'S1'),
+        'status': 'T',
+        'ASOF_CD': np.where(exctn_dt < pd.to_datetime(rpt_dt).values.astype('datetime64[D]'), 'A', ''),
+        'prev_nb': '',
+        'gvp': np.where(rng.random(n_rows) < rates['gvp'], dealers[rng.integers(0, len(dealers), n_rows)], ''),
+    })
+
+    # Both sides of inter-dealer trades (the contra party reports the opposite side)
+    df_interd = df.loc[(df.CNTRA_ID != 'C') & (rng.random(n_rows) < rates['interdealer'])].copy()
+    df_interd[['RPTG_ID', 'CNTRA_ID']] = df_interd[['CNTRA_ID', 'RPTG_ID']].values
+    df_interd['RPT_SIDE_CD'] = np.where(df_interd.RPT_SIDE_CD == 'B', 'S', 'B')
+    df_interd['rpt_sec'] = df_interd['exctn_sec'] + rng.integers(0, 900, len(df_interd))
+    df_interd['gvp'] = ''
+    df = pd.concat([df, df_interd], ignore_index=True)
+    # Message sequence numbers (pre) and control numbers (post)
+    df['nb'] = np.arange(1000000, 1000000 + len(df))
+    nb_next = 1000000 + len(df)
+
+    # Cancellations and reversals of trade reports
+    D_change = rng.random(len(df))
+    df_cancel = df.loc[D_change < rates['cancel']].copy()
+    df_reversal = df.loc[(D_change >= rates['cancel']) & (D_change < rates['cancel'] + rates['reversal'])].copy()
+    df_cancel['rpt_sec'] = df_cancel['rpt_sec'] + rng.integers(1, 600, len(df_cancel))
+    # Reversals are reported after the original report
+    df_reversal['rpt_sec'] = df_reversal['rpt_sec'] + rng.integers(60, 3600, len(df_reversal))
+    if pre_post_id == 'PRE':
+        df_cancel['status'], df_cancel['prev_nb'] = 'C', df_cancel['nb'].astype(str)
+        df_reversal['ASOF_CD'] = 'R'
+    else:
+        # Cancellations keep the control number of the original report
+        df_cancel['status'] = 'X'
+        df_reversal['status'], df_reversal['prev_nb'] = 'Y', df_reversal['nb'].astype(str)
+    if pre_post_id == 'PRE':
+        df_cancel['nb'] = np.arange(nb_next, nb_next + len(df_cancel))
+        nb_next = nb_next + len(df_cancel)
+    df_reversal['nb'] = np.arange(nb_next, nb_next + len(df_reversal))
+    nb_next = nb_next + len(df_reversal)
+    list_changes = [df_cancel, df_reversal]
+
+    # Correction chains: the corrected report can be corrected again
+    df_corrected = df.loc[(D_change >= rates['cancel'] + rates['reversal']) &
+                          (D_change < rates['cancel'] + rates['reversal'] + rates['correct'])].copy()
+    while len(df_corrected) > 0:
+        df_new = df_corrected.copy()
+        df_new['RPTD_PR'] = np.round(df_new['RPTD_PR'] + rng.choice([-0.5, 0.25, 0.5], len(df_new)), 3)
+        df_new['rpt_sec'] = df_new['rpt_sec'] + rng.integers(1, 600, len(df_new))
+        df_new['nb'] = np.arange(nb_next, nb_next + len(df_new))
+        nb_next = nb_next + len(df_new)
+        if pre_post_id == 'PRE':
+            # The correction (W) replaces the original report
+            df_new['status'], df_new['prev_nb'] = 'W', df_corrected['nb'].astype(str).values
+            list_changes.append(df_new)
+        else:
+            # The correction (C) carries the original report, the corrected report (R) follows
+            df_corr = df_corrected.copy()
+            df_corr['status'], df_corr['rpt_sec'] = 'C', df_new['rpt_sec'].values
+            df_new['status'], df_new['prev_nb'] = 'R', df_corrected['nb'].astype(str).values
+            list_changes = list_changes + [df_corr, df_new]
+        df_corrected = df_new.loc[rng.random(len(df_new)) < rates['correct_chain']]
+
+    df_changes = pd.concat(list_changes, ignore_index=True)
+    df = pd.concat([df, df_changes], ignore_index=True)
+    # Order the reports by reporting time as in the raw files
+    df = df.sort_values(['TRD_RPT_DT', 'rpt_sec', 'nb'], kind='mergesort').reset_index(drop=True)
+
+    # Bring the transactions in the layout of the raw files
+    df['TRD_EXCTN_TM'] = format_time(df['exctn_sec'].values)
+    df['TRD_RPT_TM'] = format_time(df['rpt_sec'].values)
+    # Settlement: T+3 until 05.09.2017, T+2 afterwards
+    exctn_dt = pd.to_datetime(df['TRD_EXCTN_DT']).values.astype('datetime64[D]')
+    df['TRD_STLMT_DT'] = format_date(np.busday_offset(
+        exctn_dt, np.where(exctn_dt < np.datetime64('2017-09-05'), 3, 2), roll='forward'))
+    df['YLD_PT'] = 5.0
+    df['BUY_CPCTY_CD'] = np.where(rng.random(len(df)) < 0.1, 'A', 'P')
+    df['SELL_CPCTY_CD'] = np.where(rng.random(len(df)) < 0.1, 'A', 'P')
+    df['CMSN'] = 0.0
+    df['REC_CT_NB'] = df['nb']
+    if pre_post_id == 'PRE':
+        df = df.rename(columns={'status': 'TRC_ST', 'TRD_EXCTN_TM': 'EXCTN_TM', 'RPTG_ID': 'RPTG_MKT_MP_ID',
+                                'CNTRA_ID': 'CNTRA_MP_ID', 'prev_nb': 'PREV_REC_CT_NB',
+                                'gvp': 'RPTG_SIDE_GVP_MP_ID'})
+        df = df.assign(BOND_SYM_ID='SYM', SCRTY_TYPE_CD='C', WIS_CD='N', CMSN_TRD_FL='N', BUY_CMSN_RT=df['CMSN'],
+                       SELL_CMSN_RT=df['CMSN'], DISSEM_FL='Y')
+        df = df.reindex(columns=COLUMNS_PRE_2012, fill_value='')
+    else:
+        df = df.rename(columns={'status': 'TRD_ST_CD', 'RPTG_ID': 'RPTG_PARTY_ID', 'CNTRA_ID': 'CNTRA_PARTY_ID',
+                                'prev_nb': 'PREV_TRD_CNTRL_NB', 'YLD_PT': 'CALCD_YLD_PT',
+                                'BUY_CPCTY_CD': 'BUYER_CPCTY_CD', 'SELL_CPCTY_CD': 'SLLR_CPCTY_CD',
+                                'gvp': 'RPTG_PARTY_GVP_ID'})
+        df = df.assign(ISSUE_SYM_ID='SYM', PRDCT_SBTP_CD='CORP', WIS_DSTRD_CD='N', NO_RMNRN_CD='N',
+                       BUYER_CMSN_AMT=df['CMSN'], SLLR_CMSN_AMT=df['CMSN'], PBLSH_FL='Y',
+                       SYSTM_CNTRL_DT=df['TRD_RPT_DT'], SYSTM_CNTRL_NB=df['nb'].astype(str),
+                       PREV_TRD_CNTRL_DT=np.where(df['PREV_TRD_CNTRL_NB'] != '', df['TRD_RPT_DT'], ''),
+                       FIRST_TRD_CNTRL_DT=df['TRD_RPT_DT'], FIRST_TRD_CNTRL_NB=df['nb'])
+        df = df.reindex(columns=COLUMNS_POST_2012, fill_value='')
+
+    return df
+
+
+def get_raw_file_text(df):
+    """
+    Get the content of a raw file: pipe-delimited records followed by the two trailer rows.
+    """
+    return df.to_csv(sep='|', index=False) + '0033|trailer\nRecords|{}\n'.format(len(df))
+
+
+#########
+# Step 3: Write the files
+########
+def write_day(path_raw, day, df_bonds, trades_per_day, seed, rates):
+    """
+    Generate and write the transaction file and the bond file(s) of one trading day.
+
+    Parameters:
+    -----------
+    path_raw (str): Folder of the raw TRACE data (TRACE_raw)
+    day (Timestamp): Trading day
+    df_bonds (DataFrame): Bond universe (see get_bond_universe())
+    trades_per_day (int): Average number of regular trade reports per day
+    seed (int): Seed of the day
+    rates (dict): Rates of the generated transactions (see RATES)
+
+    Returns:
+    --------
+    n_rows (int): Number of records in the transaction file
+    """
+    rng = np.random.default_rng(seed)
+    pre_post_id = 'PRE' if day.date() < DATE_REPORTING_CHANGE else 'POST'
+    path_year = path_raw + 'academic_TRACE_{}/'.format(day.year)
+    build_folders(path_year)
+
+    # Bonds that are outstanding on this day. The most active bonds are traded most often
+    df_bond_file = get_bond_file(df_bonds, day)
+    df_traded = df_bonds.loc[df_bonds['CUSIP_ID'].isin(df_bond_file['CUSIP_ID'])].sort_values(
+        'activity', ascending=False)
+    if len(df_traded) > 0:
+        df = get_synthetic_trades(pre_post_id, [day.strftime('%Y%m%d')], int(rng.poisson(trades_per_day)),
+                                  df_traded['CUSIP_ID'].values, seed, rates, df_traded['price'].values)
+    else:
+        df = pd.DataFrame(columns=COLUMNS_PRE_2012 if pre_post_id == 'PRE' else COLUMNS_POST_2012)
+    with open(path_year + '0033-corp-academic-trace-data-{}.txt'.format(day.strftime('%Y-%m-%d')), 'w') as f:
+        f.write(get_raw_file_text(df))
+
+    # After the reporting change, the 144A bonds are listed in the supplemental bond file
+    if pre_post_id == 'PRE':
+        df_bond_basic, df_bond_supp = df_bond_file, None
+    else:
+        df_bond_basic = df_bond_file.loc[df_bond_file['RULE_144A_FL'] == 'N']
+        df_bond_supp = df_bond_file.loc[df_bond_file['RULE_144A_FL'] == 'Y']
+    with open(path_year + '0033-corp-bond-{}.txt'.format(day.strftime('%Y-%m-%d')), 'w') as f:
+        f.write(get_raw_file_text(df_bond_basic))
+    if df_bond_supp is not None:
+        with open(path_year + '0033-corp-bond-supplemental-{}.txt'.format(day.strftime('%Y-%m-%d')), 'w') as f:
+            f.write(get_raw_file_text(df_bond_supp))
+
+    return len(df)
+
+
+def generate_synthetic_data(project_path, start_date, end_date, trades_per_day=1000, n_bonds=2000, rates=None,
+                            N_workers=1, seed=0, overwrite=False):
+    """
+    Generate the synthetic raw TRACE data (daily transaction and bond files) and the MERGENT FISD data of a
+    project. The days are generated in parallel. Every day has its own seed, thus the output only depends on the
+    arguments and not on the number of workers.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path (the data is written to src/original_data)
+    start_date (str): First day (YYYY-MM-DD)
+    end_date (str): Last day (YYYY-MM-DD)
+    trades_per_day (int): Average number of regular trade reports per day (before the inter-dealer duplicates,
+                          cancellations, corrections and reversals)
+    n_bonds (int): Number of bonds in the universe
+    rates (dict): Rates of the generated transactions (see RATES, None -> RATES)
+    N_workers (int): Number of worker processes (-1 -> use all available cores)
+    seed (int): Seed of the random number generator
+    overwrite (bool): Delete existing raw TRACE data of the project first (otherwise an error is raised)
+
+    Returns:
+    --------
+    df_summary (DataFrame): Number of files and records per year
+    """
+    path_raw = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    path_mergent = project_path + '/src/original_data/Mergent_FISD/'
+    trading_days = get_trading_days(start_date, end_date)
+    if len(trading_days) == 0:
+        raise ValueError('There is no trading day between {} and {}'.format(start_date, end_date))
+    # read_2012() in read_TRACE.py expects the 23 trading days before the reporting change in the 2012 folder
+    days_2012 = trading_days[trading_days.year == 2012]
+    if (len(days_2012) > 0) and (days_2012[0] > pd.Timestamp('2012-01-03')):
+        raise ValueError('If the sample contains 2012, it has to start on 2012-01-03 or earlier (the reading-in step '
+                         'expects all trading days before the reporting change in the 2012 folder)')
+    # Do not mix the synthetic data with existing data
+    if os.path.isdir(path_raw) and (len([f for f in os.listdir(path_raw) if not f.startswith('.')]) > 0):
+        if overwrite == False:
+            raise ValueError('The folder {} is not empty. Use an empty project folder or set overwrite=True'.format(
+                path_raw))
+        for fld in [f for f in os.listdir(path_raw) if f.startswith('academic_TRACE_')]:
+            for f in os.listdir(path_raw + fld):
+                os.remove(path_raw + fld + '/' + f)
+            os.rmdir(path_raw + fld)
+    build_folders(path_raw)
+    build_folders(path_mergent)
+
+    # Bond universe and MERGENT FISD data
+    df_bonds = get_bond_universe(n_bonds, start_date, end_date, seed)
+    get_issue_data(df_bonds).to_pickle(path_mergent + 'issue_data.pkl')
+    get_ratings(df_bonds, end_date, seed).to_pickle(path_mergent + 'ratings.pkl')
+    print('Generated the MERGENT FISD data of {} bonds'.format(len(df_bonds)))
+
+    # Daily files (one task per day)
+    print('Generating {} trading days from {} to {}'.format(len(trading_days), trading_days[0].date(),
+                                                           trading_days[-1].date()))
+    list_n_rows = Parallel(n_jobs=N_workers)(
+        delayed(write_day)(path_raw, day, df_bonds, trades_per_day, seed * 1000003 + day.toordinal(), rates)
+        for day in trading_days
+    )
+    df_summary = pd.DataFrame({'year': trading_days.year, 'n_files': 1, 'n_records': list_n_rows}).groupby(
+        'year').sum()
+    print(df_summary.to_string())
+
+    return df_summary
@@ -0,0 +1,189 @@
+"""
+Guard the joins of the build against blow-ups. A join on keys that are duplicated on both sides (e.g. the
+reversal matching in prior_2012_clean(), the self-merge of the inter-dealer trades in del_interd_transact() or the
+issue data with duplicate CUSIPs) can multiply the number of rows and exhaust the memory before the result exists.
+Every join of the build is therefore run through guarded_merge(), which estimates the size of the result before
+the join. The steps are as follows:
+    Step 1:     Estimate the number of rows of the result from a sample of the keys of both sides (hashed keys of
+                the sampled rows only, no copy of the data). The key counts of the right sample are scaled to the
+                size of the right side.
+    Step 2:     Compare the estimate with the limits (rows per left row and share of the available memory) and
+                either run the join, warn and run it or abort with a report of the most duplicated keys before the
+                result is allocated.
+
+Note: The estimate is unbiased but noisy for keys that are rare on the right side. The settings are taken from
+dataset_specs['join_guard'] (see specs.py and settings_TRACE.py).
+"""
+
+import numpy as np
+import pandas as pd
+
+# Import the /proc reader and the formatting of byte counts
+from telemetry_TRACE import read_proc_file, format_bytes
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+# Joins with fewer rows on both sides together are not checked
+MIN_ROWS_GUARD = 100000
+# Number of rows of each side whose keys are sampled
+SAMPLE_SIZE = 100000
+# Number of most duplicated keys shown in the report
+N_REPORT_KEYS = 5
+
+
+#########
+# Step 1: Estimate the size of the result
+########
+def hash_keys(df, keys):
+    """
+    Hash the key columns of every row to one unsigned 64-bit integer.
+    """
+    return pd.util.hash_pandas_object(df[keys], index=False).values
+
+
+def sample_keys(df, keys, rng):
+    """
+    Get the key columns of a sample of SAMPLE_SIZE rows (all rows of a smaller DataFrame).
+    """
+    if len(df) > SAMPLE_SIZE:
+        return df[keys].iloc[np.sort(rng.choice(len(df), SAMPLE_SIZE, replace=False))]
+
+    return df[keys]
+
+
+def estimate_join_size(left, right, left_on, right_on, how):
+    """
+    Estimate the number of rows and the memory of the result of a join from a sample of both sides (SAMPLE_SIZE rows
+    each). The number of right rows per key is the count in the right sample scaled to the size of the right side.
+
+    Parameters:
+    -----------
+    left (DataFrame): Left side of the join
+    right (DataFrame): Right side of the join
+    left_on (list): Key columns of the left side
+    right_on (list): Key columns of the right side
+    how (str): Type of the join ('inner' or 'left')
+
+    Returns:
+    --------
+    estimate (dict): Rows of both sides, estimated rows ('rows') and bytes ('bytes') of the result, rows of the
+                     result per left row ('fanout'), estimated largest number of right rows per key
+                     ('max_key_count') and the most duplicated keys of the sample ('top_keys')
+    """
+    rng = np.random.default_rng(0)
+    right_sample = sample_keys(right, right_on, rng)
+    right_scale = len(right) / max(len(right_sample), 1)
+    right_keys, right_counts = np.unique(hash_keys(right_sample, right_on), return_counts=True)
+    left_sample = sample_keys(left, left_on, rng)
+    left_hash = hash_keys(left_sample, left_on)
+    # Estimated number of right rows per sampled left row
+    pos = np.clip(np.searchsorted(right_keys, left_hash), 0, max(len(right_keys) - 1, 0))
+    if len(right_keys) > 0:
+        counts = np.where(right_keys[pos] == left_hash, right_counts[pos], 0) * right_scale
+    else:
+        counts = np.zeros(len(left_hash))
+    rows = int(counts.mean() * len(left)) if len(counts) > 0 else 0
+    if how == 'left':
+        # Left rows without a match are kept once. Their number cannot be estimated from two samples, the estimate is
+        # therefore a lower bound of at least half of the result
+        rows = max(rows, len(left))
+
+    # Bytes per row of the result: all columns of the left side and the non-key columns of the right side
+    left_bytes = left.memory_usage(index=False, deep=False).sum() / max(len(left), 1)
+    right_bytes = right.drop(columns=[c for c in right_on if c in left_on]).memory_usage(
+        index=False, deep=False).sum() / max(len(right), 1)
+    # Most duplicated distinct keys among the sampled left rows
+    _, first_pos = np.unique(left_hash, return_index=True)
+    top = first_pos[np.argsort(-counts[first_pos], kind='stable')][:N_REPORT_KEYS]
+    top_keys = [[str(v) for v in left_sample.iloc[i].values] + [int(round(counts[i]))] for i in top if counts[i] > 1]
+
+    estimate = {
+        'left_rows': len(left),
+        'right_rows': len(right),
+        'rows': rows,
+        'bytes': rows * (left_bytes + right_bytes),
+        'fanout': rows / max(len(left), 1),
+        'max_key_count': int(round(right_counts.max() * right_scale)) if len(right_counts) > 0 else 0,
+        'top_keys': top_keys,
+    }
+
+    return estimate
+
+
+def format_join_report(name, estimate, keys):
+    """
+    Format the estimate of a join as a report (see estimate_join_size()).
+    """
+    report = ('JOIN GUARD {}: {:,} x {:,} rows -> estimated {:,} rows ({:.1f} per left row, {}), about {:,} right '
+              'rows for the most frequent key'.format(name, estimate['left_rows'], estimate['right_rows'],
+                                                       estimate['rows'], estimate['fanout'],
+                                                       format_bytes(estimate['bytes']), estimate['max_key_count']))
+    if len(estimate['top_keys']) > 0:
+        report = report + '\n    Most duplicated keys ({} -> matches):'.format(', '.join(keys))
+        for key in estimate['top_keys']:
+            report = report + '\n        {} -> {:,}'.format(' | '.join(key[:-1]), key[-1])
+
+    return report
+
+
+#########
+# Step 2: Run the join
+########
+def guarded_merge(left, right, name, on=None, left_on=None, right_on=None, how='inner', settings=None, **kwargs):
+    """
+    Join two DataFrames like DataFrame.merge() after checking the estimated size of the result against the settings
+    of the guard (dataset_specs['join_guard']).
+
+    Parameters:
+    -----------
+    left (DataFrame): Left side of the join
+    right (DataFrame): Right side of the join
+    name (str): Name of the join in the reports (e.g. 'prior_2012_clean: reversal2')
+    on (str or list): Key columns of both sides
+    left_on (str or list): Key columns of the left side
+    right_on (str or list): Key columns of the right side
+    how (str): Type of the join ('inner' or 'left')
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+    kwargs: Further arguments of DataFrame.merge() (e.g. suffixes)
+
+    Returns:
+    --------
+    df_merge (DataFrame): Result of the join
+    """
+    # Pass the keys on as given, DataFrame.merge() keeps only one copy of the key columns with on
+    if on is not None:
+        kwargs['on'] = on
+        left_on = on
+        right_on = on
+    else:
+        kwargs['left_on'] = left_on
+        kwargs['right_on'] = right_on
+    if isinstance(left_on, str):
+        left_on = [left_on]
+    if isinstance(right_on, str):
+        right_on = [right_on]
+    if (len(left) + len(right) < MIN_ROWS_GUARD) | (how not in ['inner', 'left']):
+        return left.merge(right, how=how, **kwargs)
+
+    if settings is None:
+        settings = get_settings()
+    join_guard = settings['join_guard']
+    estimate = estimate_join_size(left, right, left_on, right_on, how)
+    memory_available = read_proc_file('/proc/meminfo', ['MemAvailable'])['MemAvailable']
+    if (memory_available is not None) and \
+            (estimate['bytes'] > join_guard['max_memory_share'] * memory_available * 1024):
+        raise MemoryError('{}\nThe result does not fit into {:.0%} of the available memory ({}). Check the keys of '
+                          'the join for duplicates.'.format(format_join_report(name, estimate, left_on),
+                                                            join_guard['max_memory_share'],
+                                                            format_bytes(memory_available * 1024)))
+    if estimate['fanout'] <= join_guard['max_fanout']:
+        return left.merge(right, how=how, **kwargs)
+
+    report = format_join_report(name, estimate, left_on)
+    if join_guard['action'] == 'abort':
+        raise MemoryError('{}\nThe join exceeds {} rows per left row. Check the keys of the join for duplicates or '
+                          'set dataset_specs[\'join_guard\'][\'action\'] to \'warn\'.'.format(
+                              report, join_guard['max_fanout']))
+    print('WARNING: {}'.format(report))
+
+    return left.merge(right, how=how, **kwargs)
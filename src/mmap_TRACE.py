@@ -0,0 +1,199 @@
+"""
+Store the final TRACE dataset in a memory-mapped columnar layout (TRACE_final.mmap). Reading the compressed dataset
+(see storage_TRACE.py) decodes the data into new memory in every process, i.e. every analyst session on a server
+holds its own copy of the final dataset. The memory-mapped layout is uncompressed and fixed-width, such that a
+process maps the files instead of reading them: opening the dataset takes no time and all processes share the same
+pages of the page cache. The steps are as follows:
+    Step 1:     Write every column as an uncompressed NumPy file (write_mmap_final()): numeric and datetime columns as
+                they are, nullable integer columns as values plus missing mask and string and date columns as
+                categorical codes plus their dictionary (the distinct values as fixed-width strings or dates).
+    Step 2:     Open the layout (open_mmap_final()). The columns of the DataFrame are read-only views of the mapped
+                files, only the small dictionaries are loaded into the memory of the process.
+
+Note: The string and date columns are returned as categoricals (e.g. use df['cusip_id'].astype(str) to get objects)
+and the DataFrame is read-only, i.e. it has to be copied before it is changed in place. The layout is written with
+the final dataset if dataset_specs['storage']['mmap_final'] is True (see specs.py). A process that still has the
+old layout open after a new build keeps reading the old files.
+"""
+
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Import the replacement of a folder
+from storage_TRACE import replace_folder
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+# Description of the columns in the layout folder
+LAYOUT_FILE = '_layout.json'
+
+
+def get_mmap_path(path):
+    """
+    Get the folder of the memory-mapped layout of an output (e.g. TRACE_final.pkl -> TRACE_final.mmap).
+    """
+    return os.path.splitext(path)[0] + '.mmap'
+
+
+#########
+# Step 1: Write the layout
+########
+def get_column_layout(values):
+    """
+    Get the arrays that represent a column in the layout.
+
+    Parameters:
+    -----------
+    values (array): Values of the column (NumPy array or pandas extension array)
+
+    Returns:
+    --------
+    kind (str): 'numpy' (values), 'masked' (values and missing mask) or 'categorical' (codes and dictionary)
+    arrays (dict): Arrays of the column
+    """
+    if isinstance(values, np.ndarray) and (values.dtype != object):
+        return 'numpy', {'values': values}
+    if isinstance(values, pd.arrays.IntegerArray) or isinstance(values, pd.arrays.FloatingArray) or \
+            isinstance(values, pd.arrays.BooleanArray):
+        return 'masked', {'values': values._data, 'mask': values._mask}
+
+    # Strings and dates are encoded as codes of a sorted dictionary. The codes have the integer type pandas uses for
+    # the number of distinct values, such that the categorical is built on the mapped codes without a copy
+    if not isinstance(values, pd.Categorical):
+        values = pd.Categorical(values)
+    categories = values.categories
+    if categories.inferred_type in ['string', 'empty']:
+        dictionary = np.array(categories, dtype=str)
+    elif categories.inferred_type == 'date':
+        dictionary = np.array(categories, dtype='datetime64[D]')
+    elif categories.dtype != object:
+        dictionary = categories.values
+    else:
+        raise ValueError('The column type {} cannot be stored in the memory-mapped layout'.format(
+            categories.inferred_type))
+
+    return 'categorical', {'codes': values.codes, 'dictionary': dictionary}
+
+
+def write_mmap_final(df, mmap_path):
+    """
+    Write a DataFrame in the memory-mapped layout: one uncompressed NumPy file per array of a column and the
+    description of the columns (see get_column_layout()).
+
+    Parameters:
+    -----------
+    df (DataFrame): Final dataset
+    mmap_path (str): Folder of the layout
+    """
+    path_tmp = os.path.join(os.path.dirname(mmap_path), 'tmp_' + os.path.basename(mmap_path))
+    if os.path.isdir(path_tmp):
+        shutil.rmtree(path_tmp)
+    os.makedirs(path_tmp)
+
+    layout = {'n_rows': len(df), 'columns': [], 'attrs': df.attrs}
+    if isinstance(df.index, pd.RangeIndex) and (df.index.start == 0) and (df.index.step == 1):
+        layout['index'] = None
+    else:
+        np.save(path_tmp + '/index.npy', np.ascontiguousarray(df.index.values))
+        layout['index'] = {'file': 'index.npy', 'name': df.index.name}
+    for i, col in enumerate(df.columns):
+        values = df[col].values if isinstance(df[col].dtype, np.dtype) else df[col].array
+        kind, arrays = get_column_layout(values)
+        files = {}
+        for name, array in arrays.items():
+            # The files are numbered, such that any column name can be stored
+            files[name] = '{}_{}.npy'.format(i, name)
+            # The view drops the (empty) dtype metadata pandas attaches to datetime arrays, which NumPy warns about
+            array = np.ascontiguousarray(array)
+            np.save(path_tmp + '/' + files[name], array.view(np.dtype(array.dtype.str)))
+        layout['columns'].append({'name': col, 'kind': kind, 'files': files, 'dtype': str(df[col].dtype)})
+    with open(path_tmp + '/' + LAYOUT_FILE, 'w') as f:
+        json.dump(layout, f, indent=2)
+
+    replace_folder(path_tmp, mmap_path)
+
+
+def store_mmap_final(df, path, settings=None):
+    """
+    Store the final dataset in the memory-mapped layout if dataset_specs['storage']['mmap_final'] is set. Otherwise,
+    a layout of an earlier build is deleted, such that it never differs from the final dataset.
+
+    Parameters:
+    -----------
+    df (DataFrame): Final dataset
+    path (str): Path of the final dataset (TRACE_final.pkl)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+    """
+    if settings is None:
+        settings = get_settings()
+    if settings['storage']['mmap_final']:
+        print('Saving the memory-mapped layout of the final dataset has started')
+        write_mmap_final(df, get_mmap_path(path))
+    elif os.path.isdir(get_mmap_path(path)):
+        shutil.rmtree(get_mmap_path(path))
+
+
+#########
+# Step 2: Open the layout
+########
+def to_categorical(codes, dictionary):
+    """
+    Build a categorical on the mapped codes without copying them.
+    """
+    if dictionary.dtype.kind == 'M':
+        # Dates are returned as datetime.date like in the final dataset
+        dictionary = dictionary.astype(object)
+    dtype = pd.CategoricalDtype(pd.Index(dictionary))
+    try:
+        return pd.Categorical.from_codes(codes, dtype=dtype, validate=False)
+    except TypeError:
+        # pandas < 2.1 validates (and copies) the codes in from_codes()
+        return pd.Categorical(codes, dtype=dtype, fastpath=True)
+
+
+def open_mmap_final(mmap_path, columns=None):
+    """
+    Open the memory-mapped layout of the final dataset. The columns are read-only views of the mapped files.
+
+    Parameters:
+    -----------
+    mmap_path (str): Folder of the layout
+    columns (list): Columns to open (None -> all columns)
+
+    Returns:
+    --------
+    df (DataFrame): Final dataset (string and date columns as categoricals)
+    """
+    with open(mmap_path + '/' + LAYOUT_FILE, 'r') as f:
+        layout = json.load(f)
+    dict_layout = {c['name']: c for c in layout['columns']}
+    if columns is None:
+        columns = [c['name'] for c in layout['columns']]
+    missing = [c for c in columns if c not in dict_layout]
+    if len(missing) > 0:
+        raise KeyError('The columns {} are not in the final dataset'.format(', '.join(missing)))
+
+    dict_columns = {}
+    for col in columns:
+        col_layout = dict_layout[col]
+        arrays = {name: np.load(mmap_path + '/' + f, mmap_mode='r', allow_pickle=False)
+                  for name, f in col_layout['files'].items()}
+        if col_layout['kind'] == 'numpy':
+            dict_columns[col] = arrays['values']
+        elif col_layout['kind'] == 'masked':
+            array_type = pd.api.types.pandas_dtype(col_layout['dtype']).construct_array_type()
+            dict_columns[col] = array_type(arrays['values'], arrays['mask'])
+        else:
+            dict_columns[col] = to_categorical(arrays['codes'], np.asarray(arrays['dictionary']))
+    if layout['index'] is None:
+        index = pd.RangeIndex(layout['n_rows'])
+    else:
+        index = pd.Index(np.load(mmap_path + '/' + layout['index']['file'], mmap_mode='r'),
+                         name=layout['index']['name'], copy=False)
+    df = pd.DataFrame(dict_columns, index=index, columns=columns, copy=False)
+    df.attrs = layout['attrs']
+
+    return df
@@ -0,0 +1,486 @@
+"""
+Run the steps from the concatenation of the yearly data up to the event time variables (define_event_time_week())
+within a given memory budget. Instead of one DataFrame containing the entire sample, the data is stored in shards
+on the local disk and processed shard by shard. The steps are as follows:
+    Step 1:     Determine the partition sizes. The size of the merged sample is estimated from the size of the
+                yearly files and the number of hash buckets is chosen such that one bucket is well below the
+                memory budget. The number of CUSIP slices is chosen such that the merging of one slice of the
+                largest year fits into the memory budget.
+    Step 2:     Concatenate and merge the yearly data slice by slice (see concatenate_merge_TRACE_MERGENT.py), i.e.
+                every year is read only for the CUSIPs of one slice (the CUSIP filter is pushed down to the stored
+                yearly datasets), and spill every merged slice immediately to the hash buckets on disk. All
+                transactions of a bond (CUSIP) are in the same bucket and every bucket belongs to one slice. The
+                buckets that are larger than a shard are split with a finer hash and the buckets are then packed
+                into shards that fit into the memory budget. The build stops with a MemoryError if a bucket still
+                does not fit into the memory budget (e.g. the transactions of a single bond).
+    Step 3:     Apply all cleaning steps and the variable creation shard by shard (see clean_merged_shard() in
+                process_TRACE.py).
+    Step 4:     Define the event time tables from the distinct trading dates of all shards (the only global step)
+                and add the event time variables shard by shard. The final dataset is stored as one file per shard
+                (TRACE_final_<shard>.pkl) as the full dataset does not necessarily fit into memory.
+
+Note: The final dataset contains the identical transactions as the in-memory build, but the rows are ordered by
+shard.
+"""
+
+import gc
+import math
+import os
+import sys
+import pandas as pd
+pd.options.mode.chained_assignment = None
+# The resource module is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Import the loop over the merged yearly data and the bond selection
+from concatenate_merge_TRACE_MERGENT import iter_merged_data
+from read_TRACE import select_bonds
+# Import the background writer of the buckets (see async_io_TRACE.py)
+from async_io_TRACE import write_pickle_async, wait_for_writes
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import store_frame, load_frame, get_frame_bytes
+# Import the partition loader, the CUSIP hash and the cleaning steps of one shard
+from process_TRACE import load_partition, get_cusip_bucket, clean_merged_shard, remove_final_files
+# Import the event time definition
+from prepare_variables import get_event_time_dates, get_event_time_tables, add_event_time_vars
+# Import the settings of the build (see settings_TRACE.py)
+from settings_TRACE import get_settings
+
+# Ratio of the peak memory of the cleaning steps to the in-memory size of one shard. Every cleaning step copies its
+# input and the inter-dealer matching merges the data with itself.
+MEMORY_FACTOR_CLEANING = 6
+# Ratio of the in-memory size of the merged data to the size of the yearly pickle files (the merged data contains
+# the rating, issue and bond info variables). For the yearly datasets, the size of their pickle is estimated (see
+# get_frame_bytes() of storage_TRACE.py)
+MEMORY_FACTOR_MERGE = 2
+# Number of hash buckets per shard. More buckets allow a more even packing of the buckets into shards.
+BUCKETS_PER_SHARD = 4
+
+
+#########
+# Step 1: Memory budget and partition sizes
+########
+def parse_memory_size(memory_size):
+    """
+    Convert a memory size such as '32G', '512M' or '1.5T' to bytes.
+
+    Parameters:
+    -----------
+    memory_size (str): Memory size. The unit (K, M, G or T) is optional (default: bytes)
+
+    Returns:
+    --------
+    memory_bytes (int): Memory size in bytes
+    """
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    memory_size = str(memory_size).strip().upper().rstrip('B')
+    if memory_size[-1] in units:
+        memory_bytes = int(float(memory_size[:-1]) * units[memory_size[-1]])
+    else:
+        memory_bytes = int(float(memory_size))
+    if memory_bytes <= 0:
+        raise ValueError('The memory budget has to be positive: {}'.format(memory_size))
+
+    return memory_bytes
+
+
+def get_yearly_file_sizes(path, dict_spec):
+    """
+    Get the size of all yearly cleaned TRACE files in the sample period (see get_frame_bytes() of storage_TRACE.py).
+
+    Parameters:
+    -----------
+    path (str): Project root path
+    dict_spec (dict): Final dataset specifications
+
+    Returns:
+    --------
+    dict_sizes (dict): File name and size in bytes of every yearly file
+    """
+    dict_sizes = {}
+    for year in range(dict_spec['sample_time_span'][1], dict_spec['sample_time_span'][0]-1, -1):
+        if year == 2012:
+            file_names = ['TRACE_clean_2012_post.pkl', 'TRACE_clean_2012_prior.pkl']
+        else:
+            file_names = ['TRACE_clean_{}.pkl'.format(year)]
+        for f in file_names:
+            dict_sizes[f] = get_frame_bytes(path + '/bld/data/TRACE/TRACE_raw_clean/' + f)
+
+    return dict_sizes
+
+
+def get_n_slices(year_bytes, max_memory):
+    """
+    Choose the number of CUSIP slices such that the merging of one slice of the largest year fits into the memory
+    budget. The merging holds the transactions and the merged data of one slice in memory.
+
+    Parameters:
+    -----------
+    year_bytes (int): Size of the largest yearly file in bytes
+    max_memory (int): Memory budget in bytes
+
+    Returns:
+    --------
+    n_slices (int): Number of CUSIP slices
+    """
+    return max(1, math.ceil(year_bytes * MEMORY_FACTOR_MERGE * 2 / max_memory))
+
+
+def get_n_buckets(path, dict_spec, max_memory):
+    """
+    Choose the number of hash buckets such that the shards fit into the memory budget and the number of CUSIP slices
+    such that the merging of every slice fits into the memory budget.
+
+    Parameters:
+    -----------
+    path (str): Project root path
+    dict_spec (dict): Final dataset specifications
+    max_memory (int): Memory budget in bytes
+
+    Returns:
+    --------
+    n_buckets (int): Number of hash buckets
+    n_slices (int): Number of CUSIP slices
+    """
+    dict_sizes = get_yearly_file_sizes(path, dict_spec)
+    # Estimated size of the merged sample in memory
+    merged_bytes = sum(dict_sizes.values()) * MEMORY_FACTOR_MERGE
+    # Target size of one shard in memory
+    shard_bytes = max_memory / MEMORY_FACTOR_CLEANING
+    n_shards = max(1, math.ceil(merged_bytes / shard_bytes))
+
+    # The concatenation step merges one slice of a year at a time in memory. The number of buckets is a multiple of
+    # the number of slices, i.e. every bucket belongs to one slice
+    n_slices = get_n_slices(max(dict_sizes.values()), max_memory)
+    n_buckets = math.ceil(n_shards * BUCKETS_PER_SHARD / n_slices) * n_slices
+
+    return n_buckets, n_slices
+
+
+def pack_buckets(bucket_sizes, shard_bytes):
+    """
+    Pack the hash buckets into shards such that every shard is at most shard_bytes large (first-fit decreasing). A
+    bucket that is larger than shard_bytes is a shard on its own.
+
+    Parameters:
+    -----------
+    bucket_sizes (dict): Size in bytes of every bucket
+    shard_bytes (float): Target size of one shard in bytes
+
+    Returns:
+    --------
+    shards (list): List of lists with the buckets of every shard
+    """
+    shards = []
+    shard_sizes = []
+    for bucket, size in sorted(bucket_sizes.items(), key=lambda x: -x[1]):
+        for i in range(len(shards)):
+            if shard_sizes[i] + size <= shard_bytes:
+                shards[i].append(bucket)
+                shard_sizes[i] = shard_sizes[i] + size
+                break
+        else:
+            shards.append([bucket])
+            shard_sizes.append(size)
+
+    return shards
+
+
+def get_peak_memory():
+    """
+    Get the peak resident memory of the current process in bytes.
+
+    Returns:
+    --------
+    peak_memory (int): Peak resident set size in bytes (0 if not available)
+    """
+    if resource is None:
+        return 0
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports the peak memory in KB, macOS in bytes
+    if sys.platform != 'darwin':
+        peak_memory = peak_memory * 1024
+
+    return peak_memory
+
+
+#########
+# Step 2: Spill the merged data to the hash buckets
+########
+def write_cusip_buckets(project_path, dataset_specs, n_buckets, settings, n_slices=1, cusip_subset=None):
+    """
+    Concatenate and merge the yearly data slice by slice and spill every merged slice of a year immediately to the
+    hash buckets on disk. Every yearly file contributes one part file to each bucket.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    n_buckets (int): Number of hash buckets (a multiple of n_slices)
+    settings (dict): Settings of the build (see settings_TRACE.py)
+    n_slices (int): Number of CUSIP slices in which every year is read and merged
+    cusip_subset (list): Optional. Only concatenate and merge the transactions of these CUSIPs
+
+    Returns:
+    --------
+    bucket_sizes (dict): In-memory size in bytes of every bucket
+    """
+    path_partitions = project_path + '/bld/data/TRACE/TRACE_partitions/'
+    # Delete the partitions of previous runs
+    for f in os.listdir(path_partitions):
+        if f.startswith('TRACE_'):
+            os.remove(path_partitions + f)
+
+    # Split the selected bonds into slices. As n_slices divides n_buckets, the slice of a CUSIP is determined by its
+    # bucket, i.e. the part files of a bucket are in the order of the years
+    if n_slices == 1:
+        cusip_slices = [cusip_subset]
+    else:
+        cusips = select_bonds(project_path).drop_duplicates()
+        if cusip_subset is not None:
+            cusips = cusips.loc[cusips.isin(cusip_subset)]
+        cusip_slice = get_cusip_bucket(cusips, n_slices)
+        cusip_slices = [list(cusips.loc[cusip_slice == i]) for i in range(n_slices)]
+
+    bucket_sizes = {}
+    k = 0
+    for i, cusips in enumerate(cusip_slices):
+        if n_slices > 1:
+            if len(cusips) == 0:
+                continue
+            print('Merging the CUSIP slice {} of {}'.format(i + 1, n_slices))
+        for df_year in iter_merged_data(project_path, dataset_specs, cusips, settings):
+            bucket = get_cusip_bucket(df_year['CUSIP_ID'], n_buckets)
+            for b, df_part in df_year.groupby(bucket):
+                bucket_sizes[b] = bucket_sizes.get(b, 0) + df_part.memory_usage(deep=True).sum()
+                write_pickle_async(df_part, path_partitions + 'TRACE_bucket_{}_{}.pkl'.format(b, k), settings)
+            k = k + 1
+            del [df_year]
+            gc.collect()
+    # Wait until the background writer has stored all buckets
+    wait_for_writes()
+
+    return bucket_sizes
+
+
+def split_large_buckets(project_path, bucket_sizes, n_buckets, shard_bytes, settings):
+    """
+    Split the buckets that are larger than a shard into smaller buckets with a finer CUSIP hash (the estimate of the
+    merged data from the yearly files can be too small). The part files of a bucket are split one after the other,
+    i.e. a large bucket is never loaded as a whole. The transactions of a bond stay in the same bucket.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    bucket_sizes (dict): In-memory size in bytes of every bucket
+    n_buckets (int): Number of hash buckets
+    shard_bytes (float): Target size of one shard in bytes
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    bucket_sizes (dict): In-memory size in bytes of every bucket after the split
+    """
+    path_partitions = project_path + '/bld/data/TRACE/TRACE_partitions/'
+    large_buckets = [b for b, size in bucket_sizes.items() if size > shard_bytes]
+    if len(large_buckets) == 0:
+        return bucket_sizes
+
+    bucket_sizes = dict(bucket_sizes)
+    # The new buckets are numbered after the buckets of the hash
+    next_bucket = n_buckets
+    for b in large_buckets:
+        # Split into twice as many buckets as necessary, the hash of a few CUSIPs is not even
+        n_split = 2 * math.ceil(bucket_sizes.pop(b) / shard_bytes)
+        part_files = sorted([f for f in os.listdir(path_partitions) if f.startswith('TRACE_bucket_{}_'.format(b))],
+                            key=lambda f: int(f[:-4].split('_')[-1]))
+        new_buckets = {}
+        for f in part_files:
+            df_part = pd.read_pickle(path_partitions + f)
+            k = int(f[:-4].split('_')[-1])
+            # All CUSIPs of the bucket have the same hash modulo n_buckets, i.e. they are in n_split finer buckets
+            for b_fine, df_fine in df_part.groupby(get_cusip_bucket(df_part['CUSIP_ID'], n_buckets * n_split)):
+                if b_fine not in new_buckets:
+                    new_buckets[b_fine] = next_bucket
+                    next_bucket = next_bucket + 1
+                b_new = new_buckets[b_fine]
+                bucket_sizes[b_new] = bucket_sizes.get(b_new, 0) + df_fine.memory_usage(deep=True).sum()
+                write_pickle_async(df_fine, path_partitions + 'TRACE_bucket_{}_{}.pkl'.format(b_new, k), settings)
+            os.remove(path_partitions + f)
+            del [df_part]
+            gc.collect()
+    wait_for_writes()
+    print('STEP 2: {} buckets were larger than a shard and are split into {} buckets'.format(
+        len(large_buckets), next_bucket - n_buckets))
+
+    return bucket_sizes
+
+
+#########
+# Step 3 and 4: Clean the shards and add the event time
+########
+def load_shard(project_path, partition_name, shard):
+    """
+    Load all buckets of one shard.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    partition_name (str): Name of the partition (e.g. 'TRACE_bucket')
+    shard (list): Buckets of the shard
+
+    Returns:
+    --------
+    df_shard (DataFrame): Data of the shard
+    """
+    df_shard = pd.concat([load_partition(project_path, partition_name, b) for b in shard])
+
+    return df_shard
+
+
+def clean_shard(project_path, dataset_specs, shard, shard_id, settings):
+    """
+    Apply all cleaning steps and the variable creation to one shard and store the result on disk.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    shard (list): Buckets of the shard
+    shard_id (int): Identifier of the shard
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    df_dates (DataFrame): Distinct trading dates of the shard (necessary to define the event time tables). None if
+                          no transaction of the shard survives the cleaning.
+    """
+    path_partitions = project_path + '/bld/data/TRACE/TRACE_partitions/'
+    df_shard = load_shard(project_path, 'TRACE_bucket', shard)
+    if len(df_shard) == 0:
+        return None
+    df_shard = clean_merged_shard(df_shard, project_path, dataset_specs, settings)
+    if len(df_shard) == 0:
+        return None
+    df_shard.to_pickle(path_partitions + 'TRACE_cleaned_{}_0.pkl'.format(shard_id))
+    df_dates = get_event_time_dates(df_shard)
+
+    return df_dates
+
+
+def finalize_shard(project_path, shard_id, event_day_tmp, event_week_tmp, settings):
+    """
+    Add the event time variables to one cleaned shard and store it as part of the final dataset.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    shard_id (int): Identifier of the shard
+    event_day_tmp (DataFrame): Event day per trading date (see get_event_time_tables())
+    event_week_tmp (DataFrame): Event week per quarter and week (see get_event_time_tables())
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    N_trnsct (int): Number of transactions in the final shard
+    """
+    df_shard = load_partition(project_path, 'TRACE_cleaned', shard_id)
+    df_shard = add_event_time_vars(df_shard, event_day_tmp, event_week_tmp, settings)
+    store_frame(df_shard, project_path + '/bld/data/TRACE/TRACE_final_clean/TRACE_final_{}.pkl'.format(shard_id),
+                settings)
+
+    return len(df_shard)
+
+
+def build_TRACE_out_of_core(project_path, dataset_specs, max_memory, settings=None):
+    """
+    Run all steps from the concatenation of the yearly data to the event time variables within the memory budget
+    (see the description at the top).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    max_memory (int): Memory budget in bytes
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs)
+
+    Returns:
+    --------
+    final_files (list): Paths of the files of the final dataset
+    """
+    if settings is None:
+        settings = get_settings(dataset_specs)
+    # Step 1: Determine the partition sizes
+    n_buckets, n_slices = get_n_buckets(project_path, dataset_specs, max_memory)
+    print("")
+    print('STEP 2: Out-of-core mode with a memory budget of {:.1f} GB: the data is merged in {} CUSIP slices and '
+          'spilled to {} hash buckets'.format(max_memory / 1024**3, n_slices, n_buckets))
+
+    # Step 2: Concatenate and merge the yearly data slice by slice and spill the merged data to the hash buckets
+    bucket_sizes = write_cusip_buckets(project_path, dataset_specs, n_buckets, settings, n_slices)
+    bucket_sizes = split_large_buckets(project_path, bucket_sizes, n_buckets, max_memory / MEMORY_FACTOR_CLEANING,
+                                       settings)
+    # The transactions of a bond are never split, i.e. the cleaning of the largest bucket has to fit into the budget
+    required_memory = max(bucket_sizes.values()) * MEMORY_FACTOR_CLEANING
+    if required_memory > max_memory:
+        raise MemoryError('The largest bucket ({:.2f} GB in memory) does not fit into the memory budget. The cleaning '
+                          'of its shard requires a memory budget of at least {:.2f} GB'.format(
+                              max(bucket_sizes.values()) / 1024**3, required_memory / 1024**3))
+    shards = pack_buckets(bucket_sizes, max_memory / MEMORY_FACTOR_CLEANING)
+    print('STEP 2: The merged data ({:.1f} GB in memory) is packed into {} shards'.format(
+        sum(bucket_sizes.values()) / 1024**3, len(shards)))
+
+    # Step 3: Clean the shards one after the other
+    list_dates = []
+    shard_ids = []
+    for shard_id, shard in enumerate(shards):
+        print('Cleaning shard {} of {}'.format(shard_id + 1, len(shards)))
+        df_dates = clean_shard(project_path, dataset_specs, shard, shard_id, settings)
+        if df_dates is not None:
+            list_dates.append(df_dates)
+            shard_ids.append(shard_id)
+        gc.collect()
+
+    # Step 4: Define the event time tables over all shards and add the event time variables
+    print("")
+    print('STEP 7.2: Create necessary event-time variables')
+    # Delete the final dataset of previous runs
+    path_final = project_path + '/bld/data/TRACE/TRACE_final_clean/'
+    remove_final_files(project_path)
+    event_day_tmp, event_week_tmp = get_event_time_tables(pd.concat(list_dates))
+    N_trnsct = 0
+    for shard_id in shard_ids:
+        N_trnsct = N_trnsct + finalize_shard(project_path, shard_id, event_day_tmp, event_week_tmp, settings)
+        gc.collect()
+    final_files = [path_final + 'TRACE_final_{}.pkl'.format(shard_id) for shard_id in shard_ids]
+
+    print('The final dataset ({} transactions) is stored in {} files. Peak memory: {:.2f} GB'.format(
+        N_trnsct, len(final_files), get_peak_memory() / 1024**3))
+
+    return final_files
+
+
+def load_TRACE_final_shards(project_path):
+    """
+    Load the final dataset of the out-of-core build, i.e. concatenate the files of all shards.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+
+    Returns:
+    --------
+    df_final (DataFrame): Final TRACE dataset
+    """
+    path_final = project_path + '/bld/data/TRACE/TRACE_final_clean/'
+    # The shards are stored as datasets (TRACE_final_<shard>.parquet) or as pickles (TRACE_final_<shard>.pkl)
+    shard_ids = sorted(set(
+        [int(os.path.splitext(f)[0].split('_')[-1]) for f in os.listdir(path_final) if f.startswith('TRACE_final_')]
+    ))
+    df_final = pd.concat([load_frame(path_final + 'TRACE_final_{}.pkl'.format(shard_id)) for shard_id in shard_ids],
+                         ignore_index=True)
+
+    return df_final
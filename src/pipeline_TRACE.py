@@ -0,0 +1,792 @@
+"""
+Express the build of the final TRACE dataset as a directed acyclic graph (DAG) of stages with checkpoints. Every
+stage stores its output as a checkpoint that is keyed by a hash of
+    a) the code of the functions that implement the stage,
+    b) the slice of the dataset specifications that the stage uses,
+    c) the input files the stage reads (raw TRACE data, MERGENT FISD data) and
+    d) the keys of the upstream stages.
+A stage is valid if the stored key equals the key of the current code, specifications and inputs and its output
+exists. A change of a stage thus invalidates the stage and all downstream stages (through d)). The steps are as
+follows:
+    Step 1:     Define the stages and their dependencies (STAGES)
+    Step 2:     Compute the key of every stage and compare it with the manifest of the last build
+    Step 3:     Run the build and resume from the first invalid stage. The upstream checkpoints of the first
+                invalid stage are loaded from disk.
+
+If only the MERGENT FISD data changed since the last build, the final dataset is updated incrementally (see
+update_TRACE.py) instead of re-running the stages. The out-of-core, two-pass and parallel modes run all steps after
+the read-in in one go without checkpoints (see run_build_without_checkpoints()). They record the keys of the
+read-in stages and a key of the final dataset (the key of the stage event_time and the code of these modes) in the
+same manifest.
+
+NOTE: The raw TRACE data is identified by the name, size and modification time of all files instead of their
+content. Hashing hundreds of GB of raw text files would take about as long as reading them in.
+"""
+
+import gc
+import hashlib
+import inspect
+import json
+import os
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+import read_TRACE
+import read_bond_background_TRACE
+import concatenate_merge_TRACE_MERGENT
+import clean_TRACE
+import bitemporal_TRACE
+import duplicates_TRACE
+import sort_order_TRACE
+import provenance_TRACE
+import raw_index_TRACE
+import storage_TRACE
+import join_guard_TRACE
+import prepare_variables
+import process_TRACE
+import out_of_core_TRACE
+from data_specs.US_holidays import US_holiday_list
+# Import the incremental update after a change of the MERGENT data
+from update_TRACE import store_reference_fingerprint, update_TRACE_final
+# Import the stage telemetry (wall time, CPU time, peak memory, rows and bytes read)
+from telemetry_TRACE import track_stage
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import store_frame, load_frame, frame_exists, remove_frame
+# Import the memory-mapped layout of the final dataset
+from mmap_TRACE import store_mmap_final
+# Import the paths of the final dataset (one file or one file per shard)
+from query_TRACE import get_final_paths
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+
+#########
+# Step 1: Stage definitions
+########
+def run_read_raw(project_path, dataset_specs, df_in, settings):
+    """Read in the daily raw transaction data and store it on a yearly level."""
+    read_TRACE.read_TRACE_all(project_path, dataset_specs, settings=settings)
+
+
+def run_bond_info(project_path, dataset_specs, df_in, settings):
+    """Read in the bond background information (and optionally the time-varying bond master)."""
+    read_bond_background_TRACE.get_unique_bond_info(project_path, dataset_specs, settings)
+    if dataset_specs['bond_info']['time_varying']:
+        read_bond_background_TRACE.get_bond_info_intervals(project_path, dataset_specs, settings)
+
+
+def run_rpt_dates(project_path, dataset_specs, df_in, settings):
+    """Read in the list of all reported dates in TRACE."""
+    read_TRACE.get_all_rpt_dates(project_path, settings)
+
+
+def run_merge(project_path, dataset_specs, df_in, settings):
+    """Concatenate the yearly data and merge the rating, issue and bond info data."""
+    return concatenate_merge_TRACE_MERGENT.conct_merge_data(project_path, dataset_specs, settings=settings)
+
+
+def run_interdealer(project_path, dataset_specs, df_in, settings):
+    """Delete one side of the inter-dealer trades."""
+    return process_TRACE.drop_interd_transact(df_in, settings)
+
+
+def run_trade_level(project_path, dataset_specs, df_in, settings):
+    """Implement the cleaning steps as in Bessembinder et al. (2018)."""
+    return clean_TRACE.clean_trade_level(df_in)
+
+
+def run_general(project_path, dataset_specs, df_in, settings):
+    """Implement the general data cleaning steps."""
+    return clean_TRACE.clean_df_general(df_in, dataset_specs)
+
+
+def run_trading_dates(project_path, dataset_specs, df_in, settings):
+    """Implement the cleaning steps for TRACE holidays and non-week days."""
+    return clean_TRACE.add_clean_trading_dates(df_in, project_path)
+
+
+def run_variables(project_path, dataset_specs, df_in, settings):
+    """Add additional necessary variables."""
+    return prepare_variables.create_necessary_vars(df_in)
+
+
+def run_event_time(project_path, dataset_specs, df_in, settings):
+    """Add the event time variables."""
+    return prepare_variables.define_event_time_week(df_in, settings)
+
+
+# Every stage is defined by
+#   'run':      Function that executes the stage. It gets the output of the upstream DataFrame stage ('data_from')
+#               and the settings of the build (see settings_TRACE.py) and returns the output DataFrame (or None if
+#               the stage writes files on its own)
+#   'upstream': Stages that have to be run before
+#   'data_from': Upstream stage whose output DataFrame is the input of the stage (None if there is none)
+#   'code':     Functions and modules that implement the stage (part of the key)
+#   'spec':     Keys of the dataset specifications that the stage uses (part of the key)
+#   'inputs':   Input files that the stage reads (part of the key, see get_input_hashes())
+# The stages are listed in a topological order.
+STAGES = {
+    'read_raw': {
+        'run': run_read_raw, 'upstream': [], 'data_from': None,
+        'code': [read_TRACE.read_in_adj_dtyp_pre_2012, read_TRACE.read_in_adj_dtyp_post_2012,
+                 read_TRACE.format_ex_tm_dt, read_TRACE.adj_dt_format_pre_2012, read_TRACE.adj_dt_format_post_2012,
+                 read_TRACE.select_bonds, read_TRACE.store_yearly_data, read_TRACE.read_post_2012,
+                 read_TRACE.read_2012, read_TRACE.read_pre_2012, read_TRACE.read_TRACE_all,
+                 clean_TRACE.post_2012_clean, clean_TRACE.prior_2012_clean, bitemporal_TRACE.get_deletion_dates,
+                 bitemporal_TRACE.get_deletions_post_2012, bitemporal_TRACE.get_deletions_prior_2012,
+                 bitemporal_TRACE.store_bitemporal_index, duplicates_TRACE.hash_trade_keys,
+                 duplicates_TRACE.BloomFilter, duplicates_TRACE.get_raw_keys, duplicates_TRACE.find_first_copies,
+                 duplicates_TRACE.check_duplicates, sort_order_TRACE, provenance_TRACE, raw_index_TRACE,
+                 storage_TRACE, join_guard_TRACE],
+        'spec': ['sample_time_span', 'bitemporal', 'duplicates'],
+        # The bond selection is applied when reading in the raw data
+        'inputs': ['raw_TRACE', 'issue_data'],
+    },
+    'bond_info': {
+        'run': run_bond_info, 'upstream': [], 'data_from': None,
+        'code': [read_bond_background_TRACE.read_bond_info, read_bond_background_TRACE.get_unique_bond_info,
+                 read_bond_background_TRACE.list_bond_info_files, read_bond_background_TRACE.get_bond_info_intervals,
+                 storage_TRACE],
+        'spec': ['sample_time_span', 'bond_info'],
+        'inputs': ['raw_TRACE'],
+    },
+    'rpt_dates': {
+        'run': run_rpt_dates, 'upstream': [], 'data_from': None,
+        'code': [read_TRACE.get_all_rpt_dates, storage_TRACE],
+        'spec': [],
+        'inputs': ['raw_TRACE'],
+    },
+    'merge': {
+        'run': run_merge, 'upstream': ['read_raw', 'bond_info'], 'data_from': None,
+        'code': [concatenate_merge_TRACE_MERGENT, clean_TRACE.harmon_pre_post_data,
+                 read_bond_background_TRACE.merge_bond_info_intervals, read_TRACE.select_bonds, sort_order_TRACE,
+                 provenance_TRACE, storage_TRACE, join_guard_TRACE],
+        'spec': ['sample_time_span', 'ratings', 'transactions', 'issue_data', 'bond_info'],
+        'inputs': ['issue_data', 'ratings'],
+    },
+    'interdealer': {
+        'run': run_interdealer, 'upstream': ['merge'], 'data_from': 'merge',
+        'code': [process_TRACE.drop_interd_transact, clean_TRACE.del_interd_transact, join_guard_TRACE],
+        'spec': [],
+        'inputs': [],
+    },
+    'trade_level': {
+        'run': run_trade_level, 'upstream': ['interdealer'], 'data_from': 'interdealer',
+        'code': [clean_TRACE.clean_trade_level, clean_TRACE.flag_trade_size_offer_size],
+        'spec': [],
+        'inputs': [],
+    },
+    'general': {
+        'run': run_general, 'upstream': ['trade_level'], 'data_from': 'trade_level',
+        'code': [clean_TRACE.clean_df_general],
+        'spec': ['dataset_clean'],
+        'inputs': [],
+    },
+    'trading_dates': {
+        'run': run_trading_dates, 'upstream': ['general', 'rpt_dates'], 'data_from': 'general',
+        'code': [clean_TRACE.add_clean_trading_dates, clean_TRACE.clean_trd_days, US_holiday_list, storage_TRACE],
+        'spec': [],
+        'inputs': [],
+    },
+    'variables': {
+        'run': run_variables, 'upstream': ['trading_dates'], 'data_from': 'trading_dates',
+        'code': [prepare_variables.create_necessary_vars],
+        'spec': [],
+        'inputs': [],
+    },
+    'event_time': {
+        'run': run_event_time, 'upstream': ['variables'], 'data_from': 'variables',
+        'code': [prepare_variables.define_event_time_week, prepare_variables.get_event_time_tables,
+                 prepare_variables.add_event_time_vars, join_guard_TRACE, storage_TRACE],
+        'spec': [],
+        'inputs': [],
+    },
+}
+# Modules of the build without checkpoints that are not part of the stages (see run_build_without_checkpoints()).
+# Their code is part of the key of the final dataset of this build (FINAL_WITHOUT_CHECKPOINTS in the manifest)
+CODE_WITHOUT_CHECKPOINTS = [process_TRACE, out_of_core_TRACE]
+FINAL_WITHOUT_CHECKPOINTS = 'final_without_checkpoints'
+# Stages of the read-in that the build without checkpoints runs as in the stage DAG
+READ_STAGES = ['read_raw', 'bond_info', 'rpt_dates']
+
+
+def get_stage_outputs(project_path, dataset_specs, stage, key):
+    """
+    Get the output files of a stage.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    stage (str): Name of the stage
+    key (str): Key of the stage
+
+    Returns:
+    --------
+    output_files (list): Paths of the output files (stored as datasets or pickles, see storage_TRACE.py)
+    """
+    path_raw_clean = project_path + '/bld/data/TRACE/TRACE_raw_clean/'
+    if stage == 'read_raw':
+        output_files = []
+        for year in range(dataset_specs['sample_time_span'][1], dataset_specs['sample_time_span'][0]-1, -1):
+            if year == 2012:
+                output_files = output_files + [path_raw_clean + 'TRACE_clean_2012_post.pkl',
+                                               path_raw_clean + 'TRACE_clean_2012_prior.pkl']
+            else:
+                output_files.append(path_raw_clean + 'TRACE_clean_{}.pkl'.format(year))
+        yearly_names = [os.path.basename(f) for f in output_files]
+        # The bitemporal index of every yearly dataset (see bitemporal_TRACE.py)
+        if dataset_specs['bitemporal']['enabled']:
+            output_files = output_files + [bitemporal_TRACE.get_bitemporal_path(project_path, f) for f in yearly_names]
+        # The duplicates of every yearly dataset (see duplicates_TRACE.py)
+        if dataset_specs['duplicates']['action'] != 'off':
+            output_files = output_files + [duplicates_TRACE.get_duplicates_path(project_path, f) for f in yearly_names]
+    elif stage == 'bond_info':
+        output_files = [path_raw_clean + 'bond_info.pkl']
+        if dataset_specs['bond_info']['time_varying']:
+            output_files.append(path_raw_clean + 'bond_info_intervals.pkl')
+    elif stage == 'rpt_dates':
+        output_files = [project_path + '/bld/data/TRACE/TRACE_info/TRACE_rpt_dates.pkl']
+    elif stage == 'event_time':
+        output_files = [project_path + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl']
+    else:
+        # Content-addressed checkpoint of the intermediate DataFrame
+        output_files = [project_path + '/bld/data/TRACE/TRACE_checkpoints/{}_{}.pkl'.format(stage, key[:16])]
+
+    return output_files
+
+
+#########
+# Step 2: Stage keys
+########
+def hash_code(code_objects):
+    """
+    Hash the source code of a list of functions and modules.
+
+    Parameters:
+    -----------
+    code_objects (list): Functions and modules
+
+    Returns:
+    --------
+    code_hash (str): SHA-256 hash of the source code
+    """
+    code_hash = hashlib.sha256()
+    for obj in code_objects:
+        code_hash.update(inspect.getsource(obj).encode())
+
+    return code_hash.hexdigest()
+
+
+def hash_file(file_path):
+    """
+    Hash the content of a file (in blocks of 16 MB).
+
+    Parameters:
+    -----------
+    file_path (str): Path of the file
+
+    Returns:
+    --------
+    file_hash (str): SHA-256 hash of the file content ('missing' if the file does not exist)
+    """
+    if not os.path.isfile(file_path):
+        return 'missing'
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(2**24), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def hash_raw_TRACE(project_path):
+    """
+    Hash the name, size and modification time of all raw TRACE files (see the note at the top).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+
+    Returns:
+    --------
+    raw_hash (str): SHA-256 hash over all raw TRACE files
+    """
+    path_raw = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    raw_hash = hashlib.sha256()
+    for root, dirs, files in os.walk(path_raw):
+        dirs.sort()
+        for f in sorted(files):
+            if f.startswith('.'):
+                continue
+            file_stat = os.stat(os.path.join(root, f))
+            raw_hash.update('{}|{}|{}\n'.format(os.path.relpath(os.path.join(root, f), path_raw), file_stat.st_size,
+                                                file_stat.st_mtime_ns).encode())
+
+    return raw_hash.hexdigest()
+
+
+def get_input_hashes(project_path):
+    """
+    Hash all input files of the build.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+
+    Returns:
+    --------
+    input_hashes (dict): Hash of the raw TRACE data ('raw_TRACE'), the issue data ('issue_data') and the ratings
+                         ('ratings')
+    """
+    path_mergent = project_path + '/src/original_data/Mergent_FISD/'
+    input_hashes = {
+        'raw_TRACE': hash_raw_TRACE(project_path),
+        'issue_data': hash_file(path_mergent + 'issue_data.pkl'),
+        'ratings': hash_file(path_mergent + 'ratings.pkl'),
+    }
+
+    return input_hashes
+
+
+def get_stage_keys(dataset_specs, input_hashes):
+    """
+    Compute the key of every stage from its code, its slice of the dataset specifications, its input files and the
+    keys of its upstream stages.
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications
+    input_hashes (dict): Hashes of the input files (see get_input_hashes())
+
+    Returns:
+    --------
+    dict_keys (dict): Key and the components of the key ('code', 'spec', 'inputs', 'upstream') of every stage
+    """
+    dict_keys = {}
+    for stage, stage_def in STAGES.items():
+        components = {
+            'code': hash_code(stage_def['code']),
+            'spec': hashlib.sha256(json.dumps({k: dataset_specs[k] for k in stage_def['spec']}, sort_keys=True)
+                                   .encode()).hexdigest(),
+            'inputs': {k: input_hashes[k] for k in stage_def['inputs']},
+            'upstream': {k: dict_keys[k]['key'] for k in stage_def['upstream']},
+        }
+        key = hashlib.sha256(json.dumps(components, sort_keys=True).encode()).hexdigest()
+        dict_keys[stage] = {'key': key, 'components': components}
+
+    return dict_keys
+
+
+def get_final_key(dict_keys):
+    """
+    Compute the key of the final dataset of the build without checkpoints from the key of the stage event_time and
+    the code of the modules of this build (CODE_WITHOUT_CHECKPOINTS).
+
+    Parameters:
+    -----------
+    dict_keys (dict): Keys of the stages (see get_stage_keys())
+
+    Returns:
+    --------
+    final_key (str): Key of the final dataset
+    """
+    return hashlib.sha256((dict_keys['event_time']['key'] + hash_code(CODE_WITHOUT_CHECKPOINTS)).encode()).hexdigest()
+
+
+def get_stage_keys_mergent_old(dataset_specs, input_hashes, manifest):
+    """
+    Compute the keys of the stages with the hashes of the MERGENT FISD data of the last build (see the manifest). If
+    only the MERGENT FISD data changed, the stored outputs are valid for these keys and can be updated incrementally
+    (see update_TRACE.py).
+    """
+    input_hashes_mergent_old = dict(input_hashes)
+    input_hashes_mergent_old.update({k: v for k, v in manifest['inputs'].items() if k in ['issue_data', 'ratings']})
+
+    return get_stage_keys(dataset_specs, input_hashes_mergent_old)
+
+
+def load_manifest(project_path):
+    """
+    Load the manifest of the last build (key, key components and output files of every stage that was run).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+
+    Returns:
+    --------
+    manifest (dict): Manifest of the last build (empty if there is none)
+    """
+    path_manifest = project_path + '/bld/data/TRACE/TRACE_checkpoints/manifest.json'
+    if not os.path.isfile(path_manifest):
+        return {'stages': {}, 'inputs': {}}
+    with open(path_manifest, 'r') as f:
+        manifest = json.load(f)
+
+    return manifest
+
+
+def store_manifest(project_path, manifest):
+    """
+    Store the manifest. The file is replaced atomically such that a crash never leaves a corrupted manifest.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    manifest (dict): Manifest of the build
+    """
+    path_manifest = project_path + '/bld/data/TRACE/TRACE_checkpoints/manifest.json'
+    with open(path_manifest + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path_manifest + '.tmp', path_manifest)
+
+
+def is_stage_valid(manifest, stage, key):
+    """
+    Check if the stored output of a stage is valid, i.e. it was computed with the same key and still exists.
+    """
+    if manifest['stages'].get(stage, {}).get('key') != key:
+        return False
+
+    return all([frame_exists(f) for f in manifest['stages'][stage]['outputs']])
+
+
+def get_stage_status(project_path, dataset_specs):
+    """
+    Compare the current stage keys with the manifest of the last build.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+
+    Returns:
+    --------
+    df_status (DataFrame): One row per stage with the columns 'valid' and 'reason' (the changed components of the
+                           key: 'code', 'spec', 'inputs: <file>', 'upstream: <stage>', 'never run' or 'output
+                           missing')
+    """
+    manifest = load_manifest(project_path)
+    dict_keys = get_stage_keys(dataset_specs, get_input_hashes(project_path))
+    list_status = []
+    for stage in STAGES:
+        reasons = []
+        stored = manifest['stages'].get(stage)
+        if stored is None:
+            reasons.append('never run')
+        else:
+            components = dict_keys[stage]['components']
+            for component in ['code', 'spec']:
+                if stored['components'][component] != components[component]:
+                    reasons.append(component)
+            for component in ['inputs', 'upstream']:
+                for k, v in components[component].items():
+                    if stored['components'][component].get(k) != v:
+                        reasons.append('{}: {}'.format(component, k))
+            if (len(reasons) == 0) & (is_stage_valid(manifest, stage, dict_keys[stage]['key']) == False):
+                reasons.append('output missing')
+        list_status.append([stage, len(reasons) == 0, ', '.join(reasons)])
+    df_status = pd.DataFrame(list_status, columns=['stage', 'valid', 'reason']).set_index('stage')
+
+    return df_status
+
+
+def get_affected_stages(changed):
+    """
+    Get the stages that a change invalidates, i.e. the stages that use a changed function, specification or input
+    file and all their downstream stages.
+
+    Parameters:
+    -----------
+    changed (list): Names of changed functions (e.g. 'clean_df_general'), modules, keys of the dataset
+                    specifications (e.g. 'dataset_clean'), input files ('raw_TRACE', 'issue_data', 'ratings') or
+                    stages
+
+    Returns:
+    --------
+    affected_stages (list): Invalidated stages in the order of execution
+    """
+    affected_stages = []
+    for stage, stage_def in STAGES.items():
+        code_names = [obj.__name__.split('.')[-1] for obj in stage_def['code']]
+        D_direct = (
+            (stage in changed) |
+            any([c in code_names for c in changed]) |
+            any([c in stage_def['spec'] for c in changed]) |
+            any([c in stage_def['inputs'] for c in changed])
+        )
+        D_upstream = any([s in affected_stages for s in stage_def['upstream']])
+        if D_direct | D_upstream:
+            affected_stages.append(stage)
+
+    return affected_stages
+
+
+#########
+# Step 3: Run the build
+########
+def load_stage_output(manifest, stage):
+    """
+    Load the output DataFrame of a valid stage from its checkpoint.
+    """
+    print('Loading the checkpoint of the stage {}'.format(stage))
+
+    return load_frame(manifest['stages'][stage]['outputs'][0])
+
+
+def get_upstream_stages(stage):
+    """
+    Get a stage and all stages it (transitively) depends on.
+
+    Parameters:
+    -----------
+    stage (str): Name of the stage
+
+    Returns:
+    --------
+    upstream_stages (list): The stage and its upstream stages in the order of execution
+    """
+    if stage not in STAGES:
+        raise ValueError('Unknown stage {}. The stages are: {}'.format(stage, ', '.join(STAGES)))
+    required = {stage}
+    for s in reversed(list(STAGES)):
+        if s in required:
+            required.update(STAGES[s]['upstream'])
+    upstream_stages = [s for s in STAGES if s in required]
+
+    return upstream_stages
+
+
+def run_build_dag(project_path, dataset_specs, target='event_time', force=False, settings=None):
+    """
+    Run all invalid stages of the build in the order of execution and resume from the first invalid stage. If only
+    the MERGENT FISD data changed, the final dataset is updated incrementally instead (see update_TRACE.py).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    target (str): Stage to build. Only the target and its upstream stages are run (default: the final dataset)
+    force (bool): Run the target stage even if its checkpoint is valid
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs)
+
+    Returns:
+    --------
+    stages_run (list): Stages that were run
+    """
+    if settings is None:
+        settings = get_settings(dataset_specs)
+    manifest = load_manifest(project_path)
+    input_hashes = get_input_hashes(project_path)
+    dict_keys = get_stage_keys(dataset_specs, input_hashes)
+    path_fingerprint = project_path + '/bld/data/TRACE/TRACE_info/reference_fingerprint.pkl'
+    stages_required = get_upstream_stages(target)
+
+    if is_stage_valid(manifest, target, dict_keys[target]['key']) & (force == False):
+        print("")
+        print('All stages are up to date. Nothing to do')
+        return []
+
+    # Only the MERGENT FISD data changed: with the input hashes of the last build, the final dataset would be valid
+    dict_keys_mergent_old = get_stage_keys_mergent_old(dataset_specs, input_hashes, manifest)
+    if (target == 'event_time') & (force == False) & \
+            is_stage_valid(manifest, 'event_time', dict_keys_mergent_old['event_time']['key']) & \
+            os.path.isfile(path_fingerprint):
+        update_TRACE_final(project_path, dataset_specs, settings)
+        # The yearly files now contain the newly selected bonds and the final dataset is updated. The checkpoints of
+        # the intermediate stages remain outdated and are recomputed if needed.
+        for stage in ['read_raw', 'event_time']:
+            manifest['stages'][stage]['key'] = dict_keys[stage]['key']
+            manifest['stages'][stage]['components'] = dict_keys[stage]['components']
+        manifest['inputs'] = input_hashes
+        store_manifest(project_path, manifest)
+        return ['update']
+
+    stages_run = []
+    df_current = None
+    stage_current = None
+    for stage in stages_required:
+        stage_def = STAGES[stage]
+        key = dict_keys[stage]['key']
+        # Adopt the outputs of the reading-in stages of a build without a manifest (e.g. a build before the stage
+        # DAG existed) instead of reading in the raw data again
+        output_files = get_stage_outputs(project_path, dataset_specs, stage, key)
+        if (stage_def['data_from'] is None) & (stage != 'merge') & (stage not in manifest['stages']) & \
+                all([frame_exists(f) for f in output_files]):
+            print("")
+            print('STAGE {}: The output exists but was not built by the stage DAG. It is adopted'.format(stage))
+            manifest['stages'][stage] = {'key': key, 'components': dict_keys[stage]['components'],
+                                         'outputs': output_files}
+            store_manifest(project_path, manifest)
+        if is_stage_valid(manifest, stage, key) & ((stage != target) | (force == False)):
+            print("")
+            print('STAGE {}: The checkpoint is valid. Proceed with the next stage'.format(stage))
+            continue
+
+        # Get the input DataFrame from the upstream stage (in memory or from its checkpoint)
+        df_in = None
+        if stage_def['data_from'] is not None:
+            if stage_current == stage_def['data_from']:
+                df_in = df_current
+            else:
+                df_in = load_stage_output(manifest, stage_def['data_from'])
+        df_current = None
+        print("")
+        print('STAGE {}: started'.format(stage))
+        with track_stage(stage, rows_in=len(df_in) if df_in is not None else None) as record:
+            df_current = stage_def['run'](project_path, dataset_specs, df_in, settings)
+            if df_current is not None:
+                record['rows_out'] = len(df_current)
+        stage_current = stage
+        del [df_in]
+
+        # Store the checkpoint and delete the checkpoints of previous runs of the stage
+        if df_current is not None:
+            store_frame(df_current, output_files[0], settings)
+            if stage == 'event_time':
+                store_mmap_final(df_current, output_files[0], settings)
+                # The final dataset of a build without checkpoints is replaced
+                manifest['stages'].pop(FINAL_WITHOUT_CHECKPOINTS, None)
+        old_outputs = manifest['stages'].get(stage, {}).get('outputs', [])
+        for f in old_outputs:
+            if (f not in output_files) & frame_exists(f):
+                remove_frame(f)
+        manifest['stages'][stage] = {'key': key, 'components': dict_keys[stage]['components'],
+                                     'outputs': output_files}
+        manifest['inputs'] = input_hashes
+        store_manifest(project_path, manifest)
+        stages_run.append(stage)
+
+    # Store the fingerprint of the MERGENT reference data this build is based on (see update_TRACE.py)
+    if target == 'event_time':
+        store_reference_fingerprint(project_path, dataset_specs)
+
+    return stages_run
+
+
+def run_build_without_checkpoints(project_path, dataset_specs, max_memory=None, settings=None):
+    """
+    Run the build in the out-of-core (max_memory), two-pass ('two_pass_cleaning') or parallel ('cleaning_workers')
+    mode. These modes run all steps after the read-in in one go and store no checkpoints. The raw data is only read
+    in again if the keys of the read-in stages changed, and the final dataset is only updated incrementally if its
+    key changed only in the MERGENT FISD data (see get_final_key()). The keys are recorded in the manifest.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    max_memory (int): Memory budget in bytes for the out-of-core mode (None -> in memory)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs)
+    """
+    if settings is None:
+        settings = get_settings(dataset_specs)
+    path_TRACE_final = project_path + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl'
+    path_fingerprint = project_path + '/bld/data/TRACE/TRACE_info/reference_fingerprint.pkl'
+    manifest = load_manifest(project_path)
+    input_hashes = get_input_hashes(project_path)
+    dict_keys = get_stage_keys(dataset_specs, input_hashes)
+    dict_keys_mergent_old = get_stage_keys_mergent_old(dataset_specs, input_hashes, manifest)
+
+    # The outputs of a read-in stage are valid if their key changed at most in the MERGENT FISD data (the update
+    # re-applies the bond selection) or if they exist but were not built with a manifest (they are adopted)
+    read_valid = True
+    for stage in READ_STAGES:
+        output_files = get_stage_outputs(project_path, dataset_specs, stage, dict_keys[stage]['key'])
+        if stage not in manifest['stages']:
+            read_valid = read_valid & all([frame_exists(f) for f in output_files])
+        else:
+            read_valid = read_valid & (is_stage_valid(manifest, stage, dict_keys[stage]['key']) |
+                                       is_stage_valid(manifest, stage, dict_keys_mergent_old[stage]['key']))
+    # The final dataset is valid for the MERGENT FISD data of the last build if it was built with the same code and
+    # specifications (by this mode or by the stage DAG)
+    final_valid = read_valid & os.path.isfile(path_fingerprint) & (
+        is_stage_valid(manifest, FINAL_WITHOUT_CHECKPOINTS, get_final_key(dict_keys_mergent_old)) |
+        is_stage_valid(manifest, 'event_time', dict_keys_mergent_old['event_time']['key'])
+    )
+
+    # 1) Read in the daily transaction data, the bond background information and the reported dates
+    if read_valid:
+        print("")
+        print("STEP 1.1: Raw Trace data is already read, cleaned and saved. Proceed with next step")
+        # If the final dataset is valid, only recompute the bonds whose MERGENT reference data (issue data or ratings)
+        # changed since the last build
+        if final_valid:
+            update_TRACE_final(project_path, dataset_specs, settings)
+            record_build_without_checkpoints(project_path, dataset_specs, manifest, dict_keys, input_hashes)
+            return
+    else:
+        print("")
+        print("STEP 1.1: Start reading and concatenating the raw TRACE data")
+        with track_stage('read_raw'):
+            run_read_raw(project_path, dataset_specs, None, settings)
+        print("STEP 1.1: Finished reading and concatenating the raw TRACE data")
+        print("")
+        print("STEP 1.2: Start reading in the bond background characteristics")
+        with track_stage('bond_info'):
+            run_bond_info(project_path, dataset_specs, None, settings)
+        print("STEP 1.2: Finished reading in the bond background characteristics")
+        print("")
+        print("STEP 1.3: Start reading in the list of all reported dates in TRACE")
+        with track_stage('rpt_dates'):
+            run_rpt_dates(project_path, dataset_specs, None, settings)
+        print("STEP 1.3: Finished reading in the list of all reported dates in TRACE")
+
+    # 2) - 4) Concatenate, clean, add the variables and save the final dataset
+    if max_memory is not None:
+        # Shard by shard within the memory budget. The final dataset is stored as one file per shard
+        # (TRACE_final_<shard>.pkl, see out_of_core_TRACE.py)
+        with track_stage('out_of_core'):
+            out_of_core_TRACE.build_TRACE_out_of_core(project_path, dataset_specs, max_memory, settings)
+    elif dataset_specs['two_pass_cleaning']:
+        # Concatenate and clean the data partition by partition (see process_TRACE.py). The final dataset is stored
+        # as one file per partition (TRACE_final_<k>.pkl)
+        with track_stage('two_pass_cleaning'):
+            process_TRACE.clean_merged_data_two_pass(project_path, dataset_specs, settings)
+    else:
+        # Merge the yearly data into CUSIP shards on disk and clean the shards in parallel (see process_TRACE.py)
+        print("")
+        print('STEP 2: The concatenation and cleaning step has started. Finished years will be displayed')
+        with track_stage('parallel_cleaning') as record:
+            df_clean = process_TRACE.clean_merged_data_parallel(None, project_path, dataset_specs,
+                                                                dataset_specs['cleaning_workers'], settings)
+            record['rows_out'] = len(df_clean)
+
+        # Add the necessary event time variables
+        with track_stage('event_time', rows_in=len(df_clean)) as record:
+            df_final = prepare_variables.define_event_time_week(df_clean, settings)
+            record['rows_out'] = len(df_final)
+        del [df_clean]
+        gc.collect()
+
+        print('Saving the DataFrame has started')
+        process_TRACE.remove_final_files(project_path)
+        store_frame(df_final, path_TRACE_final, settings)
+        store_mmap_final(df_final, path_TRACE_final, settings)
+    # Store the fingerprint of the MERGENT reference data this build is based on (see update_TRACE.py)
+    store_reference_fingerprint(project_path, dataset_specs)
+    record_build_without_checkpoints(project_path, dataset_specs, manifest, dict_keys, input_hashes)
+
+
+def record_build_without_checkpoints(project_path, dataset_specs, manifest, dict_keys, input_hashes):
+    """
+    Record the keys of the read-in stages and of the final dataset of a build without checkpoints in the manifest.
+    The stage event_time of the stage DAG is no longer valid, its output was replaced.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    manifest (dict): Manifest of the last build (see load_manifest())
+    dict_keys (dict): Keys of the stages (see get_stage_keys())
+    input_hashes (dict): Hashes of the input files (see get_input_hashes())
+    """
+    for stage in READ_STAGES:
+        manifest['stages'][stage] = {'key': dict_keys[stage]['key'], 'components': dict_keys[stage]['components'],
+                                     'outputs': get_stage_outputs(project_path, dataset_specs, stage,
+                                                                  dict_keys[stage]['key'])}
+    manifest['stages'].pop('event_time', None)
+    manifest['stages'][FINAL_WITHOUT_CHECKPOINTS] = {'key': get_final_key(dict_keys), 'components': {},
+                                                     'outputs': get_final_paths(project_path)}
+    manifest['inputs'] = input_hashes
+    store_manifest(project_path, manifest)
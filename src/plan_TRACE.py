@@ -0,0 +1,697 @@
+"""
+Plan a build before it is run (dry run). The planner estimates the wall time, the peak memory (RSS) and the disk
+space of every stage and every year of the reading-in step and recommends a build mode that fits the machine, such
+that a multi-hour rebuild does not run out of memory hours in. Nothing is read in or cleaned. The steps are as
+follows:
+    Step 1:     Take the inventory of the raw TRACE data: number and size of the daily files per year, era (pre- or
+                post-2012 layout) and the number of rows, estimated from the bytes per row of a few sampled files.
+    Step 2:     Calibrate the cost coefficients of every stage (seconds, memory and disk per row) on the run reports
+                of past builds (see telemetry_TRACE.py). Without run reports, the default coefficients are used.
+    Step 3:     Estimate the rows, wall time, peak memory and disk space of every stage from the inventory and the
+                coefficients. Stages with a valid checkpoint are marked (see pipeline_TRACE.py).
+    Step 4:     Compare the estimates with the machine (cores, available memory, free disk) and recommend the
+                build mode, the number of cleaning workers and the shard sizes.
+
+Note: The estimates scale linearly with the number of rows. They are only as good as the run reports they are
+calibrated on, i.e. calibrate on a build of a few months of the same data (or of generated data, see
+generate_synthetic_TRACE.py) on the same machine.
+"""
+
+import datetime
+import glob
+import json
+import math
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Import the stages of the build and the checkpoint status
+from pipeline_TRACE import STAGES, get_stage_status
+# Import the memory model of the out-of-core mode
+from out_of_core_TRACE import parse_memory_size, get_n_slices, MEMORY_FACTOR_CLEANING, MEMORY_FACTOR_MERGE, \
+    BUCKETS_PER_SHARD
+# Import the /proc reader and the formatting of byte counts
+from telemetry_TRACE import read_proc_file, format_bytes
+# Import the size of the stored outputs (see storage_TRACE.py)
+from storage_TRACE import frame_exists, get_disk_size
+
+# Number of daily files per year whose rows are counted to estimate the bytes per row
+SAMPLE_FILES_PER_YEAR = 3
+# Share of the available memory the recommended build may use
+MEMORY_SAFETY = 0.8
+# Speed-up of one additional cleaning worker relative to the serial cleaning (the shards are pickled to the workers
+# and the results are concatenated)
+PARALLEL_EFFICIENCY = 0.7
+# Number of CUSIP shards per cleaning worker (see clean_merged_data_parallel() in process_TRACE.py)
+SHARDS_PER_WORKER = 4
+# Stages that run on the merged data (in this order). The rows in of the merge stage are the rows out of the
+# reading-in step
+MERGED_STAGES = ['merge', 'interdealer', 'trade_level', 'general', 'trading_dates', 'variables', 'event_time']
+# Stages that are run by the parallel cleaning (see clean_merged_shard() in process_TRACE.py)
+CLEANING_STAGES = ['interdealer', 'trade_level', 'general', 'trading_dates', 'variables']
+
+# Default cost coefficients, calibrated on three builds of generated data of 4 to 15 months (see
+# generate_synthetic_TRACE.py). Units: seconds and bytes per row in ('s_per_unit', 'rss_per_unit'), rows out per row
+# in ('row_ratio') and bytes of the stored output per row out ('disk_per_row'). The reading-in step has an additional
+# fixed cost per daily file ('s_per_file'). The unit of the bond info is one byte of the daily bond files, the
+# reported dates have a fixed cost. 'base_rss' is the memory of the process before the first stage.
+DEFAULT_COEFFICIENTS = {
+    'base_rss': 125 * 1024**2,
+    'read_pre': {'s_per_unit': 3.4e-5, 's_per_file': 0.023, 'rss_per_unit': 3700, 'row_ratio': 0.78,
+                 'disk_per_row': 250},
+    'read_post': {'s_per_unit': 7.7e-5, 's_per_file': 0.031, 'rss_per_unit': 2700, 'row_ratio': 0.77,
+                  'disk_per_row': 280},
+    'bond_info': {'s_per_unit': 2.2e-7, 'rss_per_unit': 14, 'row_ratio': None, 'disk_per_row': None},
+    'rpt_dates': {'s_per_unit': 0.01, 'rss_per_unit': 0, 'row_ratio': None, 'disk_per_row': None},
+    'merge': {'s_per_unit': 5.3e-6, 'rss_per_unit': 1500, 'row_ratio': 1.0, 'disk_per_row': 220},
+    'interdealer': {'s_per_unit': 4.6e-6, 'rss_per_unit': 1200, 'row_ratio': 0.77, 'disk_per_row': 220},
+    'trade_level': {'s_per_unit': 2.9e-6, 'rss_per_unit': 1300, 'row_ratio': 0.95, 'disk_per_row': 230},
+    'general': {'s_per_unit': 2.5e-6, 'rss_per_unit': 1300, 'row_ratio': 0.94, 'disk_per_row': 170},
+    'trading_dates': {'s_per_unit': 3.4e-6, 'rss_per_unit': 1500, 'row_ratio': 0.97, 'disk_per_row': 220},
+    'variables': {'s_per_unit': 1.3e-6, 'rss_per_unit': 1500, 'row_ratio': 1.0, 'disk_per_row': 220},
+    'event_time': {'s_per_unit': 1.8e-6, 'rss_per_unit': 1600, 'row_ratio': 1.0, 'disk_per_row': 250},
+}
+
+
+#########
+# Step 1: Inventory of the raw data
+########
+def count_lines(file_path):
+    """
+    Count the lines of a file (in blocks of 16 MB).
+    """
+    n_lines = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(2**24), b''):
+            n_lines = n_lines + block.count(b'\n')
+
+    return n_lines
+
+
+def list_daily_files(project_path, year):
+    """
+    List the daily transaction files and the daily bond files of one year (see read_post_2012() in read_TRACE.py).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    year (int): Year
+
+    Returns:
+    --------
+    daily_files (list): Paths of the daily transaction files (None if there is no folder for the year)
+    bond_files (list): Paths of the daily bond and supplemental bond files
+    """
+    path_raw = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    fld = [f for f in sorted(os.listdir(path_raw)) if (f.startswith('.') == False) & f.endswith(str(year))]
+    if len(fld) == 0:
+        return None, []
+    ann_fld_path = path_raw + fld[0] + '/'
+    daily_files = [ann_fld_path + f for f in sorted(os.listdir(ann_fld_path))
+                   if not (f.startswith('0033-corp-bond') | f.startswith('.'))]
+    bond_files = [ann_fld_path + f for f in sorted(os.listdir(ann_fld_path)) if f.startswith('0033-corp-bond')]
+
+    return daily_files, bond_files
+
+
+def get_raw_inventory(project_path, dataset_specs):
+    """
+    Take the inventory of the raw TRACE data of the sample period. The number of rows is estimated from the bytes
+    per row of SAMPLE_FILES_PER_YEAR evenly spaced daily files of the year.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+
+    Returns:
+    --------
+    df_inventory (DataFrame): One row per year with the era ('pre' or 'post' layout of the daily files), the number
+                              of daily transaction files ('n_files'), their size ('raw_bytes'), the estimated bytes
+                              per row and number of rows ('raw_rows') and the size of the daily bond files
+                              ('bond_bytes')
+    """
+    path_raw = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    annual_fld = [f for f in sorted(os.listdir(path_raw)) if not f.startswith('.')]
+
+    list_inventory = []
+    for year in range(dataset_specs['sample_time_span'][1], dataset_specs['sample_time_span'][0]-1, -1):
+        daily_files, bond_files = list_daily_files(project_path, year)
+        if daily_files is None:
+            print('WARNING: There is no raw TRACE folder for the year {}'.format(year))
+            continue
+        file_sizes = [os.path.getsize(f) for f in daily_files]
+
+        # Bytes per row of the sampled files (the first line of every file is the header)
+        sample = sorted(set([round(i * (len(daily_files) - 1) / max(SAMPLE_FILES_PER_YEAR - 1, 1))
+                             for i in range(SAMPLE_FILES_PER_YEAR)])) if len(daily_files) > 0 else []
+        sample_bytes = sum([file_sizes[i] for i in sample])
+        sample_rows = sum([max(count_lines(daily_files[i]) - 1, 0) for i in sample])
+        bytes_per_row = sample_bytes / sample_rows if sample_rows > 0 else None
+
+        list_inventory.append({
+            'year': year,
+            # Since 2012, the data is in the post-2012 layout (the first days of 2012 are in the pre-2012 layout)
+            'era': 'pre' if year < 2012 else 'post',
+            'n_files': len(daily_files),
+            'raw_bytes': sum(file_sizes),
+            'bytes_per_row': bytes_per_row,
+            'raw_rows': int(sum(file_sizes) / bytes_per_row) if bytes_per_row is not None else 0,
+            'bond_bytes': sum([os.path.getsize(f) for f in bond_files]),
+        })
+    df_inventory = pd.DataFrame(list_inventory, columns=['year', 'era', 'n_files', 'raw_bytes', 'bytes_per_row',
+                                                         'raw_rows', 'bond_bytes']).set_index('year')
+
+    # The bond info is built from the bond files of all years, not only of the sample period
+    bond_bytes_all = 0
+    for fld in annual_fld:
+        bond_bytes_all = bond_bytes_all + sum([os.path.getsize(path_raw + fld + '/' + f)
+                                               for f in os.listdir(path_raw + fld)
+                                               if f.startswith('0033-corp-bond')])
+    df_inventory.attrs['bond_bytes_all'] = bond_bytes_all
+
+    return df_inventory
+
+
+def get_machine(project_path):
+    """
+    Get the resources of the machine.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+
+    Returns:
+    --------
+    machine (dict): Number of usable cores ('cpu_count'), total and available memory in bytes ('memory_total',
+                    'memory_available', None if not available) and free disk space in bytes of the project
+                    ('disk_free')
+    """
+    # Cores the process may run on (e.g. within a container), otherwise all cores
+    if hasattr(os, 'sched_getaffinity'):
+        cpu_count = len(os.sched_getaffinity(0))
+    else:
+        cpu_count = os.cpu_count() or 1
+    meminfo = read_proc_file('/proc/meminfo', ['MemTotal', 'MemAvailable'])
+    machine = {
+        'cpu_count': cpu_count,
+        'memory_total': meminfo['MemTotal'] * 1024 if meminfo['MemTotal'] is not None else None,
+        'memory_available': meminfo['MemAvailable'] * 1024 if meminfo['MemAvailable'] is not None else None,
+        'disk_free': shutil.disk_usage(project_path).free,
+    }
+
+    return machine
+
+
+#########
+# Step 2: Calibrate the cost coefficients
+########
+def get_stage_samples(project_path, report):
+    """
+    Collect the units, wall time, memory, rows and output size of every stage of one run report. Only finished
+    stages of the default build (see STAGES in pipeline_TRACE.py) are used.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path of the run report
+    report (dict): Run report (see write_run_report() in telemetry_TRACE.py)
+
+    Returns:
+    --------
+    dict_samples (dict): Coefficient key (e.g. 'read_post', 'merge') -> list of dicts with 'units', 'files' (number
+                         of daily files of the reading-in step), 'wall_time_s', 'peak_rss_bytes', 'rows_in',
+                         'rows_out' and 'disk_bytes'
+    base_rss (int): Memory of the process before the first stage (the lowest peak of all stages, None if no stage
+                    finished)
+    """
+    stages = [s for s in report['stages'] if (s['status'] == 'finished') & (s['peak_rss_bytes'] is not None)]
+    if len(stages) == 0:
+        return {}, None
+    base_rss = min([s['peak_rss_bytes'] for s in stages])
+    path_raw_clean = project_path + '/bld/data/TRACE/TRACE_raw_clean/'
+
+    dict_samples = {}
+    rows_read = 0
+    for s in stages:
+        disk_bytes = None
+        n_files = None
+        if s['stage'].startswith('read_') & (s['stage'] != 'read_raw'):
+            year = int(s['stage'][5:])
+            key = 'read_pre' if year < 2012 else 'read_post'
+            units = s['rows_in']
+            rows_read = rows_read + (s['rows_out'] or 0)
+            daily_files, _ = list_daily_files(project_path, year)
+            n_files = len(daily_files) if daily_files is not None else None
+            # Size of the yearly file(s) written by the stage
+            file_paths = [path_raw_clean + 'TRACE_clean_{}.pkl'.format(year)]
+            if year == 2012:
+                file_paths = [path_raw_clean + 'TRACE_clean_2012_post.pkl', path_raw_clean +
+                              'TRACE_clean_2012_prior.pkl']
+            if all([frame_exists(f) for f in file_paths]):
+                disk_bytes = sum([get_disk_size(f) for f in file_paths])
+        elif s['stage'] == 'bond_info':
+            key = 'bond_info'
+            units = s['bytes_read']
+        elif s['stage'] == 'rpt_dates':
+            key = 'rpt_dates'
+            units = 1
+        elif s['stage'] in MERGED_STAGES:
+            key = s['stage']
+            # The merge stage records only the rows out, its rows in are the rows out of the reading-in step
+            units = rows_read if s['stage'] == 'merge' else s['rows_in']
+            if s['stage'] == 'event_time':
+                file_paths = [project_path + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl']
+            else:
+                # The checkpoints are stored as datasets (<stage>_<key>.parquet) or as pickles (<stage>_<key>.pkl)
+                file_paths = sorted(glob.glob(project_path + '/bld/data/TRACE/TRACE_checkpoints/{}_*.p*'.format(
+                    s['stage'])), key=os.path.getmtime)[-1:]
+                file_paths = [os.path.splitext(f)[0] + '.pkl' for f in file_paths]
+            if (len(file_paths) > 0) and frame_exists(file_paths[0]):
+                disk_bytes = get_disk_size(file_paths[0])
+        else:
+            continue
+        if (units is None) or (units == 0):
+            continue
+        dict_samples.setdefault(key, []).append({
+            'units': units,
+            'files': n_files,
+            'wall_time_s': s['wall_time_s'],
+            'peak_rss_bytes': s['peak_rss_bytes'],
+            'rows_in': units if key not in ['bond_info', 'rpt_dates'] else None,
+            'rows_out': s['rows_out'],
+            'disk_bytes': disk_bytes,
+        })
+
+    return dict_samples, base_rss
+
+
+def calibrate_coefficients(calibration_paths):
+    """
+    Calibrate the cost coefficients on the run reports of past builds. Every coefficient is the ratio of the sums
+    over all reports (e.g. the sum of the wall times over the sum of the rows), such that larger runs get a larger
+    weight. The memory per row is the peak memory above the lowest base memory of all reports (the base memory of a
+    report that failed in a late stage is too high). The disk space per row is taken from the latest report of every
+    project only, since the output files of older runs are overwritten. Coefficients without any report keep their
+    default value.
+
+    Parameters:
+    -----------
+    calibration_paths (list): Project root paths whose run reports are used
+
+    Returns:
+    --------
+    coefficients (dict): Cost coefficients (see DEFAULT_COEFFICIENTS)
+    n_reports (int): Number of run reports used
+    """
+    coefficients = {k: (dict(v) if isinstance(v, dict) else v) for k, v in DEFAULT_COEFFICIENTS.items()}
+    dict_samples = {}
+    list_base_rss = []
+    n_reports = 0
+    for project_path in calibration_paths:
+        path_telemetry = project_path + '/bld/data/TRACE/TRACE_info/telemetry/'
+        report_files = sorted(glob.glob(path_telemetry + 'run_report_2*.json'))
+        for i, report_file in enumerate(report_files):
+            with open(report_file, 'r') as f:
+                report = json.load(f)
+            samples, base_rss = get_stage_samples(project_path, report)
+            if base_rss is None:
+                continue
+            n_reports = n_reports + 1
+            list_base_rss.append(base_rss)
+            for key, list_samples in samples.items():
+                for sample in list_samples:
+                    # The output files belong to the latest run
+                    if i < len(report_files) - 1:
+                        sample['disk_bytes'] = None
+                    dict_samples.setdefault(key, []).append(sample)
+
+    if len(list_base_rss) > 0:
+        coefficients['base_rss'] = min(list_base_rss)
+    for key, list_samples in dict_samples.items():
+        units = sum([s['units'] for s in list_samples])
+        coefficients[key]['s_per_unit'] = sum([s['wall_time_s'] for s in list_samples]) / units
+        if 's_per_file' in coefficients[key]:
+            coefficients[key]['s_per_unit'], coefficients[key]['s_per_file'] = fit_read_time(list_samples)
+        coefficients[key]['rss_per_unit'] = sum([max(s['peak_rss_bytes'] - coefficients['base_rss'], 0)
+                                                 for s in list_samples]) / units
+        list_rows = [s for s in list_samples if (s['rows_in'] is not None) & (s['rows_out'] is not None)]
+        if len(list_rows) > 0:
+            coefficients[key]['row_ratio'] = sum([s['rows_out'] for s in list_rows]) / \
+                sum([s['rows_in'] for s in list_rows])
+        list_disk = [s for s in list_samples if (s['disk_bytes'] is not None) and (s['rows_out'] or 0) > 0]
+        if len(list_disk) > 0:
+            coefficients[key]['disk_per_row'] = sum([s['disk_bytes'] for s in list_disk]) / \
+                sum([s['rows_out'] for s in list_disk])
+
+    return coefficients, n_reports
+
+
+def fit_read_time(list_samples):
+    """
+    Fit the wall time of the reading-in step as a fixed cost per daily file plus a cost per row (least squares). The
+    two costs can only be separated if the samples differ in the rows per file, otherwise (or if a fitted cost is
+    negative) the wall time is attributed to the rows only.
+
+    Parameters:
+    -----------
+    list_samples (list): Samples of the reading-in step (see get_stage_samples())
+
+    Returns:
+    --------
+    s_per_unit (float): Seconds per row
+    s_per_file (float): Seconds per daily file
+    """
+    s_per_unit = sum([s['wall_time_s'] for s in list_samples]) / sum([s['units'] for s in list_samples])
+    list_samples = [s for s in list_samples if (s['files'] or 0) > 0]
+    if len(list_samples) < 2:
+        return s_per_unit, 0
+    rows_per_file = [s['units'] / s['files'] for s in list_samples]
+    if max(rows_per_file) < 1.5 * min(rows_per_file):
+        return s_per_unit, 0
+    X = np.array([[s['units'], s['files']] for s in list_samples], dtype=float)
+    y = np.array([s['wall_time_s'] for s in list_samples])
+    fit = np.linalg.lstsq(X, y, rcond=None)[0]
+    if (fit < 0).any():
+        return s_per_unit, 0
+
+    return fit[0], fit[1]
+
+
+#########
+# Step 3: Estimate the stages
+########
+def get_stage_estimate(stage, year, units, rows_in, coefs, base_rss, n_files=0):
+    """
+    Estimate the rows out, wall time, peak memory and disk space of one stage.
+
+    Parameters:
+    -----------
+    stage (str): Name of the stage
+    year (int): Year of the reading-in stage (None otherwise)
+    units (float): Units of the stage (rows in, bytes of the bond files or 1, see DEFAULT_COEFFICIENTS)
+    rows_in (int): Rows in (None if the stage does not process rows)
+    coefs (dict): Cost coefficients of the stage
+    base_rss (int): Memory of the process before the first stage
+    n_files (int): Number of daily files of the reading-in stage
+
+    Returns:
+    --------
+    estimate (dict): One row of the plan
+    """
+    rows_out = int(rows_in * coefs['row_ratio']) if rows_in is not None else None
+    estimate = {
+        'stage': stage,
+        'year': year,
+        'rows_in': rows_in,
+        'rows_out': rows_out,
+        'wall_time_s': units * coefs['s_per_unit'] + n_files * coefs.get('s_per_file', 0),
+        'peak_rss_bytes': int(base_rss + units * coefs['rss_per_unit']),
+        'disk_bytes': int(rows_out * coefs['disk_per_row']) if rows_out is not None else 0,
+    }
+
+    return estimate
+
+
+def estimate_stages(df_inventory, coefficients, df_status=None):
+    """
+    Estimate the rows, wall time, peak memory and disk space of every stage of the default build and of every year
+    of the reading-in step.
+
+    Parameters:
+    -----------
+    df_inventory (DataFrame): Inventory of the raw data (see get_raw_inventory())
+    coefficients (dict): Cost coefficients (see calibrate_coefficients())
+    df_status (DataFrame): Checkpoint status of the stages (see get_stage_status() in pipeline_TRACE.py, None ->
+                           all stages are run)
+
+    Returns:
+    --------
+    df_plan (DataFrame): One row per stage (and per year of the reading-in step) with the rows in and out, wall
+                         time, peak memory, disk space and whether the stage is run ('run')
+    """
+    base_rss = coefficients['base_rss']
+    list_plan = []
+    # 1) Reading-in step, one year after the other
+    for year, row in df_inventory.iterrows():
+        list_plan.append(get_stage_estimate('read_{}'.format(year), year, row['raw_rows'], row['raw_rows'],
+                                            coefficients['read_' + row['era']], base_rss, row['n_files']))
+    rows_read = sum([p['rows_out'] for p in list_plan])
+    # 2) Bond background information and reported dates
+    list_plan.append(get_stage_estimate('bond_info', None, df_inventory.attrs['bond_bytes_all'], None,
+                                        coefficients['bond_info'], base_rss))
+    list_plan.append(get_stage_estimate('rpt_dates', None, 1, None, coefficients['rpt_dates'], base_rss))
+    # 3) Stages on the merged data, each on the rows out of the previous stage
+    rows_in = rows_read
+    for stage in MERGED_STAGES:
+        list_plan.append(get_stage_estimate(stage, None, rows_in, rows_in, coefficients[stage], base_rss))
+        rows_in = list_plan[-1]['rows_out']
+    df_plan = pd.DataFrame(list_plan)
+
+    # Stages with a valid checkpoint are skipped by the default build
+    df_plan['run'] = True
+    if df_status is not None:
+        for stage in STAGES:
+            stage_rows = df_plan['stage'].str.startswith('read_') if stage == 'read_raw' else \
+                df_plan['stage'] == stage
+            df_plan.loc[stage_rows, 'run'] = (df_status.loc[stage, 'valid'] == False)
+
+    return df_plan
+
+
+#########
+# Step 4: Recommend a build mode
+########
+def get_parallel_peak(merged_bytes, n_workers, base_rss):
+    """
+    Estimate the peak memory of the parallel cleaning (see clean_merged_data_parallel() in process_TRACE.py). The
+    main process writes the merged data to the shards on disk year by year and holds the cleaned data twice while it
+    is collected and sorted, every worker loads and cleans one shard at a time.
+
+    Parameters:
+    -----------
+    merged_bytes (float): Size of the merged data in memory
+    n_workers (int): Number of cleaning workers
+    base_rss (int): Memory of one process before the first stage
+
+    Returns:
+    --------
+    peak_bytes (float): Peak memory of the main process and all workers
+    shard_bytes (float): Size of one shard in memory
+    """
+    shard_bytes = merged_bytes / (n_workers * SHARDS_PER_WORKER)
+    peak_bytes = base_rss + 2 * merged_bytes + n_workers * (base_rss + MEMORY_FACTOR_CLEANING * shard_bytes)
+
+    return peak_bytes, shard_bytes
+
+
+def recommend_build(df_plan, machine, coefficients, max_memory=None):
+    """
+    Recommend the build mode, the number of cleaning workers and the shard sizes such that the peak memory stays
+    within the memory budget.
+
+    Parameters:
+    -----------
+    df_plan (DataFrame): Estimates of the stages (see estimate_stages())
+    machine (dict): Resources of the machine (see get_machine())
+    coefficients (dict): Cost coefficients (see calibrate_coefficients())
+    max_memory (str): Memory budget (e.g. '32G', None -> MEMORY_SAFETY times the available memory)
+
+    Returns:
+    --------
+    recommendation (dict): Build mode ('in_memory' or 'out_of_core'), cleaning workers, shard sizes, estimated wall
+                           time, peak memory and disk space of the recommended build and warnings
+    """
+    base_rss = coefficients['base_rss']
+    if max_memory is not None:
+        budget = parse_memory_size(max_memory)
+    elif machine['memory_available'] is not None:
+        budget = MEMORY_SAFETY * machine['memory_available']
+    else:
+        budget = None
+    df_read = df_plan.loc[df_plan['stage'].str.startswith('read_')]
+    df_merged = df_plan.loc[df_plan['stage'].isin(MERGED_STAGES)]
+    df_cleaning = df_plan.loc[df_plan['stage'].isin(CLEANING_STAGES)]
+    # Size of the merged data in memory, estimated from the yearly files as in the out-of-core mode
+    # (see get_n_buckets() in out_of_core_TRACE.py)
+    merged_bytes = df_read['disk_bytes'].sum() * MEMORY_FACTOR_MERGE
+
+    warnings = []
+    # The reading-in step holds one year in memory and cannot be partitioned
+    read_peak = df_read['peak_rss_bytes'].max() if len(df_read) > 0 else 0
+    if (budget is not None) and (read_peak > budget):
+        warnings.append('The reading-in of the year {} needs about {} of memory, more than the budget of {}. The '
+                        'reading-in step cannot be split, use a machine with more memory'.format(
+                            int(df_read.loc[df_read['peak_rss_bytes'].idxmax(), 'year']), format_bytes(read_peak),
+                            format_bytes(budget)))
+
+    recommendation = {
+        'memory_budget': budget,
+        'merged_bytes': merged_bytes,
+        'cleaning_workers': 1,
+        'n_shards': None,
+        'n_buckets': None,
+        'n_slices': None,
+        'shard_bytes': None,
+        'max_memory': None,
+    }
+    # The default build skips the stages with a valid checkpoint. The other modes store no checkpoints, they only
+    # skip the reading-in step if the yearly files exist
+    wall_time = df_plan.loc[df_plan['run'], 'wall_time_s'].sum()
+    wall_time_no_checkpoints = df_plan.loc[df_plan['run'] & (df_plan['stage'].isin(MERGED_STAGES) == False),
+                                           'wall_time_s'].sum() + df_merged['wall_time_s'].sum()
+    peak_in_memory = df_plan['peak_rss_bytes'].max()
+    disk_bytes = df_plan['disk_bytes'].sum()
+    if (budget is None) or (df_merged['peak_rss_bytes'].max() <= budget):
+        # The default build fits. Use as many cleaning workers as cores and memory allow
+        recommendation['mode'] = 'in_memory'
+        recommendation['peak_rss_bytes'] = peak_in_memory
+        if budget is not None:
+            for n_workers in range(machine['cpu_count'], 1, -1):
+                peak_parallel, shard_bytes = get_parallel_peak(merged_bytes, n_workers, base_rss)
+                if peak_parallel <= budget:
+                    recommendation['cleaning_workers'] = n_workers
+                    recommendation['n_shards'] = n_workers * SHARDS_PER_WORKER
+                    recommendation['shard_bytes'] = shard_bytes
+                    recommendation['peak_rss_bytes'] = max(peak_in_memory, peak_parallel)
+                    wall_time = wall_time_no_checkpoints - df_cleaning['wall_time_s'].sum() + \
+                        df_cleaning['wall_time_s'].sum() / (1 + (n_workers - 1) * PARALLEL_EFFICIENCY)
+                    break
+    else:
+        # The merged data does not fit, run the steps after the read-in shard by shard (see out_of_core_TRACE.py)
+        recommendation['mode'] = 'out_of_core'
+        shard_bytes = budget / MEMORY_FACTOR_CLEANING
+        n_shards = max(1, math.ceil(merged_bytes / shard_bytes))
+        # Every year is merged in CUSIP slices that fit into the budget, the buckets are a multiple of the slices
+        n_slices = get_n_slices(df_read['disk_bytes'].max(), budget)
+        recommendation['n_shards'] = n_shards
+        recommendation['n_slices'] = n_slices
+        recommendation['n_buckets'] = math.ceil(n_shards * BUCKETS_PER_SHARD / n_slices) * n_slices
+        recommendation['shard_bytes'] = merged_bytes / n_shards
+        if budget >= 1024**3:
+            recommendation['max_memory'] = '{}G'.format(int(budget / 1024**3))
+        else:
+            recommendation['max_memory'] = '{}M'.format(max(1, int(budget / 1024**2)))
+        wall_time = wall_time_no_checkpoints
+        recommendation['peak_rss_bytes'] = max(read_peak, base_rss + MEMORY_FACTOR_CLEANING * merged_bytes / n_shards)
+        # The shards on disk (about the size of the yearly files) are written next to the final dataset
+        disk_bytes = disk_bytes + df_read['disk_bytes'].sum()
+    recommendation['wall_time_s'] = wall_time
+    recommendation['wall_time_full_s'] = df_plan['wall_time_s'].sum()
+    recommendation['disk_bytes'] = disk_bytes
+    if disk_bytes > machine['disk_free']:
+        warnings.append('The build writes about {} but only {} are free on the disk of the project'.format(
+            format_bytes(disk_bytes), format_bytes(machine['disk_free'])))
+    recommendation['warnings'] = warnings
+
+    return recommendation
+
+
+def format_duration(seconds):
+    """
+    Format a duration in seconds (e.g. '2:05:30').
+    """
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+def print_plan(df_plan, machine, recommendation, n_reports):
+    """
+    Print the estimates of the stages and the recommended build.
+    """
+    df_print = df_plan.copy()
+    df_print['wall_time'] = df_print['wall_time_s'].apply(format_duration)
+    df_print['peak_rss'] = df_print['peak_rss_bytes'].apply(format_bytes)
+    df_print['disk'] = df_print['disk_bytes'].apply(format_bytes)
+    for col in ['rows_in', 'rows_out']:
+        df_print[col] = df_print[col].apply(lambda x: '' if pd.isna(x) else '{:,.0f}'.format(x))
+    print('')
+    print('PLAN: Estimated cost of the stages (calibrated on {} run report(s){})'.format(
+        n_reports, '' if n_reports > 0 else ', default coefficients'))
+    print(df_print[['stage', 'rows_in', 'rows_out', 'wall_time', 'peak_rss', 'disk', 'run']].to_string(index=False))
+    print('')
+    print('PLAN: Machine with {} cores, {} of memory available ({} total), {} of free disk'.format(
+        machine['cpu_count'], format_bytes(machine['memory_available']), format_bytes(machine['memory_total']),
+        format_bytes(machine['disk_free'])))
+    if recommendation['mode'] == 'in_memory':
+        if recommendation['cleaning_workers'] > 1:
+            print('PLAN: Recommended build: in memory with {} cleaning workers on {} shards of about {} '
+                  '(--workers {})'.format(recommendation['cleaning_workers'], recommendation['n_shards'],
+                                         format_bytes(recommendation['shard_bytes']),
+                                         recommendation['cleaning_workers']))
+        else:
+            print('PLAN: Recommended build: in memory with checkpoints (default)')
+    else:
+        print('PLAN: Recommended build: out-of-core with {} shards of about {} in {} hash buckets, merged in {} '
+              'CUSIP slices (--max-memory {})'.format(recommendation['n_shards'],
+                                                      format_bytes(recommendation['shard_bytes']),
+                                                      recommendation['n_buckets'], recommendation['n_slices'],
+                                                      recommendation['max_memory']))
+    print('PLAN: Estimated wall time {} (full rebuild {}), peak memory {}, disk {}'.format(
+        format_duration(recommendation['wall_time_s']), format_duration(recommendation['wall_time_full_s']),
+        format_bytes(recommendation['peak_rss_bytes']),
+        format_bytes(recommendation['disk_bytes'])))
+    for warning in recommendation['warnings']:
+        print('WARNING: {}'.format(warning))
+
+
+def store_plan(project_path, plan):
+    """
+    Store the plan as JSON in bld/data/TRACE/TRACE_info/plan (plan_<timestamp>.json and plan_latest.json).
+
+    Returns:
+    --------
+    plan_path (str): Path of the stored plan
+    """
+    path_plan = project_path + '/bld/data/TRACE/TRACE_info/plan/'
+    os.makedirs(path_plan, exist_ok=True)
+    plan_path = path_plan + 'plan_{}.json'.format(datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+    for file_path in [plan_path, path_plan + 'plan_latest.json']:
+        with open(file_path, 'w') as f:
+            json.dump(plan, f, indent=2, default=lambda x: x.item() if hasattr(x, 'item') else str(x))
+
+    return plan_path
+
+
+def plan_build(project_path, dataset_specs, max_memory=None, calibration_paths=None):
+    """
+    Plan the build of the final dataset without running it (see the steps at the top).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    max_memory (str): Memory budget (e.g. '32G', None -> MEMORY_SAFETY times the available memory)
+    calibration_paths (list): Project root paths whose run reports calibrate the coefficients (None -> the project)
+
+    Returns:
+    --------
+    plan (dict): Machine, inventory, calibrated coefficients, estimates of the stages and the recommended build
+    """
+    if calibration_paths is None:
+        calibration_paths = [project_path]
+
+    # Step 1: Inventory of the raw data and resources of the machine
+    df_inventory = get_raw_inventory(project_path, dataset_specs)
+    machine = get_machine(project_path)
+    # Step 2: Cost coefficients
+    coefficients, n_reports = calibrate_coefficients(calibration_paths)
+    # Step 3: Estimates of the stages. Stages with a valid checkpoint are skipped by the default build
+    df_plan = estimate_stages(df_inventory, coefficients, get_stage_status(project_path, dataset_specs))
+    # Step 4: Recommended build
+    recommendation = recommend_build(df_plan, machine, coefficients, max_memory)
+    print_plan(df_plan, machine, recommendation, n_reports)
+
+    plan = {
+        'created': datetime.datetime.now().isoformat(),
+        'sample_time_span': dataset_specs['sample_time_span'],
+        'machine': machine,
+        'n_reports': n_reports,
+        'coefficients': coefficients,
+        'inventory': df_inventory.reset_index().to_dict(orient='records'),
+        'stages': df_plan.to_dict(orient='records'),
+        'recommendation': recommendation,
+    }
+    plan_path = store_plan(project_path, plan)
+    print('PLAN: The plan is stored in {}'.format(plan_path))
+
+    return plan
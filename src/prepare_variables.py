@@ -8,6 +8,8 @@ from datetime import date, datetime
 import numpy as np
 import pandas as pd
 pd.options.mode.chained_assignment = None
+# Import the join with the check of the result size
+from join_guard_TRACE import guarded_merge
 
 
 def create_necessary_vars(df_in):
@@ -48,32 +50,47 @@ def create_necessary_vars(df_in):
     return df_add_vars
 
 
-def define_event_time_week(df_in):
+def get_event_time_dates(df_in):
     """
-    Attach to every date in the sample the respective event day and event week. This is important as in the
-    subsequent quarter-end analyses there are frequently analyses requiring the usage of event time. In a last step,
-    add the quarter event dummies. This is necessary as we often have to compare different quarter-ends within a
-    quarter. In this regard, it is very important that we do not group by quarter as this would essentially imply,
-    for instance, that we compare the end of quarter 4 with the beginning of quarter 4 whereas we would in fact like
-    to compare the end of quarter 4 with the beginning of quarter 1 in the subsequent year.
+    Get the distinct trading dates of a part of the sample (e.g. a partition or a shard). The dates of all parts
+    define the event time tables of the entire sample (see get_event_time_tables()).
 
     Parameters:
     -----------
-    df_in (DataFrame): Input DataFrame that is partially cleaned
+    df_in (DataFrame): Input DataFrame (needs the variables trd_exctn_dt, year, quarter, month, week and day)
 
     Returns:
     --------
-    df_add_event_time (DataFrame): Output DataFrame that is ammended by the respective event time variables
+    df_dates (DataFrame): Distinct trading dates
     """
+    df_dates = df_in.drop_duplicates(subset=['year', 'month', 'day', 'quarter', 'week'])[
+        ['trd_exctn_dt', 'year', 'quarter', 'month', 'week', 'day']
+    ]
 
-    print("")
-    print('STEP 7.2: Create necessary event-time variables')
-    df_add_event_time = df_in.copy()
+    return df_dates
+
+
+def get_event_time_tables(df_in):
+    """
+    Define the event day for every trading date and the event week for every (quarter, week) combination in the
+    sample (see define_event_time_week()). The tables only depend on the distinct trading dates in the sample. Thus,
+    df_in can also be any DataFrame that contains every trading date of the sample at least once (e.g. the distinct
+    dates of all partitions of the sample).
+
+    Parameters:
+    -----------
+    df_in (DataFrame): Input DataFrame (needs the variables trd_exctn_dt, year, quarter, month, week and day)
+
+    Returns:
+    --------
+    event_day_tmp (DataFrame): Event day per trading date (year, month, day)
+    event_week_tmp (DataFrame): Event week per quarter and week
+    """
 
     # Define the event time. In particular, split the quarter in two parts in the middle (month 1.5, 4.5,...)
     # Define days from quarter beginning to the middle with increasing event time numbers and afterwards
     # decreasing towards the sample end.
-    event_day_tmp = df_add_event_time.drop_duplicates(subset=['year', 'month', 'day']).sort_values('trd_exctn_dt')
+    event_day_tmp = df_in.drop_duplicates(subset=['year', 'month', 'day']).sort_values('trd_exctn_dt')
     # Define an indicator variable for whether the respective day is in the first or second half of the given
     # quarter (1 = first, 0=second)
     event_day_tmp['first_half_quarter'] = ((event_day_tmp.month.isin([1, 4, 7, 10])) | (
@@ -87,11 +104,9 @@ def define_event_time_week(df_in):
             (event_day_tmp['event_day_2'] * (1 - event_day_tmp['first_half_quarter'])) * (-1)
     )
     event_day_tmp = event_day_tmp[['year', 'month', 'day', 'event_day']]
-    # Merge the event time to the main dataset
-    df_add_event_time = df_add_event_time.merge(event_day_tmp, on=['year', 'month', 'day'], how='left')
 
     ## Define the event week
-    event_week_tmp = df_add_event_time.drop_duplicates(subset=['quarter', 'week']).sort_values(['week'])[['quarter', 'week']]
+    event_week_tmp = df_in.drop_duplicates(subset=['quarter', 'week']).sort_values(['week'])[['quarter', 'week']]
     event_week_tmp['first_half_quarter'] = (
             (event_week_tmp.week.isin(
                 [1, 2, 3, 4, 5, 6, 7, 15, 16, 17, 18, 19, 20, 28, 29, 30, 31, 32, 33, 41, 42, 43, 44, 45, 46])
@@ -105,9 +120,35 @@ def define_event_time_week(df_in):
             event_week_tmp['event_week_1'] * event_week_tmp['first_half_quarter'] +
             (event_week_tmp['event_week_2'] * (1 - event_week_tmp['first_half_quarter'])) * (-1)
     )
+    event_week_tmp = event_week_tmp[['quarter', 'week', 'event_week']]
+
+    return event_day_tmp, event_week_tmp
+
+
+def add_event_time_vars(df_in, event_day_tmp, event_week_tmp, settings=None):
+    """
+    Merge the event day and event week (see get_event_time_tables()) to the transactions and add the quarter event
+    dummy (see define_event_time_week()).
+
+    Parameters:
+    -----------
+    df_in (DataFrame): Input DataFrame that is partially cleaned
+    event_day_tmp (DataFrame): Event day per trading date
+    event_week_tmp (DataFrame): Event week per quarter and week
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    df_add_event_time (DataFrame): Output DataFrame that is ammended by the respective event time variables
+    """
+    df_add_event_time = df_in.copy()
+
+    # Merge the event time to the main dataset
+    df_add_event_time = guarded_merge(df_add_event_time, event_day_tmp, 'add_event_time_vars: event day',
+                                      on=['year', 'month', 'day'], how='left', settings=settings)
     # Merge the event week to the main dataset
-    df_add_event_time = df_add_event_time.merge(event_week_tmp[['quarter', 'week', 'event_week']], on=['quarter', 'week'],
-                        how='left')
+    df_add_event_time = guarded_merge(df_add_event_time, event_week_tmp, 'add_event_time_vars: event week',
+                                      on=['quarter', 'week'], how='left', settings=settings)
     # Implement necessary corrections due to differences in day/week structure
     df_add_event_time.loc[(df_add_event_time.quarter == 2) & (df_add_event_time.week == 13), 'event_week'] = 1
     df_add_event_time.loc[(df_add_event_time.quarter == 2) & (df_add_event_time.week == 14), 'event_week'] = 1
@@ -137,6 +178,36 @@ def define_event_time_week(df_in):
     return df_add_event_time
 
 
+def define_event_time_week(df_in, settings=None):
+    """
+    Attach to every date in the sample the respective event day and event week. This is important as in the
+    subsequent quarter-end analyses there are frequently analyses requiring the usage of event time. In a last step,
+    add the quarter event dummies. This is necessary as we often have to compare different quarter-ends within a
+    quarter. In this regard, it is very important that we do not group by quarter as this would essentially imply,
+    for instance, that we compare the end of quarter 4 with the beginning of quarter 4 whereas we would in fact like
+    to compare the end of quarter 4 with the beginning of quarter 1 in the subsequent year.
+
+    Parameters:
+    -----------
+    df_in (DataFrame): Input DataFrame that is partially cleaned
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    df_add_event_time (DataFrame): Output DataFrame that is ammended by the respective event time variables
+    """
+
+    print("")
+    print('STEP 7.2: Create necessary event-time variables')
+
+    # Define the event day and the event week based on all trading dates in the sample
+    event_day_tmp, event_week_tmp = get_event_time_tables(df_in)
+    # Merge the event time to the main dataset
+    df_add_event_time = add_event_time_vars(df_in, event_day_tmp, event_week_tmp, settings)
+
+    return df_add_event_time
+
+
 def map_risk_weight_reg_period(df_in):
     """
     Map the rating categories to Basel III risk weights and define the regulatory periods following
@@ -185,13 +256,13 @@ def map_risk_weight_reg_period(df_in):
     return tmp_reg_period[['reg_period']], tmp_remap_rw[['ECRA']]
 
 
-def merge_issue_info(df_in, path, dict_spec):
+def merge_issue_info(df_in, path, dict_spec, settings=None):
     """
     Merge the issue level information to the TRACE dataset.
 
     Parameters:
     -----------
-    None
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -212,6 +283,7 @@ def merge_issue_info(df_in, path, dict_spec):
     issue_data_var_list = dict_spec['issue_data']['varlist']
     issue_data_red = issue_data[issue_data_var_list]
 
-    df_merge_issue = df_in.merge(issue_data_red, on = ['CUSIP_ID'], how = 'left')
+    df_merge_issue = guarded_merge(df_in, issue_data_red, 'merge_issue_info', on = ['CUSIP_ID'], how = 'left',
+                                   settings=settings)
 
     return df_merge_issue
\ No newline at end of file
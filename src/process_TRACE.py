@@ -0,0 +1,480 @@
+"""
+Apply the cleaning steps and the variable construction to the concatenated and merged TRACE data. The steps are
+as follows:
+    Step 1:     Clean the agency trades and delete one side of the inter-dealer trades
+                (Dick-Nielsen & Poulsen (2019))
+    Step 2:     Implement the cleaning steps as in Bessembinder et al. (2018) and Anand et al. (2021)
+    Step 3:     Implement the general data cleaning steps and the cleaning steps for TRACE holidays and
+                non-week days
+    Step 4:     Add additional necessary variables
+
+All steps are either on the bond or on the transaction level. Thus, the function can be applied to the entire
+sample or to a subset of bonds (see update_TRACE.py). The event time variables in define_event_time_week() depend
+on all trading dates in the sample and are therefore added separately.
+
+clean_merged_data_two_pass() produces the identical transactions without holding the entire merged sample in memory:
+    Pass 0:     The merged yearly data is stored in partitions by execution year. The inter-dealer trades are
+                matched on the execution date and thus both sides of a trade are always in the same partition.
+    Pass 1:     Delete the inter-dealer trades partition by partition and compute the bond-level statistics that
+                are needed over the entire sample (number of trades and maximum of the trade size indicator per
+                CUSIP, see get_cusip_trade_stats()).
+    Pass 2:     Apply the remaining cleaning steps and the variable creation partition by partition using the
+                bond-level statistics of pass 1.
+    Event time: Define the event time tables from the distinct trading dates of all partitions and add the event
+                time variables partition by partition. The final dataset is stored as one file per partition.
+
+clean_merged_data_parallel() produces the identical output in parallel. The transactions are hash-partitioned by
+CUSIP into shards on disk (while the yearly data is merged or from the merged data) such that all transactions of a
+bond are in the same shard, and every worker process loads and cleans its shards. The event time variables (the only
+step over the entire sample) are added centrally afterwards.
+"""
+
+import copy
+import gc
+import os
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+from joblib import Parallel, delayed, cpu_count
+
+# Import the inter-dealer transaction and agency trade filter according to
+# Dick-Nielsen & Poulsen (2019)
+from clean_TRACE import del_interd_transact
+# Import the cleaning function as specified in Bessembinder et al. (2018)
+from clean_TRACE import clean_trade_level
+# Import further specific cleaning steps
+from clean_TRACE import clean_df_general
+# Import the cleaning steps for individual trading dates
+from clean_TRACE import add_clean_trading_dates
+# Import the bond-level statistics for the partition-wise trade-level cleaning
+from clean_TRACE import get_cusip_trade_stats, combine_cusip_trade_stats
+# Import function to read generate the later on required variables
+from prepare_variables import create_necessary_vars
+# Import the event time variables of a partition
+from prepare_variables import get_event_time_dates, get_event_time_tables, add_event_time_vars
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import store_frame, remove_frame
+# Import the loop over the merged yearly data
+from concatenate_merge_TRACE_MERGENT import iter_merged_data
+# Import the background writer of the partitions (see async_io_TRACE.py)
+from async_io_TRACE import write_pickle_async, wait_for_writes
+# Import the settings of the build (see settings_TRACE.py)
+from settings_TRACE import get_settings
+# Import the transfer of the cleaned shards from the worker processes through shared memory
+from shared_memory_TRACE import share_frame, collect_frames, shared_frames
+
+
+def drop_interd_transact(df_merged, settings=None):
+    """
+    Delete one side of the inter-dealer trades using del_interd_transact().
+
+    Parameters:
+    -----------
+    df_merged (DataFrame): Concatenated and merged TRACE data
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    df_merged_cleaned_1 (DataFrame): TRACE data without the double-counted inter-dealer trades
+    """
+
+    # Define a selection variable based on which the inter-dealer transactions are deleted.
+    df_merged['I_drop'] = np.arange(0, len(df_merged))
+    # Select only the necessary variables
+    df_merged_red = df_merged[['CUSIP_ID', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'ENTRD_VOL_QT', 'RPTD_PR', 'RPTG_PARTY_ID',
+                               'CNTRA_PARTY_ID', 'RPT_SIDE_CD', 'I_drop']].copy()
+    list_keep = del_interd_transact(df_merged_red, settings)
+    df_merged_cleaned_1 = df_merged.loc[df_merged['I_drop'].isin(list_keep)]
+    del [df_merged, df_merged_red]
+    gc.collect()
+    df_merged_cleaned_1 = df_merged_cleaned_1[df_merged_cleaned_1.columns.drop(['I_drop'])]
+
+    return df_merged_cleaned_1
+
+
+def clean_merged_data(df_merged, project_path, dataset_specs, settings=None):
+    """
+    Apply all cleaning steps and add the necessary variables to the concatenated and merged TRACE data
+    (output of conct_merge_data()).
+
+    Parameters:
+    -----------
+    df_merged (DataFrame): Concatenated and merged TRACE data
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs)
+
+    Returns:
+    --------
+    df_merged_cleaned_5_1 (DataFrame): Cleaned TRACE data including the additional variables (but without the
+                                       event time variables)
+    """
+    if settings is None:
+        settings = get_settings(dataset_specs)
+
+    # Step 1) Clean the agency trades and delete one side of the inter-dealer trades
+    # NOTE: This applies the cleaning step proposed in Dick-Nielsen & Poulsen (2019) for the agency trades and the
+    # inter-dealer trades. However, this step is not necessary and has to be explicitly motivated.
+    # Motivation: I decide to exclude:
+    # a) Double-counted inter-dealer trades. If we leave them in, every D-D trade has two entries, one from the buying and
+    # one from the selling dealer. However, there is only one trade. By cancelling one of these two reports no information
+    # is lost and there is no risk of double-counting
+    # b) Agency trades without commission: If we leave them in we would
+    # essentially see some  agency trades that seem to be very cheap. However, Dick-Nielsen (2014) points out that there
+    # are some unreported costs (e.g. fees) in the background. -> Currently agency trades are NOT excluded
+    df_merged_cleaned_1 = drop_interd_transact(df_merged, settings)
+    del [df_merged]
+
+    # Step 2) Implement the cleaning steps as in Bessembinder et al. (2018) and Anand et al. (2021)
+    df_merged_cleaned_2 = clean_trade_level(df_merged_cleaned_1)
+    del [df_merged_cleaned_1]
+    gc.collect()
+
+    # Step 3.1) Implement the general data cleaning steps
+    df_merged_cleaned_3 = clean_df_general(df_merged_cleaned_2, dataset_specs)
+    del [df_merged_cleaned_2]
+    gc.collect()
+
+    # Step 3.2) Implement the cleaning steps for TRACE holidays and non-week days
+    df_merged_cleaned_4 = add_clean_trading_dates(df_merged_cleaned_3, project_path)
+    del [df_merged_cleaned_3]
+    gc.collect()
+
+    # Step 4) Add additional necessary variables
+    df_merged_cleaned_5_1 = create_necessary_vars(df_merged_cleaned_4)
+    del [df_merged_cleaned_4]
+
+    return df_merged_cleaned_5_1
+
+
+def write_merged_partitions(project_path, dataset_specs, settings):
+    """
+    Pass 0 of clean_merged_data_two_pass(): Loop over the merged yearly data and store it in partitions by execution
+    year. Every yearly file contributes one part file to each partition. The variable I_order records the position
+    of every transaction in the concatenated data of conct_merge_data() to restore the ordering at the end.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    partition_years (list): Execution years of all partitions
+    """
+    path_partitions = project_path + '/bld/data/TRACE/TRACE_partitions/'
+    # Delete the partitions of previous runs
+    for f in os.listdir(path_partitions):
+        if f.startswith('TRACE_'):
+            os.remove(path_partitions + f)
+
+    partition_years = set()
+    N_trnsct = 0
+    for k, df_year in enumerate(iter_merged_data(project_path, dataset_specs, settings=settings)):
+        df_year['I_order'] = np.arange(N_trnsct, N_trnsct + len(df_year))
+        N_trnsct = N_trnsct + len(df_year)
+        exctn_year = pd.to_datetime(df_year['TRD_EXCTN_DT']).dt.year
+        for year, df_part in df_year.groupby(exctn_year):
+            write_pickle_async(df_part, path_partitions + 'TRACE_merged_{}_{}.pkl'.format(year, k), settings)
+            partition_years.add(year)
+        del [df_year]
+        gc.collect()
+    # Wait until the background writer has stored all partitions
+    wait_for_writes()
+
+    return sorted(partition_years)
+
+
+def load_partition(project_path, partition_name, year):
+    """
+    Load one partition, i.e. concatenate all of its part files (see write_merged_partitions()).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    partition_name (str): Name of the partition (e.g. 'TRACE_merged')
+    year (int): Execution year of the partition
+
+    Returns:
+    --------
+    df_part (DataFrame): Partition data
+    """
+    path_partitions = project_path + '/bld/data/TRACE/TRACE_partitions/'
+    part_files = sorted(
+        [f for f in os.listdir(path_partitions) if f.startswith('{}_{}_'.format(partition_name, year))],
+        key=lambda f: int(f[:-4].split('_')[-1])
+    )
+    df_part = pd.concat([pd.read_pickle(path_partitions + f) for f in part_files])
+
+    return df_part
+
+
+def remove_final_files(project_path):
+    """
+    Delete the final dataset of previous runs (TRACE_final.pkl and the files of the partitions or shards
+    TRACE_final_<k>.pkl, see clean_merged_data_two_pass() and out_of_core_TRACE.py).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    """
+    path_final = project_path + '/bld/data/TRACE/TRACE_final_clean/'
+    for f in os.listdir(path_final):
+        if f.startswith('TRACE_final'):
+            remove_frame(path_final + os.path.splitext(f)[0] + '.pkl')
+
+
+def clean_merged_data_two_pass(project_path, dataset_specs, settings=None):
+    """
+    Concatenate and merge the yearly TRACE data and apply all cleaning steps, the variable creation and the event
+    time variables in two passes over partitions by execution year (see the description at the top). The
+    transactions are identical to define_event_time_week(clean_merged_data(conct_merge_data())) but at most one
+    partition is in memory at a time. The final dataset is stored as one file per partition (TRACE_final_<k>.pkl,
+    the latest execution year first). Within a partition, the transactions are in the order of the in-memory build.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs)
+
+    Returns:
+    --------
+    final_files (list): Paths of the files of the final dataset
+    """
+    if settings is None:
+        settings = get_settings(dataset_specs)
+    path_partitions = project_path + '/bld/data/TRACE/TRACE_partitions/'
+    path_final = project_path + '/bld/data/TRACE/TRACE_final_clean/'
+
+    # Pass 0: Store the merged data in partitions by execution year
+    print("")
+    print('STEP 2: The concatenation step has started. The merged data is stored in partitions by execution year')
+    partition_years = write_merged_partitions(project_path, dataset_specs, settings)
+
+    # Pass 1: Delete the inter-dealer trades and compute the bond-level statistics over the entire sample
+    list_stats = []
+    for year in partition_years:
+        print('Pass 1: Inter-dealer trades and bond-level statistics of the partition {}'.format(year))
+        df_part = drop_interd_transact(load_partition(project_path, 'TRACE_merged', year), settings)
+        list_stats.append(get_cusip_trade_stats(df_part))
+        write_pickle_async(df_part, path_partitions + 'TRACE_interd_{}_0.pkl'.format(year), settings)
+        del [df_part]
+        gc.collect()
+    wait_for_writes()
+    cusip_stats = combine_cusip_trade_stats(list_stats)
+
+    # Pass 2: Apply the remaining cleaning steps partition by partition. Keep the ordering variable I_order in the
+    # dataset to restore the ordering of the concatenated data within every partition at the end. Keep the distinct
+    # trading dates of every partition for the event time tables
+    dataset_specs_order = copy.deepcopy(dataset_specs)
+    dataset_specs_order['dataset_clean']['varlist'] = dataset_specs['dataset_clean']['varlist'] + ['I_order']
+    list_clean = []
+    list_dates = []
+    for year in partition_years:
+        print('Pass 2: Cleaning of the partition {}'.format(year))
+        df_part = clean_trade_level(load_partition(project_path, 'TRACE_interd', year), cusip_stats)
+        df_part = clean_df_general(df_part, dataset_specs_order)
+        if len(df_part) > 0:
+            df_part = add_clean_trading_dates(df_part, project_path)
+        if len(df_part) > 0:
+            df_part = create_necessary_vars(df_part)
+            list_dates.append(get_event_time_dates(df_part))
+            write_pickle_async(df_part, path_partitions + 'TRACE_cleaned_{}_0.pkl'.format(year), settings)
+            list_clean.append(year)
+        del [df_part]
+        gc.collect()
+    wait_for_writes()
+
+    # Define the event time tables from the trading dates of all partitions (the only step over the entire sample)
+    # and add the event time variables partition by partition
+    print("")
+    print('STEP 7.2: Create necessary event-time variables')
+    remove_final_files(project_path)
+    event_day_tmp, event_week_tmp = get_event_time_tables(pd.concat(list_dates))
+    final_files = []
+    N_trnsct = 0
+    for year in sorted(list_clean, reverse=True):
+        df_part = add_event_time_vars(load_partition(project_path, 'TRACE_cleaned', year), event_day_tmp,
+                                      event_week_tmp, settings)
+        # Restore the ordering of the concatenated data
+        df_part = df_part.sort_values('i_order').drop(columns=['i_order']).reset_index(drop=True)
+        final_files.append(path_final + 'TRACE_final_{}.pkl'.format(len(final_files)))
+        store_frame(df_part, final_files[-1], settings)
+        N_trnsct = N_trnsct + len(df_part)
+        del [df_part]
+        gc.collect()
+    print('The final dataset ({} transactions) is stored in {} files'.format(N_trnsct, len(final_files)))
+
+    return final_files
+
+
+def get_cusip_bucket(cusips, n_buckets):
+    """
+    Assign every CUSIP to a hash bucket. The hash is deterministic (unlike Python's hash()), i.e. the same CUSIP is
+    always in the same bucket.
+
+    Parameters:
+    -----------
+    cusips (Series): CUSIP IDs
+    n_buckets (int): Number of hash buckets
+
+    Returns:
+    --------
+    buckets (np.array): Bucket of every CUSIP
+    """
+    buckets = (pd.util.hash_array(cusips.astype(str).values) % np.uint64(n_buckets)).astype(np.int64)
+
+    return buckets
+
+
+def clean_merged_shard(df_shard, project_path, dataset_specs, settings):
+    """
+    Apply all cleaning steps and the variable creation to one shard of the merged data. All transactions of a bond
+    have to be in the same shard. The bond-level cleaning steps then need no information of the other shards.
+
+    Parameters:
+    -----------
+    df_shard (DataFrame): Merged TRACE data of a subset of bonds
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    df_shard (DataFrame): Cleaned TRACE data including the additional variables (but without the event time
+                          variables). May be empty.
+    """
+    df_shard = clean_trade_level(drop_interd_transact(df_shard, settings))
+    df_shard = clean_df_general(df_shard, dataset_specs)
+    if len(df_shard) > 0:
+        df_shard = add_clean_trading_dates(df_shard, project_path)
+    if len(df_shard) > 0:
+        df_shard = create_necessary_vars(df_shard)
+
+    return df_shard
+
+
+def write_merged_shards(project_path, dataset_specs, n_shards, settings, df_merged=None):
+    """
+    Hash-partition the merged data by CUSIP into shards on disk. Without df_merged, the merged yearly data is written
+    year by year, i.e. the merged sample is never held in memory. Every yearly file (or df_merged) contributes one
+    part file to each shard. The variable I_order records the position of every transaction in the concatenated data
+    of conct_merge_data() to restore the ordering at the end.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    n_shards (int): Number of CUSIP shards
+    settings (dict): Settings of the build (see settings_TRACE.py)
+    df_merged (DataFrame): Optional. Concatenated and merged TRACE data (None -> merge the yearly data)
+
+    Returns:
+    --------
+    shard_ids (list): Identifiers of the non-empty shards
+    N_trnsct (int): Number of transactions
+    """
+    path_partitions = project_path + '/bld/data/TRACE/TRACE_partitions/'
+    # Delete the partitions of previous runs
+    for f in os.listdir(path_partitions):
+        if f.startswith('TRACE_'):
+            os.remove(path_partitions + f)
+
+    shard_ids = set()
+    N_trnsct = 0
+    merged_data = [df_merged] if df_merged is not None else iter_merged_data(project_path, dataset_specs,
+                                                                              settings=settings)
+    for k, df_year in enumerate(merged_data):
+        # Only one shard of the year is copied at a time
+        buckets = get_cusip_bucket(df_year['CUSIP_ID'], n_shards)
+        for shard_id, rows in pd.Series(buckets).groupby(buckets).indices.items():
+            df_shard = df_year.iloc[rows]
+            df_shard['I_order'] = N_trnsct + rows
+            write_pickle_async(df_shard, path_partitions + 'TRACE_shard_{}_{}.pkl'.format(shard_id, k), settings)
+            shard_ids.add(shard_id)
+            del [df_shard]
+        N_trnsct = N_trnsct + len(df_year)
+        del [df_year]
+        gc.collect()
+    # Wait until the background writer has stored all shards
+    wait_for_writes()
+
+    return sorted(shard_ids), N_trnsct
+
+
+def clean_merged_shard_shared(project_path, dataset_specs, shard_id, prefix, settings):
+    """
+    Load one shard from disk and clean it in a worker process (see clean_merged_shard()). The result is returned
+    through shared memory instead of pickling it.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    shard_id (int): Identifier of the shard (see write_merged_shards())
+    prefix (str): Prefix of the shared memory segment (see shared_frames() in shared_memory_TRACE.py)
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    handle (dict): Handle of the cleaned shard (see share_frame() in shared_memory_TRACE.py)
+    """
+    df_shard = load_partition(project_path, 'TRACE_shard', shard_id)
+
+    return share_frame(clean_merged_shard(df_shard, project_path, dataset_specs, settings), prefix)
+
+
+def clean_merged_data_parallel(df_merged, project_path, dataset_specs, N_workers, settings=None):
+    """
+    Apply all cleaning steps and add the necessary variables to the concatenated and merged TRACE data in a pool of
+    worker processes. The output is identical to clean_merged_data().
+
+    Parameters:
+    -----------
+    df_merged (DataFrame): Concatenated and merged TRACE data (None -> merge the yearly data while it is written to
+                           the shards, see write_merged_shards())
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    N_workers (int): Number of worker processes (-1 -> use all available cores)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs). The
+                     worker processes get the settings as an argument
+
+    Returns:
+    --------
+    df_clean (DataFrame): Cleaned TRACE data including the additional variables (but without the event time
+                          variables)
+    """
+    if settings is None:
+        settings = get_settings(dataset_specs)
+    if N_workers < 0:
+        N_workers = cpu_count()
+    # Use more shards than workers to balance the load between the workers (the bonds differ strongly in the
+    # number of transactions)
+    n_shards = N_workers * 4
+    print("")
+    print('STEP 3: The cleaning steps are run on {} CUSIP shards with {} worker processes'.format(n_shards,
+                                                                                                 N_workers))
+
+    # Keep the ordering variable I_order in the dataset to restore the ordering of the serial path at the end
+    dataset_specs_order = copy.deepcopy(dataset_specs)
+    dataset_specs_order['dataset_clean']['varlist'] = dataset_specs['dataset_clean']['varlist'] + ['I_order']
+
+    # Hash-partition the transactions by CUSIP on disk. The workers load their shards, i.e. the shards are neither
+    # held in the parent process nor pickled to the workers
+    shard_ids, N_trnsct = write_merged_shards(project_path, dataset_specs, n_shards, settings, df_merged)
+    print('STEP 3: {} transactions are written to {} shards'.format(N_trnsct, len(shard_ids)))
+    # The workers return the cleaned shards in shared memory segments, which are removed once the shards are
+    # concatenated (or after an error)
+    with shared_frames() as prefix:
+        handles = Parallel(n_jobs=N_workers)(
+            delayed(clean_merged_shard_shared)(project_path, dataset_specs_order, shard_id, prefix, settings)
+            for shard_id in shard_ids
+        )
+
+        # Concatenate the cleaned shards and restore the ordering
+        df_clean = collect_frames(handles)
+    df_clean = df_clean.sort_values('i_order').drop(columns=['i_order'])
+
+    return df_clean
@@ -0,0 +1,132 @@
+"""
+Give every trade a compact provenance ID that points back to its raw record. The ID is assigned when a raw daily file
+is parsed and is kept through the cleaning, the concatenation and the merge until the final dataset (RAW_ID, raw_id
+after the renaming in clean_df_general()). The steps are as follows:
+    Step 1:     Encode the raw file and the line in one int64 (encode_raw_ids()): the file ordinal (year * 1000 + the
+                position of the daily file in its annual folder) in the upper 32 bits and the line (the position of
+                the trade among the trade lines of the file, i.e. the row of pd.read_csv()) in the lower 32 bits.
+    Step 2:     Decode the IDs vectorized (decode_raw_ids()) into year, day and line.
+    Step 3:     Look up the raw records of IDs in the raw daily files with the CUSIP index of the raw files
+                (get_raw_records(), see raw_index_TRACE.py).
+
+Note: The ID is unique per raw trade report, i.e. it can be used to deduplicate or to join trades without a key of
+several columns. IDs of different builds are comparable as long as the raw files do not change.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Name of the provenance ID in the raw and cleaned yearly data (the final dataset has the lowercase name)
+RAW_ID = 'RAW_ID'
+# Number of bits of the line in the ID
+LINE_BITS = 32
+
+
+#########
+# Step 1: Encode the IDs
+########
+def get_file_ordinal(year, day):
+    """
+    Get the ordinal of a raw daily file: year * 1000 + position of the file in its annual folder (e.g. 2014017).
+    """
+    return int(year) * 1000 + int(day)
+
+
+def encode_raw_ids(file_ordinal, lines):
+    """
+    Encode the file ordinal and the lines of some trades in int64 IDs.
+
+    Parameters:
+    -----------
+    file_ordinal (int or array): Ordinal of the raw file (see get_file_ordinal())
+    lines (array): Lines of the trades (position among the trade lines of the file)
+
+    Returns:
+    --------
+    raw_ids (array): Provenance IDs
+    """
+    return (np.asarray(file_ordinal, dtype=np.int64) << LINE_BITS) | np.asarray(lines, dtype=np.int64)
+
+
+def add_raw_ids(df, file_ordinal):
+    """
+    Add the provenance ID to a freshly parsed raw file. The index of the DataFrame is still the line of every trade
+    (the default index of pd.read_csv()).
+
+    Parameters:
+    -----------
+    df (DataFrame): Raw trades of one daily file
+    file_ordinal (int): Ordinal of the raw file (None -> no ID is added)
+
+    Returns:
+    --------
+    df (DataFrame): Raw trades with the provenance ID
+    """
+    if file_ordinal is not None:
+        df[RAW_ID] = encode_raw_ids(file_ordinal, df.index.values)
+
+    return df
+
+
+def get_provenance_vars(df):
+    """
+    Get the provenance variables of a DataFrame, such that they are kept when the variables are selected.
+    """
+    return [v for v in [RAW_ID, RAW_ID.lower()] if v in df.columns]
+
+
+#########
+# Step 2: Decode the IDs
+########
+def decode_raw_ids(raw_ids):
+    """
+    Decode provenance IDs into the raw file (year and position of the daily file) and the line.
+
+    Parameters:
+    -----------
+    raw_ids (array): Provenance IDs
+
+    Returns:
+    --------
+    df_ids (DataFrame): raw_id, year, day (position of the daily file in the annual folder) and line
+    """
+    raw_ids = np.asarray(raw_ids, dtype=np.int64)
+    file_ordinals = raw_ids >> LINE_BITS
+
+    return pd.DataFrame({
+        'raw_id': raw_ids,
+        'year': file_ordinals // 1000,
+        'day': file_ordinals % 1000,
+        'line': raw_ids & np.int64((1 << LINE_BITS) - 1),
+    })
+
+
+#########
+# Step 3: Look up the raw records
+########
+def get_raw_records(project_path, raw_ids):
+    """
+    Look up the raw records of provenance IDs in the raw daily files (e.g. the raw line of a trade in the final
+    dataset). The lines are found with the CUSIP index of the raw files, which is built if it is missing (see
+    raw_index_TRACE.py).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    raw_ids (array): Provenance IDs
+
+    Returns:
+    --------
+    df_records (DataFrame): raw_id, file (path of the raw file), line and record (the raw line, None if the line does
+                            not exist)
+    """
+    from raw_index_TRACE import get_raw_lines
+    df_ids = decode_raw_ids(raw_ids)
+    df_ids['file'] = None
+    df_ids['record'] = None
+    for (year, day), df_file in df_ids.groupby(['year', 'day']):
+        file_path, records = get_raw_lines(project_path, year, day, df_file['line'].values)
+        df_ids.loc[df_file.index, 'file'] = file_path
+        df_ids.loc[df_file.index, 'record'] = records
+
+    return df_ids[['raw_id', 'file', 'line', 'record']]
@@ -0,0 +1,17 @@
+"""
+PyCleanTrace: Read, concatenate and clean the Academic TRACE data (see the README). The processing modules are only
+imported when a function is called.
+
+Example:
+    import pycleantrace
+    dataset_specs = pycleantrace.get_default_specs()
+    dataset_specs['sample_time_span'] = [2010, 2015]
+    pycleantrace.build(dataset_specs)
+    df = pycleantrace.load_trace(columns=['cusip_id', 'trd_exctn_tm', 'rptd_pr'], start='2014-01-01', end='2014-12-31')
+    df = pycleantrace.open_trace(columns=['cusip_id', 'rptd_pr'])
+"""
+
+from pycleantrace.specs import get_default_specs
+from pycleantrace.api import build, run_stage, get_status, update, benchmark, generate, check_equivalence, plan, \
+    load_trace, open_trace, serve, connect, extract_raw_trades, get_raw_records, \
+    load_asof_snapshots, load_duplicates
@@ -0,0 +1,7 @@
+"""
+Run the command line interface via python -m pycleantrace (see cli.py).
+"""
+
+from pycleantrace.cli import main
+
+main()
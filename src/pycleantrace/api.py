@@ -0,0 +1,543 @@
+"""
+Importable API to build the final TRACE dataset. All functions import the processing modules (and thus pandas) only
+when they are called such that importing the package is fast. The functions are as follows:
+    build():        Build the final dataset. By default, the build runs as a DAG of stages with checkpoints and
+                    resumes from the first invalid stage (see pipeline_TRACE.py)
+    run_stage():    Run one stage of the build (and its invalid upstream stages)
+    get_status():   Show which stages are invalid and why
+    update():       Update the final dataset after a new delivery of the MERGENT FISD data (see update_TRACE.py)
+    benchmark():    Benchmark the stages on generated fixtures and compare the results across commits
+                    (see benchmark_TRACE.py)
+    generate():     Generate synthetic raw TRACE and MERGENT FISD data for a project (see generate_synthetic_TRACE.py)
+    check_equivalence():
+                    Check that a new implementation of a cleaning step keeps the same trades as the current one on a
+                    full year of the project (see equivalence_TRACE.py)
+    plan():         Estimate the wall time, memory and disk space of a build and recommend a build mode that fits the
+                    machine without running the build (see plan_TRACE.py)
+    load_trace():   Load the transactions of the final dataset that match a query (columns, CUSIPs, date range and
+                    filters) without loading the whole dataset (see query_TRACE.py)
+    open_trace():   Open the memory-mapped layout of the final dataset that all processes share (see mmap_TRACE.py)
+    serve():        Serve the queries of the final dataset to the analysts on this machine from one process with one
+                    shared cache (see server_TRACE.py)
+    connect():      Connect to the server (a client with a pool of connections)
+    extract_raw_trades():
+                    Extract the raw trades of some bonds from the raw daily files with the CUSIP index of the raw
+                    files (see raw_index_TRACE.py)
+    get_raw_records():
+                    Look up the raw records of trades of the final dataset by their provenance ID (raw_id, see
+                    provenance_TRACE.py)
+    load_asof_snapshots():
+                    Materialize the sample after the Dick-Nielsen & Poulsen (2019) corrections as of past report dates
+                    (see bitemporal_TRACE.py)
+    load_duplicates():
+                    Load the trade reports that appear in more than one raw file (see duplicates_TRACE.py)
+"""
+
+import os
+import sys
+import time
+
+from pycleantrace.specs import get_default_specs
+
+# The processing modules are located in the src folder next to the package. The project root is one level above
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_PATH = os.path.dirname(SRC_PATH)
+
+
+def add_src_path():
+    """
+    Add the src folder to the module search path such that the processing modules can be imported.
+    """
+    if SRC_PATH not in sys.path:
+        sys.path.insert(0, SRC_PATH)
+
+
+def get_build_args(dataset_specs, project_path):
+    """
+    Fill in the default dataset specifications and project root path and get the settings of the build from the
+    dataset specifications (see settings_TRACE.py).
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    dataset_specs (dict): Final dataset specifications
+    project_path (str): Project root path
+    settings (dict): Settings of the build (see get_settings() in settings_TRACE.py)
+    """
+    add_src_path()
+    if dataset_specs is None:
+        dataset_specs = get_default_specs()
+    if project_path is None:
+        project_path = PROJECT_PATH
+    from settings_TRACE import get_settings
+    settings = get_settings(dataset_specs)
+
+    return dataset_specs, project_path, settings
+
+
+def build(dataset_specs=None, project_path=None, max_memory=None, profile_stages=None, trace_memory_stages=None):
+    """
+    Build the final cleaned and concatenated TRACE dataset. The performance metrics of all stages are written to a
+    JSON run report (see telemetry_TRACE.py).
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+    max_memory (str): Memory budget (e.g. '32G'). If set, the steps after the read-in are run out-of-core on shards
+                      stored on the local disk (see out_of_core_TRACE.py)
+    profile_stages (list): Stages to profile with cProfile (e.g. ['merge', 'read_2013'] or ['all'])
+    trace_memory_stages (list): Stages to trace with tracemalloc (e.g. ['general'] or ['all'])
+
+    Returns:
+    --------
+    stages_run (list): Stages that were run (None in the out-of-core, two-pass and parallel modes)
+    """
+    t0 = time.time()
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    from general_functions import construct_nec_folders
+    import pipeline_TRACE
+    import telemetry_TRACE
+
+    # Construct the necessary input/output folders
+    construct_nec_folders(project_path)
+    print("START TO READ AND CLEAN THE ACADEMIC TRACE DATA FOR THE TIME RANGE: {} to {}".
+          format(dataset_specs['sample_time_span'][0], dataset_specs['sample_time_span'][1]))
+
+    telemetry_TRACE.start_run(project_path, dataset_specs, profile_stages, trace_memory_stages)
+    try:
+        if (max_memory is None) & (dataset_specs['two_pass_cleaning'] == False) & \
+                (dataset_specs['cleaning_workers'] == 1):
+            # Run all steps as a DAG of stages with checkpoints. Only the stages whose code, specifications or
+            # input data changed since the last build are run (see pipeline_TRACE.py)
+            stages_run = pipeline_TRACE.run_build_dag(project_path, dataset_specs, settings=settings)
+        else:
+            if max_memory is not None:
+                import out_of_core_TRACE
+                max_memory = out_of_core_TRACE.parse_memory_size(max_memory)
+            pipeline_TRACE.run_build_without_checkpoints(project_path, dataset_specs, max_memory, settings)
+            stages_run = None
+    finally:
+        # Write the run report also if a stage failed
+        telemetry_TRACE.write_run_report()
+
+    print("ALL FINISHED! The total data generation part took {}".format(time.time()-t0))
+
+    return stages_run
+
+
+def run_stage(name, dataset_specs=None, project_path=None, force=True):
+    """
+    Run one stage of the build. Invalid upstream stages are run first.
+
+    Parameters:
+    -----------
+    name (str): Name of the stage (see STAGES in pipeline_TRACE.py)
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+    force (bool): Run the stage even if its checkpoint is valid
+
+    Returns:
+    --------
+    stages_run (list): Stages that were run
+    """
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    from general_functions import construct_nec_folders
+    import pipeline_TRACE
+
+    construct_nec_folders(project_path)
+    stages_run = pipeline_TRACE.run_build_dag(project_path, dataset_specs, target=name, force=force, settings=settings)
+
+    return stages_run
+
+
+def get_status(dataset_specs=None, project_path=None):
+    """
+    Show which stages of the build are invalid and why (see get_stage_status() in pipeline_TRACE.py).
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    df_status (DataFrame): One row per stage with the columns 'valid' and 'reason'
+    """
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    import pipeline_TRACE
+
+    return pipeline_TRACE.get_stage_status(project_path, dataset_specs)
+
+
+def update(dataset_specs=None, project_path=None):
+    """
+    Update the final dataset after a new delivery of the MERGENT FISD data. Only the bonds whose selection, issue
+    information or ratings changed are recomputed (see update_TRACE.py).
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    dict_changed (dict): CUSIPs that were recomputed
+    """
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    from update_TRACE import update_TRACE_final
+
+    return update_TRACE_final(project_path, dataset_specs, settings)
+
+
+def benchmark(project_path=None, scales=None, benchmarks=None, repeat=3, compare=None):
+    """
+    Run the micro and macro benchmarks of the stages on generated fixtures and store the results for the current
+    commit (see benchmark_TRACE.py). Optionally, compare the results with the results of an earlier commit.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path (None -> the folder above src)
+    scales (list): Data scales (e.g. ['10k', '100k'], None -> default scales)
+    benchmarks (list): Benchmarks to run (e.g. ['post_2012_clean'], None -> all)
+    repeat (int): Number of timed runs per benchmark
+    compare (str): Commit to compare the results with (None -> no comparison)
+
+    Returns:
+    --------
+    df_results (DataFrame): One row per benchmark and scale
+    """
+    add_src_path()
+    if project_path is None:
+        project_path = PROJECT_PATH
+    import benchmark_TRACE
+
+    df_results = benchmark_TRACE.run_benchmarks(project_path, scales, benchmarks, repeat)
+    if compare is not None:
+        benchmark_TRACE.compare_benchmark_results(project_path, compare)
+
+    return df_results
+
+
+def generate(project_path, start_date, end_date, trades_per_day=1000, n_bonds=2000, rates=None, N_workers=1, seed=0,
+             overwrite=False):
+    """
+    Generate synthetic daily raw TRACE files and MERGENT FISD data for a project such that the build can be run
+    without the licensed data (see generate_synthetic_TRACE.py).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path (use a separate project folder, the data is written to src/original_data)
+    start_date (str): First day (YYYY-MM-DD)
+    end_date (str): Last day (YYYY-MM-DD)
+    trades_per_day (int): Average number of regular trade reports per day
+    n_bonds (int): Number of bonds in the universe
+    rates (dict): Rates of the generated transactions, e.g. {'cancel': 0.05} (see RATES, None -> default rates)
+    N_workers (int): Number of worker processes (-1 -> use all available cores)
+    seed (int): Seed of the random number generator
+    overwrite (bool): Delete existing raw TRACE data of the project first
+
+    Returns:
+    --------
+    df_summary (DataFrame): Number of files and records per year
+    """
+    add_src_path()
+    from generate_synthetic_TRACE import generate_synthetic_data
+
+    return generate_synthetic_data(project_path, start_date, end_date, trades_per_day, n_bonds, rates, N_workers,
+                                   seed, overwrite)
+
+
+def check_equivalence(check, candidate=None, year=None, dataset_specs=None, project_path=None, n_partitions=1,
+                      candidate_kwargs=None):
+    """
+    Run the current implementation of a cleaning step (reference) and a new implementation (candidate) on one full
+    year of the project and compare the outputs row by row. The differing trades are attributed to the cleaning rules
+    of the reference (see equivalence_TRACE.py).
+
+    Parameters:
+    -----------
+    check (str): Checked step (e.g. 'post_2012_clean', see CHECKS in equivalence_TRACE.py)
+    candidate (function or str): New implementation with the arguments of the reference, or 'module:function'
+                                 (None -> the reference itself)
+    year (int): Year of the input data (None -> last year of the sample)
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+    n_partitions (int): Number of CUSIP partitions that are checked one after the other (limits the memory usage)
+    candidate_kwargs (dict): Further keyword arguments of the candidate (e.g. {'N_workers': 4})
+
+    Returns:
+    --------
+    report (dict): Equivalence report (report['equivalent'] is True if the outputs are identical)
+    """
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    import equivalence_TRACE
+
+    if year is None:
+        year = dataset_specs['sample_time_span'][1]
+    if candidate is not None:
+        candidate = equivalence_TRACE.get_candidate(candidate, candidate_kwargs)
+
+    return equivalence_TRACE.check_equivalence_year(project_path, check, candidate, year, dataset_specs,
+                                                    n_partitions)
+
+
+def plan(dataset_specs=None, project_path=None, max_memory=None, calibration_paths=None):
+    """
+    Estimate the wall time, peak memory and disk space of every stage of the build from the raw data and the run
+    reports of past builds and recommend the build mode, the number of cleaning workers and the shard sizes. Nothing
+    is read in or cleaned (see plan_TRACE.py).
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+    max_memory (str): Memory budget (e.g. '32G', None -> 80% of the available memory)
+    calibration_paths (list): Project root paths whose run reports calibrate the cost coefficients (None -> the
+                              project)
+
+    Returns:
+    --------
+    plan (dict): Estimates of the stages and the recommended build (plan['recommendation'])
+    """
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    import plan_TRACE
+
+    return plan_TRACE.plan_build(project_path, dataset_specs, max_memory, calibration_paths)
+
+
+def load_trace(columns=None, cusips=None, start=None, end=None, filters=None, output='pandas', batch_size=None,
+               project_path=None, cache=True, dataset_specs=None, group_by=None, aggs=None):
+    """
+    Load the transactions of the final dataset that match a query, or an aggregation of them. The columns, the
+    CUSIPs, the date range and the filters are pushed down to the stored dataset, i.e. only the matching partitions
+    and row groups of the requested columns are read (see query_TRACE.py). If the query cache is enabled, the
+    results are cached in memory and on disk until a new final dataset is published (see cache_TRACE.py).
+
+    Example:
+        df = pycleantrace.load_trace(columns=['cusip_id', 'trd_exctn_tm', 'rptd_pr', 'entrd_vol_qt'],
+                                     start='2014-01-01', end='2014-06-30', filters=[('rptd_pr', '>', 100)])
+        df_volume = pycleantrace.load_trace(group_by='rating', aggs={'volume': ('entrd_vol_qt', 'sum'),
+                                                                     'n_bonds': ('cusip_id', 'nunique')})
+
+    Parameters:
+    -----------
+    columns (list): Columns to load (None -> all columns)
+    cusips (list): CUSIPs to keep (None -> all bonds)
+    start (str or date): First execution date (inclusive, None -> no lower bound)
+    end (str or date): Last execution date (inclusive, None -> no upper bound)
+    filters (list): Further filters as (column, operator, value), e.g. [('rpt_side_cd', '==', 'S')]
+    output (str): 'pandas' (DataFrame) or 'arrow' (Arrow table)
+    batch_size (int): If set, return a generator of batches of at most batch_size rows (for results that do not fit
+                      into memory)
+    project_path (str): Project root path (None -> the folder above src)
+    cache (bool): Reuse the cached result of the same query (False -> always read the final dataset)
+    dataset_specs (dict): Dataset specifications with the settings of the query cache ('query_cache', None -> the
+                          default specifications, i.e. no cache)
+    group_by (str or list): Columns of the groups of an aggregation (None -> one group of all matching transactions)
+    aggs (dict): Aggregations as name -> (column, function), e.g. {'n_trades': ('cusip_id', 'size')}. The functions
+                 are size, count, nunique, sum, mean, median, std, min and max (None -> no aggregation)
+
+    Returns:
+    --------
+    result (DataFrame, Table or generator): Matching transactions or their aggregation (one row per group)
+    """
+    add_src_path()
+    if project_path is None:
+        project_path = PROJECT_PATH
+    from settings_TRACE import get_settings
+    from query_TRACE import load_trace as load_trace_query
+
+    return load_trace_query(project_path, columns, cusips, start, end, filters, output, batch_size, cache, group_by,
+                            aggs, get_settings(dataset_specs))
+
+
+def open_trace(columns=None, project_path=None):
+    """
+    Open the memory-mapped layout of the final dataset (dataset_specs['storage']['mmap_final'] has to be set for the
+    build). The columns are read-only views of the mapped files, i.e. opening the dataset takes no time and all
+    processes that open it share the same memory (see mmap_TRACE.py).
+
+    Example:
+        df = pycleantrace.open_trace(columns=['cusip_id', 'trd_exctn_dt', 'rptd_pr'])
+        df_bond = df[df['cusip_id'] == '000000J34']
+
+    Parameters:
+    -----------
+    columns (list): Columns to open (None -> all columns)
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    df (DataFrame): Final dataset (string and date columns as categoricals)
+    """
+    add_src_path()
+    if project_path is None:
+        project_path = PROJECT_PATH
+    from mmap_TRACE import get_mmap_path, open_mmap_final, LAYOUT_FILE
+    mmap_path = get_mmap_path(project_path + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl')
+    if os.path.isfile(mmap_path + '/' + LAYOUT_FILE) == False:
+        raise FileNotFoundError('There is no memory-mapped layout in {}. Please run the build with '
+                                "dataset_specs['storage']['mmap_final'] = True first.".format(mmap_path))
+
+    return open_mmap_final(mmap_path, columns)
+
+
+def serve(host='127.0.0.1', port=8765, dataset_specs=None, project_path=None):
+    """
+    Serve the queries of the final dataset over HTTP until the server is interrupted. All clients share the cache of
+    the query results of the server (see server_TRACE.py).
+
+    Parameters:
+    -----------
+    host (str): Address of the server (localhost by default)
+    port (int): Port of the server
+    dataset_specs (dict): Dataset specifications with the settings of the query cache ('query_cache', None -> the
+                          default specifications, i.e. no cache). Enable the cache to share the results of
+                          repeated queries between the clients
+    project_path (str): Project root path (None -> the folder above src)
+    """
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    import server_TRACE
+
+    server_TRACE.serve(project_path, host, port, settings)
+
+
+def connect(host='127.0.0.1', port=8765, pool_size=4, timeout=None):
+    """
+    Connect to the TRACE data server (see serve()).
+
+    Example:
+        client = pycleantrace.connect()
+        df = client.query(columns=['cusip_id', 'trd_exctn_dt', 'rptd_pr'], start='2014-01-01', end='2014-06-30')
+
+    Parameters:
+    -----------
+    host (str): Address of the server
+    port (int): Port of the server
+    pool_size (int): Number of connections that are kept open (e.g. one per thread that queries the server)
+    timeout (float): Timeout of the connections in seconds (None -> no timeout)
+
+    Returns:
+    --------
+    client (TraceClient): Client with the methods query() (see load_trace()) and status()
+    """
+    add_src_path()
+    import server_TRACE
+
+    return server_TRACE.TraceClient(host, port, pool_size, timeout)
+
+
+def extract_raw_trades(cusips, start_year=None, end_year=None, project_path=None):
+    """
+    Extract the raw trades of some bonds from the raw daily files, e.g. to audit a cleaning decision. Only the lines
+    of the bonds are read and parsed with the CUSIP index of the raw files (see raw_index_TRACE.py). The index of a
+    year is built first if it is missing or a raw file has changed.
+
+    Example:
+        dict_trades = pycleantrace.extract_raw_trades(['000000J34'], start_year=2010, end_year=2014)
+        df_post = dict_trades['post_2012']
+
+    Parameters:
+    -----------
+    cusips (list): CUSIPs to extract
+    start_year (int): First year (None -> the first annual folder)
+    end_year (int): Last year (None -> the last annual folder)
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    dict_trades (dict): Raw trades before the cleaning by format ('prior_2012' and 'post_2012', see read_TRACE.py)
+    """
+    add_src_path()
+    if project_path is None:
+        project_path = PROJECT_PATH
+    import raw_index_TRACE
+
+    return raw_index_TRACE.extract_raw_trades(project_path, cusips, start_year, end_year)
+
+
+def get_raw_records(raw_ids, project_path=None):
+    """
+    Look up the raw records of trades by their provenance ID, e.g. the raw line of a trade in the final dataset
+    (raw_id). The ID encodes the raw daily file and the line of the trade (see provenance_TRACE.py).
+
+    Example:
+        df = pycleantrace.load_trace(columns=['cusip_id', 'raw_id'], cusips=['000000J34'])
+        df_records = pycleantrace.get_raw_records(df['raw_id'])
+
+    Parameters:
+    -----------
+    raw_ids (array): Provenance IDs
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    df_records (DataFrame): raw_id, file (path of the raw file), line and record (the raw line)
+    """
+    add_src_path()
+    if project_path is None:
+        project_path = PROJECT_PATH
+    import provenance_TRACE
+
+    return provenance_TRACE.get_raw_records(project_path, raw_ids)
+
+
+def load_asof_snapshots(asof_dates, cusips=None, dataset_specs=None, project_path=None):
+    """
+    Materialize the sample after the Dick-Nielsen & Poulsen (2019) corrections as it would have looked at the end of
+    past report dates, i.e. with the late reports, cancellations, corrections and reversals that were reported until
+    then. All as-of dates are materialized in one pass (see bitemporal_TRACE.py). The dataset has to be built with
+    dataset_specs['bitemporal']['enabled'] = True.
+
+    Example:
+        df_asof = pycleantrace.load_asof_snapshots(['2013-03-31', '2013-06-30', '2013-12-31'])
+        df_q1 = df_asof.loc[df_asof['ASOF_DT'] == datetime.date(2013, 3, 31)]
+
+    Parameters:
+    -----------
+    asof_dates (list): As-of dates (a single date is also accepted)
+    cusips (list): Optional. Only the trades of these CUSIP IDs
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    df_asof (DataFrame): Trade reports of every snapshot (ASOF_DT, the transaction variables and RAW_ID)
+    """
+    add_src_path()
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    import bitemporal_TRACE
+
+    return bitemporal_TRACE.load_asof_snapshots(project_path, asof_dates, dataset_specs, cusips)
+
+
+def load_duplicates(dataset_specs=None, project_path=None):
+    """
+    Load the trade reports that appear in more than one raw file, e.g. in overlapping deliveries or in the files at
+    the year boundary (see duplicates_TRACE.py). The duplicates are found while the raw data is read in with
+    dataset_specs['duplicates']['action'] = 'flag' or 'drop' (the check is off by default).
+
+    Example:
+        df_duplicates = pycleantrace.load_duplicates()
+        df_records = pycleantrace.get_raw_records(df_duplicates['RAW_ID'])
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications (None -> default specifications, see specs.py)
+    project_path (str): Project root path (None -> the folder above src)
+
+    Returns:
+    --------
+    df_duplicates (DataFrame): File name of the yearly dataset, CUSIP_ID, RAW_ID of the duplicate and FIRST_RAW_ID of
+                               the first copy
+    """
+    add_src_path()
+    dataset_specs, project_path, settings = get_build_args(dataset_specs, project_path)
+    import duplicates_TRACE
+
+    return duplicates_TRACE.load_duplicates(project_path, dataset_specs['sample_time_span'])
@@ -0,0 +1,167 @@
+"""
+Command line interface of PyCleanTrace. Run from the src folder:
+    python -m pycleantrace build [--max-memory 32G]     Build the final dataset (--profile and --trace-memory
+                                                        profile single stages, see telemetry_TRACE.py)
+    python -m pycleantrace status                       Show which stages are invalid and why
+    python -m pycleantrace update                       Update the final dataset after new MERGENT FISD data
+    python -m pycleantrace <stage> [--no-force]         Run one stage (e.g. merge) and its invalid upstream stages
+    python -m pycleantrace benchmark [--compare COMMIT] Benchmark the stages on generated fixtures
+    python -m pycleantrace generate --project-path PATH Generate synthetic raw TRACE and MERGENT FISD data
+    python -m pycleantrace equivalence --check STEP     Compare a new implementation of a cleaning step with the
+                                                        current one on one year (exit code 1 if they differ)
+    python -m pycleantrace plan [--max-memory 32G]      Estimate the wall time, memory and disk space of the build
+                                                        and recommend a build mode (dry run)
+    python -m pycleantrace serve [--port 8765]          Serve the final dataset to the analysts on this machine
+The sample time span and the number of cleaning workers can be set for every subcommand, all other specifications
+are taken from specs.py.
+"""
+
+import argparse
+import json
+
+# Names of the stages of the build (see STAGES in pipeline_TRACE.py). They are listed here such that the command
+# line can be parsed without importing the processing modules
+STAGE_NAMES = ['read_raw', 'bond_info', 'rpt_dates', 'merge', 'interdealer', 'trade_level', 'general',
+               'trading_dates', 'variables', 'event_time']
+SUBCOMMANDS = ['build', 'status', 'update', 'benchmark', 'generate', 'equivalence', 'plan', 'serve'] + STAGE_NAMES
+
+
+def get_parser():
+    """
+    Define the command line arguments.
+
+    Returns:
+    --------
+    parser (ArgumentParser): Parser with one subcommand per action and stage
+    """
+    # Options of all subcommands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--project-path', default=None, help='Project root path (default: the folder above src)')
+    common.add_argument('--start-year', type=int, default=None, help='First year of the sample')
+    common.add_argument('--end-year', type=int, default=None, help='Last year of the sample')
+    common.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes for the cleaning steps (-1 -> use all available cores)')
+
+    parser = argparse.ArgumentParser(prog='pycleantrace',
+                                     description='Build the final cleaned and concatenated TRACE dataset')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_build = subparsers.add_parser('build', parents=[common], help='Build the final dataset')
+    parser_build.add_argument('--max-memory', default=None,
+                              help='Memory budget (e.g. 32G). If set, the steps after the read-in are run '
+                                   'out-of-core on shards stored on the local disk')
+    parser_build.add_argument('--profile', nargs='+', default=None, metavar='STAGE',
+                              help='Profile these stages with cProfile (e.g. merge read_2013, or all)')
+    parser_build.add_argument('--trace-memory', nargs='+', default=None, metavar='STAGE',
+                              help='Trace the memory allocations of these stages with tracemalloc')
+    subparsers.add_parser('status', parents=[common], help='Show which stages are invalid and why')
+    subparsers.add_parser('update', parents=[common], help='Update the final dataset after new MERGENT FISD data')
+    for stage in STAGE_NAMES:
+        parser_stage = subparsers.add_parser(stage, parents=[common],
+                                             help='Run the stage {} and its invalid upstream stages'.format(stage))
+        parser_stage.add_argument('--no-force', action='store_true',
+                                  help='Skip the stage if its checkpoint is valid')
+    # The benchmarks run on generated fixtures and do not use the dataset specifications
+    parser_benchmark = subparsers.add_parser('benchmark', help='Benchmark the stages on generated fixtures')
+    parser_benchmark.add_argument('--project-path', default=None,
+                                  help='Project root path, the results are stored in its bld folder')
+    parser_benchmark.add_argument('--scales', nargs='+', default=None,
+                                  help='Data scales (10k, 100k, 1M; default: 10k 100k)')
+    parser_benchmark.add_argument('--benchmarks', nargs='+', default=None, metavar='BENCHMARK',
+                                  help='Benchmarks to run (default: all)')
+    parser_benchmark.add_argument('--repeat', type=int, default=3, help='Number of timed runs per benchmark')
+    parser_benchmark.add_argument('--compare', default=None, metavar='COMMIT',
+                                  help='Compare the results with the results of this commit')
+    parser_equivalence = subparsers.add_parser('equivalence', parents=[common],
+                                               help='Compare a new implementation of a cleaning step with the '
+                                                    'current one')
+    parser_equivalence.add_argument('--check', required=True,
+                                    help='Checked step (e.g. post_2012_clean, see CHECKS in equivalence_TRACE.py)')
+    parser_equivalence.add_argument('--candidate', default=None, metavar='MODULE:FUNCTION',
+                                    help='New implementation (default: the current implementation itself)')
+    parser_equivalence.add_argument('--candidate-kwargs', default=None, metavar='JSON',
+                                    help='Further keyword arguments of the candidate, e.g. \'{"N_workers": 4}\'')
+    parser_equivalence.add_argument('--year', type=int, default=None,
+                                    help='Year of the input data (default: last year of the sample)')
+    parser_equivalence.add_argument('--partitions', type=int, default=1,
+                                    help='Number of CUSIP partitions that are checked one after the other')
+    parser_plan = subparsers.add_parser('plan', parents=[common],
+                                        help='Estimate the cost of the build and recommend a build mode (dry run)')
+    parser_plan.add_argument('--max-memory', default=None,
+                             help='Memory budget (e.g. 32G, default: 80%% of the available memory)')
+    parser_plan.add_argument('--calibrate-from', nargs='+', default=None, metavar='PROJECT_PATH',
+                             help='Calibrate the cost coefficients on the run reports of these projects (default: '
+                                  'the project)')
+    parser_serve = subparsers.add_parser('serve', parents=[common],
+                                         help='Serve the final dataset to the analysts on this machine')
+    parser_serve.add_argument('--host', default='127.0.0.1', help='Address of the server (default: localhost only)')
+    parser_serve.add_argument('--port', type=int, default=8765, help='Port of the server')
+    # The generator writes into a separate project folder and does not use the dataset specifications
+    parser_generate = subparsers.add_parser('generate', help='Generate synthetic raw TRACE and MERGENT FISD data')
+    parser_generate.add_argument('--project-path', required=True, help='Project root path of the synthetic data')
+    parser_generate.add_argument('--start-date', required=True, help='First day (YYYY-MM-DD)')
+    parser_generate.add_argument('--end-date', required=True, help='Last day (YYYY-MM-DD)')
+    parser_generate.add_argument('--trades-per-day', type=int, default=1000,
+                                 help='Average number of regular trade reports per day')
+    parser_generate.add_argument('--bonds', type=int, default=2000, help='Number of bonds in the universe')
+    parser_generate.add_argument('--workers', type=int, default=1,
+                                 help='Number of worker processes (-1 -> use all available cores)')
+    parser_generate.add_argument('--seed', type=int, default=0, help='Seed of the random number generator')
+    parser_generate.add_argument('--overwrite', action='store_true', help='Delete existing raw TRACE data first')
+    for rate in ['cancel', 'correct', 'reversal', 'asof', 'interdealer']:
+        parser_generate.add_argument('--{}-rate'.format(rate), type=float, default=None,
+                                     help='Share of the {} reports (see RATES in generate_synthetic_TRACE.py)'.format(
+                                         rate))
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Parse the command line and run the subcommand.
+
+    Parameters:
+    -----------
+    argv (list): Command line arguments (None -> sys.argv)
+    """
+    args = get_parser().parse_args(argv)
+    from pycleantrace import api
+
+    if args.command == 'benchmark':
+        api.benchmark(args.project_path, args.scales, args.benchmarks, args.repeat, args.compare)
+        return
+    if args.command == 'generate':
+        rates = {rate: getattr(args, rate + '_rate') for rate in ['cancel', 'correct', 'reversal', 'asof',
+                                                                  'interdealer']
+                 if getattr(args, rate + '_rate') is not None}
+        api.generate(args.project_path, args.start_date, args.end_date, args.trades_per_day, args.bonds, rates,
+                     args.workers, args.seed, args.overwrite)
+        return
+
+    # Adjust the default specifications
+    dataset_specs = api.get_default_specs()
+    if args.start_year is not None:
+        dataset_specs['sample_time_span'][0] = args.start_year
+    if args.end_year is not None:
+        dataset_specs['sample_time_span'][1] = args.end_year
+    if args.workers is not None:
+        dataset_specs['cleaning_workers'] = args.workers
+
+    if args.command == 'build':
+        api.build(dataset_specs, args.project_path, args.max_memory, args.profile, args.trace_memory)
+    elif args.command == 'status':
+        print(api.get_status(dataset_specs, args.project_path).to_string())
+    elif args.command == 'update':
+        api.update(dataset_specs, args.project_path)
+    elif args.command == 'equivalence':
+        candidate_kwargs = json.loads(args.candidate_kwargs) if args.candidate_kwargs is not None else None
+        report = api.check_equivalence(args.check, args.candidate, args.year, dataset_specs, args.project_path,
+                                       args.partitions, candidate_kwargs)
+        # Non-zero exit code such that the check can gate a change
+        if report['equivalent'] == False:
+            raise SystemExit(1)
+    elif args.command == 'plan':
+        api.plan(dataset_specs, args.project_path, args.max_memory, args.calibrate_from)
+    elif args.command == 'serve':
+        api.serve(args.host, args.port, dataset_specs, args.project_path)
+    else:
+        api.run_stage(args.command, dataset_specs, args.project_path, force=(args.no_force == False))
@@ -0,0 +1,96 @@
+"""
+Default specifications of the final TRACE dataset. Adjust the sample time span and the variable lists here or pass
+an adjusted copy (see get_default_specs()) to build().
+"""
+
+import copy
+
+DATASET_SPECS = {
+    # Specify the sample time span of the dataset
+    'sample_time_span': [2007, 2018],
+    # Specify the variables to keep from the ratings data
+    'ratings': {
+        'varlist': ['complete_cusip', 'rating_date', 'rating']
+    },
+    # Specify the variables to keep from the transaction (raw TRACE) data.
+    'transactions': {
+        'varlist': ['CUSIP_ID', 'RPTG_PARTY_ID','RPT_SIDE_CD','BUY_CPCTY_CD','SELL_CPCTY_CD',
+                   'CNTRA_PARTY_ID', 'ENTRD_VOL_QT', 'RPTD_PR', 'TRD_RPT_DT', 
+                   'TRD_EXCTN_DT', 'TRD_EXCTN_TM',  'CMSN_TRD', 'TRDG_MKT_CD']
+    },
+    # Specify the variables to keep from the issue data
+    'issue_data': {
+        'varlist': ['CUSIP_ID', 'maturity', 'offering_amt', 'offering_price', 'principal_amt', 
+                    'bond_type', 'amount_outstanding', 'effective_date', 'putable', 'offering_date', 
+                    'active_issue']
+    },
+    # Specify the variables to keep from the bond background information data
+    'bond_info': {
+        'varlist': ['CUSIP_ID', 'RULE_144A_FL'],
+        # Merge the bond information in force on the execution date (time-varying bond master) instead of the
+        # first record per bond
+        'time_varying': False
+    },
+    # Clean the concatenated data partition by partition in two passes (see process_TRACE.py). The
+    # output is identical but the full merged sample does not need to fit in memory at once
+    'two_pass_cleaning': False,
+    # Number of worker processes for the cleaning steps after the concatenation (1 -> serial, -1 -> use all
+    # available cores). The trades are sharded by CUSIP and the output is identical (see process_TRACE.py)
+    'cleaning_workers': 1,
+    # Check the size of every join before it is run (see join_guard_TRACE.py). If a join exceeds 'max_fanout' rows
+    # per row of the left side, 'action' is 'warn' or 'abort'. A join whose result exceeds 'max_memory_share' of the
+    # available memory is always aborted
+    'join_guard': {'action': 'warn', 'max_fanout': 10, 'max_memory_share': 0.5},
+    # Overlap the disk I/O with the processing (see async_io_TRACE.py): read the next 'prefetch_files' raw files on
+    # an I/O thread and write the yearly datasets and partitions in a background writer ('enabled': False -> one
+    # step at a time)
+    'overlap_io': {'enabled': True, 'prefetch_files': 2, 'max_pending_writes': 1},
+    # Store the outputs (yearly datasets, bond info, reported dates, checkpoints and the final dataset) as pickles
+    # that pd.read_pickle() reads. 'format': 'parquet' -> store compressed Parquet datasets partitioned by year and,
+    # if 'cusip_buckets' > 0, by CUSIP hash bucket instead, which are read with load_frame() or load_trace() (see
+    # storage_TRACE.py, needs pyarrow). 'mmap_final': True -> also store the final dataset in an uncompressed
+    # memory-mapped layout that all processes share (see mmap_TRACE.py)
+    'storage': {'format': 'pickle', 'compression': 'zstd', 'row_group_size': 500000, 'cusip_buckets': 0,
+                'mmap_final': False},
+    # Cache the results of load_trace() in memory and on disk (bld/data/TRACE/TRACE_query_cache) with a
+    # least-recently-used eviction beyond 'max_memory_mb' and 'max_disk_mb'. A new build invalidates the cached
+    # results. Off by default, it is meant for aggregations and small projections that are queried repeatedly, e.g.
+    # by the server (see cache_TRACE.py)
+    'query_cache': {'enabled': False, 'max_memory_mb': 64, 'max_disk_mb': 256},
+    # Index the lines of the raw daily files by CUSIP while they are read in (bld/data/TRACE/TRACE_raw_index), such
+    # that the raw trades of some bonds can be extracted without parsing whole years (see raw_index_TRACE.py). Off by
+    # default: the index of a year is then built the first time its raw trades are extracted
+    'raw_index': {'enabled': False},
+    # Store the trade reports that the cancellations, corrections and reversals delete with the date of the deletion
+    # while the raw data is read in (bld/data/TRACE/TRACE_bitemporal), such that the sample can be materialized as
+    # of past report dates (see bitemporal_TRACE.py)
+    'bitemporal': {'enabled': False},
+    # Check every trade report against the trade reports of all raw files that were read in before (a Bloom filter
+    # sized for 'expected_trades' with an exact confirmation of the candidates, see duplicates_TRACE.py). 'action' is
+    # 'flag' (store the duplicates in bld/data/TRACE/TRACE_duplicates), 'drop' (also drop them before the cleaning)
+    # or 'off' (default, the filter takes about 180 MB for 100 million trades and the hashes of all files are written
+    # to disk)
+    'duplicates': {'action': 'off', 'expected_trades': 100000000, 'false_positive_rate': 0.001},
+    # Specify the variables to be kept in the final DataFrame of the cleaning step 
+    # (All variables here need to be in the union of the variables specified above)
+    'dataset_clean': {
+        'varlist': ['CUSIP_ID', 'RPTG_PARTY_ID', 'CNTRA_PARTY_ID', 'ENTRD_VOL_QT', 'RPTD_PR', 
+                    'RPT_SIDE_CD', 'TRD_EXCTN_DT', 'TRD_EXCTN_TM', 'CMSN_TRD', 'TRDG_MKT_CD', 
+                    'BUY_CPCTY_CD', 'SELL_CPCTY_CD', 'maturity', 'rating_date', 'rating', 
+                    'rating_numeric', 'principal_amt', 'offering_date', 'offering_amt', 
+                    'offering_price', 'amount_outstanding', 'effective_date', 'active_issue']
+    }
+}
+
+
+def get_default_specs():
+    """
+    Get a copy of the default dataset specifications that can be adjusted without changing the defaults.
+
+    Returns:
+    --------
+    dataset_specs (dict): Final dataset specifications
+    """
+    dataset_specs = copy.deepcopy(DATASET_SPECS)
+
+    return dataset_specs
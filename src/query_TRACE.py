@@ -0,0 +1,254 @@
+"""
+Query the final TRACE dataset without loading it into memory. Instead of reading the whole dataset and filtering it
+in pandas, the columns, the date range and the CUSIPs of a query are pushed down to the stored dataset (see
+storage_TRACE.py). The steps are as follows:
+    Step 1:     Translate the query (columns, CUSIPs, date range and further filters) into the filters of the
+                storage. The date range is also translated into a range of years, such that only the partitions of
+                the years in the range are read. An aggregation (group-by columns and aggregations, e.g. the volume
+                by rating or the trades per event week) is checked and translated into the columns it reads.
+    Step 2:     Find the stored final dataset: TRACE_final (in-memory build) or the shards TRACE_final_<shard>
+                (out-of-core build).
+    Step 3:     Load the result as a DataFrame or an Arrow table, or stream it in batches if it does not fit into
+                memory (load_trace()). An aggregation is computed from the matching transactions and only its
+                result is returned. The results are cached until a new final dataset is published (see
+                cache_TRACE.py).
+
+Note: The pushdown needs the final dataset to be stored as a Parquet dataset. A final dataset stored as a pickle is
+read in full and filtered in pandas (with the same result).
+"""
+
+import datetime
+import itertools
+import os
+import numpy as np
+import pandas as pd
+
+# Import the columnar storage of the outputs
+from storage_TRACE import frame_exists, load_frame, load_table, load_frame_batches
+# Import the cache of the query results
+from cache_TRACE import run_cached
+
+# Variables of the final dataset that the query translates into filters
+DATE_VAR = 'trd_exctn_dt'
+CUSIP_VAR = 'cusip_id'
+# Functions of the aggregations
+AGG_FUNCTIONS = ['size', 'count', 'nunique', 'sum', 'mean', 'median', 'std', 'min', 'max']
+
+
+#########
+# Step 1: Translate the query into filters
+########
+def to_date(date):
+    """
+    Convert a date (e.g. '2014-06-30', a datetime or a Timestamp) to a datetime.date (None -> None).
+    """
+    if date is None:
+        return None
+    if isinstance(date, datetime.date) and not isinstance(date, datetime.datetime):
+        return date
+
+    return pd.Timestamp(date).date()
+
+
+def get_query_filters(cusips=None, start=None, end=None, filters=None):
+    """
+    Translate a query into the filters of the storage (see load_frame() in storage_TRACE.py).
+
+    Parameters:
+    -----------
+    cusips (list): CUSIPs to keep (None -> all bonds)
+    start (str or date): First execution date (inclusive, None -> no lower bound)
+    end (str or date): Last execution date (inclusive, None -> no upper bound)
+    filters (list): Further filters, e.g. [('rptd_pr', '>', 100)]
+
+    Returns:
+    --------
+    query_filters (list): Filters of the query
+    """
+    query_filters = []
+    start = to_date(start)
+    end = to_date(end)
+    if (start is not None) and (end is not None) and (start > end):
+        raise ValueError('The start date {} is after the end date {}'.format(start, end))
+    # The bounds of the years skip the partitions, the bounds of the dates skip the row groups and rows
+    if start is not None:
+        query_filters = query_filters + [('year', '>=', start.year), (DATE_VAR, '>=', start)]
+    if end is not None:
+        query_filters = query_filters + [('year', '<=', end.year), (DATE_VAR, '<=', end)]
+    if cusips is not None:
+        if isinstance(cusips, str):
+            cusips = [cusips]
+        query_filters.append((CUSIP_VAR, 'in', list(cusips)))
+    if filters is not None:
+        query_filters = query_filters + list(filters)
+
+    return query_filters
+
+
+def get_aggregation(group_by=None, aggs=None):
+    """
+    Check an aggregation and bring it into the form of the cache key (None if the query has no aggregation).
+
+    Parameters:
+    -----------
+    group_by (str or list): Columns of the groups (None -> one group of all matching transactions)
+    aggs (dict): Aggregations as name of the result column -> (column, function), e.g.
+                 {'volume': ('entrd_vol_qt', 'sum'), 'n_bonds': ('cusip_id', 'nunique')}. The functions are size,
+                 count, nunique, sum, mean, median, std, min and max
+
+    Returns:
+    --------
+    aggregation (dict): Group-by columns ('group_by') and aggregations as [name, column, function] ('aggs')
+    """
+    if (group_by is None) and (aggs is None):
+        return None
+    if (aggs is None) or (len(aggs) == 0):
+        raise ValueError('An aggregation needs at least one aggregation, e.g. {\'n_trades\': (\'cusip_id\', '
+                         '\'size\')}')
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    list_aggs = []
+    for name, agg in aggs.items():
+        if (isinstance(agg, (list, tuple)) == False) or (len(agg) != 2):
+            raise ValueError('The aggregation {} has to be a pair (column, function): {}'.format(name, agg))
+        if agg[1] not in AGG_FUNCTIONS:
+            raise ValueError('Unknown function of the aggregation {}: {}. The functions are: {}'.format(
+                name, agg[1], ', '.join(AGG_FUNCTIONS)))
+        list_aggs.append([str(name), agg[0], agg[1]])
+
+    return {'group_by': [] if group_by is None else list(group_by), 'aggs': list_aggs}
+
+
+def get_aggregation_columns(aggregation):
+    """
+    Get the columns that an aggregation reads (group-by columns first).
+    """
+    columns = list(aggregation['group_by'])
+    for _, col, _ in aggregation['aggs']:
+        if col not in columns:
+            columns.append(col)
+
+    return columns
+
+
+#########
+# Step 2: Find the final dataset
+########
+def get_final_paths(project_path):
+    """
+    Get the path of the final dataset (TRACE_final.pkl) or, after an out-of-core or two-pass build, the paths of its
+    shards (TRACE_final_<shard>.pkl). The paths are mapped to the stored datasets or pickles by storage_TRACE.py.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+
+    Returns:
+    --------
+    final_paths (list): Paths of the final dataset
+    """
+    path_final = project_path + '/bld/data/TRACE/TRACE_final_clean/'
+    if frame_exists(path_final + 'TRACE_final.pkl'):
+        return [path_final + 'TRACE_final.pkl']
+    shard_ids = []
+    if os.path.isdir(path_final):
+        shard_ids = sorted(set(
+            [int(os.path.splitext(f)[0].split('_')[-1]) for f in os.listdir(path_final)
+             if f.startswith('TRACE_final_')]
+        ))
+    if len(shard_ids) == 0:
+        raise FileNotFoundError('There is no final dataset in {}. Please run the build first.'.format(path_final))
+
+    return [path_final + 'TRACE_final_{}.pkl'.format(shard_id) for shard_id in shard_ids]
+
+
+#########
+# Step 3: Load the result
+########
+def aggregate_frame(df, aggregation):
+    """
+    Compute an aggregation of the matching transactions (see get_aggregation()). The groups are sorted by the
+    group-by columns, missing values form their own group.
+    """
+    named_aggs = {name: (col, func) for name, col, func in aggregation['aggs']}
+    if len(aggregation['group_by']) == 0:
+        return df.groupby(np.zeros(len(df), dtype=int)).agg(**named_aggs).reset_index(drop=True)
+
+    return df.groupby(aggregation['group_by'], dropna=False, observed=True).agg(**named_aggs).reset_index()
+
+
+def run_query(final_paths, columns, query_filters, output, aggregation=None):
+    """
+    Load the result of a query from the final dataset or its shards.
+    """
+    if aggregation is not None:
+        # The groups can span several shards, i.e. the transactions of all shards are aggregated together
+        df_agg = aggregate_frame(run_query(final_paths, get_aggregation_columns(aggregation), query_filters,
+                                           'pandas'), aggregation)
+        if output == 'arrow':
+            import pyarrow as pa
+            return pa.Table.from_pandas(df_agg, preserve_index=False)
+        return df_agg
+    if output == 'arrow':
+        list_tables = [load_table(p, columns, query_filters) for p in final_paths]
+        if len(list_tables) == 1:
+            return list_tables[0]
+        import pyarrow as pa
+        return pa.concat_tables(list_tables)
+    list_frames = [load_frame(p, columns, query_filters) for p in final_paths]
+    if len(list_frames) == 1:
+        return list_frames[0]
+
+    return pd.concat(list_frames, ignore_index=True)
+
+
+def load_trace(project_path, columns=None, cusips=None, start=None, end=None, filters=None, output='pandas',
+               batch_size=None, cache=True, group_by=None, aggs=None, settings=None):
+    """
+    Load the transactions of the final dataset that match a query, or an aggregation of them. Only the requested
+    columns and the partitions and row groups that can contain matching transactions are read. The result is cached
+    if the query cache is enabled (see cache_TRACE.py).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    columns (list): Columns to load (None -> all columns)
+    cusips (list): CUSIPs to keep (None -> all bonds)
+    start (str or date): First execution date (inclusive, None -> no lower bound)
+    end (str or date): Last execution date (inclusive, None -> no upper bound)
+    filters (list): Further filters, e.g. [('rptd_pr', '>', 100), ('rpt_side_cd', '==', 'S')]. The operators are
+                    ==, !=, <, <=, >, >=, in and not in
+    output (str): 'pandas' (DataFrame) or 'arrow' (Arrow table)
+    batch_size (int): If set, return a generator of batches of at most batch_size rows instead of the whole result
+                      (DataFrames or Arrow record batches). Batches are not cached
+    cache (bool): Reuse the cached result of the same query (False -> always read the final dataset)
+    group_by (str or list): Columns of the groups of an aggregation (None -> one group, see get_aggregation())
+    aggs (dict): Aggregations as name -> (column, function), e.g. {'volume': ('entrd_vol_qt', 'sum')} (None -> no
+                 aggregation). Only the group-by and the aggregated columns are read, and columns has to be None
+    settings (dict): Settings of the build with the settings of the query cache (see settings_TRACE.py, None ->
+                     default settings, i.e. no cache)
+
+    Returns:
+    --------
+    result (DataFrame, Table or generator): Matching transactions or their aggregation (one row per group)
+    """
+    if output not in ['pandas', 'arrow']:
+        raise ValueError('The output has to be pandas or arrow: {}'.format(output))
+    aggregation = get_aggregation(group_by, aggs)
+    if (aggregation is not None) and ((columns is not None) or (batch_size is not None)):
+        raise ValueError('An aggregation reads its own columns and is not streamed (columns and batch_size have to '
+                         'be None)')
+    query_filters = get_query_filters(cusips, start, end, filters)
+    final_paths = get_final_paths(project_path)
+
+    if batch_size is not None:
+        return itertools.chain.from_iterable(
+            [load_frame_batches(p, columns, query_filters, batch_size, as_arrow=(output == 'arrow'))
+             for p in final_paths]
+        )
+    if cache == False:
+        return run_query(final_paths, columns, query_filters, output, aggregation)
+
+    return run_cached(project_path, final_paths, columns, query_filters, output,
+                      lambda: run_query(final_paths, columns, query_filters, output, aggregation), aggregation,
+                      settings)
@@ -0,0 +1,416 @@
+"""
+Index the raw daily TRACE files by CUSIP, such that the raw trades of a few bonds can be extracted without parsing
+whole years again (e.g. to audit a cleaning decision). The steps are as follows:
+    Step 1:     Index every raw file while it is read in (load_and_index_raw_file()): the byte offset and length of
+                the line of every trade, the CUSIP of the line and the header and trailer lines of the file. The
+                lines are found with vectorized NumPy operations on the raw bytes, i.e. without parsing the file.
+    Step 2:     Store the index of an annual folder (bld/data/TRACE/TRACE_raw_index/<folder>.parquet) sorted by
+                CUSIP, such that the lines of a CUSIP are found with the pushdown of the storage (see
+                storage_TRACE.py). The size and modification time of every raw file are stored with the index.
+    Step 3:     Extract the raw trades of some CUSIPs (extract_raw_trades()): read only the indexed lines of the
+                CUSIPs and parse them with the same functions as the read-in (adj_dt_format_pre_2012() and
+                adj_dt_format_post_2012()). The lines of provenance IDs are found by the line number of the trades
+                (get_raw_lines(), see provenance_TRACE.py). The index of a folder is rebuilt if it is missing or a raw
+                file has changed.
+
+Note: The offsets refer to the decompressed content of a raw file. Uncompressed files are read with one seek per
+line, compressed files (.gz, .bz2, .xz, .zip) are decompressed but still not parsed. The index is built during the
+read-in only if dataset_specs['raw_index']['enabled'] is True (off by default, see specs.py and settings_TRACE.py).
+Otherwise, the index of a folder is built the first time that its raw trades are extracted. The index is only written
+to bld/data/TRACE/TRACE_raw_index, the folders of the raw data are never written to.
+"""
+
+import io
+import os
+import numpy as np
+import pandas as pd
+
+# Import the loading of the raw files (see async_io_TRACE.py)
+from async_io_TRACE import load_raw_file, DECOMPRESS
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import store_frame, load_frame, read_meta, get_storage_path
+# Import the provenance IDs of the trades (see provenance_TRACE.py)
+from provenance_TRACE import RAW_ID, get_file_ordinal, encode_raw_ids
+# Import the settings of the build
+from settings_TRACE import get_settings
+
+# Indices of the raw files that were read in but not stored yet: path of the raw file -> index
+RAW_FILE_INDEX = {}
+# Version of the stored index (2: with the line number of every trade). Indices of other versions are rebuilt
+INDEX_VERSION = 2
+
+
+def get_index_path(project_path, annual_fld):
+    """
+    Get the path of the index of an annual folder of the raw data.
+    """
+    return project_path + '/bld/data/TRACE/TRACE_raw_index/{}.pkl'.format(annual_fld)
+
+
+def get_daily_files(ann_fld_path):
+    """
+    Get the daily transaction files of an annual folder (the supplementary files start with '0033-corp-bond').
+    """
+    return [f for f in sorted(os.listdir(ann_fld_path)) if not (f.startswith('0033-corp-bond') | f.startswith('.'))]
+
+
+def get_file_stat(path):
+    """
+    Get the size and modification time of a raw file (to detect changed files).
+    """
+    stat = os.stat(path)
+
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+#########
+# Step 1: Index the raw files
+########
+def index_raw_data(data):
+    """
+    Find the lines of the trades in the content of a raw file and the CUSIP of every line. The first line is the
+    header, the last two lines are the FINRA trailer (see read_in_adj_dtyp_pre_2012()). Blank lines are skipped like
+    in pd.read_csv().
+
+    Parameters:
+    -----------
+    data (bytes-like): Decompressed content of the raw file
+
+    Returns:
+    --------
+    cusips (array): CUSIP of every trade line
+    offsets (array): Byte offset of every trade line
+    lengths (array): Length of every trade line in bytes (including the line break)
+    info (dict): Byte ranges of the header and the trailer and the format of the file ('prior_2012' or 'post_2012')
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n'))
+    if (len(buf) > 0) and (buf[-1] != ord('\n')):
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    sizes = ends - starts
+    # Blank lines (also with a carriage return)
+    blank = (sizes == 0) | ((sizes == 1) & (buf[np.minimum(starts, len(buf) - 1)] == ord('\r')))
+    lines = np.flatnonzero(blank == False)
+    if len(lines) < 3:
+        raise ValueError('A raw file needs a header and two trailer lines, found {} lines'.format(len(lines)))
+    lengths_all = np.minimum(ends + 1, len(buf)) - starts
+
+    header = bytes(buf[starts[lines[0]]:ends[lines[0]]]).decode().rstrip('\r').split('|')
+    if 'CUSIP_ID' not in header:
+        raise ValueError('The header of a raw file has no CUSIP_ID column')
+    info = {
+        'header': [int(starts[lines[0]]), int(lengths_all[lines[0]])],
+        'trailer': [int(starts[lines[-2]]), int(starts[lines[-1]] + lengths_all[lines[-1]] - starts[lines[-2]])],
+        'format': 'post_2012' if 'TRD_EXCTN_TM' in header else 'prior_2012',
+    }
+
+    # The CUSIP is the k-th field of a line: between the (k-1)-th and the k-th separator after the line start
+    k = header.index('CUSIP_ID')
+    lines = lines[1:-2]
+    line_starts = starts[lines]
+    line_ends = ends[lines]
+    pipes = np.flatnonzero(buf == ord('|'))
+    first = np.searchsorted(pipes, line_starts)
+    if k == 0:
+        field_starts = line_starts.copy()
+    else:
+        field_starts = pipes[np.minimum(first + k - 1, len(pipes) - 1)] + 1
+    field_ends = pipes[np.minimum(first + k, len(pipes) - 1)]
+    valid = (first + k < len(pipes)) & (field_ends < line_ends) & (field_starts <= field_ends)
+    widths = np.where(valid, field_ends - field_starts, 0)
+
+    # Gather the fields into a fixed-width byte matrix (padded with zeros) and view it as strings
+    width = max(int(widths.max()) if len(widths) > 0 else 0, 1)
+    positions = field_starts[:, None] + np.arange(width)[None, :]
+    matrix = np.where(np.arange(width)[None, :] < widths[:, None], buf[np.minimum(positions, len(buf) - 1)], 0)
+    cusips = np.ascontiguousarray(matrix.astype(np.uint8)).view('S{}'.format(width)).ravel().astype(str)
+
+    return cusips, line_starts, lengths_all[lines].astype(np.int32), info
+
+
+def load_and_index_raw_file(path, settings=None):
+    """
+    Load a raw file (see load_raw_file()) and index its lines if the raw file index is enabled. The index is kept
+    until the index of the folder is stored (store_raw_index()). The file is indexed on the I/O thread that prefetches
+    the raw files, i.e. in parallel to the processing of the previous day.
+
+    Parameters:
+    -----------
+    path (str): Path of the raw file
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    Returns:
+    --------
+    raw_file (BytesIO): Content of the (decompressed) file
+    """
+    if settings is None:
+        settings = get_settings()
+    raw_file = load_raw_file(path)
+    if settings['raw_index']['enabled']:
+        cusips, offsets, lengths, info = index_raw_data(raw_file.getbuffer())
+        info.update(get_file_stat(path))
+        RAW_FILE_INDEX[path] = (cusips, offsets, lengths, info)
+
+    return raw_file
+
+
+#########
+# Step 2: Store the index of an annual folder
+########
+def build_folder_index(ann_fld_path, daily_files, list_indices):
+    """
+    Combine the indices of the raw files of an annual folder into one DataFrame sorted by CUSIP, file and offset.
+
+    Parameters:
+    -----------
+    ann_fld_path (str): Path of the annual folder
+    daily_files (list): Names of the daily files
+    list_indices (list): Index of every daily file (see index_raw_data())
+
+    Returns:
+    --------
+    df_index (DataFrame): Lines of the trades (CUSIP_ID, file, line, offset, length) with the description of the
+                          files in df_index.attrs. The line is the position of the trade among the trade lines of its
+                          file (the row of pd.read_csv())
+    """
+    cusips = pd.Categorical(np.concatenate([ix[0] for ix in list_indices]))
+    files = pd.Categorical.from_codes(
+        np.concatenate([np.full(len(ix[0]), i, dtype=np.int32) for i, ix in enumerate(list_indices)]),
+        categories=daily_files
+    )
+    lines = np.concatenate([np.arange(len(ix[0]), dtype=np.int32) for ix in list_indices])
+    offsets = np.concatenate([ix[1] for ix in list_indices]).astype(np.int64)
+    lengths = np.concatenate([ix[2] for ix in list_indices]).astype(np.int32)
+    # The categories of the CUSIPs are sorted, i.e. the order of the codes is the order of the CUSIPs
+    order = np.lexsort((offsets, files.codes, cusips.codes))
+    df_index = pd.DataFrame({
+        'CUSIP_ID': cusips.take(order),
+        'file': files.take(order),
+        'line': lines[order],
+        'offset': offsets[order],
+        'length': lengths[order],
+    })
+    df_index.attrs = {'version': INDEX_VERSION, 'folder': os.path.basename(ann_fld_path),
+                      'files': {f: ix[3] for f, ix in zip(daily_files, list_indices)}}
+
+    return df_index
+
+
+def store_raw_index(project_path, ann_fld_path, settings=None):
+    """
+    Store the index of an annual folder after all its raw files were read in (see load_and_index_raw_file()). If a
+    raw file of the folder was not indexed (e.g. the index is disabled), no index is stored.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    ann_fld_path (str): Path of the annual folder
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+    """
+    daily_files = get_daily_files(ann_fld_path)
+    paths = [ann_fld_path + '/' + f for f in daily_files]
+    list_indices = [RAW_FILE_INDEX.pop(p, None) for p in paths]
+    if (len(daily_files) == 0) or any([ix is None for ix in list_indices]):
+        return
+    index_path = get_index_path(project_path, os.path.basename(ann_fld_path))
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    store_frame(build_folder_index(ann_fld_path, daily_files, list_indices), index_path, settings)
+
+
+def index_raw_folder(project_path, ann_fld_path):
+    """
+    Index all raw files of an annual folder without reading them in (e.g. for folders that were read in before the
+    index existed) and store the index.
+    """
+    print('Indexing the raw files in {}'.format(ann_fld_path))
+    daily_files = get_daily_files(ann_fld_path)
+    list_indices = []
+    for f in daily_files:
+        raw_file = load_raw_file(ann_fld_path + '/' + f)
+        cusips, offsets, lengths, info = index_raw_data(raw_file.getbuffer())
+        info.update(get_file_stat(ann_fld_path + '/' + f))
+        list_indices.append((cusips, offsets, lengths, info))
+        del raw_file
+    index_path = get_index_path(project_path, os.path.basename(ann_fld_path))
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    store_frame(build_folder_index(ann_fld_path, daily_files, list_indices), index_path)
+
+
+#########
+# Step 3: Extract the raw trades of some CUSIPs
+########
+def is_index_valid(index_path, ann_fld_path):
+    """
+    Check that the stored index of an annual folder covers exactly its current raw files.
+    """
+    storage_path = get_storage_path(index_path)
+    if storage_path is None:
+        return False
+    if os.path.isdir(storage_path):
+        attrs = read_meta(storage_path)['attrs']
+    else:
+        attrs = load_frame(index_path).attrs
+    if attrs.get('version') != INDEX_VERSION:
+        return False
+    files = attrs['files']
+    daily_files = get_daily_files(ann_fld_path)
+    if sorted(files) != sorted(daily_files):
+        return False
+    for f in daily_files:
+        stat = get_file_stat(ann_fld_path + '/' + f)
+        if (stat['size'] != files[f]['size']) | (stat['mtime_ns'] != files[f]['mtime_ns']):
+            return False
+
+    return True
+
+
+def get_folder_year(annual_fld):
+    """
+    Get the year of an annual folder of the raw data from its name (e.g. academic_TRACE_2014 -> 2014, None if the
+    name does not end with a year).
+    """
+    return int(annual_fld[-4:]) if annual_fld[-4:].isdigit() else None
+
+
+def load_folder_index(project_path, ann_fld_path, filters=None):
+    """
+    Load the index of an annual folder (see load_frame() for the filters). The index is rebuilt first if it is missing
+    or a raw file has changed.
+    """
+    index_path = get_index_path(project_path, os.path.basename(ann_fld_path))
+    if is_index_valid(index_path, ann_fld_path) == False:
+        index_raw_folder(project_path, ann_fld_path)
+
+    return load_frame(index_path, filters=filters)
+
+
+def read_raw_lines(path, ranges):
+    """
+    Read some lines of a raw file.
+
+    Parameters:
+    -----------
+    path (str): Path of the raw file
+    ranges (list): Byte offset and length of every line
+
+    Returns:
+    --------
+    parts (list): Content of the lines (every line ends with a line break)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    parts = []
+    if (ext in DECOMPRESS) or (ext == '.zip'):
+        data = load_raw_file(path).getbuffer()
+        for o, n in ranges:
+            parts.append(bytes(data[o:o + n]))
+    else:
+        with open(path, 'rb') as f:
+            for o, n in ranges:
+                f.seek(o)
+                parts.append(f.read(n))
+
+    # The last line of a file can lack the line break
+    return [p if p.endswith(b'\n') else p + b'\n' for p in parts]
+
+
+def extract_raw_trades(project_path, cusips, start_year=None, end_year=None):
+    """
+    Extract the raw trades of some CUSIPs from the raw daily files. The result equals the read-in of the raw files
+    (adj_dt_format_pre_2012() and adj_dt_format_post_2012() in read_TRACE.py) restricted to the CUSIPs, before the
+    selection of the bonds and the cleaning.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    cusips (list): CUSIPs to extract
+    start_year (int): First year (None -> the first annual folder)
+    end_year (int): Last year (None -> the last annual folder)
+
+    Returns:
+    --------
+    dict_trades (dict): Raw trades by format ('prior_2012' and 'post_2012'), ordered by day and line of the raw
+                        files
+    """
+    # Import the parsing of the read-in
+    from read_TRACE import adj_dt_format_pre_2012, adj_dt_format_post_2012
+    dict_parse = {'prior_2012': adj_dt_format_pre_2012, 'post_2012': adj_dt_format_post_2012}
+    if isinstance(cusips, str):
+        cusips = [cusips]
+
+    # Collect the lines of the CUSIPs by format and header of the raw files
+    raw_path = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    annual_flds = [f for f in sorted(os.listdir(raw_path)) if not f.startswith('.')]
+    dict_lines = {}
+    for annual_fld in annual_flds:
+        year = get_folder_year(annual_fld)
+        if (year is not None) and (((start_year is not None) and (year < start_year)) or
+                                   ((end_year is not None) and (year > end_year))):
+            continue
+        ann_fld_path = raw_path + annual_fld
+        df_index = load_folder_index(project_path, ann_fld_path, filters=[('CUSIP_ID', 'in', list(cusips))])
+        files = df_index.attrs['files']
+        daily_files = sorted(files)
+        df_index = df_index.sort_values(['file', 'offset'])
+        for f, df_file in df_index.groupby(df_index['file'].astype(str), sort=True):
+            info = files[f]
+            header, trailer = read_raw_lines(ann_fld_path + '/' + f, [info['header'], info['trailer']])
+            lines = read_raw_lines(ann_fld_path + '/' + f, zip(df_file['offset'].values, df_file['length'].values))
+            if (info['format'], header) not in dict_lines:
+                dict_lines[(info['format'], header)] = [[], trailer, []]
+            dict_lines[(info['format'], header)][0].extend(lines)
+            # Provenance IDs of the lines as in the read-in (see read_TRACE.py)
+            if year is not None:
+                dict_lines[(info['format'], header)][2].append(
+                    encode_raw_ids(get_file_ordinal(year, daily_files.index(f)), df_file['line'].values))
+
+    # Parse the lines of all files with the same header at once (a raw file with only these trades)
+    dict_frames = {}
+    for (fmt, header), (lines, trailer, list_ids) in dict_lines.items():
+        raw_file = io.BytesIO(b''.join([header] + lines + [trailer]))
+        df = dict_parse[fmt](raw_file)
+        # The index of the parsed lines is their position in the reduced raw file
+        if len(list_ids) > 0:
+            df[RAW_ID] = np.concatenate(list_ids)[df.index.values]
+        dict_frames.setdefault(fmt, []).append(df)
+    dict_trades = {}
+    for fmt in ['prior_2012', 'post_2012']:
+        if fmt in dict_frames:
+            dict_trades[fmt] = pd.concat(dict_frames[fmt], ignore_index=True)
+
+    return dict_trades
+
+
+def get_raw_lines(project_path, year, day, lines):
+    """
+    Read the raw lines of some trades of one raw daily file (see provenance_TRACE.py).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    year (int): Year of the annual folder
+    day (int): Position of the daily file in the annual folder
+    lines (array): Lines of the trades (position among the trade lines of the file)
+
+    Returns:
+    --------
+    file_path (str): Path of the raw file (None if it does not exist)
+    records (list): Raw line of every trade (None if the line does not exist)
+    """
+    raw_path = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    annual_flds = [f for f in sorted(os.listdir(raw_path)) if get_folder_year(f) == year]
+    if len(annual_flds) == 0:
+        return None, [None] * len(lines)
+    ann_fld_path = raw_path + annual_flds[0]
+    daily_files = get_daily_files(ann_fld_path)
+    if (day < 0) or (day >= len(daily_files)):
+        return None, [None] * len(lines)
+
+    df_index = load_folder_index(project_path, ann_fld_path, filters=[('file', 'in', [daily_files[day]])])
+    dict_ranges = dict(zip(df_index['line'].values, zip(df_index['offset'].values, df_index['length'].values)))
+    lines_found = [line for line in lines if line in dict_ranges]
+    dict_records = dict(zip(lines_found, read_raw_lines(ann_fld_path + '/' + daily_files[day],
+                                                        [dict_ranges[line] for line in lines_found])))
+    records = [dict_records[line].decode().rstrip('\r\n') if line in dict_records else None for line in lines]
+
+    return ann_fld_path + '/' + daily_files[day], records
@@ -21,9 +21,9 @@ Read in the daily raw Academic TRACE data and apply the corrections as described
 # Read in the necessary packages
 import pandas as pd
 pd.options.mode.chained_assignment = None
+import functools
 import gc
 import os
-import pickle as pickle
 from joblib import Parallel, delayed
 import tqdm
 
@@ -32,6 +32,26 @@ import tqdm
 from clean_TRACE import prior_2012_clean
 # (post 2012)
 from clean_TRACE import post_2012_clean
+# Import the telemetry of the reading-in step (rows, throughput and remaining time)
+from telemetry_TRACE import track_stage, add_rows, report_progress
+# Import the prefetching of the raw files and the background writer (see async_io_TRACE.py)
+from async_io_TRACE import prefetch, write_async, wait_for_writes
+# Import the CUSIP index of the raw files that is built while they are read in (see raw_index_TRACE.py)
+from raw_index_TRACE import load_and_index_raw_file, store_raw_index
+# Import the provenance IDs of the trades (see provenance_TRACE.py)
+from provenance_TRACE import RAW_ID, add_raw_ids, get_file_ordinal
+# Import the bitemporal index of the corrections (see bitemporal_TRACE.py)
+from bitemporal_TRACE import store_bitemporal_index
+# Import the check of the trade reports that appear in several raw files (see duplicates_TRACE.py)
+from duplicates_TRACE import duplicate_check, check_duplicates
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import store_frame, load_frame, frame_exists
+# Import the canonical order of the trades (see sort_order_TRACE.py)
+from sort_order_TRACE import get_canonical_order, sort_frame
+# Import the transfer of the unmatched trades between the processes of the parallel reading-in step
+from shared_memory_TRACE import share_frame, attach_frame, collect_frames, release_frame, shared_frames
+# Import the settings of the build (see settings_TRACE.py)
+from settings_TRACE import get_settings
 
 
 ########
@@ -44,7 +64,8 @@ def read_in_adj_dtyp_pre_2012(in_path):
 
     Args:
     --------
-    in_path (str): Path specification of the daily raw dataset
+    in_path (str or file-like): Path specification of the daily raw dataset (or its content, see
+    load_raw_file())
 
     Returns:
     --------
@@ -103,7 +124,8 @@ def read_in_adj_dtyp_post_2012(in_path):
 
     Args:
     --------
-    in_path (str): Path specification of the daily raw dataset
+    in_path (str or file-like): Path specification of the daily raw dataset (or its content, see
+    load_raw_file())
 
     Returns:
     --------
@@ -206,13 +228,16 @@ def format_ex_tm_dt(df, date_var):
     return df
 
 
-def adj_dt_format_pre_2012(in_path):
+def adj_dt_format_pre_2012(in_path, file_ordinal=None):
     """Read in the daily raw data prior to 06.02.2012 using the function read_in_adj_dtyp(),
     adjust the date format of the date variables and return the daily cleaned TRACE DataFrame.
 
     Args:
     --------
-    in_path (str): Specify the input path to the raw data file
+    in_path (str or file-like): Specify the input path to the raw data file (or its content, see
+    load_raw_file())
+    file_ordinal (int): Optional. Ordinal of the raw file for the provenance ID of the trades (see
+    provenance_TRACE.py)
 
     Returns:
     --------
@@ -222,6 +247,8 @@ def adj_dt_format_pre_2012(in_path):
 
     # Read in the dataset using read_in_adj_dtyp()
     df = read_in_adj_dtyp_pre_2012(in_path)
+    # Add the provenance ID of every trade while the index is still the line in the raw file
+    df = add_raw_ids(df, file_ordinal)
 
     # Sometimes there are typos which make the date too large (e.g. 30140101 instead of 20140101). 
     # This is excluded by the code below. 20810401 is the maximal number possible
@@ -243,13 +270,16 @@ def adj_dt_format_pre_2012(in_path):
     return df
 
 
-def adj_dt_format_post_2012(in_path):
+def adj_dt_format_post_2012(in_path, file_ordinal=None):
     """Read in the daily raw data prior to 06.02.2012, adjust the date format of the date variables 
     and return the daily cleaned TRACE DataFrame.
 
     Args:
     --------
-    in_path (str): Specify the input path to the raw data file
+    in_path (str or file-like): Specify the input path to the raw data file (or its content, see
+    load_raw_file())
+    file_ordinal (int): Optional. Ordinal of the raw file for the provenance ID of the trades (see
+    provenance_TRACE.py)
 
     Returns:
     --------
@@ -259,6 +289,8 @@ def adj_dt_format_post_2012(in_path):
 
     # Read in the dataset using read_in_adj_dtyp()
     df = read_in_adj_dtyp_post_2012(in_path)
+    # Add the provenance ID of every trade while the index is still the line in the raw file
+    df = add_raw_ids(df, file_ordinal)
 
     # It was noted that sometimes there are typos in the raw data which make the date too large
     # (e.g. 30140101 instead of 20140101). This is excluded by the code below:
@@ -318,10 +350,42 @@ def select_bonds(path):
     return issue_data['CUSIP_ID']
 
 
+def store_yearly_data(df, out_path, cusip_subset=None, settings=None):
+    """Store a yearly TRACE dataset (see storage_TRACE.py). If only a subset of bonds was read in, the 
+    existing yearly dataset is updated instead: all rows of the bonds in the subset are replaced 
+    by the newly read rows and all other rows are kept. The dataset is sorted by the canonical 
+    order of the trades (CUSIP, execution date and time, provenance ID) and stored with this order 
+    (see sort_order_TRACE.py), i.e. the later steps do not sort it again. The dataset is written 
+    by the background writer while the next year is read in (see wait_for_writes()).
+
+    Args:
+    --------
+    df (pd.DataFrame): Yearly TRACE dataset
+    out_path (str): Output path of the yearly dataset
+    cusip_subset (list): CUSIP IDs that were read in (None = all bonds)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+
+    """
+    if cusip_subset is not None:
+        # The existing yearly dataset has to be completely written before it is updated
+        wait_for_writes()
+    if (cusip_subset is not None) & frame_exists(out_path):
+        df_stored = load_frame(out_path)
+        # A yearly dataset of an older build has no provenance IDs, i.e. the updated rows get none either
+        if (RAW_ID in df.columns) & (RAW_ID not in df_stored.columns):
+            df = df.drop(columns=[RAW_ID])
+        df = pd.concat([df_stored.loc[df_stored['CUSIP_ID'].isin(cusip_subset) == False], df],
+                       ignore_index=True)
+    # Establish the canonical order of the trades (only once for all later steps)
+    df = sort_frame(df, get_canonical_order(df)).reset_index(drop=True)
+    add_rows(rows_out=len(df))
+    write_async(functools.partial(store_frame, settings=settings), df, out_path, settings)
+
+
 ########
 # Step 4
 ########
-def read_post_2012(year_ind, counter, annual_fld, path):
+def read_post_2012(year_ind, counter, annual_fld, path, cusip_subset=None, settings=None):
     """Read in TRACE data in the years post 2012 (i.e. > 2012). In a first step, source 
     automatically  the directories where the files are stored. In a second step, loop through all 
     days in a yearly folder and clean and concatenate the data to generate a yearly file. 
@@ -333,6 +397,8 @@ def read_post_2012(year_ind, counter, annual_fld, path):
     (0 = 2002, 1 = 2003, etc.)
     annual_fld (str): List of annual folder names
     path (str): Project root path
+    cusip_subset (list): Optional. Only read in these CUSIP IDs and update the existing yearly file
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -344,6 +410,8 @@ def read_post_2012(year_ind, counter, annual_fld, path):
 
     # Get list of CUSIP IDs that are to be maintained in the sample using select_bonds()
     cusip_list_keep = select_bonds(path)
+    if cusip_subset is not None:
+        cusip_list_keep = cusip_list_keep.loc[cusip_list_keep.isin(cusip_subset)]
     # Define the path to the annual TRACE dataset that is to be cleaned
 
     ann_fld_path = path + '/src/original_data/academic_TRACE/TRACE_raw/' + annual_fld[counter - 1]
@@ -355,21 +423,26 @@ def read_post_2012(year_ind, counter, annual_fld, path):
         [f for f in sorted(os.listdir(ann_fld_path))
          if not (f.startswith('0033-corp-bond') | f.startswith('.'))]
     )
+    # Read (and decompress) and index the next daily files on an I/O thread while the current day is processed
+    raw_files = prefetch(functools.partial(load_and_index_raw_file, settings=settings),
+                         [ann_fld_path + '/' + f for f in daily_files], settings=settings)
 
     df_dict_post_2012 = {}
 
     # Initialize trsct count
     # Loop over all days in one yearly folder and concatenate the dataset
     for day in range(0, len(daily_files)):
-        print('Currently reading Year: 20{}, Trading Day: {}'.format(year_ind, day))
+        report_progress('Currently reading Year: 20{}, Trading Day: {}'.format(year_ind, day), day, len(daily_files))
         if day == 0:
             # Read in the new daily dataset.
-            df = adj_dt_format_post_2012(ann_fld_path + '/' + daily_files[day])
+            df = adj_dt_format_post_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df))
             # Keep only the bonds according to the specifications in select_bonds()
             df_dict_post_2012['df_day_{}'.format(day)] = df.loc[df['CUSIP_ID'].isin(cusip_list_keep)]
         else:
             # Read in the new daily dataset.
-            df_tmp = adj_dt_format_post_2012(ann_fld_path + '/' + daily_files[day])
+            df_tmp = adj_dt_format_post_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df_tmp))
             # Keep only the bonds according to the specifications in select_bonds()
             df_dict_post_2012['df_day_{}'.format(day)] = df_tmp.loc[df_tmp['CUSIP_ID'].isin(cusip_list_keep)]
 
@@ -378,14 +451,23 @@ def read_post_2012(year_ind, counter, annual_fld, path):
             #df = pd.concat([df, df_tmp])
             #print("End concatenation")
 
+    # Store the CUSIP index of the raw files of the year
+    store_raw_index(path, ann_fld_path, settings)
+
     df = pd.concat(df_dict_post_2012.values(), ignore_index=True)
+    # Flag (or drop) the trade reports that were already read in from another raw file
+    df = check_duplicates(path, df, 'TRACE_clean_{}.pkl'.format(year_ind + 2000), cusip_subset, settings)
 
     # Implement the Dick-Nielsen (2019) corrections using post_2012_clean()
-    df_post, unmatched = post_2012_clean(df)
+    df_post, unmatched = post_2012_clean(df, settings)
+    # Store the trade reports that the corrections delete with the date of the deletion (as-of snapshots)
+    store_bitemporal_index(path, df, df_post, 'TRACE_clean_{}.pkl'.format(year_ind + 2000), cusip_subset,
+                           settings=settings)
     # Store the yearly TRACE data to disc:
     print("Saving the concatenated raw data for the year {}".format(year_ind + 2000))
-    df_post.to_pickle(
-        path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}.pkl'.format(year_ind + 2000)
+    store_yearly_data(
+        df_post, path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}.pkl'.format(year_ind + 2000),
+        cusip_subset, settings
     )
     # Drop DataFrame from memory to save memory space
     del [df]
@@ -395,7 +477,7 @@ def read_post_2012(year_ind, counter, annual_fld, path):
 
 
 
-def read_2012(year_ind, counter, annual_fld, path, unmatched_in):
+def read_2012(year_ind, counter, annual_fld, path, unmatched_in, cusip_subset=None, settings=None):
     """Read in TRACE data in the year 2012. FINRA changed the reporting on 06.02.2012 which requires 
     a different reading-in procedure before and after this date. In a first step, source
     automatically the directories where the files are stored. In a second step, loop through all 
@@ -409,6 +491,8 @@ def read_2012(year_ind, counter, annual_fld, path, unmatched_in):
     annual_fld (list): List of annual folder names
     path (str): Project root path
     unmatched_in (pd.DataFrame): Read in the unmatched transactions from the post_2012 cleaning step
+    cusip_subset (list): Optional. Only read in these CUSIP IDs and update the existing yearly file
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -418,6 +502,8 @@ def read_2012(year_ind, counter, annual_fld, path, unmatched_in):
 
     # Get list of CUSIP IDs that are to be maintained in the sample using select_bonds()
     cusip_list_keep = select_bonds(path)
+    if cusip_subset is not None:
+        cusip_list_keep = cusip_list_keep.loc[cusip_list_keep.isin(cusip_subset)]
     # Define the path to the annual TRACE dataset that is to be cleaned
     ann_fld_path = path + '/src/original_data/academic_TRACE/TRACE_raw/' + annual_fld[counter - 1]
     print(ann_fld_path)
@@ -428,17 +514,22 @@ def read_2012(year_ind, counter, annual_fld, path, unmatched_in):
         [f for f in sorted(os.listdir(ann_fld_path))
          if not (f.startswith('0033-corp-bond') | f.startswith('.'))]
     )
+    # Read (and decompress) and index the next daily files on an I/O thread while the current day is processed
+    raw_files = prefetch(functools.partial(load_and_index_raw_file, settings=settings),
+                         [ann_fld_path + '/' + f for f in daily_files], settings=settings)
     # Loop over all days in one yearly folder and concatenate the dataset
     for day in range(0, len(daily_files)):
-        print('Currently reading Year: 20{}, Trading Day: {}'.format(year_ind, day))
+        report_progress('Currently reading Year: 20{}, Trading Day: {}'.format(year_ind, day), day, len(daily_files))
         if (day == 0):
             # Read in the new daily dataset for the first day of 2012
-            df_2012_prior = adj_dt_format_pre_2012(ann_fld_path + '/' + daily_files[day])
+            df_2012_prior = adj_dt_format_pre_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df_2012_prior))
             # Keep only the bonds according to the specifications in select_bonds()
             df_2012_prior = df_2012_prior.loc[df_2012_prior['CUSIP_ID'].isin(cusip_list_keep)]
         elif (day > 0) & (day <= 22):
             # Read in the new daily dataset.
-            df_2012_prior_tmp = adj_dt_format_pre_2012(ann_fld_path + '/' + daily_files[day])
+            df_2012_prior_tmp = adj_dt_format_pre_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df_2012_prior_tmp))
             # Keep only the bonds according to the specifications in select_bonds()
             df_2012_prior_tmp = (
                 df_2012_prior_tmp.loc[df_2012_prior_tmp['CUSIP_ID'].isin(cusip_list_keep)]
@@ -448,12 +539,14 @@ def read_2012(year_ind, counter, annual_fld, path, unmatched_in):
         elif (day == 23):
             # Read in the new daily dataset for the first day after the reporting standards 
             # changed on 06.02.2012
-            df_2012_post = adj_dt_format_post_2012(ann_fld_path + '/' + daily_files[day])
+            df_2012_post = adj_dt_format_post_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df_2012_post))
             # Keep only the bonds according to the specifications in select_bonds()
             df_2012_post = df_2012_post.loc[df_2012_post['CUSIP_ID'].isin(cusip_list_keep)]
         else:
             # Read in the new daily dataset.
-            df_2012_post_tmp = adj_dt_format_post_2012(ann_fld_path + '/' + daily_files[day])
+            df_2012_post_tmp = adj_dt_format_post_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df_2012_post_tmp))
             # Keep only the bonds according to the specifications in select_bonds()
             df_2012_post_tmp = (
                 df_2012_post_tmp.loc[df_2012_post_tmp['CUSIP_ID'].isin(cusip_list_keep)]
@@ -461,18 +554,34 @@ def read_2012(year_ind, counter, annual_fld, path, unmatched_in):
             # Concatenate the datasets
             df_2012_post = pd.concat([df_2012_post, df_2012_post_tmp])
 
+    # Store the CUSIP index of the raw files of the year
+    store_raw_index(path, ann_fld_path, settings)
+
+    # Flag (or drop) the trade reports that were already read in from another raw file (in the order of the files)
+    df_2012_prior = check_duplicates(path, df_2012_prior, 'TRACE_clean_2012_prior.pkl', cusip_subset, settings)
+    df_2012_post = check_duplicates(path, df_2012_post, 'TRACE_clean_2012_post.pkl', cusip_subset, settings)
+
     # Apply the cleaning steps by Dick-Nielsen & Poulsen (2019) for the post 2012 data:
-    df_2012_post_cl_DN, unmatched_tmp = post_2012_clean(df_2012_post)
+    df_2012_post_cl_DN, unmatched_tmp = post_2012_clean(df_2012_post, settings)
     unmatched = pd.concat([unmatched_in, unmatched_tmp])
     # Apply the cleaning steps by Dick-Nielsen & Poulsen (2019) for the pre 2012 data:
-    df_2012_pre_cl_DN = prior_2012_clean(df_2012_prior, unmatched)
+    df_2012_pre_cl_DN = prior_2012_clean(df_2012_prior, unmatched, settings)
+    # Store the trade reports that the corrections delete with the date of the deletion (as-of snapshots)
+    store_bitemporal_index(path, df_2012_post, df_2012_post_cl_DN, 'TRACE_clean_2012_post.pkl', cusip_subset,
+                           settings=settings)
+    store_bitemporal_index(path, df_2012_prior, df_2012_pre_cl_DN, 'TRACE_clean_2012_prior.pkl', cusip_subset,
+                           unmatched, settings)
     # Store the yearly TRACE data
     print("Saving the concatenated raw data for the year 2012 (post change in reporting)")
-    df_2012_post_cl_DN.to_pickle(
-        path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}_post.pkl'.format(year_ind  + 2000))
+    store_yearly_data(
+        df_2012_post_cl_DN,
+        path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}_post.pkl'.format(year_ind  + 2000),
+        cusip_subset, settings)
     print("Saving the concatenated raw data for the year 2012 (pre change in reporting)")
-    df_2012_pre_cl_DN.to_pickle(
-        path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}_prior.pkl'.format(year_ind  + 2000))
+    store_yearly_data(
+        df_2012_pre_cl_DN,
+        path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}_prior.pkl'.format(year_ind  + 2000),
+        cusip_subset, settings)
 
     # Drop DataFrame from memory to save memory space
     del [[df_2012_post_cl_DN, df_2012_pre_cl_DN]]
@@ -481,7 +590,7 @@ def read_2012(year_ind, counter, annual_fld, path, unmatched_in):
     return unmatched
 
 
-def read_pre_2012(year_ind, counter, annual_fld, path, unmatched_in):
+def read_pre_2012(year_ind, counter, annual_fld, path, unmatched_in, cusip_subset=None, settings=None):
     """Read in TRACE data in the years prior to 2012 (i.e. <= 2011). In a first step source 
     automatically the directories where the files are stored. In a second step, loop through all 
     days in a yearly folder  and clean and concatenate the data to generate a yearly file. 
@@ -492,6 +601,8 @@ def read_pre_2012(year_ind, counter, annual_fld, path, unmatched_in):
     year_ind (int): Year for which the TRACE dataset is to be generated
     annual_fld (list): List of annual folder names
     path (str): Project root path
+    cusip_subset (list): Optional. Only read in these CUSIP IDs and update the existing yearly file
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -501,6 +612,8 @@ def read_pre_2012(year_ind, counter, annual_fld, path, unmatched_in):
 
     # Get list of CUSIP IDs that are to be maintained in the sample using select_bonds()
     cusip_list_keep = select_bonds(path)
+    if cusip_subset is not None:
+        cusip_list_keep = cusip_list_keep.loc[cusip_list_keep.isin(cusip_subset)]
     # Define the path to the annual TRACE folder that is to be cleared
     ann_fld_path = path + '/src/original_data/academic_TRACE/TRACE_raw/' + annual_fld[counter - 1]
     # Get a list of the daily files within the annual folder. Note that the actual transaction data 
@@ -510,36 +623,52 @@ def read_pre_2012(year_ind, counter, annual_fld, path, unmatched_in):
         [f for f in sorted(os.listdir(ann_fld_path))
          if not (f.startswith('0033-corp-bond') | f.startswith('.'))]
     )
+    # Read (and decompress) and index the next daily files on an I/O thread while the current day is processed
+    raw_files = prefetch(functools.partial(load_and_index_raw_file, settings=settings),
+                         [ann_fld_path + '/' + f for f in daily_files], settings=settings)
 
     df_dict_pre_2012 = {}
 
     # Loop over all days in one yearly folder and concatenate the dataset
     for day in range(0, len(daily_files)):
         if year_ind >= 10:
-            print('Currently reading Year: 20{}, Trading Day: {}'.format(year_ind, day))
+            report_progress('Currently reading Year: 20{}, Trading Day: {}'.format(year_ind, day), day,
+                            len(daily_files))
         else:
-            print('Currently reading Year: 200{}, Trading Day: {}'.format(year_ind, day))
+            report_progress('Currently reading Year: 200{}, Trading Day: {}'.format(year_ind, day), day,
+                            len(daily_files))
         if (day == 0):
             # Read in the new daily dataset.
-            df = adj_dt_format_pre_2012(ann_fld_path + '/' + daily_files[day])
+            df = adj_dt_format_pre_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df))
             # Keep only the bonds according to the specifications in select_bonds()
             df_dict_pre_2012['df_day_{}'.format(day)] = df.loc[df['CUSIP_ID'].isin(cusip_list_keep)]
         else:
             # Read in the new daily dataset.
-            df_tmp = adj_dt_format_pre_2012(ann_fld_path + '/' + daily_files[day])
+            df_tmp = adj_dt_format_pre_2012(next(raw_files), get_file_ordinal(2000 + year_ind, day))
+            add_rows(rows_in=len(df_tmp))
             # Keep only the bonds according to the specifications in select_bonds()
             df_dict_pre_2012['df_day_{}'.format(day)] = df_tmp.loc[df_tmp['CUSIP_ID'].isin(cusip_list_keep)]
             # Concatenate the datasets
             #df = pd.concat([df, df_tmp])
 
+    # Store the CUSIP index of the raw files of the year
+    store_raw_index(path, ann_fld_path, settings)
+
     df = pd.concat(df_dict_pre_2012.values(), ignore_index=True)
+    # Flag (or drop) the trade reports that were already read in from another raw file
+    df = check_duplicates(path, df, 'TRACE_clean_{}.pkl'.format(year_ind + 2000), cusip_subset, settings)
 
     # Implement the Dick-Nielsen (2019) corrections using post_2012_clean()
-    df_prior = prior_2012_clean(df, unmatched_in)
+    df_prior = prior_2012_clean(df, unmatched_in, settings)
+    # Store the trade reports that the corrections delete with the date of the deletion (as-of snapshots)
+    store_bitemporal_index(path, df, df_prior, 'TRACE_clean_{}.pkl'.format(year_ind + 2000), cusip_subset,
+                           unmatched_in, settings)
     # Store the yearly TRACE data
     print("Saving the concatenated raw data for the year {}".format(year_ind + 2000))
-    df_prior.to_pickle(
-        path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}.pkl'.format(year_ind  + 2000)
+    store_yearly_data(
+        df_prior, path + '/bld/data/TRACE/TRACE_raw_clean/TRACE_clean_{}.pkl'.format(year_ind  + 2000),
+        cusip_subset, settings
     )
     # Drop DataFrame from memory to save memory space
     del [df_prior]
@@ -549,20 +678,26 @@ def read_pre_2012(year_ind, counter, annual_fld, path, unmatched_in):
 ########
 # Step 5
 ########
-def read_TRACE_all(path, dataset_specs_in):
+def read_TRACE_all(path, dataset_specs_in, cusip_subset=None, settings=None):
     """Read in the entire TRACE dataset by executing the above steps. I.e., read in the daily text 
     files, apply the correction steps and concatenate all files on a yearly level. 
-    Then save the dataset for each year in pickle format.
+    Then save the dataset for each year (see storage_TRACE.py).
 
     Args:
     --------
     path: Project root path
+    dataset_specs_in (dict): Final dataset specifications
+    cusip_subset (list): Optional. Only read in these CUSIP IDs and update the existing yearly
+    files (e.g. for bonds that are newly selected after an update of the MERGENT data)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs_in)
 
     Note:
     --------
     Executes all previously specified reading-in steps.
 
     """
+    if settings is None:
+        settings = get_settings(dataset_specs_in)
     # Get the name of the annual TRACE data folders. Exclude the listing of system files
     annual_fld_names = (
         [f for f in sorted(os.listdir(path + '/src/original_data/academic_TRACE/TRACE_raw/'))
@@ -571,97 +706,124 @@ def read_TRACE_all(path, dataset_specs_in):
 
     counter = len(annual_fld_names)
 
-    # Apply the reading-in procedure in the respective years. Loop backwards to assure that the 
-    # unmatched data of the poSst period are available for the pre-period.
-    for year_ind in range(int(str(dataset_specs_in['sample_time_span'][1])[-2:]), int(str(dataset_specs_in['sample_time_span'][0])[-2:])-1, -1):
-        print("")
-        print("START READING IN YEAR {}".format(2000 + year_ind))
-        print("")
-
-        # Initialization with starting year:
-        if year_ind == int(str(dataset_specs_in['sample_time_span'][1])[-2:]):
-            unmatched = read_post_2012(year_ind, counter, annual_fld_names, path)
-
-        # Note: 12 corresponds to 2012 which is the cutoff year due to the change in the TRACE 
-        # dataset format
-        elif (year_ind < int(str(dataset_specs_in['sample_time_span'][1])[-2:])) & (year_ind > 12):
-            unmatched_tmp = read_post_2012(year_ind, counter, annual_fld_names, path)
-            unmatched = pd.concat([unmatched, unmatched_tmp])
-
-        elif year_ind == 12:  # corresponds to 2012 (!!mind the reverse counting!!)
-            unmatched_tmp = read_2012(year_ind, counter, annual_fld_names, path, unmatched)
-            unmatched_fin = pd.concat([unmatched, unmatched_tmp])
-
-        else:
-            read_pre_2012(year_ind, counter, annual_fld_names, path, unmatched_fin)
-
-        # Subtract one from the automatic counter that works as a selector variable
-        counter = counter-1
-
-
-def read_TRACE_all_PARALLEL_post_2012(path, annual_fld_names, year_ind):
-    """Read in the entire TRACE dataset by executing the above steps. I.e., read in the daily text 
-    files, apply the correction steps and concatenate all files on a yearly level. 
-    Then save the dataset for each year in pickle format.
+    # Check every raw file against all files that were read in before (see duplicates_TRACE.py)
+    with duplicate_check(path, settings):
+        # Apply the reading-in procedure in the respective years. Loop backwards to assure that the 
+        # unmatched data of the poSst period are available for the pre-period.
+        for year_ind in range(int(str(dataset_specs_in['sample_time_span'][1])[-2:]), int(str(dataset_specs_in['sample_time_span'][0])[-2:])-1, -1):
+            print("")
+            print("START READING IN YEAR {}".format(2000 + year_ind))
+            print("")
+
+            # Track the wall time, memory, rows and bytes read of the year (see telemetry_TRACE.py)
+            with track_stage('read_{}'.format(2000 + year_ind)):
+                # Initialization with starting year:
+                if year_ind == int(str(dataset_specs_in['sample_time_span'][1])[-2:]):
+                    unmatched = read_post_2012(year_ind, counter, annual_fld_names, path, cusip_subset, settings)
+
+                # Note: 12 corresponds to 2012 which is the cutoff year due to the change in the TRACE 
+                # dataset format
+                elif (year_ind < int(str(dataset_specs_in['sample_time_span'][1])[-2:])) & (year_ind > 12):
+                    unmatched_tmp = read_post_2012(year_ind, counter, annual_fld_names, path, cusip_subset,
+                                                   settings)
+                    unmatched = pd.concat([unmatched, unmatched_tmp])
+
+                elif year_ind == 12:  # corresponds to 2012 (!!mind the reverse counting!!)
+                    unmatched_tmp = read_2012(year_ind, counter, annual_fld_names, path, unmatched,
+                                              cusip_subset, settings)
+                    unmatched_fin = pd.concat([unmatched, unmatched_tmp])
+
+                else:
+                    read_pre_2012(year_ind, counter, annual_fld_names, path, unmatched_fin, cusip_subset,
+                                  settings)
+
+            # Subtract one from the automatic counter that works as a selector variable
+            counter = counter-1
+
+    # Wait until the background writer has stored all yearly datasets
+    wait_for_writes()
+
+
+def read_TRACE_all_PARALLEL_post_2012(path, annual_fld_names, year_ind, counter, prefix, cusip_subset=None,
+                                      settings=None):
+    """Read in one year after 2012 in a worker process (see read_post_2012()) and return the unmatched 
+    trades through shared memory instead of pickling them.
 
     Args:
     -----------
     path (str): Project root path
+    annual_fld_names (list): List of annual folder names
+    year_ind (int): Year indicator (13 = 2013, etc.)
+    counter (int): Position of the annual folder of the year in annual_fld_names (starting at 1)
+    prefix (str): Prefix of the shared memory segment (see shared_frames() in shared_memory_TRACE.py)
+    cusip_subset (list): Optional. Only read in these CUSIP IDs and update the existing yearly file
+    settings (dict): Settings of the build of the parent process (see settings_TRACE.py)
 
-    Notes:
+    Returns:
     --------
-    Executes all previously specified reading-in steps.
+    handle (dict): Handle of the unmatched trades (see share_frame() in shared_memory_TRACE.py)
 
     """
 
-    # Apply the reading-in procedure in the respective years. Loop backwards to assure that the 
-    # unmatched data of the post period are available for the pre-period.
-    if year_ind == len(annual_fld_names):
-        unmatched = read_post_2012(year_ind, annual_fld_names, path)
-    # Note: 11 corresponds to 2012 which is the cutoff year due to the change in the TRACE dataset 
-    #format
-    elif (year_ind < len(annual_fld_names)) & (year_ind > 11):
-        unmatched = read_post_2012(year_ind, annual_fld_names, path)
-    else:
-        print('Reading-in step misspecified')
+    # Note: 12 corresponds to 2012 which is the cutoff year due to the change in the TRACE dataset 
+    # format
+    if year_ind <= 12:
+        raise ValueError('Reading-in step misspecified: 20{} is not after 2012'.format(year_ind))
+    # The files of the year are checked against each other
+    with duplicate_check(path, settings):
+        unmatched = read_post_2012(year_ind, counter, annual_fld_names, path, cusip_subset, settings)
+    # The yearly dataset has to be on disk before the worker returns
+    wait_for_writes()
 
-    return unmatched
+    return share_frame(unmatched, prefix)
 
 
-def read_TRACE_all_PARALLEL_prior_2012(path, annual_fld_names, unmatched, year_ind):
-    """Read in the entire TRACE dataset by executing the above steps. I.e., read in the daily text 
-    files, apply the correction steps and concatenate all files on a yearly level. Then save the
-     dataset for each year in pickle format.
+def read_TRACE_all_PARALLEL_prior_2012(path, annual_fld_names, unmatched_handle, year_ind, counter,
+                                       cusip_subset=None, settings=None):
+    """Read in one year before 2012 in a worker process (see read_pre_2012()). The unmatched trades 
+    are mapped from the shared memory of the parent process instead of being pickled to every worker.
 
     Args:
     --------
     path (str): Project root path
-
-    Returns:
-    --------
-    Executes all previously specified reading-in steps.
+    annual_fld_names (list): List of annual folder names
+    unmatched_handle (dict): Handle of the unmatched trades (see share_frame() in shared_memory_TRACE.py)
+    year_ind (int): Year indicator (11 = 2011, etc.)
+    counter (int): Position of the annual folder of the year in annual_fld_names (starting at 1)
+    cusip_subset (list): Optional. Only read in these CUSIP IDs and update the existing yearly file
+    settings (dict): Settings of the build of the parent process (see settings_TRACE.py)
 
     """
 
-    # Apply the reading-in procedure in the respective years. Loop backwards to assure that the 
-    # unmatched data of the post period are available for the pre-period.
-    if year_ind < 11:
-        read_pre_2012(year_ind, annual_fld_names, path, unmatched)
-    else:
-        print('Reading-in step misspecified')
+    if year_ind >= 12:
+        raise ValueError('Reading-in step misspecified: 20{} is not before 2012'.format(year_ind))
+    unmatched = attach_frame(unmatched_handle)
+    # The files of the year are checked against each other
+    with duplicate_check(path, settings):
+        read_pre_2012(year_ind, counter, annual_fld_names, path, unmatched, cusip_subset, settings)
+    # The yearly dataset has to be on disk before the worker returns
+    wait_for_writes()
+    # Unmap the unmatched trades, the parent process removes the segment
+    del [unmatched]
+    release_frame(unmatched_handle, unlink=False)
 
 
-
-
-def read_TRACE_all_PARALLEL_2(path, N_workers):
+def read_TRACE_all_PARALLEL_2(path, dataset_specs_in, N_workers, cusip_subset=None, settings=None):
     """Parallelize the reading-in steps to increase performance. Read in the annual folder names 
-    in a first step.
+    in a first step. The years after 2012 and the years before 2012 are read in parallel, the 
+    unmatched trades are passed between the processes through shared memory. The output is the 
+    same as of read_TRACE_all(), except that the duplicate trade reports are only searched within 
+    every year (see duplicates_TRACE.py).
 
     Args:
     --------
     path (str): Project root path
+    dataset_specs_in (dict): Final dataset specifications
     N_workers (int): Define how many cores should be allocated to the reading-in step 
     (-1 -> use all available cores)
+    cusip_subset (list): Optional. Only read in these CUSIP IDs and update the existing yearly files
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs_in).
+    The worker processes get them as an argument
 
     Returns:
     --------
@@ -670,38 +832,53 @@ def read_TRACE_all_PARALLEL_2(path, N_workers):
     """
 
     print("The reading-in step is started")
+    if settings is None:
+        settings = get_settings(dataset_specs_in)
 
     # Get the name of the annual TRACE data folders. Exclude the listing of system files
     annual_fld_names = (
         [f for f in sorted(os.listdir(path + '/src/original_data/academic_TRACE/TRACE_raw/'))
          if not f.startswith('.')]
     )
-
-    # Perform the parallelization from the last sample year until 2013
-    unmatched_out_parallel = (
-        Parallel(n_jobs = N_workers)(delayed(read_TRACE_all_PARALLEL_post_2012)(path, 
-        annual_fld_names, year) for year in range(len(annual_fld_names), 11, -1))
-    )
-    unmatched = pd.concat(unmatched_out_parallel)
+    end_ind = int(str(dataset_specs_in['sample_time_span'][1])[-2:])
+    start_ind = int(str(dataset_specs_in['sample_time_span'][0])[-2:])
+    if end_ind <= 12:
+        raise ValueError('The parallel reading-in step needs at least one sample year after 2012')
+    # Position of the annual folder of every year (the last folder is the last sample year, see read_TRACE_all())
+    counter = {year_ind: len(annual_fld_names) - (end_ind - year_ind) for year_ind in range(start_ind, end_ind + 1)}
+
+    with shared_frames() as prefix:
+        # Perform the parallelization from the last sample year until 2013
+        unmatched_handles = (
+            Parallel(n_jobs=N_workers)(delayed(read_TRACE_all_PARALLEL_post_2012)(
+                path, annual_fld_names, year_ind, counter[year_ind], prefix, cusip_subset, settings)
+                for year_ind in range(end_ind, max(start_ind, 13) - 1, -1))
+        )
+        unmatched = collect_frames(unmatched_handles)
     print("The reading-in for the most recent sample year until 2013 is finalized")
 
-    # Perform the reading-in step for 2012:
-    unmatched = read_2012(11, annual_fld_names, path, unmatched)
-    print("The reading-in for the year 2012 is finalised")
-
-
-    # Perform the reading-in for the years 2002 - 2011:
-    Parallel(n_jobs=N_workers)(delayed(read_TRACE_all_PARALLEL_prior_2012)(path, annual_fld_names, 
-        unmatched, year) for year in range(10, 0, -1))
-    print("The reading-in for the years 2011 - 2002 is finalized")
+    if start_ind <= 12:
+        # Perform the reading-in step for 2012:
+        with duplicate_check(path, settings):
+            unmatched_tmp = read_2012(12, counter[12], annual_fld_names, path, unmatched, cusip_subset, settings)
+        unmatched_fin = pd.concat([unmatched, unmatched_tmp])
+        wait_for_writes()
+        print("The reading-in for the year 2012 is finalised")
+
+    if start_ind <= 11:
+        # Perform the reading-in for the years 2002 - 2011. The unmatched trades are shared with all workers
+        with shared_frames() as prefix:
+            unmatched_handle = share_frame(unmatched_fin, prefix)
+            Parallel(n_jobs=N_workers)(delayed(read_TRACE_all_PARALLEL_prior_2012)(
+                path, annual_fld_names, unmatched_handle, year_ind, counter[year_ind], cusip_subset, settings)
+                for year_ind in range(11, start_ind - 1, -1))
+        print("The reading-in for the years 2011 - 2002 is finalized")
 
     print(
         "SUCCESS! The reading-in and concatenation to individual year files finalised")
 
 
-
-
-def get_all_rpt_dates(path):
+def get_all_rpt_dates(path, settings=None):
     """Get all reporting dates in the raw TRACE data. That is, extract the date from every single 
     raw.txt file in the TRACE data. This is important as e.g. on some weekdays 
     (where there is no holiday) there is no TRACE report  available. On such days the number of 
@@ -711,6 +888,7 @@ def get_all_rpt_dates(path):
     Args:
     --------
     path: Project root path
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
 
     Returns:
     --------
@@ -735,8 +913,8 @@ def get_all_rpt_dates(path):
         TRACE_rpt_days_yearly = [c[30:40] for c in daily_files]
         TRACE_rpt_days_all = TRACE_rpt_days_all + TRACE_rpt_days_yearly
 
-    with open(path + '/bld/data/TRACE/TRACE_info/TRACE_rpt_dates.pkl', 'wb') as f:
-        pickle.dump(TRACE_rpt_days_all, f)
+    store_frame(pd.DataFrame({'rpt_date': TRACE_rpt_days_all}),
+                path + '/bld/data/TRACE/TRACE_info/TRACE_rpt_dates.pkl', settings)
 
 
 def get_full_sample_info(path):
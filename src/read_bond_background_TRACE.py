@@ -4,6 +4,12 @@ to this list if the bond CUSIP is not on the list yet. The advantage is that I g
 identifiers that is ever traded. The disadvantage is that I lose the time-varying information such as the
 coupon rate.
 
+To keep the time-varying information, get_bond_info_intervals() additionally compresses the daily files to the
+change points of every bond and stores the attributes together with their validity interval [valid_from, valid_to).
+merge_bond_info_intervals() then attaches to every trade the attributes that are in force on the execution date.
+Trades before the first record of a bond get the attributes of the first record, as with the merge of the first
+record per bond.
+
 """
 
 import pandas as pd
@@ -11,6 +17,10 @@ import numpy as np
 pd.options.mode.chained_assignment = None
 import os
 from datetime import datetime
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import store_frame
+# Import the settings of the build (see settings_TRACE.py)
+from settings_TRACE import get_settings
 
 
 def read_bond_info(in_path):
@@ -57,7 +67,7 @@ def read_bond_info(in_path):
 
     return df
 
-def get_unique_bond_info(path, dataset_specs_in):
+def get_unique_bond_info(path, dataset_specs_in, settings=None):
     """
     Construct one dataset containing all unique CUSIPs that are ever registered over the entire sample period.
     Note: Every day information on the traded bonds is stored in the file "0033-corp-bond-YYYY-MM-DD.txt"
@@ -71,12 +81,16 @@ def get_unique_bond_info(path, dataset_specs_in):
     Parameters:
     ----------
     path (str):  Project path
+    dataset_specs_in (dict): Final dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs_in)
 
     Returns:
     --------
     df (DataFrame):  Daily raw transactions with adjusted data types
 
     """
+    if settings is None:
+        settings = get_settings(dataset_specs_in)
     # Define the folder path to the raw TRACE data
     annual_fld = (
         [f for f in sorted(os.listdir(path + '/src/original_data/academic_TRACE/TRACE_raw/'))
@@ -161,8 +175,194 @@ def get_unique_bond_info(path, dataset_specs_in):
                      bond_info_df_tmp_supp.loc[bond_info_df_tmp_supp.CUSIP_ID.isin(add_CUSIPs_supp)]]
                 )
     # Store the dataset
-    bond_info_df.to_pickle(path + '/bld/data/TRACE/TRACE_raw_clean/bond_info.pkl')
+    store_frame(bond_info_df, path + '/bld/data/TRACE/TRACE_raw_clean/bond_info.pkl', settings)
 
     return bond_info_df
 
 
+
+
+def list_bond_info_files(path):
+    """
+    List all daily bond information files in chronological order. Prior to 2012-02-06 there is only the basic
+    file "0033-corp-bond-YYYY-MM-DD.txt", afterwards there is additionally the supplemental file
+    "0033-corp-bond-supplemental-YYYY-MM-DD.txt" for the same date.
+
+    Parameters:
+    ----------
+    path (str):  Project path
+
+    Returns:
+    --------
+    bond_files (list): List of tuples (date, path to the basic file, path to the supplemental file or None)
+
+    """
+    # Define the folder path to the raw TRACE data
+    annual_fld = (
+        [f for f in sorted(os.listdir(path + '/src/original_data/academic_TRACE/TRACE_raw/'))
+         if not f.startswith('.')]
+    )
+
+    bond_files = []
+    for fld in annual_fld:
+        ann_fld_path = path + '/src/original_data/academic_TRACE/TRACE_raw/' + fld
+        # Map the supplemental files to their date. The date is always stored in the last 14 characters of the
+        # file name (YYYY-MM-DD.txt)
+        daily_files_supp = (
+            {f[-14:-4]: ann_fld_path + '/' + f for f in sorted(os.listdir(ann_fld_path))
+             if f.startswith('0033-corp-bond-supplemental')}
+        )
+        daily_files_basic = (
+            [f for f in sorted(os.listdir(ann_fld_path)) if f.startswith('0033-corp-bond-20')]
+        )
+        for f in daily_files_basic:
+            bond_files.append((datetime.strptime(f[-14:-4], '%Y-%m-%d'), ann_fld_path + '/' + f,
+                               daily_files_supp.get(f[-14:-4])))
+
+    return sorted(bond_files, key=lambda x: x[0])
+
+
+def get_bond_info_intervals(path, dataset_specs_in, settings=None):
+    """
+    Construct the time-varying bond master. In contrast to get_unique_bond_info(), every change of a bond
+    attribute (e.g. coupon, 144A flag, TRACE grade or maturity) is kept. To keep the storage small, the daily files
+    are compressed to change points only: a bond only gets a new record on the first day on which at least one of its
+    attributes differs from the last known record. A bond that is missing on a given day keeps its last known
+    attributes. Each record is valid from its change date (inclusive) until the next change date of the same bond
+    (exclusive). The last record of each bond is open-ended (valid_to = NaT).
+
+    Parameters:
+    ----------
+    path (str):  Project path
+    dataset_specs_in (dict): Final dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dataset_specs_in)
+
+    Returns:
+    --------
+    bond_intervals_df (DataFrame):  Bond attributes with the columns CUSIP_ID, valid_from, valid_to and all
+                                    attributes of the daily bond information files
+
+    """
+    if settings is None:
+        settings = get_settings(dataset_specs_in)
+    # Last known attributes of every bond (indexed by CUSIP)
+    bond_state = None
+    # Collect the change points of every day
+    change_points = []
+    # Attributes of the daily files (known once a file is read)
+    bond_columns = []
+
+    for date, in_path_basic, in_path_supp in list_bond_info_files(path):
+        # Only read the days within the sample period
+        if ((date.year < dataset_specs_in['sample_time_span'][0]) |
+                (date.year > dataset_specs_in['sample_time_span'][1])):
+            continue
+        print('Currently reading the bond information of: {}'.format(date.date()))
+
+        # Read in the daily data. The basic file takes precedence over the supplemental file
+        bond_info_day = read_bond_info(in_path_basic)
+        if in_path_supp is not None:
+            bond_info_day = pd.concat([bond_info_day, read_bond_info(in_path_supp)])
+        bond_info_day = bond_info_day.drop_duplicates(subset=['CUSIP_ID']).set_index('CUSIP_ID')
+        bond_columns = list(bond_info_day.columns)
+
+        if bond_state is None:
+            # All bonds on the first day are change points
+            changed = pd.Series(True, index=bond_info_day.index)
+        else:
+            # Compare the attributes with the last known attributes. Missing values on both sides are treated as
+            # equal. Bonds that are not known yet are always change points.
+            bond_prev = bond_state.reindex(index=bond_info_day.index, columns=bond_info_day.columns)
+            equal = (bond_prev == bond_info_day) | (bond_prev.isna() & bond_info_day.isna())
+            changed = (equal.all(axis=1) == False) | (bond_info_day.index.isin(bond_state.index) == False)
+
+        bond_changes = bond_info_day.loc[changed.values]
+        if len(bond_changes) > 0:
+            bond_changes = bond_changes.reset_index()
+            bond_changes['valid_from'] = date
+            change_points.append(bond_changes)
+            # Update the last known attributes of the changed bonds
+            if bond_state is None:
+                bond_state = bond_info_day.loc[changed.values]
+            else:
+                bond_state = pd.concat([bond_state.loc[bond_state.index.isin(bond_changes.CUSIP_ID) == False],
+                                        bond_info_day.loc[changed.values]])
+
+    if len(change_points) == 0:
+        # There are no bond files in the sample period
+        print('WARNING: There is no bond information within the sample period {}-{}'.format(
+            dataset_specs_in['sample_time_span'][0], dataset_specs_in['sample_time_span'][1]))
+        change_points = [pd.DataFrame(columns=['CUSIP_ID'] + bond_columns + ['valid_from'])]
+    bond_intervals_df = pd.concat(change_points, ignore_index=True)
+    # The validity of a record ends with the next change point of the same bond
+    bond_intervals_df = bond_intervals_df.sort_values(['CUSIP_ID', 'valid_from'], ignore_index=True)
+    bond_intervals_df['valid_to'] = bond_intervals_df.groupby('CUSIP_ID')['valid_from'].shift(-1)
+    bond_intervals_df = (
+        bond_intervals_df[['CUSIP_ID', 'valid_from', 'valid_to'] +
+                          [c for c in bond_intervals_df.columns if c not in ['CUSIP_ID', 'valid_from', 'valid_to']]]
+    )
+
+    # Store the dataset
+    store_frame(bond_intervals_df, path + '/bld/data/TRACE/TRACE_raw_clean/bond_info_intervals.pkl', settings)
+
+    return bond_intervals_df
+
+
+def merge_bond_info_intervals(df_transact, bond_intervals_df, varlist):
+    """
+    Attach the bond attributes that are in force on the execution date of each trade. The validity intervals of
+    all bonds are mapped to one non-overlapping interval index by shifting the day numbers of every bond by its own
+    offset (bond code * offset). A single vectorized lookup of the (shifted) execution dates then finds the matching
+    interval of every trade at once, i.e. there is no merge per day or per bond. The first record of a bond is also
+    valid before its change date, such that the trades before the first record get the same attributes as with the
+    merge of the first record per bond (time_varying = False).
+
+    Parameters:
+    -----------
+    df_transact (DataFrame): Transaction dataset (needs CUSIP_ID and TRD_EXCTN_DT)
+    bond_intervals_df (DataFrame): Bond master as constructed in get_bond_info_intervals()
+    varlist (list): Variables of the bond master to attach (including CUSIP_ID)
+
+    Returns:
+    --------
+    df_merge (DataFrame): Transaction dataset with the attached bond attributes. Trades of bonds without any record
+                          and trades with a missing execution date have missing attributes.
+
+    """
+    # Offset in days between two bonds. Larger than any day number in the sample (days since 1970)
+    bond_offset = 10**6
+
+    # Map the CUSIPs of both datasets to common integer codes
+    cusip_codes, cusip_uniques = pd.factorize(pd.concat([bond_intervals_df['CUSIP_ID'], df_transact['CUSIP_ID']]))
+    interval_codes = cusip_codes[:len(bond_intervals_df)].astype(np.int64)
+    transact_codes = cusip_codes[len(bond_intervals_df):].astype(np.int64)
+
+    # Day numbers of the interval bounds. Open-ended intervals are closed at the end of the bond's own range
+    valid_from_days = pd.to_datetime(bond_intervals_df['valid_from']).values.astype('datetime64[D]').astype(np.int64)
+    valid_to_days = pd.to_datetime(bond_intervals_df['valid_to']).values.astype('datetime64[D]').astype(np.int64)
+    valid_to_days = np.where(bond_intervals_df['valid_to'].isna(), bond_offset - 1, valid_to_days)
+    # The first record of every bond starts at the beginning of the bond's own range
+    first_record = pd.Series(valid_from_days).groupby(interval_codes).transform('min').values == valid_from_days
+    valid_from_days = np.where(first_record, 0, valid_from_days)
+    interval_index = pd.IntervalIndex.from_arrays(interval_codes * bond_offset + valid_from_days,
+                                                  interval_codes * bond_offset + valid_to_days, closed='left')
+
+    # Look up the interval of every trade
+    exctn_days = pd.to_datetime(df_transact['TRD_EXCTN_DT']).values.astype('datetime64[D]').astype(np.int64)
+    interval_pos = interval_index.get_indexer(transact_codes * bond_offset + exctn_days)
+    # Trades with a missing execution date are never matched
+    interval_pos[df_transact['TRD_EXCTN_DT'].isna().values] = -1
+
+    # Attach the attributes (the CUSIP is already in the transaction data)
+    df_merge = df_transact.copy()
+    attribute_vars = [v for v in varlist if v != 'CUSIP_ID']
+    if len(bond_intervals_df) == 0:
+        for v in attribute_vars:
+            df_merge[v] = np.nan
+        return df_merge
+    bond_attributes = bond_intervals_df[attribute_vars].iloc[np.where(interval_pos >= 0, interval_pos, 0)]
+    for v in attribute_vars:
+        df_merge[v] = bond_attributes[v].values
+        df_merge.loc[interval_pos < 0, v] = np.nan
+
+    return df_merge
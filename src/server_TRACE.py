@@ -0,0 +1,390 @@
+"""
+Serve the final TRACE dataset to several analysts from one local process. Without the server, every analyst session
+reads the final dataset into its own memory. Here, one server process answers the queries of all clients over HTTP
+on localhost and shares one cache of the query results (see cache_TRACE.py). The steps are as follows:
+    Step 1:     Encode the query as JSON (the dates of the filters are tagged, such that they are decoded as dates).
+    Step 2:     Answer the queries in the server (start_server(), serve()): POST /query loads the result with the
+                pushdown of the columns and filters, or the aggregation of the matching transactions (see
+                query_TRACE.py), and streams it as Arrow IPC record batches in a chunked response. GET /status
+                returns the fingerprint of the final dataset and the size of the cache.
+    Step 3:     Query the server with a client that keeps a pool of open connections (TraceClient), such that the
+                queries of several threads do not open a new connection each. The result is a DataFrame, an Arrow
+                table or a generator of batches.
+
+Note: The server only listens on localhost (127.0.0.1) by default and has no authentication. The queries that are not
+cached are run one after the other, the cached results are streamed to several clients at the same time. The
+DataFrames of the client are converted from Arrow, i.e. missing values of string columns are None.
+"""
+
+import datetime
+import http.client
+import http.server
+import json
+import queue
+import threading
+import pandas as pd
+import pyarrow as pa
+
+# Import the query of the final dataset and the query cache
+from query_TRACE import load_trace, get_final_paths
+from cache_TRACE import MEMORY_CACHE, get_build_fingerprint
+# Import the settings of the query cache
+from settings_TRACE import get_settings
+
+# Default address of the server
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Number of rows per streamed record batch if the client does not set a batch size
+DEFAULT_BATCH_SIZE = 100000
+# Content type of the Arrow IPC stream
+ARROW_STREAM_TYPE = 'application/vnd.apache.arrow.stream'
+
+
+#########
+# Step 1: Encode the query
+########
+def encode_value(value):
+    """
+    Encode a value of a filter as JSON (dates and timestamps are tagged).
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [encode_value(v) for v in value]
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        return {'timestamp': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    if hasattr(value, 'item'):
+        # NumPy scalars
+        return value.item()
+
+    return value
+
+
+def decode_value(value):
+    """
+    Decode a value of a filter (see encode_value()).
+    """
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if isinstance(value, dict) and ('date' in value):
+        return datetime.date.fromisoformat(value['date'])
+    if isinstance(value, dict) and ('timestamp' in value):
+        return pd.Timestamp(value['timestamp'])
+
+    return value
+
+
+def encode_query(columns=None, cusips=None, start=None, end=None, filters=None, batch_size=None, group_by=None,
+                 aggs=None):
+    """
+    Encode a query as JSON (see load_trace() in query_TRACE.py for the arguments).
+    """
+    if isinstance(cusips, str):
+        cusips = [cusips]
+    query = {
+        'columns': None if columns is None else list(columns),
+        'cusips': None if cusips is None else list(cusips),
+        'start': encode_value(start),
+        'end': encode_value(end),
+        'filters': None if filters is None else [[col, op, encode_value(value)] for col, op, value in filters],
+        'batch_size': batch_size,
+        'group_by': [group_by] if isinstance(group_by, str) else group_by,
+        'aggs': None if aggs is None else {name: list(agg) for name, agg in aggs.items()},
+    }
+
+    return json.dumps(query).encode()
+
+
+def decode_query(body):
+    """
+    Decode a query (see encode_query()).
+    """
+    query = json.loads(body)
+    unknown = [k for k in query if k not in ['columns', 'cusips', 'start', 'end', 'filters', 'batch_size', 'group_by',
+                                             'aggs']]
+    if len(unknown) > 0:
+        raise ValueError('Unknown arguments of the query: {}'.format(', '.join(unknown)))
+    for k in ['start', 'end']:
+        query[k] = decode_value(query.get(k))
+    if query.get('filters') is not None:
+        query['filters'] = [(col, op, decode_value(value)) for col, op, value in query['filters']]
+    batch_size = query.get('batch_size')
+    if (batch_size is not None) and ((isinstance(batch_size, int) == False) or (batch_size < 1)):
+        raise ValueError('The batch size has to be a positive integer: {}'.format(batch_size))
+
+    return query
+
+
+#########
+# Step 2: Answer the queries
+########
+class ChunkedWriter:
+    """
+    File object that writes the Arrow IPC stream into a chunked HTTP response.
+    """
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        if len(data) > 0:
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode() + data + b'\r\n')
+        return len(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+    def close(self):
+        # The end of the chunked response
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+        self.closed = True
+
+
+class TraceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handler of the requests of the server. The connections are kept open between the requests (HTTP/1.1).
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        try:
+            fingerprint = get_build_fingerprint(get_final_paths(self.server.project_path))
+        except FileNotFoundError:
+            fingerprint = None
+        self.send_json(200, {'fingerprint': fingerprint, 'cached_results': len(MEMORY_CACHE['entries']),
+                             'cached_mb': MEMORY_CACHE['bytes'] / 1024 ** 2,
+                             'settings': self.server.settings['query_cache']})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            query = decode_query(body)
+            # The cache of the query results is shared by all clients and is not thread-safe
+            with self.server.lock:
+                table = load_trace(self.server.project_path, query['columns'], query['cusips'], query['start'],
+                                   query['end'], query['filters'], output='arrow', group_by=query.get('group_by'),
+                                   aggs=query.get('aggs'), settings=self.server.settings)
+        except (ValueError, KeyError, TypeError, pa.ArrowInvalid) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except FileNotFoundError as e:
+            self.send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+            return
+
+        # Stream the result in record batches (the result in the cache is not copied)
+        self.send_response(200)
+        self.send_header('Content-Type', ARROW_STREAM_TYPE)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('X-Num-Rows', str(table.num_rows))
+        self.end_headers()
+        sink = ChunkedWriter(self.wfile)
+        try:
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                for batch in table.to_batches(max_chunksize=query['batch_size'] or DEFAULT_BATCH_SIZE):
+                    writer.write_batch(batch)
+            sink.close()
+        except (ConnectionResetError, BrokenPipeError):
+            # The client stopped reading the batches (e.g. it broke out of the loop over the batches)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        print('SERVER: {} {}'.format(self.address_string(), format % args))
+
+
+def make_server(project_path, host=DEFAULT_HOST, port=DEFAULT_PORT, settings=None):
+    """
+    Create the server (every connection is handled in its own thread). The queries are run with the settings of the
+    server (see settings_TRACE.py, None -> default settings).
+    """
+    server = http.server.ThreadingHTTPServer((host, port), TraceRequestHandler)
+    server.daemon_threads = True
+    server.project_path = project_path
+    server.settings = settings if settings is not None else get_settings()
+    server.lock = threading.Lock()
+
+    return server
+
+
+def start_server(project_path, host=DEFAULT_HOST, port=DEFAULT_PORT, settings=None):
+    """
+    Start the server in a background thread (e.g. in a notebook or a test). Stop it with server.shutdown().
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    host (str): Address of the server (localhost by default)
+    port (int): Port of the server (0 -> a free port, see server.server_address)
+    settings (dict): Settings of the query cache (see settings_TRACE.py, None -> default settings, i.e. no cache)
+
+    Returns:
+    --------
+    server (ThreadingHTTPServer): Running server
+    """
+    server = make_server(project_path, host, port, settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def serve(project_path, host=DEFAULT_HOST, port=DEFAULT_PORT, settings=None):
+    """
+    Run the server until it is interrupted (Ctrl+C).
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    host (str): Address of the server (localhost by default)
+    port (int): Port of the server
+    settings (dict): Settings of the query cache (see settings_TRACE.py, None -> default settings, i.e. no cache)
+    """
+    server = make_server(project_path, host, port, settings)
+    print('The TRACE data server is listening on http://{}:{}'.format(host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('The TRACE data server has stopped')
+    finally:
+        server.server_close()
+
+
+#########
+# Step 3: Query the server
+########
+class TraceClient:
+    """
+    Client of the TRACE data server with a pool of open connections. One client can be used by several threads.
+
+    Example:
+        client = TraceClient(port=8765)
+        df = client.query(columns=['cusip_id', 'rptd_pr'], start='2014-01-01', end='2014-06-30')
+        for df_batch in client.query(columns=['cusip_id', 'rptd_pr'], batch_size=100000):
+            ...
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, pool_size=4, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def get_connection(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def release_connection(self, connection):
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, body=None):
+        """
+        Send a request on a pooled connection. A connection that was closed by the server is replaced once.
+
+        Returns:
+        --------
+        connection (HTTPConnection): Connection of the response (to be released after the response is read)
+        response (HTTPResponse): Response with status 200
+        """
+        for attempt in range(2):
+            connection = self.get_connection()
+            try:
+                connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if attempt == 1:
+                    raise
+        if response.status != 200:
+            message = json.loads(response.read()).get('error')
+            self.release_connection(connection)
+            if response.status == 400:
+                raise ValueError(message)
+            if response.status == 404:
+                raise FileNotFoundError(message)
+            raise RuntimeError('The TRACE data server failed: {}'.format(message))
+
+        return connection, response
+
+    def status(self):
+        """
+        Get the fingerprint of the served final dataset and the size of the cache of the server.
+        """
+        connection, response = self.request('GET', '/status')
+        status = json.loads(response.read())
+        self.release_connection(connection)
+
+        return status
+
+    def query(self, columns=None, cusips=None, start=None, end=None, filters=None, output='pandas',
+              batch_size=None, group_by=None, aggs=None):
+        """
+        Load the transactions of the final dataset that match a query, or an aggregation of them, from the server
+        (see load_trace() in query_TRACE.py for the arguments).
+
+        Returns:
+        --------
+        result (DataFrame, Table or generator): Matching transactions or their aggregation (a generator of batches
+                                                if batch_size is set)
+        """
+        if output not in ['pandas', 'arrow']:
+            raise ValueError('The output has to be pandas or arrow: {}'.format(output))
+        body = encode_query(columns, cusips, start, end, filters, batch_size, group_by, aggs)
+        connection, response = self.request('POST', '/query', body)
+        if batch_size is not None:
+            return self.iter_batches(connection, response, output)
+        table = pa.ipc.open_stream(response).read_all()
+        response.read()
+        self.release_connection(connection)
+        if output == 'arrow':
+            return table
+
+        return table.to_pandas()
+
+    def iter_batches(self, connection, response, output):
+        """
+        Read the record batches of a response one after the other. A connection whose response was not read to the
+        end is closed instead of returned to the pool.
+        """
+        complete = False
+        try:
+            for batch in pa.ipc.open_stream(response):
+                yield batch if output == 'arrow' else batch.to_pandas()
+            response.read()
+            complete = True
+        finally:
+            if complete:
+                self.release_connection(connection)
+            else:
+                connection.close()
+
+    def close(self):
+        """
+        Close the connections of the pool.
+        """
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
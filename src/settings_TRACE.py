@@ -0,0 +1,139 @@
+"""
+Settings of the build that do not change its output: the join guard (see join_guard_TRACE.py), the overlapped I/O
+(see async_io_TRACE.py), the storage (see storage_TRACE.py), the query cache (see cache_TRACE.py), the raw file index
+(see raw_index_TRACE.py), the bitemporal index (see bitemporal_TRACE.py) and the duplicate check (see
+duplicates_TRACE.py). The steps are as follows:
+    Step 1:     Take the settings from the dataset specifications and check them (get_settings()). Missing settings
+                keep their defaults (SETTINGS).
+    Step 2:     Pass the settings on to every function of the build that uses them (argument settings). The functions
+                use the defaults if they are called without settings (e.g. in the tests).
+
+Note: The settings are never stored in the modules, i.e. a build or a query does not change the settings of a later
+build or query in the same process. The worker processes of the parallel steps get the settings as an argument.
+"""
+
+import copy
+
+# Default settings (see the descriptions in specs.py)
+SETTINGS = {
+    # Join guard:
+    #   action:                 What to do if a join exceeds max_fanout ('warn' or 'abort'). A join whose result does
+    #                           not fit into max_memory_share of the available memory is always aborted
+    #   max_fanout:             Maximum number of rows of the result per row of the left side
+    #   max_memory_share:       Maximum share of the available memory the result may use
+    'join_guard': {'action': 'warn', 'max_fanout': 10, 'max_memory_share': 0.5},
+    # Overlapped I/O:
+    #   enabled:                False -> read and write in the main thread (one step at a time)
+    #   prefetch_files:         Number of files that may be loaded ahead of the processing
+    #   max_pending_writes:     Number of DataFrames that may wait for the background writer
+    'overlap_io': {'enabled': True, 'prefetch_files': 2, 'max_pending_writes': 1},
+    # Storage:
+    #   format:                 'pickle' or 'parquet' (columnar dataset, read with load_frame())
+    #   compression:            Compression codec of the Parquet files (e.g. 'zstd', 'snappy' or 'none')
+    #   row_group_size:         Number of rows per row group (the unit of the pruning with the min/max statistics)
+    #   cusip_buckets:          Number of CUSIP hash buckets per year (0 -> no partitioning by CUSIP)
+    #   mmap_final:             Also store the final dataset in the memory-mapped layout (see mmap_TRACE.py)
+    'storage': {'format': 'pickle', 'compression': 'zstd', 'row_group_size': 500000, 'cusip_buckets': 0,
+                'mmap_final': False},
+    # Query cache:
+    #   enabled:                Cache the results of the queries
+    #   max_memory_mb:          Size of the results kept in the memory of the process (MB)
+    #   max_disk_mb:            Size of the results kept on disk (MB)
+    'query_cache': {'enabled': False, 'max_memory_mb': 64, 'max_disk_mb': 256},
+    # Raw file index:
+    #   enabled:                Index the raw files while they are read in
+    'raw_index': {'enabled': False},
+    # Bitemporal index:
+    #   enabled:                Store the trade reports that are deleted by the corrections while the raw data is
+    #                           read in
+    'bitemporal': {'enabled': False},
+    # Duplicate check:
+    #   action:                 'off' (no check), 'flag' (store the duplicates) or 'drop' (also drop them before the
+    #                           cleaning)
+    #   expected_trades:        Number of trade reports of the sample (after the bond selection) that the Bloom filter
+    #                           is sized for
+    #   false_positive_rate:    Share of new trade reports that the Bloom filter reports as candidates
+    'duplicates': {'action': 'off', 'expected_trades': 100000000, 'false_positive_rate': 0.001},
+}
+# Allowed values of the settings: a list of values or one of the kinds 'bool', 'positive_int', 'non_negative_int',
+# 'positive_number', 'non_negative_number' and 'rate' (in (0, 1)). Settings without a rule take any value
+RULES = {
+    'join_guard': {'action': ['warn', 'abort'], 'max_fanout': 'positive_number',
+                   'max_memory_share': 'positive_number'},
+    'overlap_io': {'enabled': 'bool', 'prefetch_files': 'positive_int', 'max_pending_writes': 'positive_int'},
+    'storage': {'format': ['pickle', 'parquet'], 'row_group_size': 'positive_int',
+                'cusip_buckets': 'non_negative_int', 'mmap_final': 'bool'},
+    'query_cache': {'enabled': 'bool', 'max_memory_mb': 'non_negative_number', 'max_disk_mb': 'non_negative_number'},
+    'raw_index': {'enabled': 'bool'},
+    'bitemporal': {'enabled': 'bool'},
+    'duplicates': {'action': ['off', 'flag', 'drop'], 'expected_trades': 'positive_int',
+                   'false_positive_rate': 'rate'},
+}
+# Descriptions of the kinds in the error messages
+KINDS = {
+    'bool': 'True or False',
+    'positive_int': 'a positive integer',
+    'non_negative_int': 'a non-negative integer',
+    'positive_number': 'a positive number',
+    'non_negative_number': 'a non-negative number',
+    'rate': 'a number in (0, 1)',
+}
+
+
+#########
+# Step 1: Take the settings from the dataset specifications
+########
+def is_valid(value, rule):
+    """
+    Check a value of a setting against its rule (see RULES).
+    """
+    if isinstance(rule, list):
+        return value in rule
+    if rule == 'bool':
+        return isinstance(value, bool)
+    # True and False are no numbers here
+    if isinstance(value, bool):
+        return False
+    if rule == 'positive_int':
+        return isinstance(value, int) and (value >= 1)
+    if rule == 'non_negative_int':
+        return isinstance(value, int) and (value >= 0)
+    if isinstance(value, (int, float)) == False:
+        return False
+    if rule == 'positive_number':
+        return value > 0
+    if rule == 'non_negative_number':
+        return value >= 0
+
+    return (value > 0) and (value < 1)
+
+
+def get_settings(dataset_specs=None):
+    """
+    Get the settings of a build from the dataset specifications. Settings that the specifications do not set keep
+    their defaults.
+
+    Parameters:
+    -----------
+    dataset_specs (dict): Final dataset specifications (None -> default settings)
+
+    Returns:
+    --------
+    settings (dict): Settings by section, e.g. settings['storage']['format']
+    """
+    settings = copy.deepcopy(SETTINGS)
+    if dataset_specs is None:
+        return settings
+    for section in SETTINGS:
+        for k, v in (dataset_specs.get(section) or {}).items():
+            if k not in SETTINGS[section]:
+                raise ValueError("Unknown setting dataset_specs['{}']['{}']. The settings are: {}".format(
+                    section, k, ', '.join(SETTINGS[section])))
+            rule = RULES[section].get(k)
+            if (rule is not None) and (is_valid(v, rule) == False):
+                allowed = ' or '.join([repr(r) for r in rule]) if isinstance(rule, list) else KINDS[rule]
+                raise ValueError("The setting dataset_specs['{}']['{}'] has to be {}: {}".format(
+                    section, k, allowed, v))
+            settings[section][k] = copy.deepcopy(v)
+
+    return settings
@@ -0,0 +1,331 @@
+"""
+Pass DataFrames between the worker processes and the parent process through shared memory instead of pickling them.
+The results of a process pool (e.g. the cleaned CUSIP shards in clean_merged_data_parallel() or the unmatched
+trades of the parallel reading-in step) are otherwise pickled in the worker, sent through a pipe and unpickled in the
+parent, which holds several copies of the data at a time and runs on one core. The steps are as follows:
+    Step 1:     Store a DataFrame in one shared memory segment (share_frame()). The columns with a NumPy data type
+                (numbers, booleans and datetimes) are stored as raw buffers, the object columns (e.g. strings and
+                dates) as integer codes plus the distinct values and the categorical columns as codes plus the
+                categories. Only a small handle (segment name, layout and distinct values) is sent to the parent.
+    Step 2:     Map the segment in the receiving process (attach_frame()). The buffer columns of the DataFrame are
+                views of the shared memory, i.e. they are not copied. collect_frames() concatenates the DataFrames
+                of several handles with a single copy.
+    Step 3:     Free the segments once they are consumed. The segments of a parallel step are named with the prefix
+                of shared_frames(), which removes all segments with this prefix at the end of the step (also after
+                an error in a worker) and the leftovers of crashed runs.
+
+Note: The process that creates a segment does not remove it, the receiving process does (see release_frame()). The
+round trip returns a DataFrame that is identical to the input (data types, missing values, index and attrs).
+Columns with mixed types or extension data types are pickled into the handle.
+"""
+
+import contextlib
+import itertools
+import os
+import pickle
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import pandas as pd
+
+# Prefix of the names of all segments (followed by the process id of the owner of the parallel step)
+SEGMENT_PREFIX = 'pct'
+# Folder of the shared memory segments (Linux). On other systems the leftovers of crashed runs are not removed
+SHM_FOLDER = '/dev/shm'
+# Alignment of the columns in the segment (bytes)
+ALIGNMENT = 64
+# Object columns of these types (see pd.api.types.infer_dtype()) are stored as codes plus distinct values. The
+# distinct values of all other object columns (e.g. mixed integers and floats) could merge, they are pickled instead
+CODES_TYPES = ['string', 'bytes', 'date', 'datetime', 'time', 'integer', 'boolean', 'empty']
+# Segments mapped by this process: name -> SharedMemory
+ATTACHED = {}
+# Counter of the parallel steps of this process (part of the segment prefix)
+STEP_COUNTER = itertools.count()
+
+
+#########
+# Step 1: Store a DataFrame in shared memory
+########
+def get_array_layout(values):
+    """
+    Define how one column (or the index) is stored in the segment.
+
+    Parameters:
+    -----------
+    values (array or ExtensionArray): Values of the column
+
+    Returns:
+    --------
+    layout (dict): Kind of storage ('buffer', 'codes', 'categorical' or 'pickled') and the information to restore
+                   the values
+    buffer (np.array): Array that is copied into the segment (None for 'pickled')
+    """
+    if isinstance(values, pd.Categorical):
+        layout = {'kind': 'categorical', 'categories': values.categories, 'ordered': values.ordered}
+        return layout, values.codes
+    if isinstance(values, np.ndarray) and (values.dtype != object):
+        return {'kind': 'buffer'}, values
+    if isinstance(values, np.ndarray) and (pd.api.types.infer_dtype(values, skipna=True) in CODES_TYPES):
+        codes, uniques = pd.factorize(values)
+        if len(uniques) < np.iinfo(np.int32).max:
+            codes = codes.astype(np.int32)
+        layout = {'kind': 'codes', 'uniques': uniques}
+        # pd.factorize() does not distinguish the missing values (None, NaN, NaT). Keep them as they are
+        na_values = values[codes == -1]
+        if len(na_values) > 0:
+            if len(set([type(v) for v in na_values])) == 1:
+                layout['na_value'] = na_values[0]
+            else:
+                layout['na_values'] = na_values
+        return layout, codes
+    # Extension data types and object columns of mixed types
+    return {'kind': 'pickled', 'values': pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)}, None
+
+
+def share_frame(df, prefix):
+    """
+    Store a DataFrame in a new shared memory segment. The segment is removed by the process that consumes the
+    handle (see collect_frames() and release_frame()).
+
+    Parameters:
+    -----------
+    df (DataFrame): Data to share
+    prefix (str): Prefix of the segment name (see shared_frames())
+
+    Returns:
+    --------
+    handle (dict): Segment name, number of rows, layout of the columns and the index and the attrs of the DataFrame
+    """
+    list_layouts = []
+    list_buffers = []
+    offset = 0
+    for values in [df.index] + [df.iloc[:, k] for k in range(df.shape[1])]:
+        if isinstance(values, pd.RangeIndex):
+            list_layouts.append({'kind': 'range', 'start': values.start, 'stop': values.stop, 'step': values.step})
+            list_buffers.append(None)
+            continue
+        if isinstance(values, pd.MultiIndex):
+            list_layouts.append({'kind': 'pickled', 'values': pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)})
+            list_buffers.append(None)
+            continue
+        # NumPy data types as arrays, extension data types (e.g. categorical or datetimes with a time zone) as they are
+        layout, buffer = get_array_layout(values.values if isinstance(values.dtype, np.dtype) else values.array)
+        if buffer is not None:
+            buffer = np.ascontiguousarray(buffer)
+            layout['dtype'] = buffer.dtype.str
+            layout['offset'] = offset
+            offset = offset + -(-buffer.nbytes // ALIGNMENT) * ALIGNMENT
+        list_layouts.append(layout)
+        list_buffers.append(buffer)
+
+    handle = {
+        'name': prefix + uuid.uuid4().hex[:12],
+        'size': max(offset, 1),
+        'n_rows': len(df),
+        'columns': df.columns,
+        'index_name': df.index.name,
+        'index_layout': list_layouts[0],
+        'layouts': list_layouts[1:],
+        'index_dtype': df.index.dtype,
+        'attrs': df.attrs,
+    }
+    shm = shared_memory.SharedMemory(name=handle['name'], create=True, size=handle['size'])
+    try:
+        for layout, buffer in zip(list_layouts, list_buffers):
+            if buffer is not None:
+                np.ndarray(buffer.shape, dtype=buffer.dtype, buffer=shm.buf, offset=layout['offset'])[:] = buffer
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    # The receiving process removes the segment. Otherwise the resource tracker of this process would remove it when
+    # the process ends (e.g. a worker of the pool that ends before the parent has read the segment)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    shm.close()
+
+    return handle
+
+
+#########
+# Step 2: Map the DataFrames in the receiving process
+########
+def get_array(layout, shm, n_rows):
+    """
+    Restore the values of one column (or the index) from the segment (see get_array_layout()). The buffer columns
+    are views of the segment.
+    """
+    if layout['kind'] == 'pickled':
+        return pickle.loads(layout['values'])
+    if layout['kind'] == 'range':
+        return pd.RangeIndex(layout['start'], layout['stop'], layout['step'])
+    values = np.ndarray((n_rows,), dtype=np.dtype(layout['dtype']), buffer=shm.buf, offset=layout['offset'])
+    # Other processes may read the same segment, i.e. the shared values must not be changed in place
+    values.flags.writeable = False
+    if layout['kind'] == 'categorical':
+        return pd.Categorical.from_codes(values, categories=layout['categories'], ordered=layout['ordered'])
+    if layout['kind'] == 'codes':
+        codes = values
+        values = np.empty(n_rows, dtype=object)
+        values[codes != -1] = layout['uniques'].take(codes[codes != -1])
+        if 'na_value' in layout:
+            values[codes == -1] = layout['na_value']
+        elif 'na_values' in layout:
+            values[codes == -1] = layout['na_values']
+    return values
+
+
+def attach_frame(handle):
+    """
+    Map the segment of a handle (see share_frame()) and restore the DataFrame. The buffer columns are views of the
+    segment (no copy). The segment stays mapped until release_frame() is called.
+
+    Parameters:
+    -----------
+    handle (dict): Handle of the DataFrame
+
+    Returns:
+    --------
+    df (DataFrame): Shared DataFrame
+    """
+    if handle['name'] not in ATTACHED:
+        ATTACHED[handle['name']] = shared_memory.SharedMemory(name=handle['name'])
+    shm = ATTACHED[handle['name']]
+    index = get_array(handle['index_layout'], shm, handle['n_rows'])
+    if isinstance(index, pd.Index) == False:
+        index = pd.Index(index, dtype=handle['index_dtype'], copy=False)
+    index.name = handle['index_name']
+    dict_columns = {}
+    for k, layout in enumerate(handle['layouts']):
+        values = get_array(layout, shm, handle['n_rows'])
+        if isinstance(values, np.ndarray) and (values.dtype == object):
+            # Keep the object data type (pandas would convert e.g. an object column of Timestamps to datetime64)
+            values = pd.Series(values, index=index, dtype=object, copy=False)
+        dict_columns[k] = values
+    # copy=False keeps one block per column, i.e. the buffer columns are not copied into a common block
+    df = pd.DataFrame(dict_columns, index=index, copy=False)
+    df.columns = handle['columns']
+    df.attrs = handle['attrs']
+
+    return df
+
+
+def collect_frames(handles):
+    """
+    Concatenate the DataFrames of several handles (in their order) with a single copy and remove their segments.
+    Empty DataFrames are skipped (like the empty shards in clean_merged_data_parallel()). The columns are
+    concatenated one by one: pd.concat() of the DataFrames would depend on how the columns are grouped into blocks
+    (e.g. the missing values of an object column without any value in a DataFrame are converted to NaN).
+
+    Parameters:
+    -----------
+    handles (list): Handles of the DataFrames (see share_frame())
+
+    Returns:
+    --------
+    df (DataFrame): Concatenated DataFrames
+    """
+    try:
+        list_frames = [attach_frame(handle) for handle in handles if handle['n_rows'] > 0]
+        if len(list_frames) == 0:
+            # Return an empty DataFrame with the columns if all DataFrames are empty
+            list_frames = [attach_frame(handle) for handle in handles[:1]]
+        if (len(list_frames) == 0) or \
+                any([df_part.columns.equals(list_frames[0].columns) == False for df_part in list_frames]):
+            df = pd.concat(list_frames)
+        else:
+            index = list_frames[0].index.append([df_part.index for df_part in list_frames[1:]])
+            dict_columns = {}
+            for k in range(len(list_frames[0].columns)):
+                dict_columns[k] = pd.concat([df_part.iloc[:, k] for df_part in list_frames], ignore_index=True)
+                dict_columns[k].index = index
+            df = pd.DataFrame(dict_columns, index=index, copy=False)
+            df.columns = list_frames[0].columns
+            if len(list_frames) == 1:
+                # The columns of a single DataFrame would still be (read-only) views of the segment
+                df = df.copy()
+        del [list_frames]
+    finally:
+        for handle in handles:
+            release_frame(handle)
+
+    return df
+
+
+#########
+# Step 3: Free the segments
+########
+def release_frame(handle, unlink=True):
+    """
+    Unmap the segment of a handle in this process and remove it (unlink=False -> only unmap, e.g. in a worker that
+    reads a segment of the parent). The memory is freed once no DataFrame of this process uses the segment any more.
+
+    Parameters:
+    -----------
+    handle (dict): Handle of the DataFrame
+    unlink (bool): Remove the segment
+    """
+    shm = ATTACHED.pop(handle['name'], None)
+    if shm is None:
+        try:
+            shm = shared_memory.SharedMemory(name=handle['name'])
+        except FileNotFoundError:
+            return
+    if unlink == False:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    try:
+        shm.close()
+    except BufferError:
+        # A DataFrame still uses the segment. The mapping is removed together with its last view
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def remove_segments(prefix):
+    """
+    Remove all segments whose name starts with prefix, e.g. the segments of a worker that failed before its handle
+    reached the parent.
+    """
+    for name in [n for n in list(ATTACHED) if n.startswith(prefix)]:
+        release_frame({'name': name})
+    if os.path.isdir(SHM_FOLDER):
+        for name in [f for f in os.listdir(SHM_FOLDER) if f.startswith(prefix)]:
+            release_frame({'name': name})
+
+
+def remove_stale_segments():
+    """
+    Remove the segments of parallel steps whose process no longer runs (e.g. after a crash).
+    """
+    if os.path.isdir(SHM_FOLDER) == False:
+        return
+    for f in os.listdir(SHM_FOLDER):
+        pid = f[len(SEGMENT_PREFIX):].split('_')[0]
+        if f.startswith(SEGMENT_PREFIX) and pid.isdigit() and (int(pid) != os.getpid()):
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                release_frame({'name': f})
+            except PermissionError:
+                pass
+
+
+@contextlib.contextmanager
+def shared_frames():
+    """
+    Scope of the segments of one parallel step. All segments whose name starts with the returned prefix are removed
+    at the end of the scope, whether they were consumed or not.
+
+    Returns:
+    --------
+    prefix (str): Prefix of the segment names (see share_frame())
+    """
+    remove_stale_segments()
+    prefix = '{}{}_{}_'.format(SEGMENT_PREFIX, os.getpid(), next(STEP_COUNTER))
+    try:
+        yield prefix
+    finally:
+        remove_segments(prefix)
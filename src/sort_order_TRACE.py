@@ -0,0 +1,282 @@
+"""
+Keep the sort order of the DataFrames of the pipeline with the frames, such that a stage does not sort a frame that
+is already sorted. Every yearly dataset is sorted once when it is read in, by the canonical order of the trades
+(CUSIP, execution date and time, provenance ID), and this order is carried to the merged yearly data. The steps are
+as follows:
+    Step 1:     Record the sort order of a frame in df.attrs['sort_order'] (set_sort_order()) and read it
+                (get_sort_order()). The attributes are stored with the frame (in the metadata of a Parquet dataset, in
+                a pickle, in shared memory and in the memory-mapped layout) and passed on by pandas to frames derived
+                from it (e.g. a selection of rows or columns), but not by a join (keep_sort_order()).
+    Step 2:     Check the recorded order against the data before it is used (check_sort_order(), one pass over the
+                sort variables). A frame whose order changed after it was recorded (e.g. it was reordered in place or
+                concatenated with other frames) is sorted again. Sort a frame only if it is not already sorted
+                (sort_frame()). The sort is stable, i.e. rows with equal values keep their current order and the
+                result is the same whether the sort is skipped or not.
+    Step 3:     Join a frame to the last matching row of another frame with a merge-join of the sorted keys
+                (asof_join_sorted()), i.e. without sorting both frames by the date first as pd.merge_asof() does.
+
+Note: A recorded order is only a claim that is checked before it is used. store_frame() (see storage_TRACE.py) does
+not store an order that does not hold.
+"""
+
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+# Import the provenance ID of the trades (the last variable of the canonical order)
+from provenance_TRACE import RAW_ID
+
+# Key of the sort order in df.attrs
+SORT_ORDER = 'sort_order'
+# Variables of the execution time before (EXCTN_TM) and after (TRD_EXCTN_TM) the harmonisation of the variable names
+EXCTN_TM_VARS = ['TRD_EXCTN_TM', 'EXCTN_TM']
+
+
+#########
+# Step 1: Record the sort order
+########
+def get_canonical_order(df):
+    """
+    Get the canonical order of the trades: CUSIP, execution date, execution time and provenance ID (see
+    provenance_TRACE.py) as far as the variables are in the frame.
+    """
+    by = ['CUSIP_ID', 'TRD_EXCTN_DT'] + [v for v in EXCTN_TM_VARS if v in df.columns][:1] + [RAW_ID]
+
+    return [v for v in by if v in df.columns]
+
+
+def set_sort_order(df, by):
+    """
+    Record that the rows of a frame are sorted by some variables (lexicographically, missing values last).
+
+    Parameters:
+    -----------
+    df (DataFrame): Sorted frame
+    by (list): Variables of the order
+
+    Returns:
+    --------
+    df (DataFrame): The frame with the recorded order
+    """
+    # A new list, the attributes of derived frames refer to the same objects
+    df.attrs[SORT_ORDER] = list(by)
+
+    return df
+
+
+def get_sort_order(df):
+    """
+    Get the variables by which the rows of a frame are recorded to be sorted ([] if no order is recorded). The order
+    ends before the first variable that is no longer in the frame.
+    """
+    by = []
+    for v in df.attrs.get(SORT_ORDER, []):
+        if v not in df.columns:
+            break
+        by.append(v)
+
+    return by
+
+
+def keep_sort_order(df, df_source):
+    """
+    Pass the sort order of a frame on to a frame whose rows are in the same order (e.g. the result of a left join).
+
+    Parameters:
+    -----------
+    df (DataFrame): Frame with the rows in the order of df_source
+    df_source (DataFrame): Frame with a recorded order
+
+    Returns:
+    --------
+    df (DataFrame): The frame with the order of df_source (if one is recorded)
+    """
+    by = get_sort_order(df_source)
+    if len(by) > 0:
+        return set_sort_order(df, by)
+
+    return df
+
+
+def rename_sort_order(df, columns):
+    """
+    Rename the variables of the recorded order of a frame whose variables were renamed (see harmon_pre_post_data()).
+
+    Parameters:
+    -----------
+    df (DataFrame): Frame with renamed variables
+    columns (dict): Old names -> new names
+
+    Returns:
+    --------
+    df (DataFrame): The frame with the renamed order
+    """
+    if SORT_ORDER in df.attrs:
+        set_sort_order(df, [columns.get(v, v) for v in df.attrs[SORT_ORDER]])
+
+    return df
+
+
+def replace_sort_var(df, var, var_new):
+    """
+    Replace a variable of the recorded order of a frame by a variable that has the same order (e.g. the execution
+    date by its conversion to datetime).
+    """
+    by = get_sort_order(df)
+    if var in by:
+        set_sort_order(df, [var_new if v == var else v for v in by])
+
+    return df
+
+
+#########
+# Step 2: Check the order and sort only unsorted frames
+########
+def get_sort_codes(values):
+    """
+    Encode the values of a variable by integers in the order of the values (missing values last). Object variables
+    with values that cannot be compared (e.g. execution times that are partly 0) are ordered by their string
+    representation.
+    """
+    codes, uniques = pd.factorize(values)
+    try:
+        ranks = np.argsort(uniques.argsort(kind='stable'))
+    except TypeError:
+        ranks = np.argsort(uniques.astype(str).argsort(kind='stable'))
+
+    return np.where(codes < 0, len(uniques), ranks[codes])
+
+
+def check_sort_order(df, by):
+    """
+    Check if the rows of a frame are sorted by some variables (lexicographically, missing values last).
+
+    Parameters:
+    -----------
+    df (DataFrame): Frame
+    by (list): Variables of the order
+
+    Returns:
+    --------
+    is_sorted (bool): True if the frame is sorted by the variables
+    """
+    # Pairs of neighbouring rows whose order is not yet decided by the previous variables
+    undecided = np.ones(max(len(df) - 1, 0), dtype=bool)
+    for v in by:
+        step = np.diff(get_sort_codes(df[v].values))
+        if np.any(undecided & (step < 0)):
+            return False
+        undecided &= step == 0
+        if undecided.any() == False:
+            break
+
+    return True
+
+
+def is_sorted_by(df, by):
+    """
+    Check if the rows of a frame are recorded to be sorted by some variables and the data is sorted by them (also
+    true if the frame is sorted by more variables, e.g. sorted by CUSIP_ID and date implies sorted by CUSIP_ID).
+    """
+    by = list(by)
+
+    return (get_sort_order(df)[:len(by)] == by) and check_sort_order(df, by)
+
+
+def drop_invalid_sort_order(df):
+    """
+    Remove a recorded order that does not hold (e.g. frames sorted by CUSIP that were concatenated year by year)
+    before a frame is stored. The frame itself is not changed.
+
+    Parameters:
+    -----------
+    df (DataFrame): Frame
+
+    Returns:
+    --------
+    df (DataFrame): The frame or, if its order does not hold, a shallow copy without the order
+    """
+    if (SORT_ORDER not in df.attrs) or is_sorted_by(df, get_sort_order(df)):
+        return df
+    df = df.copy(deep=False)
+    df.attrs.pop(SORT_ORDER)
+
+    return df
+
+
+def sort_frame(df, by):
+    """
+    Sort a frame by some variables (stable) unless it is already sorted by them. Equivalent to
+    df.sort_values(by, kind='stable').
+
+    Parameters:
+    -----------
+    df (DataFrame): Frame
+    by (list): Variables of the order
+
+    Returns:
+    --------
+    df (DataFrame): Sorted frame with the recorded order
+    """
+    by = list(by)
+    if is_sorted_by(df, by):
+        return df
+    # Sort by the codes of the variables (the last key of np.lexsort is the first variable)
+    order = np.lexsort([get_sort_codes(df[v].values) for v in reversed(by)]) if len(by) > 0 else np.arange(len(df))
+
+    return set_sort_order(df.take(order), by)
+
+
+#########
+# Step 3: Merge-join of sorted frames
+########
+def asof_join_sorted(df_left, df_right, by, on, suffixes=('_x', '_y')):
+    """
+    Join every row of df_left to the last row of df_right with the same value of by and a value of on that is not
+    larger (like pd.merge_asof(df_left, df_right, on=on, by=by, direction='backward')). Both frames are sorted by
+    (by, on) with sort_frame(), which is skipped for frames that are already sorted, and the last matching rows are
+    found with one search in the sorted keys. The result is in the order of (by, on) and rows with equal keys keep
+    the order of df_left. Among the rows of df_right with equal keys, the last one is matched.
+
+    Parameters:
+    -----------
+    df_left (DataFrame): Left frame (no missing values in on)
+    df_right (DataFrame): Right frame (no missing values in on)
+    by (str): Variable that has to match exactly (e.g. CUSIP_ID)
+    on (str): Ordered variable (e.g. date)
+    suffixes (tuple): Suffixes of other variables that are in both frames
+
+    Returns:
+    --------
+    df_join (DataFrame): Rows of df_left with the variables of the matched rows of df_right (missing if no row
+                         matches)
+    """
+    df_left = sort_frame(df_left, [by, on])
+    df_right = sort_frame(df_right, [by, on])
+
+    # Encode (by, on) of both frames in one integer key that has the same order: the codes of by are in the order of
+    # the values (missing values last) and the values of on are replaced by their rank
+    by_codes, by_uniques = pd.factorize(pd.concat([df_left[by], df_right[by]], ignore_index=True), sort=True)
+    by_codes = np.where(by_codes < 0, len(by_uniques), by_codes).astype(np.int64)
+    on_values, on_ranks = np.unique(np.concatenate([df_left[on].values, df_right[on].values]), return_inverse=True)
+    keys = by_codes * (len(on_values) + 1) + on_ranks.astype(np.int64)
+    left_keys, right_keys = keys[:len(df_left)], keys[len(df_left):]
+    left_codes, right_codes = by_codes[:len(df_left)], by_codes[len(df_left):]
+
+    # Last row of df_right with a key that is not larger (rows with a missing value of by never match)
+    right_pos = np.searchsorted(right_keys, left_keys, side='right') - 1
+    matched = (right_pos >= 0) & (left_codes < len(by_uniques))
+    matched[matched] = right_codes[right_pos[matched]] == left_codes[matched]
+    right_pos[matched == False] = -1
+
+    # Attach the variables of df_right (the missing values are filled as in DataFrame.merge())
+    df_join = df_left.reset_index(drop=True)
+    right_vars = [v for v in df_right.columns if v not in [by, on]]
+    for v in right_vars:
+        values = pd.api.extensions.take(df_right[v].values, right_pos, allow_fill=True)
+        if v in df_join.columns:
+            df_join = df_join.rename(columns={v: v + suffixes[0]})
+            v = v + suffixes[1]
+        df_join[v] = values
+
+    return keep_sort_order(df_join, df_left)
@@ -0,0 +1,649 @@
+"""
+Store the outputs of the build (yearly datasets, bond background information, reported dates, checkpoints and the
+final dataset) as compressed columnar datasets instead of pickles (opt-in with the format 'parquet'). A pickle has to
+be read in full, even if only a few columns or bonds are needed, and it is read by one thread. The steps are as
+follows:
+    Step 1:     Write a DataFrame as a Parquet dataset (store_frame()): one folder <name>.parquet with one file per
+                partition. The data is partitioned by year (if it has a 'year' column) and optionally by a hash bucket
+                of the CUSIP. Every file is compressed and split into row groups with min/max statistics per column.
+    Step 2:     Read a dataset in parallel (load_frame(), as an Arrow table with load_table() or in batches with
+                load_frame_batches()). Partitions whose year or CUSIP bucket does not match the filters are skipped,
+                the row groups are pruned with their statistics and only the requested columns are read.
+
+Note: The outputs keep their names ending in .pkl in the code (e.g. TRACE_final.pkl). The functions of this module
+map such a name to the stored dataset (TRACE_final.parquet) or to the pickle of older builds, i.e. the builds before
+this change stay valid. The default format is 'pickle', such that the outputs can still be read with pd.read_pickle()
+under their names. A DataFrame is also stored as a pickle if pyarrow is not installed or if it cannot be stored
+exactly (e.g. object columns with mixed types). The round trip returns the identical
+DataFrame (rows in the original order, index, dtypes and missing values). The settings are taken from
+dataset_specs['storage'] (see specs.py and settings_TRACE.py).
+"""
+
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Atomic pickle writes (see async_io_TRACE.py)
+from async_io_TRACE import write_pickle
+# Check of the recorded sort order of a DataFrame (see sort_order_TRACE.py)
+from sort_order_TRACE import drop_invalid_sort_order
+# Settings of the build
+from settings_TRACE import get_settings
+
+# pyarrow is optional: without it, all outputs are stored as pickles
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Name of the column with the original row number in the stored datasets
+ROW_COLUMN = '__row__'
+# Description of the dataset (partitioning, index, missing values) in the dataset folder
+META_FILE = '_dataset.json'
+# Names of the CUSIP column in the yearly datasets and in the merged datasets
+CUSIP_COLUMNS = ['CUSIP_ID', 'cusip_id']
+# Arrow types that an object column may have. Any other type would not be returned as the same objects
+OBJECT_TYPES = ['string', 'large_string', 'binary', 'date32[day]', 'null']
+# Kinds of missing values in object columns
+NA_KINDS = {type(None): 'None', float: 'NaN', type(pd.NaT): 'NaT'}
+# Warn only once if pyarrow is missing
+WARNINGS = {'no_pyarrow': False}
+
+
+def get_dataset_path(path):
+    """
+    Get the folder of the Parquet dataset of an output (e.g. TRACE_final.pkl -> TRACE_final.parquet).
+    """
+    return os.path.splitext(path)[0] + '.parquet'
+
+
+def get_storage_path(path):
+    """
+    Get the stored file or dataset folder of an output (None if the output does not exist). A dataset takes precedence
+    over a pickle.
+
+    Parameters:
+    -----------
+    path (str): Path of the output (ending in .pkl)
+
+    Returns:
+    --------
+    storage_path (str): Path of the dataset folder or of the pickle
+    """
+    if os.path.isfile(get_dataset_path(path) + '/' + META_FILE):
+        return get_dataset_path(path)
+    if os.path.isfile(path):
+        return path
+
+    return None
+
+
+def frame_exists(path):
+    """
+    Check if an output exists (as a dataset or as a pickle).
+    """
+    return get_storage_path(path) is not None
+
+
+def remove_frame(path):
+    """
+    Delete an output (the dataset and the pickle).
+    """
+    if os.path.isdir(get_dataset_path(path)):
+        shutil.rmtree(get_dataset_path(path))
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def get_disk_size(path):
+    """
+    Get the size of an output on disk in bytes (None if the output does not exist).
+    """
+    storage_path = get_storage_path(path)
+    if storage_path is None:
+        return None
+    if os.path.isfile(storage_path):
+        return os.path.getsize(storage_path)
+
+    return sum([os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(storage_path) for f in files])
+
+
+def get_frame_bytes(path):
+    """
+    Get the size of an output as it is used for the memory estimates: the size of the pickle or, for a dataset, the
+    in-memory size of the stored DataFrame without the objects of the object columns, which is about the size of its
+    pickle (the compressed files are much smaller).
+    """
+    storage_path = get_storage_path(path)
+    if (storage_path is None) or os.path.isfile(storage_path):
+        return get_disk_size(path)
+
+    return read_meta(storage_path)['memory_bytes']
+
+
+def get_frame_columns(path):
+    """
+    Get the columns of an output without reading it (None for a pickle, which has to be read to get its columns).
+    """
+    storage_path = get_storage_path(path)
+    if (storage_path is None) or os.path.isfile(storage_path):
+        return None
+
+    return read_meta(storage_path)['columns']
+
+
+def read_meta(dataset_path):
+    """
+    Read the description of a dataset (see write_dataset()).
+    """
+    with open(dataset_path + '/' + META_FILE, 'r') as f:
+        return json.load(f)
+
+
+#########
+# Step 1: Write the dataset
+########
+def get_cusip_bucket(cusips, n_buckets):
+    """
+    Get the hash bucket of every CUSIP. The hash does not depend on the process, such that the bucket of a CUSIP can
+    be computed again when the dataset is read.
+
+    Parameters:
+    -----------
+    cusips (array): CUSIPs
+    n_buckets (int): Number of buckets
+
+    Returns:
+    --------
+    buckets (array): Bucket of every CUSIP
+    """
+    return (pd.util.hash_array(np.asarray(cusips, dtype=object)) % np.uint64(n_buckets)).astype(np.int64)
+
+
+def get_na_kinds(df):
+    """
+    Get the missing value of every object column with missing values (None, NaN or NaT). Parquet stores all of them
+    as null, NaN and NaT are restored after the read. Returns None if a column contains several kinds (it cannot be
+    stored exactly).
+    """
+    na_values = {}
+    for col in df.columns[(df.dtypes == object).values]:
+        values = df[col].values
+        values_na = values[pd.isna(values)]
+        if len(values_na) == 0:
+            continue
+        kinds = set([NA_KINDS.get(type(v)) for v in values_na])
+        if (len(kinds) > 1) or (None in kinds):
+            return None
+        if kinds != {'None'}:
+            na_values[col] = kinds.pop()
+
+    return na_values
+
+
+def to_arrow_table(df):
+    """
+    Convert a DataFrame to an Arrow table with the original row number (ROW_COLUMN). A default index (0, 1, ...) is
+    not stored since it equals the row number.
+
+    Parameters:
+    -----------
+    df (DataFrame): Data
+
+    Returns:
+    --------
+    table (Table): Arrow table (None if the DataFrame cannot be stored exactly)
+    meta (dict): Description of the dataset (index, missing values, attributes, in-memory size)
+    """
+    if (isinstance(df.columns, pd.MultiIndex)) or (df.columns.is_unique == False) or \
+            (all([isinstance(c, str) for c in df.columns]) == False) or (ROW_COLUMN in df.columns):
+        return None, None
+    na_values = get_na_kinds(df)
+    if na_values is None:
+        return None, None
+    range_index = isinstance(df.index, pd.RangeIndex) and (df.index.start == 0) and (df.index.step == 1)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=(range_index == False))
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None, None
+    # Object columns that would be returned with another dtype (e.g. Timestamps, Decimals or booleans)
+    for col in df.columns[(df.dtypes == object).values]:
+        if str(table.schema.field(col).type) not in OBJECT_TYPES:
+            return None, None
+    table = table.append_column(ROW_COLUMN, pa.array(np.arange(len(df), dtype=np.int64)))
+    try:
+        attrs = json.loads(json.dumps(df.attrs))
+    except TypeError:
+        return None, None
+    meta = {
+        'n_rows': len(df),
+        'columns': list(df.columns),
+        'range_index': range_index,
+        'na_values': na_values,
+        'attrs': attrs,
+        'memory_bytes': int(df.memory_usage(index=True, deep=False).sum()),
+    }
+
+    return table, meta
+
+
+def get_partitions(df, n_buckets):
+    """
+    Get the partition of every row: the year (if the data has a 'year' column) and the CUSIP hash bucket (if
+    n_buckets > 0 and the data has a CUSIP column).
+
+    Parameters:
+    -----------
+    df (DataFrame): Data
+    n_buckets (int): Number of CUSIP hash buckets
+
+    Returns:
+    --------
+    partition_cols (list): Partition keys (e.g. ['year', 'bucket'])
+    keys (list): Arrays of the partition keys of every row
+    cusip_col (str): CUSIP column (None if the data is not partitioned by CUSIP)
+    """
+    partition_cols = []
+    keys = []
+    cusip_col = None
+    if ('year' in df.columns) and (df['year'].dtype.kind in 'iu'):
+        partition_cols.append('year')
+        keys.append(df['year'].values.astype(np.int64))
+    cusip_cols = [c for c in CUSIP_COLUMNS if c in df.columns]
+    if (n_buckets > 0) and (len(cusip_cols) > 0):
+        cusip_col = cusip_cols[0]
+        partition_cols.append('bucket')
+        keys.append(get_cusip_bucket(df[cusip_col].values, n_buckets))
+
+    return partition_cols, keys, cusip_col
+
+
+def replace_folder(path_tmp, path):
+    """
+    Replace a folder by a completely written temporary folder. Processes that still read files of the old folder can
+    finish reading them (the files are only unlinked).
+    """
+    if os.path.isdir(path):
+        path_old = os.path.join(os.path.dirname(path), 'old_' + os.path.basename(path))
+        if os.path.isdir(path_old):
+            shutil.rmtree(path_old)
+        os.replace(path, path_old)
+        os.replace(path_tmp, path)
+        shutil.rmtree(path_old)
+    else:
+        os.replace(path_tmp, path)
+
+
+def write_dataset(df, dataset_path, storage):
+    """
+    Write a DataFrame as a Parquet dataset with one file per partition (e.g. year=2013/bucket=3/part-0.parquet). Within
+    a partition, the rows keep their original order.
+
+    Parameters:
+    -----------
+    df (DataFrame): Data
+    dataset_path (str): Folder of the dataset
+    storage (dict): Settings of the storage (settings['storage'])
+
+    Returns:
+    --------
+    success (bool): False if the DataFrame cannot be stored exactly as a dataset
+    """
+    table, meta = to_arrow_table(df)
+    if table is None:
+        return False
+    partition_cols, keys, cusip_col = get_partitions(df, storage['cusip_buckets'])
+    meta.update({'partition_cols': partition_cols, 'cusip_col': cusip_col,
+                 'cusip_buckets': storage['cusip_buckets'], 'partitions': []})
+
+    # Write the dataset into a temporary folder and replace the old dataset afterwards
+    path_tmp = os.path.join(os.path.dirname(dataset_path), 'tmp_' + os.path.basename(dataset_path))
+    if os.path.isdir(path_tmp):
+        shutil.rmtree(path_tmp)
+    os.makedirs(path_tmp)
+    if len(partition_cols) == 0:
+        list_parts = [([], np.arange(len(df)))]
+    else:
+        # Group the rows by partition (stable, i.e. the original order within a partition)
+        codes, uniques = pd.factorize(pd.MultiIndex.from_arrays(keys), sort=True)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        list_parts = [(list(uniques[i]), order[bounds[i]:bounds[i + 1]]) for i in range(len(uniques))]
+    for values, pos in list_parts:
+        folder = '/'.join(['{}={}'.format(c, int(v)) for c, v in zip(partition_cols, values)])
+        os.makedirs(os.path.join(path_tmp, folder), exist_ok=True)
+        file_name = os.path.join(folder, 'part-0.parquet')
+        if len(partition_cols) == 0:
+            table_part = table
+        else:
+            table_part = table.take(pa.array(pos))
+        pq.write_table(table_part, os.path.join(path_tmp, file_name), row_group_size=storage['row_group_size'],
+                       compression=storage['compression'], write_statistics=True)
+        meta['partitions'].append({'file': file_name, 'keys': [int(v) for v in values], 'n_rows': len(pos)})
+    with open(path_tmp + '/' + META_FILE, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    replace_folder(path_tmp, dataset_path)
+
+    return True
+
+
+def store_frame(df, path, settings=None):
+    """
+    Store an output of the build. It is written as a Parquet dataset (<name>.parquet) or, if this is not possible, as
+    a pickle. The output of the other format is deleted. A recorded sort order (see sort_order_TRACE.py) is only
+    stored if it holds.
+
+    Parameters:
+    -----------
+    df (DataFrame): Data
+    path (str): Path of the output (ending in .pkl)
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> default settings)
+    """
+    if settings is None:
+        settings = get_settings()
+    storage = settings['storage']
+    if (storage['format'] == 'parquet') and (pa is None) and (WARNINGS['no_pyarrow'] == False):
+        print('WARNING: pyarrow is not installed. The outputs are stored as pickles')
+        WARNINGS['no_pyarrow'] = True
+    if isinstance(df, pd.DataFrame):
+        df = drop_invalid_sort_order(df)
+    if (storage['format'] == 'parquet') and (pa is not None) and isinstance(df, pd.DataFrame):
+        if write_dataset(df, get_dataset_path(path), storage):
+            if os.path.isfile(path):
+                os.remove(path)
+            return
+        print('WARNING: {} cannot be stored exactly as a Parquet dataset. It is stored as a pickle'.format(
+            os.path.basename(path)))
+    write_pickle(df, path)
+    if os.path.isdir(get_dataset_path(path)):
+        shutil.rmtree(get_dataset_path(path))
+
+
+#########
+# Step 2: Read the dataset
+########
+def get_filter_mask(df, filters):
+    """
+    Evaluate filters on a DataFrame (see load_frame()).
+
+    Returns:
+    --------
+    mask (array): True for the rows that pass all filters
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col, op, value in filters:
+        values = df[col]
+        if op == '==':
+            mask = mask & (values == value).values
+        elif op == '!=':
+            mask = mask & (values != value).values
+        elif op == '<':
+            mask = mask & (values < value).values
+        elif op == '<=':
+            mask = mask & (values <= value).values
+        elif op == '>':
+            mask = mask & (values > value).values
+        elif op == '>=':
+            mask = mask & (values >= value).values
+        elif op == 'in':
+            mask = mask & values.isin(list(value)).values
+        elif op == 'not in':
+            mask = mask & (values.isin(list(value)) == False).values
+        else:
+            raise ValueError('Unknown filter operator {}. The operators are: ==, !=, <, <=, >, >=, in, not in'.format(
+                op))
+
+    return mask
+
+
+def get_filter_expression(filters, null_columns=()):
+    """
+    Convert filters to an expression of pyarrow (see load_frame()). A column without any values is stored with the
+    type null, which pyarrow cannot compare with a value. A filter on such a column (null_columns) has the same result
+    for every row and is evaluated as for a missing value in a DataFrame.
+    """
+    expression = None
+    for col, op, value in filters:
+        field = ds.field(col)
+        if col in null_columns:
+            expr = ds.scalar(bool(get_filter_mask(pd.DataFrame({col: [None]}), [(col, op, value)])[0]))
+        elif op == '==':
+            expr = field == value
+        elif op == '!=':
+            expr = field != value
+        elif op == '<':
+            expr = field < value
+        elif op == '<=':
+            expr = field <= value
+        elif op == '>':
+            expr = field > value
+        elif op == '>=':
+            expr = field >= value
+        elif op == 'in':
+            expr = field.isin(list(value))
+        elif op == 'not in':
+            expr = ~field.isin(list(value))
+        else:
+            raise ValueError('Unknown filter operator {}. The operators are: ==, !=, <, <=, >, >=, in, not in'.format(
+                op))
+        expression = expr if expression is None else expression & expr
+
+    return expression
+
+
+def is_partition_selected(partition, meta, filters):
+    """
+    Check if a partition can contain rows that pass the filters (a filter on the year or on the CUSIP).
+    """
+    keys = dict(zip(meta['partition_cols'], partition['keys']))
+    for col, op, value in filters:
+        if (col == 'year') and ('year' in keys):
+            if get_filter_mask(pd.DataFrame({'year': [keys['year']]}), [(col, op, value)])[0] == False:
+                return False
+        if (col == meta['cusip_col']) and ('bucket' in keys) and (op in ['==', 'in']):
+            cusips = [value] if op == '==' else list(value)
+            if keys['bucket'] not in get_cusip_bucket(cusips, meta['cusip_buckets']):
+                return False
+
+    return True
+
+
+def get_scanner(dataset_path, columns=None, filters=None, batch_size=None):
+    """
+    Set up the scan of a Parquet dataset: skip the partitions that cannot match the filters, add the index and the
+    row number to the requested columns and push the filters down to the row groups. The files are read and
+    decompressed by the threads of pyarrow.
+
+    Parameters:
+    -----------
+    dataset_path (str): Folder of the dataset
+    columns (list): Columns to read (None -> all columns)
+    filters (list): Filters that the rows have to pass (see load_frame())
+    batch_size (int): Maximum number of rows per batch (None -> default of pyarrow)
+
+    Returns:
+    --------
+    scanner (Scanner): Scanner of the selected partitions
+    meta (dict): Description of the dataset
+    n_files (int): Number of selected partitions
+    """
+    meta = read_meta(dataset_path)
+    filters = filters or []
+    part_files = [dataset_path + '/' + p['file'] for p in meta['partitions'] if is_partition_selected(p, meta, filters)]
+    no_match = len(part_files) == 0
+    if no_match:
+        # No partition matches: scan the first file with an empty result to get the schema
+        part_files = [dataset_path + '/' + meta['partitions'][0]['file']]
+    dataset = ds.dataset(part_files, format='parquet')
+    if no_match:
+        expression = ds.scalar(False)
+    else:
+        null_columns = [field.name for field in dataset.schema if pa.types.is_null(field.type)]
+        expression = get_filter_expression(filters, null_columns)
+    if columns is not None:
+        missing = [c for c in columns if c not in meta['columns']]
+        if len(missing) > 0:
+            raise KeyError('The columns {} are not in {}'.format(', '.join(missing), os.path.basename(dataset_path)))
+        pandas_meta = json.loads(dataset.schema.metadata[b'pandas'])
+        index_cols = [c for c in pandas_meta['index_columns'] if isinstance(c, str)]
+        columns = list(columns) + index_cols + [ROW_COLUMN]
+    scan_args = {'columns': columns, 'filter': expression, 'use_threads': True}
+    if batch_size is not None:
+        scan_args['batch_size'] = batch_size
+    scanner = dataset.scanner(**scan_args)
+
+    return scanner, meta, len(part_files)
+
+
+def table_to_frame(table, meta, n_files):
+    """
+    Convert the Arrow table of a scan to a DataFrame and restore the original row order, the default index, the
+    NaN/NaT of the object columns and the attributes.
+    """
+    df = table.to_pandas(use_threads=True)
+    rows = df.pop(ROW_COLUMN).values
+    if (n_files > 1) and (len(rows) > 0) and (np.all(rows[1:] > rows[:-1]) == False):
+        order = np.argsort(rows, kind='stable')
+        df = df.take(order)
+        rows = rows[order]
+    if meta['range_index']:
+        if (len(rows) == meta['n_rows']) and ((len(rows) == 0) or (rows[-1] == len(rows) - 1)):
+            df.index = pd.RangeIndex(len(rows))
+        else:
+            df.index = pd.Index(rows)
+    for col, kind in meta['na_values'].items():
+        if col in df.columns:
+            values = df[col].values.copy()
+            values[pd.isna(values)] = np.nan if kind == 'NaN' else pd.NaT
+            df[col] = values
+    df.attrs = meta['attrs']
+
+    return df
+
+
+def read_dataset(dataset_path, columns=None, filters=None):
+    """
+    Read a Parquet dataset (see load_frame()).
+    """
+    scanner, meta, n_files = get_scanner(dataset_path, columns, filters)
+
+    return table_to_frame(scanner.to_table(), meta, n_files)
+
+
+def load_frame(path, columns=None, filters=None):
+    """
+    Load an output of the build (a Parquet dataset or a pickle). Filters on the year and on the CUSIP skip the
+    partitions of the dataset, all filters skip the row groups whose min/max statistics do not match.
+
+    Parameters:
+    -----------
+    path (str): Path of the output (ending in .pkl)
+    columns (list): Columns to read (None -> all columns)
+    filters (list): Filters that the rows have to pass, e.g. [('year', '>=', 2014), ('cusip_id', 'in', cusips)].
+                    The operators are ==, !=, <, <=, >, >=, in and not in
+
+    Returns:
+    --------
+    df (DataFrame): Data (a pickle of an older build may also contain another object, e.g. a list)
+    """
+    storage_path = get_storage_path(path)
+    if storage_path is None:
+        raise FileNotFoundError('The output {} does not exist (neither as a dataset nor as a pickle)'.format(path))
+    if os.path.isdir(storage_path):
+        if pa is None:
+            raise ImportError('pyarrow is required to read the dataset {}'.format(storage_path))
+        return read_dataset(storage_path, columns, filters)
+
+    df = pd.read_pickle(storage_path)
+    if filters:
+        df = df.loc[get_filter_mask(df, filters)]
+    if columns is not None:
+        df = df[list(columns)]
+
+    return df
+
+
+def load_table(path, columns=None, filters=None):
+    """
+    Load an output of the build as an Arrow table (see load_frame()). The rows are in the original order. Missing
+    values are nulls (the NaN/NaT of object columns are not restored), the index is kept as a column.
+
+    Parameters:
+    -----------
+    path (str): Path of the output (ending in .pkl)
+    columns (list): Columns to read (None -> all columns)
+    filters (list): Filters that the rows have to pass (see load_frame())
+
+    Returns:
+    --------
+    table (Table): Data
+    """
+    if pa is None:
+        raise ImportError('pyarrow is required to load {} as an Arrow table'.format(path))
+    storage_path = get_storage_path(path)
+    if (storage_path is None) or os.path.isfile(storage_path):
+        return pa.Table.from_pandas(load_frame(path, columns, filters))
+
+    scanner, meta, n_files = get_scanner(storage_path, columns, filters)
+    table = scanner.to_table()
+    if n_files > 1:
+        table = table.sort_by(ROW_COLUMN)
+
+    return table.drop([ROW_COLUMN])
+
+
+def load_frame_batches(path, columns=None, filters=None, batch_size=100000, as_arrow=False):
+    """
+    Load an output of the build in batches of at most batch_size rows, such that results larger than the memory can
+    be processed batch by batch. The batches of a dataset are read one after the other in the order of its partitions
+    (within a partition, in the original order). A pickle is read in full and then split into batches.
+
+    Parameters:
+    -----------
+    path (str): Path of the output (ending in .pkl)
+    columns (list): Columns to read (None -> all columns)
+    filters (list): Filters that the rows have to pass (see load_frame())
+    batch_size (int): Maximum number of rows per batch
+    as_arrow (bool): Return Arrow record batches instead of DataFrames (see load_table())
+
+    Returns:
+    --------
+    Generator of the batches (DataFrames or record batches)
+    """
+    if as_arrow and (pa is None):
+        raise ImportError('pyarrow is required to load {} as Arrow record batches'.format(path))
+    storage_path = get_storage_path(path)
+    if (storage_path is None) or os.path.isfile(storage_path):
+        df = load_frame(path, columns, filters)
+        for start in range(0, len(df), batch_size):
+            if as_arrow:
+                yield pa.RecordBatch.from_pandas(df.iloc[start:start + batch_size])
+            else:
+                yield df.iloc[start:start + batch_size]
+        return
+
+    scanner, meta, _ = get_scanner(storage_path, columns, filters, batch_size)
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        if as_arrow:
+            yield batch.select([c for c in batch.schema.names if c != ROW_COLUMN])
+        else:
+            yield table_to_frame(pa.Table.from_batches([batch]), meta, 1)
+
+
+def load_rpt_dates(path):
+    """
+    Load the list of all reported dates in TRACE (TRACE_rpt_dates.pkl, see read_TRACE.py). Older builds stored the
+    list itself as a pickle.
+    """
+    rpt_dates = load_frame(path)
+    if isinstance(rpt_dates, pd.DataFrame):
+        rpt_dates = rpt_dates['rpt_date'].tolist()
+
+    return rpt_dates
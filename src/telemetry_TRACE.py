@@ -0,0 +1,365 @@
+"""
+Collect performance telemetry for every stage of the build and for every year of the reading-in step. For each
+tracked stage, the following metrics are recorded:
+    a) Wall time and CPU time (of the process and its terminated child processes)
+    b) Peak resident memory (RSS) during the stage
+    c) Number of rows in and out
+    d) Number of bytes read from disk (or from the page cache)
+The metrics of all stages are written to a JSON run report in bld/data/TRACE/TRACE_info/telemetry. While a stage is
+running, report_progress() prints the throughput (rows/s) and the estimated remaining time. Optionally, the stage is
+profiled with cProfile (function-level CPU time) or tracemalloc (allocations by source line). The steps are as
+follows:
+    Step 1:     Start a run and define the stages to profile (start_run())
+    Step 2:     Track the stages (track_stage()) and count the rows (add_rows())
+    Step 3:     Write the run report and end the run (write_run_report())
+
+NOTE: Peak RSS and bytes read are taken from /proc (Linux). On other systems the peak RSS is the peak of the whole
+process so far and the bytes read are not recorded. The memory of worker processes (e.g. cleaning_workers > 1) is
+not part of the peak RSS.
+"""
+
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+# The resource module is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# State of the current run: options, the records of all finished stages and the stack of running stages
+RUN = {
+    'project_path': None,
+    'run_info': {},
+    'profile_stages': [],
+    'trace_memory_stages': [],
+    'stages': [],
+    'stack': [],
+    'profiling': False,
+}
+
+
+#########
+# Step 1: Start the run
+########
+def start_run(project_path, dataset_specs, profile_stages=None, trace_memory_stages=None):
+    """
+    Start a new run. The records of a previous run are deleted.
+
+    Parameters:
+    -----------
+    project_path (str): Project root path
+    dataset_specs (dict): Final dataset specifications
+    profile_stages (list): Stages to profile with cProfile (e.g. ['merge', 'read_2013'], 'all' for all stages)
+    trace_memory_stages (list): Stages to trace with tracemalloc ('all' for all stages)
+    """
+    RUN['project_path'] = project_path
+    RUN['profile_stages'] = profile_stages or []
+    RUN['trace_memory_stages'] = trace_memory_stages or []
+    RUN['stages'] = []
+    RUN['stack'] = []
+    RUN['run_info'] = {
+        'run_id': datetime.datetime.now().strftime('%Y%m%d_%H%M%S'),
+        'start': datetime.datetime.now().isoformat(),
+        'sample_time_span': dataset_specs['sample_time_span'],
+        'python': sys.version.split(' ')[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        't0_wall': time.perf_counter(),
+    }
+
+
+#########
+# Step 2: Track the stages
+########
+def read_proc_file(file_path, fields):
+    """
+    Read numeric fields from a /proc file (e.g. /proc/self/status). Returns None for fields that are not available.
+    """
+    values = {f: None for f in fields}
+    try:
+        with open(file_path, 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in values:
+                    values[name] = int(value.split()[0])
+    except OSError:
+        pass
+
+    return values
+
+
+def get_peak_rss():
+    """
+    Get the peak resident memory of the process in bytes since the last reset (see reset_peak_rss()).
+    """
+    peak_rss = read_proc_file('/proc/self/status', ['VmHWM'])['VmHWM']
+    if peak_rss is not None:
+        return peak_rss * 1024
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports the peak memory in KB, macOS in bytes
+    if sys.platform != 'darwin':
+        peak_rss = peak_rss * 1024
+
+    return peak_rss
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory of the process to the current resident memory (Linux only).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def get_bytes_read():
+    """
+    Get the number of bytes the process has read so far (Linux only, None otherwise).
+    """
+    return read_proc_file('/proc/self/io', ['rchar'])['rchar']
+
+
+def get_cpu_time():
+    """
+    Get the CPU time (user and system) of the process and its terminated child processes in seconds.
+    """
+    cpu_times = os.times()
+
+    return cpu_times.user + cpu_times.system + cpu_times.children_user + cpu_times.children_system
+
+
+@contextlib.contextmanager
+def track_stage(name, rows_in=None):
+    """
+    Track the wall time, CPU time, peak RSS, rows and bytes read of a stage. Stages can be nested (e.g. the years of
+    the reading-in step). The record is yielded such that the caller can set the number of rows out.
+
+    Parameters:
+    -----------
+    name (str): Name of the stage
+    rows_in (int): Number of rows in (optional, see also add_rows())
+
+    Returns:
+    --------
+    record (dict): Record of the stage. It is appended to the run report when the stage finishes.
+    """
+    # The peak RSS of the running parent stages has to be saved before the peak is reset
+    for record_parent in RUN['stack']:
+        record_parent['peak_rss_bytes'] = max_none(record_parent['peak_rss_bytes'], get_peak_rss())
+    reset_peak_rss()
+
+    record = {
+        'stage': name,
+        'parent': RUN['stack'][-1]['stage'] if len(RUN['stack']) > 0 else None,
+        'rows_in': rows_in,
+        'rows_out': None,
+        'peak_rss_bytes': None,
+        'status': 'running',
+    }
+    # Only one profiler can be active at a time, i.e. a stage within a profiled stage is not profiled separately
+    profiler = None
+    if ((name in RUN['profile_stages']) | ('all' in RUN['profile_stages'])) & (RUN['profiling'] == False):
+        profiler = cProfile.Profile()
+        RUN['profiling'] = True
+    D_trace_memory = ((name in RUN['trace_memory_stages']) | ('all' in RUN['trace_memory_stages'])) & \
+        (tracemalloc.is_tracing() == False)
+    if D_trace_memory:
+        tracemalloc.start()
+    bytes_read_0 = get_bytes_read()
+    t0_cpu = get_cpu_time()
+    t0_wall = time.perf_counter()
+    record['t0_wall'] = t0_wall
+    RUN['stack'].append(record)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+        record['status'] = 'finished'
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            RUN['profiling'] = False
+        record['wall_time_s'] = time.perf_counter() - t0_wall
+        record['cpu_time_s'] = get_cpu_time() - t0_cpu
+        record['peak_rss_bytes'] = max_none(record['peak_rss_bytes'], get_peak_rss())
+        bytes_read_1 = get_bytes_read()
+        record['bytes_read'] = bytes_read_1 - bytes_read_0 if bytes_read_0 is not None else None
+        if (record['rows_in'] is not None) & (record['wall_time_s'] > 0):
+            record['rows_per_s'] = record['rows_in'] / record['wall_time_s']
+        if profiler is not None:
+            record['profile_file'] = write_profile(profiler, name)
+        if D_trace_memory:
+            record['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            record['tracemalloc_file'] = write_tracemalloc(tracemalloc.take_snapshot(), name)
+            tracemalloc.stop()
+        RUN['stack'].pop()
+        # The peak of a child stage is also a peak of its parent stages
+        for record_parent in RUN['stack']:
+            record_parent['peak_rss_bytes'] = max_none(record_parent['peak_rss_bytes'], record['peak_rss_bytes'])
+        del record['t0_wall']
+        RUN['stages'].append(record)
+        print('TELEMETRY {}: {:.1f}s wall, {:.1f}s CPU, peak RSS {}, rows {} -> {}'.format(
+            name, record['wall_time_s'], record['cpu_time_s'], format_bytes(record['peak_rss_bytes']),
+            record['rows_in'], record['rows_out']))
+
+
+def max_none(a, b):
+    """
+    Maximum of two values that may be None.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    return max(a, b)
+
+
+def format_bytes(n_bytes):
+    """
+    Format a number of bytes (e.g. '1.25 GB').
+    """
+    if n_bytes is None:
+        return 'n/a'
+
+    return '{:.2f} GB'.format(n_bytes / 1024**3)
+
+
+def add_rows(rows_in=0, rows_out=0):
+    """
+    Add rows to the innermost running stage (e.g. the rows of every daily file of the reading-in step).
+
+    Parameters:
+    -----------
+    rows_in (int): Number of rows in to add
+    rows_out (int): Number of rows out to add
+    """
+    if len(RUN['stack']) == 0:
+        return
+    record = RUN['stack'][-1]
+    if rows_in:
+        record['rows_in'] = (record['rows_in'] or 0) + int(rows_in)
+    if rows_out:
+        record['rows_out'] = (record['rows_out'] or 0) + int(rows_out)
+
+
+def report_progress(message, n_done, n_total):
+    """
+    Print the progress of the innermost running stage including the throughput in rows/s (rows in so far) and the
+    estimated remaining time.
+
+    Parameters:
+    -----------
+    message (str): Progress message (e.g. the current trading day)
+    n_done (int): Number of finished work units (e.g. daily files)
+    n_total (int): Total number of work units
+    """
+    if (len(RUN['stack']) == 0) | (n_done == 0):
+        print(message)
+        return
+    record = RUN['stack'][-1]
+    t_elapsed = time.perf_counter() - record['t0_wall']
+    rows_per_s = (record['rows_in'] or 0) / t_elapsed if t_elapsed > 0 else 0
+    eta = datetime.timedelta(seconds=int(t_elapsed / n_done * (n_total - n_done)))
+    print('{} | {}/{} | {:,.0f} rows/s | ETA {}'.format(message, n_done, n_total, rows_per_s, eta))
+
+
+def get_telemetry_path():
+    """
+    Get the output folder of the telemetry (run reports and profiles) and create it if necessary.
+    """
+    path_telemetry = RUN['project_path'] + '/bld/data/TRACE/TRACE_info/telemetry/'
+    os.makedirs(path_telemetry, exist_ok=True)
+
+    return path_telemetry
+
+
+def write_profile(profiler, name):
+    """
+    Write the cProfile statistics of a stage (binary .prof file for e.g. snakeviz and the top 30 functions by
+    cumulative time as text).
+    """
+    if RUN['project_path'] is None:
+        return None
+    file_stub = get_telemetry_path() + '{}_{}'.format(RUN['run_info']['run_id'], name)
+    profiler.dump_stats(file_stub + '.prof')
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+    with open(file_stub + '_profile.txt', 'w') as f:
+        f.write(stream.getvalue())
+
+    return file_stub + '.prof'
+
+
+def write_tracemalloc(snapshot, name):
+    """
+    Write the top 30 source lines by allocated memory of a stage.
+    """
+    if RUN['project_path'] is None:
+        return None
+    file_path = get_telemetry_path() + '{}_{}_tracemalloc.txt'.format(RUN['run_info']['run_id'], name)
+    with open(file_path, 'w') as f:
+        for stat in snapshot.statistics('lineno')[:30]:
+            f.write(str(stat) + '\n')
+
+    return file_path
+
+
+#########
+# Step 3: Run report
+########
+def write_run_report():
+    """
+    Write the JSON run report with the metrics of all tracked stages and end the run. The report is stored as
+    run_report_<run_id>.json and as run_report_latest.json.
+
+    Returns:
+    --------
+    report_path (str): Path of the run report (None if no run was started)
+    """
+    if RUN['project_path'] is None:
+        return None
+    run_info = {k: v for k, v in RUN['run_info'].items() if k != 't0_wall'}
+    run_info['wall_time_s'] = time.perf_counter() - RUN['run_info']['t0_wall']
+    run_info['peak_rss_bytes'] = max([r['peak_rss_bytes'] or 0 for r in RUN['stages']] + [0])
+    report = {'run': run_info, 'stages': RUN['stages']}
+
+    path_telemetry = get_telemetry_path()
+    report_path = path_telemetry + 'run_report_{}.json'.format(run_info['run_id'])
+    for file_path in [report_path, path_telemetry + 'run_report_latest.json']:
+        with open(file_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    print('TELEMETRY: The run report is stored in {}'.format(report_path))
+    end_run()
+
+    return report_path
+
+
+def end_run():
+    """
+    End the current run, i.e. the stages that are tracked afterwards (e.g. by a later run_stage() in the same process)
+    are not recorded in the run and nothing is written to its project.
+    """
+    RUN['project_path'] = None
+    RUN['run_info'] = {}
+    RUN['profile_stages'] = []
+    RUN['trace_memory_stages'] = []
+    RUN['stages'] = []
+    RUN['stack'] = []
+    RUN['profiling'] = False
@@ -0,0 +1,342 @@
+"""
+Incrementally update the final TRACE dataset after a new delivery of the MERGENT FISD data (issue_data.pkl and/or
+ratings.pkl). Instead of rebuilding the entire dataset, only the bonds whose reference data changed are recomputed.
+The steps are as follows:
+    Step 1:     Compute a fingerprint of the reference data on the CUSIP level. The fingerprint consists of the
+                bond selection (Bessembinder et al. (2018)), a hash of the issue information and a hash of the
+                cleaned rating information. The fingerprint of the last build is stored in the TRACE_info folder.
+    Step 2:     Compare the stored fingerprint with the fingerprint of the current reference data and extract the
+                CUSIPs whose selection, ratings or issue information changed.
+    Step 3:     Recompute only the changed bonds. Bonds that are newly selected have never been read in (the bond
+                selection is applied when reading the raw data). For these bonds only, the raw data is read in again
+                and the yearly files are updated. All changed bonds are then run through the bond selection, the
+                rating as-of merge, the trade-level cleaning and the variable creation.
+    Step 4:     Replace the old bonds in the files of the final dataset (TRACE_final.pkl or the files of the
+                partitions or shards TRACE_final_<k>.pkl) one file at a time. Only the files that contain a changed
+                bond or receive recomputed trades are rewritten. The event time tables are computed from the trading
+                dates of the updated sample (read without the other variables). Only if they changed, the event time
+                variables of the other files are recomputed as well.
+
+Note: The fingerprint does not cover the daily bond background information files. They are stored in the folders of
+the raw TRACE data, i.e. a change of these files changes the key of the raw data and the build runs the affected
+stages again instead of an update (see pipeline_TRACE.py).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+
+# Import the bond selection according to Bessembinder et al. (2018)
+from read_TRACE import select_bonds
+# Import function to read in the daily raw data of a subset of bonds
+from read_TRACE import read_TRACE_all
+# Import the rating cleaning and the concatenation and merging step
+from concatenate_merge_TRACE_MERGENT import rd_cl_ratings, conct_merge_data
+# Import the cleaning steps and the variable creation
+from process_TRACE import clean_merged_data
+# Import the event time variables (tables of the event day and week of the entire sample)
+from prepare_variables import get_event_time_dates, get_event_time_tables, add_event_time_vars
+# Import the columnar storage of the outputs (see storage_TRACE.py)
+from storage_TRACE import store_frame, load_frame, frame_exists
+# Import the memory-mapped layout of the final dataset
+from mmap_TRACE import store_mmap_final
+# Import the settings of the build (see settings_TRACE.py)
+from settings_TRACE import get_settings
+# Import the paths of the final dataset (one file or one file per partition or shard)
+from query_TRACE import get_final_paths
+
+# Variables that define the event time tables (see get_event_time_dates())
+DATE_VARS = ['trd_exctn_dt', 'year', 'quarter', 'month', 'week', 'day']
+# Event time variables of the final dataset (see add_event_time_vars())
+EVENT_TIME_VARS = ['event_day', 'event_week', 'quarter_event_dummy']
+
+
+#########
+# Step 1: Reference data fingerprint
+########
+def hash_by_cusip(df, cusip_var):
+    """
+    Hash all rows of a DataFrame and combine the row hashes on the CUSIP level. The row hashes are summed up
+    (modulo 2^64) such that the CUSIP hash does not depend on the ordering of the rows.
+
+    Parameters:
+    -----------
+    df (DataFrame): Input data
+    cusip_var (str): Name of the CUSIP variable
+
+    Returns:
+    --------
+    cusip_hash (Series): Hash per CUSIP
+    """
+    row_hash = pd.util.hash_pandas_object(df.astype(str), index=False)
+    cusip_hash = row_hash.groupby(df[cusip_var].values).sum()
+
+    return cusip_hash
+
+
+def get_reference_fingerprint(path, dict_spec):
+    """
+    Compute the fingerprint of the current MERGENT FISD reference data for every CUSIP.
+
+    Parameters:
+    -----------
+    path (str): Project root path
+    dict_spec (dict): Final dataset specifications
+
+    Returns:
+    --------
+    df_fingerprint (DataFrame): Fingerprint per CUSIP (index) with the columns 'eligible', 'issue_hash' and
+                                'rating_hash'
+    """
+
+    # Bond selection
+    cusip_keep = select_bonds(path)
+
+    # Issue information (only the variables that are merged to the transaction data)
+    df_issue = pd.read_pickle(path + '/src/original_data/Mergent_FISD/issue_data.pkl')
+    issue_hash = hash_by_cusip(df_issue[dict_spec['issue_data']['varlist']], 'CUSIP_ID')
+
+    # Rating information (cleaned and restricted in the same way as in merge_transact_rating())
+    df_ratings = rd_cl_ratings(path, dict_spec['ratings']['varlist'])
+    df_ratings = df_ratings.loc[df_ratings.rating_year >= dict_spec['sample_time_span'][0]-1]
+    rating_hash = hash_by_cusip(df_ratings, 'CUSIP_ID')
+
+    df_fingerprint = pd.DataFrame(index=pd.Index(
+        sorted(set(issue_hash.index).union(rating_hash.index).union(cusip_keep)), name='CUSIP_ID'
+    ))
+    df_fingerprint['eligible'] = df_fingerprint.index.isin(cusip_keep)
+    df_fingerprint['issue_hash'] = issue_hash.reindex(df_fingerprint.index, fill_value=0).astype(np.uint64)
+    df_fingerprint['rating_hash'] = rating_hash.reindex(df_fingerprint.index, fill_value=0).astype(np.uint64)
+
+    return df_fingerprint
+
+
+def store_reference_fingerprint(path, dict_spec):
+    """
+    Store the fingerprint of the reference data that the current final dataset is built on.
+
+    Parameters:
+    -----------
+    path (str): Project root path
+    dict_spec (dict): Final dataset specifications
+    """
+    get_reference_fingerprint(path, dict_spec).to_pickle(
+        path + '/bld/data/TRACE/TRACE_info/reference_fingerprint.pkl'
+    )
+
+
+#########
+# Step 2: Identify the changed bonds
+########
+def find_changed_cusips(df_fingerprint_old, df_fingerprint_new):
+    """
+    Compare two reference data fingerprints and extract the CUSIPs that need to be recomputed.
+
+    Parameters:
+    -----------
+    df_fingerprint_old (DataFrame): Fingerprint of the last build
+    df_fingerprint_new (DataFrame): Fingerprint of the current reference data
+
+    Returns:
+    --------
+    dict_changed (dict): Lists of CUSIPs whose 'eligibility', 'issue' information or 'rating' information changed.
+                         'newly_eligible' contains the CUSIPs that are newly selected and 'all' the union of all
+                         changed CUSIPs.
+    """
+    cusip_all = df_fingerprint_old.index.union(df_fingerprint_new.index)
+    # CUSIPs that are missing in one of the fingerprints are not selected and have no issue or rating information
+    df_old = df_fingerprint_old.reindex(cusip_all, fill_value=0)
+    df_new = df_fingerprint_new.reindex(cusip_all, fill_value=0)
+    df_old['eligible'] = df_old['eligible'].astype(bool)
+    df_new['eligible'] = df_new['eligible'].astype(bool)
+
+    # Only bonds that are selected in either of the two builds can affect the final dataset
+    D_relevant = df_old['eligible'] | df_new['eligible']
+    dict_changed = {
+        'eligibility': list(cusip_all[(df_old['eligible'] != df_new['eligible']).values]),
+        'newly_eligible': list(cusip_all[(df_new['eligible'] & (df_old['eligible'] == False)).values]),
+        'issue': list(cusip_all[((df_old['issue_hash'] != df_new['issue_hash']) & D_relevant).values]),
+        'rating': list(cusip_all[((df_old['rating_hash'] != df_new['rating_hash']) & D_relevant).values]),
+    }
+    dict_changed['all'] = sorted(set(dict_changed['eligibility']).union(dict_changed['issue'])
+                                 .union(dict_changed['rating']))
+
+    return dict_changed
+
+
+#########
+# Step 3: Recompute the changed bonds
+########
+def recompute_bonds(path, dict_spec, dict_changed, settings):
+    """
+    Recompute the changed bonds: read in the raw data of the newly selected bonds and run all changed bonds through
+    the bond selection, the merging, the cleaning and the variable creation.
+
+    Parameters:
+    -----------
+    path (str): Project root path
+    dict_spec (dict): Final dataset specifications
+    dict_changed (dict): Changed CUSIPs (see find_changed_cusips())
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    df_recomputed (DataFrame): Recomputed transactions without the event time variables (None if all changed bonds
+                               are deselected)
+    """
+    # Read in the raw data of the newly selected bonds only
+    if len(dict_changed['newly_eligible']) > 0:
+        print('UPDATE: Read in the raw TRACE data of {} newly selected bonds'.format(
+            len(dict_changed['newly_eligible'])))
+        read_TRACE_all(path, dict_spec, cusip_subset=dict_changed['newly_eligible'], settings=settings)
+
+    # Recompute the changed bonds (selection, rating merge, cleaning and variable creation)
+    df_merged = conct_merge_data(path, dict_spec, cusip_subset=dict_changed['all'], settings=settings)
+    if len(df_merged) == 0:
+        # All changed bonds are deselected
+        return None
+
+    return clean_merged_data(df_merged, path, dict_spec, settings)
+
+
+#########
+# Step 4: Replace the changed bonds in the final dataset
+########
+def get_file_targets(df_recomputed, list_files):
+    """
+    Assign every recomputed transaction to a file of the final dataset. The files of the two-pass build are
+    partitions by execution year (the years of the files do not overlap): a transaction is assigned to the file of
+    its year (or of the closest year). The files of the out-of-core build are shards by CUSIP: a transaction is
+    assigned to the file that contained its bond before (or to the smallest file for a newly selected bond).
+
+    Parameters:
+    -----------
+    df_recomputed (DataFrame): Recomputed transactions
+    list_files (list): Years ('years'), CUSIPs ('cusips') and number of rows ('n_rows') of every file
+
+    Returns:
+    --------
+    targets (array): Index of the file of every transaction
+    """
+    if len(list_files) == 1:
+        return np.zeros(len(df_recomputed), dtype=int)
+    n_years = sum([len(f['years']) for f in list_files])
+    if len(set().union(*[f['years'] for f in list_files])) == n_years:
+        file_years = pd.Series({year: k for k, f in enumerate(list_files) for year in f['years']}).sort_index()
+        pos = np.abs(df_recomputed['year'].values[:, None] - file_years.index.values[None, :]).argmin(axis=1)
+        return file_years.values[pos]
+    file_cusips = pd.Series({cusip: k for k, f in enumerate(list_files) for cusip in f['cusips']}, dtype=float)
+    smallest = int(np.argmin([f['n_rows'] for f in list_files]))
+
+    return df_recomputed['cusip_id'].map(file_cusips).fillna(smallest).astype(int).values
+
+
+def replace_bonds(path, df_recomputed, cusips_changed, settings):
+    """
+    Replace the changed bonds in the files of the final dataset one file at a time and recompute the event time
+    variables where necessary (see the description at the top).
+
+    Parameters:
+    -----------
+    path (str): Project root path
+    df_recomputed (DataFrame): Recomputed transactions without the event time variables (None -> no transactions)
+    cusips_changed (list): CUSIPs whose transactions are replaced
+    settings (dict): Settings of the build (see settings_TRACE.py)
+
+    Returns:
+    --------
+    files_written (list): Paths of the rewritten files
+    """
+    final_paths = get_final_paths(path)
+    # Read the trading dates and the CUSIPs of all files to get the event time tables before and after the update
+    list_files = []
+    list_dates_old = []
+    list_dates_new = []
+    for f in final_paths:
+        df_dates = load_frame(f, columns=['cusip_id'] + DATE_VARS)
+        D_changed = df_dates['cusip_id'].isin(cusips_changed)
+        list_dates_old.append(get_event_time_dates(df_dates))
+        list_dates_new.append(get_event_time_dates(df_dates.loc[D_changed == False]))
+        list_files.append({'years': set(df_dates['year']), 'cusips': set(df_dates['cusip_id']),
+                           'n_rows': len(df_dates), 'changed': D_changed.any()})
+    if df_recomputed is not None:
+        list_dates_new.append(get_event_time_dates(df_recomputed))
+        targets = get_file_targets(df_recomputed, list_files)
+    tables_old = get_event_time_tables(pd.concat(list_dates_old))
+    tables_new = get_event_time_tables(pd.concat(list_dates_new))
+    D_tables_changed = any([t_old.reset_index(drop=True).equals(t_new.reset_index(drop=True)) == False
+                            for t_old, t_new in zip(tables_old, tables_new)])
+    if D_tables_changed:
+        print('UPDATE: The trading dates of the sample changed. The event time variables of all files are recomputed')
+
+    files_written = []
+    for k, f in enumerate(final_paths):
+        df_new = None
+        if df_recomputed is not None:
+            df_new = df_recomputed.loc[targets == k]
+        if (list_files[k]['changed'] == False) & ((df_new is None) or (len(df_new) == 0)) & \
+                (D_tables_changed == False):
+            continue
+        df_file = load_frame(f, filters=[('cusip_id', 'not in', list(cusips_changed))])
+        if D_tables_changed:
+            df_file = add_event_time_vars(df_file.drop(columns=EVENT_TIME_VARS), *tables_new, settings=settings)
+        if (df_new is not None) and (len(df_new) > 0):
+            df_file = pd.concat([df_file, add_event_time_vars(df_new, *tables_new, settings=settings)[df_file.columns]],
+                                ignore_index=True)
+        store_frame(df_file, f, settings)
+        if os.path.basename(f) == 'TRACE_final.pkl':
+            store_mmap_final(df_file, f, settings)
+        files_written.append(f)
+
+    return files_written
+
+
+def update_TRACE_final(path, dict_spec, settings=None):
+    """
+    Update the final TRACE dataset after a change of the MERGENT FISD reference data. Only the bonds whose
+    selection, ratings or issue information changed are recomputed and only the files of the final dataset that
+    contain them are rewritten.
+
+    Parameters:
+    -----------
+    path (str): Project root path
+    dict_spec (dict): Final dataset specifications
+    settings (dict): Settings of the build (see settings_TRACE.py, None -> the settings of dict_spec)
+
+    Returns:
+    --------
+    dict_changed (dict): CUSIPs that were recomputed (see find_changed_cusips())
+    """
+    if settings is None:
+        settings = get_settings(dict_spec)
+    path_fingerprint = path + '/bld/data/TRACE/TRACE_info/reference_fingerprint.pkl'
+    if not os.path.isfile(path_fingerprint):
+        raise ValueError('There is no previous build to update. Please run the full build first.')
+    try:
+        get_final_paths(path)
+    except FileNotFoundError:
+        raise ValueError('There is no previous build to update. Please run the full build first.')
+
+    # Step 2: Identify the changed bonds
+    df_fingerprint_new = get_reference_fingerprint(path, dict_spec)
+    dict_changed = find_changed_cusips(pd.read_pickle(path_fingerprint), df_fingerprint_new)
+    print("")
+    print('UPDATE: {} bonds with changed selection, {} with changed issue information and {} with changed '
+          'ratings'.format(len(dict_changed['eligibility']), len(dict_changed['issue']),
+                           len(dict_changed['rating'])))
+    if len(dict_changed['all']) == 0:
+        print('UPDATE: The reference data is unchanged. Nothing to do')
+        return dict_changed
+
+    # Step 3: Recompute the changed bonds
+    df_recomputed = recompute_bonds(path, dict_spec, dict_changed, settings)
+
+    # Step 4: Replace the changed bonds in the files of the final dataset
+    print('UPDATE: Saving the updated files of the final dataset has started')
+    files_written = replace_bonds(path, df_recomputed, dict_changed['all'], settings)
+    df_fingerprint_new.to_pickle(path_fingerprint)
+    print('UPDATE: {} bonds were recomputed, {} files of the final dataset were rewritten'.format(
+        len(dict_changed['all']), len(files_written)))
+
+    return dict_changed
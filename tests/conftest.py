@@ -0,0 +1,40 @@
+"""
+Fixtures of the tests: a small project with generated data (see generate_synthetic_TRACE.py) that is generated and
+built once per test session. The sample contains the data prior and post the reporting change in 2012.
+"""
+
+import copy
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import pycleantrace
+
+# Sample of the generated project
+SAMPLE_TIME_SPAN = [2011, 2013]
+START_DATE = '2011-12-01'
+END_DATE = '2013-01-31'
+
+
+@pytest.fixture(scope='session')
+def dataset_specs():
+    dataset_specs = pycleantrace.get_default_specs()
+    dataset_specs['sample_time_span'] = SAMPLE_TIME_SPAN
+
+    return dataset_specs
+
+
+@pytest.fixture(scope='session')
+def project_path(tmp_path_factory):
+    project_path = str(tmp_path_factory.mktemp('TRACE_synthetic'))
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=100, n_bonds=200, seed=1)
+
+    return project_path
+
+
+@pytest.fixture(scope='session')
+def built_project(project_path, dataset_specs):
+    pycleantrace.build(copy.deepcopy(dataset_specs), project_path)
+
+    return project_path
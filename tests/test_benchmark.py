@@ -0,0 +1,15 @@
+import os
+import subprocess
+
+from benchmark_TRACE import get_git_commit
+
+
+def test_git_commit_of_the_code(tmp_path, monkeypatch):
+    # The commit is the one of the code, not of the working directory (e.g. a project path outside the repository)
+    code_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=code_path, capture_output=True, text=True)
+    monkeypatch.chdir(tmp_path)
+    if result.returncode != 0:
+        assert get_git_commit() == 'unknown'
+    else:
+        assert get_git_commit().split('-')[0] == result.stdout.strip()
@@ -0,0 +1,59 @@
+import copy
+import os
+import shutil
+import pandas as pd
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from bitemporal_TRACE import ASOF_DT
+from concatenate_merge_TRACE_MERGENT import get_yearly_files, read_yearly_data
+from provenance_TRACE import RAW_ID
+from raw_index_TRACE import get_daily_files
+from read_TRACE import select_bonds
+
+# Knowledge date of the snapshot
+ASOF_DATE = '2012-09-28'
+
+
+def remove_later_reports(project_path, asof_date):
+    # Empty the raw daily files of the days after the as-of date (the generated trades are reported on the day of
+    # their file), i.e. the raw data as it was known at the end of the as-of date
+    raw_path = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    for annual_fld in sorted(os.listdir(raw_path)):
+        for f in get_daily_files(raw_path + annual_fld):
+            if f[-14:-4] > asof_date:
+                with open(raw_path + annual_fld + '/' + f) as raw_file:
+                    header = raw_file.readline()
+                with open(raw_path + annual_fld + '/' + f, 'w') as raw_file:
+                    raw_file.write(header + '0033|trailer\nRecords|0\n')
+
+
+def load_yearly_data(project_path, dataset_specs):
+    cusip_keep = select_bonds(project_path)
+    return pd.concat([read_yearly_data(project_path, file_name, pre_post_id, dataset_specs, cusip_keep)
+                      for year, file_name, pre_post_id in get_yearly_files(dataset_specs['sample_time_span'])],
+                     ignore_index=True)
+
+
+def sort_trades(df):
+    # The provenance IDs of the two builds differ in the emptied files only, the trades are compared by their values
+    df = df.drop(columns=[RAW_ID])
+    return df.astype(str).sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_asof_snapshot_equals_build_at_asof_date(tmp_path, dataset_specs):
+    dataset_specs = copy.deepcopy(dataset_specs)
+    dataset_specs['bitemporal']['enabled'] = True
+    project_path = str(tmp_path / 'TRACE_full')
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=30, n_bonds=50, seed=7)
+    project_path_asof = str(tmp_path / 'TRACE_asof')
+    shutil.copytree(project_path + '/src', project_path_asof + '/src')
+    remove_later_reports(project_path_asof, ASOF_DATE)
+    pycleantrace.build(copy.deepcopy(dataset_specs), project_path)
+    pycleantrace.build(copy.deepcopy(dataset_specs), project_path_asof)
+
+    df_asof = pycleantrace.load_asof_snapshots([ASOF_DATE], dataset_specs=copy.deepcopy(dataset_specs),
+                                               project_path=project_path)
+    df_expected = load_yearly_data(project_path_asof, dataset_specs)
+    assert (len(df_expected) > 0) and (df_asof[ASOF_DT] == pd.Timestamp(ASOF_DATE).date()).all()
+    pd.testing.assert_frame_equal(sort_trades(df_asof.drop(columns=[ASOF_DT])), sort_trades(df_expected))
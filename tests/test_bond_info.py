@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import pandas as pd
+
+import pycleantrace
+from conftest import START_DATE, END_DATE, SAMPLE_TIME_SPAN
+from read_bond_background_TRACE import list_bond_info_files, read_bond_info, get_bond_info_intervals, \
+    merge_bond_info_intervals
+
+# Attributes of the bond files that can change over time (144A registration, coupon steps)
+VARLIST = ['CUSIP_ID', 'CPN_RT', 'CPN_TYPE_CD', 'RULE_144A_FL', 'DSMTN_FL', 'MTRTY_DT', 'TRACE_GRADE_CD']
+SPECS = {'sample_time_span': SAMPLE_TIME_SPAN}
+
+
+def remove_bond(project_path, cusip, n_days):
+    # Remove a bond from the bond files of the first days, such that its first record starts later
+    for date, in_path_basic, in_path_supp in list_bond_info_files(project_path)[:n_days]:
+        for in_path in [p for p in [in_path_basic, in_path_supp] if p is not None]:
+            with open(in_path) as f:
+                lines = f.readlines()
+            with open(in_path, 'w') as f:
+                f.writelines([line for line in lines if line.split('|')[1] != cusip])
+
+
+def change_coupon(project_path, cusip, first_day):
+    # Change the coupon of a bond in the bond files from a day on
+    for date, in_path_basic, in_path_supp in list_bond_info_files(project_path)[first_day:]:
+        for in_path in [p for p in [in_path_basic, in_path_supp] if p is not None]:
+            with open(in_path) as f:
+                lines = f.readlines()
+            pos = lines[0].split('|').index('CPN_RT')
+            for i, line in enumerate(lines):
+                fields = line.split('|')
+                if (len(fields) > pos) and (fields[1] == cusip):
+                    fields[pos] = str(float(fields[pos]) + 1)
+                    lines[i] = '|'.join(fields)
+            with open(in_path, 'w') as f:
+                f.writelines(lines)
+
+
+def merge_per_day(df_transact, project_path):
+    # Merge the trades of every day with the last known attributes of the bonds on that day. Trades before the first
+    # record of a bond get the first record, like the merge of the first record per bond
+    bond_state = None
+    list_days = []
+    for date, in_path_basic, in_path_supp in list_bond_info_files(project_path):
+        bond_info_day = read_bond_info(in_path_basic)
+        if in_path_supp is not None:
+            bond_info_day = pd.concat([bond_info_day, read_bond_info(in_path_supp)])
+        bond_info_day = bond_info_day.drop_duplicates(subset=['CUSIP_ID'])[VARLIST].set_index('CUSIP_ID')
+        if bond_state is None:
+            bond_state = bond_info_day
+            bond_first = bond_info_day
+        else:
+            bond_state = pd.concat([bond_state.loc[bond_state.index.isin(bond_info_day.index) == False],
+                                    bond_info_day])
+            bond_first = pd.concat([bond_first, bond_info_day.loc[bond_info_day.index.isin(bond_first.index) == False]])
+        list_days.append((date, bond_state))
+
+    df_merge = df_transact.copy()
+    for v in VARLIST[1:]:
+        df_merge[v] = np.nan
+    df_merge = df_merge.astype({v: object for v in VARLIST[1:]})
+    for date, bond_state in list_days:
+        D_day = (df_merge['TRD_EXCTN_DT'] == date).values
+        df_merge.loc[D_day, VARLIST[1:]] = bond_state.reindex(df_merge.loc[D_day, 'CUSIP_ID']).values
+    D_missing = df_merge['CPN_RT'].isna().values
+    df_merge.loc[D_missing, VARLIST[1:]] = bond_first.reindex(df_merge.loc[D_missing, 'CUSIP_ID']).values
+
+    return df_merge
+
+
+def test_interval_merge_equals_per_day_merge(tmp_path):
+    project_path = str(tmp_path)
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=10, n_bonds=60, seed=4)
+    os.makedirs(project_path + '/bld/data/TRACE/TRACE_raw_clean')
+    df_first_day = read_bond_info(list_bond_info_files(project_path)[0][1])
+    remove_bond(project_path, df_first_day['CUSIP_ID'].iloc[0], 10)
+    change_coupon(project_path, df_first_day['CUSIP_ID'].iloc[1], 100)
+
+    # Every bond trades on every day, including the days before its first record, and a bond without any record
+    dates = [date for date, _, _ in list_bond_info_files(project_path)]
+    df_intervals = get_bond_info_intervals(project_path, SPECS)
+    cusips = list(df_intervals['CUSIP_ID'].unique()) + ['000000AA0']
+    df_transact = pd.DataFrame([(c, d) for c in cusips for d in dates], columns=['CUSIP_ID', 'TRD_EXCTN_DT'])
+    assert df_intervals['CUSIP_ID'].duplicated().any()
+
+    df_merge = merge_bond_info_intervals(df_transact, df_intervals, VARLIST)
+    df_expected = merge_per_day(df_transact, project_path)
+    pd.testing.assert_frame_equal(df_merge.astype(object), df_expected.astype(object))
+    assert df_merge.loc[df_merge['CUSIP_ID'] == '000000AA0', VARLIST[1:]].isna().all().all()
+    assert df_merge.loc[df_merge['CUSIP_ID'] == df_first_day['CUSIP_ID'].iloc[0], 'CPN_RT'].notna().all()
+
+
+def test_intervals_without_bond_files(tmp_path):
+    project_path = str(tmp_path)
+    os.makedirs(project_path + '/src/original_data/academic_TRACE/TRACE_raw')
+    os.makedirs(project_path + '/bld/data/TRACE/TRACE_raw_clean')
+    df_intervals = get_bond_info_intervals(project_path, SPECS)
+    assert len(df_intervals) == 0
+    df_transact = pd.DataFrame({'CUSIP_ID': ['000000AA0'], 'TRD_EXCTN_DT': [pd.Timestamp('2012-01-03')]})
+    df_merge = merge_bond_info_intervals(df_transact, df_intervals, ['CUSIP_ID', 'RULE_144A_FL'])
+    assert df_merge['RULE_144A_FL'].isna().all()
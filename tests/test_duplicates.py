@@ -0,0 +1,63 @@
+import copy
+import os
+import numpy as np
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from provenance_TRACE import encode_raw_ids, get_file_ordinal
+from raw_index_TRACE import get_daily_files
+from read_TRACE import select_bonds
+
+# Copies of trade reports: (year, day) of the source file, (year, day) of the file they are inserted into (in the
+# same year and across the years)
+INJECTIONS = [((2012, 100), (2012, 150)), ((2013, 5), (2012, 200))]
+
+
+def insert_duplicates(project_path, source, target, cusips, n_lines=3):
+    # Insert some trade lines of the source file into the target file before its trailer (the last two lines)
+    raw_path = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    paths = []
+    for year, day in [source, target]:
+        paths.append(raw_path + 'academic_TRACE_{}/'.format(year) +
+                     get_daily_files(raw_path + 'academic_TRACE_{}'.format(year))[day])
+    with open(paths[0]) as f:
+        source_lines = f.readlines()[1:-2]
+    with open(paths[1]) as f:
+        target_lines = f.readlines()
+    lines = [i for i, line in enumerate(source_lines) if line.split('|')[3] in cusips][:n_lines]
+    n_trades = len(target_lines) - 3
+    trailer = ['0033|trailer\n', 'Records|{}\n'.format(n_trades + len(lines))]
+    with open(paths[1], 'w') as f:
+        f.writelines(target_lines[:-2] + [source_lines[i] for i in lines] + trailer)
+
+    # Provenance IDs of the copies and of the originals
+    return (encode_raw_ids(get_file_ordinal(*target), n_trades + np.arange(len(lines))),
+            encode_raw_ids(get_file_ordinal(*source), lines))
+
+
+def test_duplicate_check_is_off_by_default(built_project, dataset_specs):
+    # The default build neither allocates the Bloom filter nor stores duplicates
+    assert dataset_specs['duplicates']['action'] == 'off'
+    path_duplicates = built_project + '/bld/data/TRACE/TRACE_duplicates'
+    assert (os.path.isdir(path_duplicates) == False) or (len(os.listdir(path_duplicates)) == 0)
+
+
+def test_injected_duplicates_are_detected(tmp_path, dataset_specs):
+    project_path = str(tmp_path)
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=30, n_bonds=50, seed=8)
+    cusips = set(select_bonds(project_path))
+    expected = set()
+    for source, target in INJECTIONS:
+        copy_ids, first_ids = insert_duplicates(project_path, source, target, cusips)
+        assert len(copy_ids) > 0
+        # Which copy is the first one depends on the order of the read-in, the pairs are compared without their order
+        expected = expected | set([frozenset([c, f]) for c, f in zip(copy_ids, first_ids)])
+
+    dataset_specs = copy.deepcopy(dataset_specs)
+    dataset_specs['duplicates'] = {'action': 'flag', 'expected_trades': 100000, 'false_positive_rate': 0.01}
+    pycleantrace.build(copy.deepcopy(dataset_specs), project_path)
+    df_duplicates = pycleantrace.load_duplicates(dataset_specs, project_path)
+
+    # Exactly the inserted copies are confirmed (the candidates of the Bloom filter that are no copies are not)
+    assert set([frozenset(p) for p in zip(df_duplicates['RAW_ID'], df_duplicates['FIRST_RAW_ID'])]) == expected
+    assert df_duplicates['RAW_ID'].isin(df_duplicates['FIRST_RAW_ID']).any() == False
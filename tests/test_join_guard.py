@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import join_guard_TRACE
+from join_guard_TRACE import estimate_join_size, guarded_merge
+from settings_TRACE import get_settings
+
+
+def make_sides(n_left, n_right, n_keys, seed=0):
+    rng = np.random.default_rng(seed)
+    left = pd.DataFrame({'k': rng.integers(0, n_keys, n_left), 'x': np.arange(n_left)})
+    right = pd.DataFrame({'k': rng.integers(0, n_keys, n_right), 'y': rng.normal(size=n_right)})
+    return left, right
+
+
+@pytest.mark.parametrize('how', ['inner', 'left'])
+@pytest.mark.parametrize('n_keys', [50, 5000, 500000])
+def test_estimate_close_to_true_size(how, n_keys):
+    # Both sides are larger than the sample, the keys are duplicated on both sides
+    left, right = make_sides(300000, 400000, n_keys)
+    estimate = estimate_join_size(left, right, ['k'], ['k'], how)
+    # True size of the result from the key counts (the result of 50 keys does not fit into the memory)
+    right_counts = left['k'].map(right['k'].value_counts()).fillna(0)
+    rows = right_counts.sum() if how == 'inner' else right_counts.clip(lower=1).sum()
+    assert abs(estimate['rows'] - rows) <= 0.1 * rows if how == 'inner' else rows / 2 <= estimate['rows'] <= 1.1 * rows
+
+
+def test_guard_aborts_blow_up():
+    left, right = make_sides(200000, 200000, 100)
+    estimate = estimate_join_size(left, right, ['k'], ['k'], 'inner')
+    assert estimate['fanout'] > 1000
+    assert len(estimate['top_keys']) == join_guard_TRACE.N_REPORT_KEYS
+
+    settings = get_settings({'join_guard': {'action': 'abort', 'max_memory_share': 1e6}})
+    with pytest.raises(MemoryError, match='rows per left row'):
+        guarded_merge(left, right, 'test', on='k', settings=settings)
+    # A join on unique keys passes the guard and equals the join of pandas
+    right_unique = right.drop_duplicates('k')
+    pd.testing.assert_frame_equal(guarded_merge(left, right_unique, 'test', on='k', how='left', settings=settings),
+                                  left.merge(right_unique, on='k', how='left'))
+
+
+def test_chunk_action_is_rejected():
+    with pytest.raises(ValueError):
+        get_settings({'join_guard': {'action': 'chunk'}})
@@ -0,0 +1,29 @@
+import copy
+import pandas as pd
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from storage_TRACE import load_frame
+
+
+def test_mmap_final_equals_final(tmp_path, dataset_specs):
+    project_path = str(tmp_path)
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=30, n_bonds=50, seed=6)
+    dataset_specs = copy.deepcopy(dataset_specs)
+    dataset_specs['storage']['mmap_final'] = True
+    pycleantrace.build(dataset_specs, project_path)
+
+    df_final = load_frame(project_path + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl')
+    df_mmap = pycleantrace.open_trace(project_path=project_path)
+    assert df_mmap.attrs == df_final.attrs
+    # The string and date columns are categoricals of the values of the final dataset (missing values as NaN)
+    for col in df_mmap.columns:
+        if isinstance(df_mmap[col].dtype, pd.CategoricalDtype):
+            assert (df_mmap[col].isna() == df_final[col].isna()).all(), col
+            df_mmap[col] = df_mmap[col].astype(object).where(df_mmap[col].notna(), df_final[col])
+    pd.testing.assert_frame_equal(df_mmap, df_final)
+
+    # A subset of the columns
+    columns = ['cusip_id', 'rptd_pr', 'event_week']
+    df_columns = pycleantrace.open_trace(columns=columns, project_path=project_path)
+    pd.testing.assert_frame_equal(df_columns.astype({'cusip_id': object}), df_final[columns])
@@ -0,0 +1,44 @@
+import copy
+import pandas as pd
+import pytest
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from out_of_core_TRACE import MEMORY_FACTOR_MERGE, get_yearly_file_sizes, get_n_buckets, build_TRACE_out_of_core, \
+    load_TRACE_final_shards, parse_memory_size
+from query_TRACE import get_final_paths
+from storage_TRACE import load_frame
+
+
+@pytest.fixture(scope='module')
+def out_of_core_project(tmp_path_factory, dataset_specs):
+    # Generated project with the yearly files, the bond information and the reported dates (the steps before the
+    # out-of-core steps)
+    project_path = str(tmp_path_factory.mktemp('TRACE_out_of_core'))
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=100, n_bonds=200, seed=1)
+    for stage in ['read_raw', 'bond_info', 'rpt_dates']:
+        pycleantrace.run_stage(stage, copy.deepcopy(dataset_specs), project_path)
+
+    return project_path
+
+
+def test_out_of_core_build_merges_in_slices(out_of_core_project, built_project, dataset_specs):
+    # A budget below the memory of the merging of the largest year: every year is merged in CUSIP slices
+    dict_sizes = get_yearly_file_sizes(built_project, dataset_specs)
+    max_memory = int(max(dict_sizes.values()) * MEMORY_FACTOR_MERGE * 2 / 1.05)
+    n_buckets, n_slices = get_n_buckets(built_project, dataset_specs, max_memory)
+    assert (n_slices == 2) and (n_buckets % n_slices == 0)
+
+    pycleantrace.build(copy.deepcopy(dataset_specs), out_of_core_project, max_memory=str(max_memory))
+
+    # The shards contain the same transactions as the in-memory build
+    df_default = load_frame(get_final_paths(built_project)[0]).sort_values('raw_id').reset_index(drop=True)
+    df_out_of_core = load_TRACE_final_shards(out_of_core_project).sort_values('raw_id').reset_index(drop=True)
+    assert sorted(df_out_of_core.columns) == sorted(df_default.columns)
+    pd.testing.assert_frame_equal(df_out_of_core, df_default[df_out_of_core.columns])
+
+
+def test_out_of_core_build_fails_below_required_budget(out_of_core_project, dataset_specs):
+    # The transactions of the largest bond cannot be cleaned within the budget
+    with pytest.raises(MemoryError, match='requires a memory budget of at least'):
+        build_TRACE_out_of_core(out_of_core_project, copy.deepcopy(dataset_specs), parse_memory_size('4M'))
@@ -0,0 +1,17 @@
+import copy
+import pandas as pd
+
+from concatenate_merge_TRACE_MERGENT import conct_merge_data
+from process_TRACE import clean_merged_data, clean_merged_data_parallel
+
+
+def test_parallel_cleaning_equals_serial_cleaning(built_project, dataset_specs):
+    df_merged = conct_merge_data(built_project, dataset_specs)
+    df_serial = clean_merged_data(df_merged.copy(), built_project, copy.deepcopy(dataset_specs))
+    assert len(df_serial) > 0
+
+    # The shards are written from the merged data or while the yearly data is merged
+    df_parallel = clean_merged_data_parallel(df_merged.copy(), built_project, copy.deepcopy(dataset_specs), 2)
+    pd.testing.assert_frame_equal(df_parallel, df_serial)
+    df_parallel = clean_merged_data_parallel(None, built_project, copy.deepcopy(dataset_specs), 2)
+    pd.testing.assert_frame_equal(df_parallel, df_serial)
@@ -0,0 +1,27 @@
+import copy
+import os
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from pipeline_TRACE import FINAL_WITHOUT_CHECKPOINTS, load_manifest
+from storage_TRACE import get_storage_path, load_frame
+
+
+def test_build_without_checkpoints_checks_the_keys(dataset_specs, tmp_path_factory):
+    project_path = str(tmp_path_factory.mktemp('TRACE_keys'))
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=30, n_bonds=50, seed=2)
+    path_final = project_path + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl'
+    dataset_specs_parallel = copy.deepcopy(dataset_specs)
+    dataset_specs_parallel['cleaning_workers'] = 2
+    pycleantrace.build(copy.deepcopy(dataset_specs_parallel), project_path)
+    assert FINAL_WITHOUT_CHECKPOINTS in load_manifest(project_path)['stages']
+    mtime = os.path.getmtime(get_storage_path(path_final))
+
+    # Nothing changed: the final dataset is kept
+    pycleantrace.build(copy.deepcopy(dataset_specs_parallel), project_path)
+    assert os.path.getmtime(get_storage_path(path_final)) == mtime
+
+    # The specifications of the final dataset changed: the final dataset is rebuilt instead of updated
+    dataset_specs_parallel['dataset_clean']['varlist'].remove('active_issue')
+    pycleantrace.build(copy.deepcopy(dataset_specs_parallel), project_path)
+    assert 'active_issue' not in load_frame(path_final).columns
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from provenance_TRACE import encode_raw_ids, decode_raw_ids, get_file_ordinal, get_raw_records
+from raw_index_TRACE import get_daily_files
+from storage_TRACE import load_frame
+
+
+def test_encode_decode_round_trip():
+    rng = np.random.default_rng(0)
+    years = rng.integers(2002, 2030, 1000)
+    days = rng.integers(0, 1000, 1000)
+    lines = np.concatenate([rng.integers(0, 2 ** 32, 998), [0, 2 ** 32 - 1]])
+    raw_ids = encode_raw_ids([get_file_ordinal(y, d) for y, d in zip(years, days)], lines)
+    assert raw_ids.dtype == np.int64
+    assert len(np.unique(raw_ids)) == np.unique(np.stack([years, days, lines]), axis=1).shape[1]
+
+    df_ids = decode_raw_ids(raw_ids)
+    pd.testing.assert_frame_equal(df_ids, pd.DataFrame({'raw_id': raw_ids, 'year': years, 'day': days,
+                                                        'line': lines}), check_dtype=False)
+
+
+def test_raw_records_equal_raw_lines(built_project):
+    # Known lines of a raw daily file: the first line is the header, the trade lines follow
+    ann_fld_path = built_project + '/src/original_data/academic_TRACE/TRACE_raw/academic_TRACE_2012'
+    day = 30
+    file_path = ann_fld_path + '/' + get_daily_files(ann_fld_path)[day]
+    with open(file_path) as f:
+        raw_lines = f.read().splitlines()
+    n_trades = len(raw_lines) - 3
+    lines = np.array([0, 5, n_trades - 1, n_trades])
+
+    df_records = get_raw_records(built_project, encode_raw_ids(get_file_ordinal(2012, day), lines))
+    assert (df_records['file'] == file_path).all()
+    assert df_records['record'].tolist() == [raw_lines[1 + line] for line in lines[:3]] + [None]
+    pd.testing.assert_series_equal(df_records['line'], pd.Series(lines, name='line'), check_dtype=False)
+
+
+def test_raw_records_of_final_trades(built_project):
+    # The raw record of a trade in the final dataset has its CUSIP and volume
+    df_final = load_frame(built_project + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl',
+                          columns=['cusip_id', 'entrd_vol_qt', 'raw_id'])
+    df_sample = df_final.sample(20, random_state=0)
+    df_records = get_raw_records(built_project, df_sample['raw_id'].values)
+    for record, cusip, volume in zip(df_records['record'], df_sample['cusip_id'], df_sample['entrd_vol_qt']):
+        assert cusip in record.split('|')
+        assert volume in [float(v) for v in record.split('|') if v.replace('.', '', 1).isdigit()]
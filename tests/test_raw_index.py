@@ -0,0 +1,43 @@
+import os
+import shutil
+import pandas as pd
+
+from provenance_TRACE import get_file_ordinal
+from raw_index_TRACE import get_daily_files, get_folder_year, extract_raw_trades
+from read_TRACE import adj_dt_format_pre_2012, adj_dt_format_post_2012
+from storage_TRACE import load_frame
+
+
+def parse_raw_files(project_path, cusips):
+    # Parse every raw daily file in full and keep the trades of the CUSIPs
+    raw_path = project_path + '/src/original_data/academic_TRACE/TRACE_raw/'
+    dict_frames = {}
+    for annual_fld in sorted(os.listdir(raw_path)):
+        for day, f in enumerate(get_daily_files(raw_path + annual_fld)):
+            with open(raw_path + annual_fld + '/' + f) as raw_file:
+                fmt = 'post_2012' if 'TRD_EXCTN_TM' in raw_file.readline() else 'prior_2012'
+            parse = adj_dt_format_post_2012 if fmt == 'post_2012' else adj_dt_format_pre_2012
+            df = parse(raw_path + annual_fld + '/' + f, get_file_ordinal(get_folder_year(annual_fld), day))
+            dict_frames.setdefault(fmt, []).append(df.loc[df['CUSIP_ID'].isin(cusips)])
+
+    return {fmt: pd.concat(list_frames, ignore_index=True) for fmt, list_frames in dict_frames.items()}
+
+
+def test_indexed_read_equals_full_parse(built_project, dataset_specs):
+    # The default build does not index the raw files, the index is built when the trades are extracted (other tests
+    # may have built it already)
+    assert dataset_specs['raw_index']['enabled'] == False
+    path_index = built_project + '/bld/data/TRACE/TRACE_raw_index'
+    if os.path.isdir(path_index):
+        shutil.rmtree(path_index)
+    cusips = list(load_frame(built_project + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl',
+                             columns=['cusip_id'])['cusip_id'].unique()[:3])
+    dict_trades = extract_raw_trades(built_project, cusips)
+    raw_path = built_project + '/src/original_data/academic_TRACE/TRACE_raw'
+    assert len(os.listdir(path_index)) == len(os.listdir(raw_path))
+
+    dict_expected = parse_raw_files(built_project, cusips)
+    assert sorted(dict_trades) == sorted(dict_expected)
+    for fmt in dict_expected:
+        assert len(dict_expected[fmt]) > 0
+        pd.testing.assert_frame_equal(dict_trades[fmt], dict_expected[fmt])
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+from cache_TRACE import get_build_fingerprint
+from query_TRACE import load_trace, get_final_paths
+from server_TRACE import start_server, TraceClient
+from settings_TRACE import get_settings
+
+# Query of a projection with the CUSIP, date range and filter pushdown
+QUERY = {
+    'columns': ['cusip_id', 'trd_exctn_dt', 'trd_exctn_tm', 'rptd_pr', 'entrd_vol_qt', 'rating', 'event_week'],
+    'cusips': ['000019H28', '000010J82', '000028G95'],
+    'start': '2012-01-15',
+    'end': '2012-12-31',
+    'filters': [('rptd_pr', '>', 95), ('rpt_side_cd', '==', 'S')],
+}
+# Aggregations of the transactions of 2012
+AGG_QUERIES = [
+    {'group_by': 'rating', 'aggs': {'volume': ('entrd_vol_qt', 'sum'), 'n_bonds': ('cusip_id', 'nunique')}},
+    {'group_by': 'event_week', 'aggs': {'n_trades': ('cusip_id', 'size')}},
+]
+
+
+@pytest.fixture(scope='module')
+def client(built_project):
+    # The server shares its cache of the query results (off by default)
+    server = start_server(built_project, port=0, settings=get_settings({'query_cache': {'enabled': True}}))
+    client = TraceClient(port=server.server_address[1])
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_query_equals_load_trace(built_project, client):
+    df_query = load_trace(built_project, cache=False, **QUERY)
+    table = load_trace(built_project, output='arrow', cache=False, **QUERY)
+    assert len(df_query) > 0
+
+    # The whole result as an Arrow table and as a DataFrame
+    assert client.query(output='arrow', **QUERY).equals(table)
+    pd.testing.assert_frame_equal(client.query(**QUERY), df_query)
+
+    # The result streamed in batches
+    list_batches = list(client.query(batch_size=50, **QUERY))
+    assert len(list_batches) == -(-len(df_query) // 50)
+    assert all(len(df_batch) <= 50 for df_batch in list_batches)
+    pd.testing.assert_frame_equal(pd.concat(list_batches), df_query)
+
+
+def test_status_reports_cache(built_project, client):
+    client.query(**QUERY)
+    status = client.status()
+    assert status['fingerprint'] == get_build_fingerprint(get_final_paths(built_project))
+    assert status['cached_results'] >= 1
+    assert status['cached_mb'] > 0
+
+
+@pytest.mark.parametrize('agg_query', AGG_QUERIES)
+def test_aggregation_equals_pandas(built_project, client, agg_query):
+    df_agg = load_trace(built_project, start='2012-01-01', end='2012-12-31', **agg_query)
+    df_final = load_trace(built_project, start='2012-01-01', end='2012-12-31', cache=False)
+    df_expected = df_final.groupby(agg_query['group_by']).agg(**agg_query['aggs']).reset_index()
+    pd.testing.assert_frame_equal(df_agg, df_expected, check_dtype=False)
+
+    # The cached result and the result of the server are the same
+    pd.testing.assert_frame_equal(load_trace(built_project, start='2012-01-01', end='2012-12-31', **agg_query),
+                                  df_agg)
+    pd.testing.assert_frame_equal(client.query(start='2012-01-01', end='2012-12-31', **agg_query), df_agg,
+                                  check_dtype=False)
@@ -0,0 +1,26 @@
+import pytest
+
+from settings_TRACE import SETTINGS, get_settings
+
+
+def test_settings_of_specs_keep_the_defaults():
+    settings = get_settings({'storage': {'format': 'parquet'}, 'duplicates': None})
+    assert settings['storage']['format'] == 'parquet'
+    assert settings['storage']['row_group_size'] == SETTINGS['storage']['row_group_size']
+    assert settings['duplicates'] == SETTINGS['duplicates']
+    # The settings of one build are not shared with the defaults or with the settings of a later build
+    settings['query_cache']['enabled'] = True
+    assert SETTINGS['query_cache']['enabled'] == False
+    assert get_settings()['query_cache']['enabled'] == False
+
+
+@pytest.mark.parametrize('section, setting', [
+    ('storage', {'format': 'csv'}),
+    ('overlap_io', {'prefetch_files': 0}),
+    ('query_cache', {'enabled': 'yes'}),
+    ('duplicates', {'false_positive_rate': 1}),
+    ('raw_index', {'enabeld': True}),
+])
+def test_invalid_settings_are_rejected(section, setting):
+    with pytest.raises(ValueError, match=r"dataset_specs\['{}'\]\['{}'\]".format(section, list(setting)[0])):
+        get_settings({section: setting})
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from concatenate_merge_TRACE_MERGENT import get_yearly_files
+from sort_order_TRACE import (get_canonical_order, get_sort_order, check_sort_order, sort_frame, set_sort_order,
+                              drop_invalid_sort_order)
+from storage_TRACE import load_frame
+
+
+def test_yearly_files_are_stored_in_canonical_order(built_project, dataset_specs):
+    for year, file_name, pre_post_id in get_yearly_files(dataset_specs['sample_time_span']):
+        df_year = load_frame(built_project + '/bld/data/TRACE/TRACE_raw_clean/' + file_name)
+        by = get_canonical_order(df_year)
+        assert get_sort_order(df_year) == by == ['CUSIP_ID', 'TRD_EXCTN_DT', by[2], 'RAW_ID'], file_name
+        assert check_sort_order(df_year, by), file_name
+
+
+def test_final_dataset_stores_only_a_valid_order(built_project):
+    df_final = load_frame(built_project + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl')
+    assert check_sort_order(df_final, get_sort_order(df_final))
+
+
+def test_sort_frame_equals_sort_values():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'a': rng.choice(['x', 'y', None], 1000), 'b': rng.integers(0, 5, 1000).astype(float),
+                       'c': rng.normal(size=1000)})
+    df.loc[rng.choice(1000, 50), 'b'] = np.nan
+    df_sorted = sort_frame(df, ['a', 'b'])
+    pd.testing.assert_frame_equal(df_sorted, df.sort_values(['a', 'b'], kind='stable'))
+    assert sort_frame(df_sorted, ['a']) is df_sorted
+
+    # An order that no longer holds is sorted again and not stored
+    df_sorted.loc[df_sorted.index[0], 'a'] = 'z'
+    assert sort_frame(df_sorted, ['a']) is not df_sorted
+    assert 'sort_order' not in drop_invalid_sort_order(df_sorted).attrs
+    assert get_sort_order(df_sorted) == ['a', 'b']
+
+
+def test_mixed_execution_times_can_be_sorted():
+    # Execution times that are 0 instead of a time cannot be compared with the times
+    df = pd.DataFrame({'CUSIP_ID': ['A', 'A', 'A'], 'TRD_EXCTN_TM': pd.Series(
+        [pd.Timestamp('2011-01-01 10:00'), 0.0, pd.Timestamp('2011-01-01 09:00')], dtype=object)})
+    df_sorted = sort_frame(set_sort_order(df, ['CUSIP_ID']), get_canonical_order(df))
+    assert check_sort_order(df_sorted, ['CUSIP_ID', 'TRD_EXCTN_TM'])
+    assert list(df_sorted.index) == [1, 2, 0]
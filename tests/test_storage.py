@@ -0,0 +1,57 @@
+import copy
+import os
+import pandas as pd
+import pytest
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from concatenate_merge_TRACE_MERGENT import get_yearly_files
+from settings_TRACE import get_settings
+from storage_TRACE import get_filter_mask, get_storage_path, load_frame, store_frame
+
+
+@pytest.fixture(scope='module')
+def parquet_project(tmp_path_factory, dataset_specs):
+    # The Parquet datasets are opt-in
+    project_path = str(tmp_path_factory.mktemp('TRACE_parquet'))
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=30, n_bonds=50, seed=5)
+    dataset_specs = copy.deepcopy(dataset_specs)
+    dataset_specs['storage']['format'] = 'parquet'
+    pycleantrace.build(dataset_specs, project_path)
+
+    return project_path
+
+
+def test_outputs_are_pickles_by_default(built_project):
+    final_path = built_project + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl'
+    assert os.path.isfile(final_path)
+    pd.testing.assert_frame_equal(pd.read_pickle(final_path), load_frame(final_path))
+
+
+def test_yearly_files_are_parquet(parquet_project, dataset_specs):
+    # The yearly datasets (including the ones prior to the reporting change) are stored as Parquet datasets
+    for year, file_name, pre_post_id in get_yearly_files(dataset_specs['sample_time_span']):
+        storage_path = get_storage_path(parquet_project + '/bld/data/TRACE/TRACE_raw_clean/' + file_name)
+        assert storage_path is not None, file_name
+        assert storage_path.endswith('.parquet'), storage_path
+
+
+def test_final_dataset_is_parquet(parquet_project):
+    final_path = parquet_project + '/bld/data/TRACE/TRACE_final_clean/TRACE_final.pkl'
+    assert get_storage_path(final_path).endswith('.parquet')
+    df_final = load_frame(final_path)
+    assert isinstance(df_final, pd.DataFrame) and (len(df_final) > 0)
+
+
+@pytest.mark.parametrize('filters', [
+    [('CUSIP_ID', 'in', ['A'])],
+    [('CUSIP_ID', 'not in', ['A'])],
+    [('CUSIP_ID', '==', 'A'), ('price', '>', 100)],
+])
+def test_filters_on_column_without_values(tmp_path, filters):
+    # A column without any values is stored with the Arrow type null (e.g. in an empty yearly dataset)
+    df = pd.DataFrame({'CUSIP_ID': pd.Series([None, None], dtype=object), 'price': [99.5, 101.0]})
+    path = str(tmp_path / 'frame.pkl')
+    store_frame(df, path, settings=get_settings({'storage': {'format': 'parquet'}}))
+    assert get_storage_path(path).endswith('.parquet')
+    pd.testing.assert_frame_equal(load_frame(path, filters=filters), load_frame(path).loc[get_filter_mask(df, filters)])
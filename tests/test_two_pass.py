@@ -0,0 +1,31 @@
+import copy
+import pandas as pd
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from query_TRACE import get_final_paths
+from storage_TRACE import load_frame
+
+
+def load_final(project_path):
+    # Concatenate the files of the final dataset and order the transactions by their raw record
+    df_final = pd.concat([load_frame(f) for f in get_final_paths(project_path)], ignore_index=True)
+
+    return df_final.sort_values('raw_id').reset_index(drop=True)
+
+
+def test_two_pass_build_equals_default_build(built_project, dataset_specs, tmp_path_factory):
+    # Build the same generated data with the two-pass cleaning
+    project_path = str(tmp_path_factory.mktemp('TRACE_two_pass'))
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=100, n_bonds=200, seed=1)
+    dataset_specs_two_pass = copy.deepcopy(dataset_specs)
+    dataset_specs_two_pass['two_pass_cleaning'] = True
+    pycleantrace.build(dataset_specs_two_pass, project_path)
+
+    # The final dataset is stored per partition and contains the same transactions and event time variables
+    final_paths = get_final_paths(project_path)
+    assert all('TRACE_final_' in f for f in final_paths)
+    df_default = load_final(built_project)
+    df_two_pass = load_final(project_path)
+    pd.testing.assert_frame_equal(df_two_pass, df_default[df_two_pass.columns])
+    assert sorted(df_two_pass.columns) == sorted(df_default.columns)
@@ -0,0 +1,61 @@
+import copy
+import pandas as pd
+import pytest
+
+import pycleantrace
+from conftest import START_DATE, END_DATE
+from query_TRACE import get_final_paths
+from storage_TRACE import load_frame
+
+
+def generate_project(project_path):
+    pycleantrace.generate(project_path, START_DATE, END_DATE, trades_per_day=30, n_bonds=60, seed=3)
+
+
+def change_reference_data(project_path):
+    # Deselect a bond, change the issue information of a bond, select a new bond and change the ratings of a bond
+    path_mergent = project_path + '/src/original_data/Mergent_FISD/'
+    df_issue = pd.read_pickle(path_mergent + 'issue_data.pkl')
+    eligible = sorted(df_issue.loc[df_issue.bond_type.isin(['CDEB', 'USBN']) & (df_issue.putable == 'N'),
+                                   'CUSIP_ID'])
+    df_issue.loc[df_issue.CUSIP_ID == eligible[0], 'putable'] = 'Y'
+    df_issue.loc[df_issue.CUSIP_ID == eligible[1], 'offering_amt'] *= 2
+    df_issue.loc[df_issue.CUSIP_ID == sorted(df_issue.loc[df_issue.bond_type == 'CMTN', 'CUSIP_ID'])[0],
+                 'bond_type'] = 'CDEB'
+    df_issue.to_pickle(path_mergent + 'issue_data.pkl')
+    df_ratings = pd.read_pickle(path_mergent + 'ratings.pkl')
+    df_ratings.loc[df_ratings.complete_cusip == eligible[2], 'rating'] = 'CCC'
+    df_ratings.to_pickle(path_mergent + 'ratings.pkl')
+
+
+def load_final(project_path):
+    df_final = pd.concat([load_frame(f) for f in get_final_paths(project_path)], ignore_index=True)
+
+    return df_final.sort_values('raw_id').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('two_pass_cleaning', [False, True])
+def test_update_equals_rebuild(dataset_specs, tmp_path_factory, capsys, two_pass_cleaning):
+    dataset_specs_update = copy.deepcopy(dataset_specs)
+    dataset_specs_update['two_pass_cleaning'] = two_pass_cleaning
+
+    # Build, change the MERGENT data and update the final dataset
+    project_path = str(tmp_path_factory.mktemp('TRACE_update'))
+    generate_project(project_path)
+    pycleantrace.build(copy.deepcopy(dataset_specs_update), project_path)
+    df_before = load_final(project_path)
+    change_reference_data(project_path)
+    capsys.readouterr()
+    pycleantrace.build(copy.deepcopy(dataset_specs_update), project_path)
+    assert 'UPDATE: 2 bonds with changed selection, 3 with changed issue information' in capsys.readouterr().out
+    df_update = load_final(project_path)
+
+    # Build the changed data from scratch
+    project_path_rebuild = str(tmp_path_factory.mktemp('TRACE_rebuild'))
+    generate_project(project_path_rebuild)
+    change_reference_data(project_path_rebuild)
+    pycleantrace.build(copy.deepcopy(dataset_specs_update), project_path_rebuild)
+    df_rebuild = load_final(project_path_rebuild)
+
+    assert df_update.equals(df_before) == False
+    pd.testing.assert_frame_equal(df_update, df_rebuild)